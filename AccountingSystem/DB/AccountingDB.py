@@ -3,12 +3,14 @@ __RCSID__ = "$Id$"
 
 import datetime, time
 import types
+import copy
 import threading
 import random
 from DIRAC.Core.Base.DB import DB
 from DIRAC import S_OK, S_ERROR, gMonitor, gConfig
 from DIRAC.Core.Utilities import List, ThreadSafe, Time, DEncode
 from DIRAC.AccountingSystem.private.TypeLoader import TypeLoader
+from DIRAC.AccountingSystem.private.BucketRangeCache import BucketRangeCache
 from DIRAC.Core.Utilities.ThreadPool import ThreadPool
 
 gSynchro = ThreadSafe.Synchronizer()
@@ -32,6 +34,7 @@ class AccountingDB( DB ):
     maxParallelInsertions = self.getCSOption( "ParallelRecordInsertions", 10 )
     self.__threadPool = ThreadPool( 1, maxParallelInsertions )
     self.__threadPool.daemonize()
+    self.__rangeCache = BucketRangeCache( lifeTime = self.getCSOption( "QueryCacheLifeTime", 600 ) )
     self.catalogTableName = _getTableName( "catalog", "Types" )
     self._createTables( { self.catalogTableName : { 'Fields' : { 'name' : "VARCHAR(64) UNIQUE NOT NULL",
                                                           'keyFields' : "VARCHAR(255) NOT NULL",
@@ -256,7 +259,8 @@ class AccountingDB( DB ):
     """
     self.log.verbose( "Adding to catalog type %s" % typeName, "with length %s" % str( bucketsLength ) )
     self.dbCatalog[ typeName ] = { 'keys' : keyFields , 'values' : valueFields,
-                                   'typeFields' : [], 'bucketFields' : [], 'dataTimespan' : 0 }
+                                   'typeFields' : [], 'bucketFields' : [], 'dataTimespan' : 0,
+                                   'rollups' : [] }
     self.dbCatalog[ typeName ][ 'typeFields' ].extend( keyFields )
     self.dbCatalog[ typeName ][ 'typeFields' ].extend( valueFields )
     self.dbCatalog[ typeName ][ 'bucketFields' ] = list( self.dbCatalog[ typeName ][ 'typeFields' ] )
@@ -383,6 +387,7 @@ class AccountingDB( DB ):
           pass
       else:
         self.log.notice( "ReadOnly mode: %s is OK" % name )
+        self.__registerRollups( name, keyFieldsList, valueFieldsList, tablesInThere )
       return S_OK( not updateDBCatalog )
 
     if tables:
@@ -397,9 +402,67 @@ class AccountingDB( DB ):
                          [ 'name', 'keyFields', 'valueFields', 'bucketsLength' ],
                          [ name, ",".join( keyFieldsList ), ",".join( valueFieldsList ), bucketsEncoding ] )
       self.__addToCatalog( name, keyFieldsList, valueFieldsList, bucketsLength )
+    self.__registerRollups( name, keyFieldsList, valueFieldsList, tablesInThere )
     self.log.info( "Registered type %s" % name )
     return S_OK( True )
 
+  def __registerRollups( self, typeName, keyFields, valueFields, tablesInThere ):
+    """
+    Create the rollups for the keys in the RollupKeyFields option and drop the ones
+    not listed anymore. A rollup has the buckets of a type aggregated by a single key
+    """
+    rollupKeys = self.getCSOption( "RollupKeyFields", [] )
+    rollups = []
+    for keyField in keyFields:
+      rollupTableName = _getTableName( "rollup", typeName, keyField )
+      if self.__readOnly:
+        if rollupTableName in tablesInThere:
+          rollups.append( keyField )
+        continue
+      if keyField not in rollupKeys:
+        if rollupTableName in tablesInThere:
+          self.log.info( "Dropping rollup of %s by %s" % ( typeName, keyField ) )
+          retVal = self._update( "DROP TABLE `%s`" % rollupTableName )
+          if not retVal[ 'OK' ]:
+            self.log.error( "Can't drop rollup", "%s: %s" % ( rollupTableName, retVal[ 'Message' ] ) )
+        continue
+      if rollupTableName not in tablesInThere:
+        retVal = self.__createRollup( typeName, keyField, valueFields )
+        if not retVal[ 'OK' ]:
+          self.log.error( "Can't create rollup", "%s by %s: %s" % ( typeName, keyField, retVal[ 'Message' ] ) )
+          continue
+      rollups.append( keyField )
+    if typeName in self.dbCatalog:
+      self.dbCatalog[ typeName ][ 'rollups' ] = rollups
+
+  def __createRollup( self, typeName, keyField, valueFields ):
+    """
+    Create the rollup table of a type by a key and fill it from the buckets
+    """
+    rollupTableName = _getTableName( "rollup", typeName, keyField )
+    fieldsDict = { 'startTime' : "INT UNSIGNED NOT NULL",
+                   'bucketLength' : "MEDIUMINT UNSIGNED NOT NULL",
+                   'entriesInBucket' : "DECIMAL(30,10) NOT NULL",
+                   keyField : "INTEGER NOT NULL" }
+    for valueField in valueFields:
+      fieldsDict[ valueField ] = "DECIMAL(30,10) NOT NULL"
+    retVal = self._createTables( { rollupTableName : { 'Fields' : fieldsDict,
+                                                       'UniqueIndexes' : { 'UniqueConstraint' : [ 'startTime',
+                                                                                                  keyField,
+                                                                                                  'bucketLength' ] }
+                                                     }
+                                 } )
+    if not retVal[ 'OK' ]:
+      return retVal
+    self.log.info( "Filling rollup of %s by %s" % ( typeName, keyField ) )
+    groupFields = [ "`%s`" % field for field in ( 'startTime', 'bucketLength', keyField ) ]
+    sumFields = [ "`%s`" % field for field in list( valueFields ) + [ 'entriesInBucket' ] ]
+    cmd = "INSERT INTO `%s` ( %s ) " % ( rollupTableName, ", ".join( groupFields + sumFields ) )
+    cmd += "SELECT %s FROM `%s` " % ( ", ".join( groupFields + [ "SUM(%s)" % field for field in sumFields ] ),
+                                     _getTableName( "bucket", typeName ) )
+    cmd += "GROUP BY %s" % ", ".join( groupFields )
+    return self._update( cmd )
+
   def getRegisteredTypes( self ):
     """
     Get list of registered types
@@ -590,16 +653,25 @@ class AccountingDB( DB ):
   def insertRecordBundleThroughQueue( self, recordsToQueue ) :
     if self.__readOnly:
       return S_ERROR( "ReadOnly mode enabled. No modification allowed" )
-    recordsToProcess = []
-    now = Time.toEpoch()
+    #One multi row insert per type
+    rowsByType = {}
+    takenSince = Time.toString( Time.dateTime() )
     for record in recordsToQueue:
       typeName, startTime, endTime, valuesList = record
-      result = self.__insertInQueueTable( typeName, startTime, endTime, valuesList )
+      if typeName not in self.dbCatalog:
+        return S_ERROR( "Type %s has not been defined in the db" % typeName )
+      numExp = len( self.dbCatalog[ typeName ][ 'typeFields' ] )
+      if len( valuesList ) + 2 != numExp:
+        return S_ERROR( "Fields mismatch for record %s. %s fields and %s expected" % ( typeName,
+                                                                                       len( valuesList ) + 2,
+                                                                                       numExp ) )
+      rowsByType.setdefault( typeName, [] ).append( [ 0, takenSince ] + list( valuesList ) + [ startTime, endTime ] )
+    for typeName in rowsByType:
+      result = self.insertMany( _getTableName( "in", typeName ),
+                                [ 'taken', 'takenSince' ] + self.dbCatalog[ typeName ][ 'typeFields' ],
+                                rowsByType[ typeName ] )
       if not result[ 'OK' ]:
         return result
-      iD = result[ 'Value' ]
-      recordsToProcess.append( ( iD, typeName, startTime, endTime, valuesList, now ) )
-
     return S_OK()
 
   def insertRecordThroughQueue( self, typeName, startTime, endTime, valuesList ):
@@ -622,17 +694,75 @@ class AccountingDB( DB ):
     Do the real insert and delete from the in buffer table
     """
     self.log.verbose( "Received bundle to process", "of %s elements" % len( recordTuples ) )
+    recordsByType = {}
     for record in recordTuples:
-      iD, typeName, startTime, endTime, valuesList, insertionEpoch = record
-      result = self.insertRecordDirectly( typeName, startTime, endTime, valuesList )
-      if not result[ 'OK' ]:
-        self._update( "UPDATE `%s` SET taken=0 WHERE id=%s" % ( _getTableName( "in", typeName ), iD ) )
-        self.log.error( "Can't insert row", result[ 'Message' ] )
+      recordsByType.setdefault( record[1], [] ).append( record )
+    for typeName in recordsByType:
+      typeRecords = recordsByType[ typeName ]
+      inTableName = _getTableName( "in", typeName )
+      result = self.insertRecordBundleDirectly( typeName, [ record[2:5] for record in typeRecords ] )
+      if result[ 'OK' ]:
+        insertedRecords = typeRecords
+      else:
+        self.log.warn( "Can't insert bundle, inserting records one by one", result[ 'Message' ] )
+        insertedRecords = []
+        for record in typeRecords:
+          iD, typeName, startTime, endTime, valuesList, insertionEpoch = record
+          result = self.insertRecordDirectly( typeName, startTime, endTime, list( valuesList ) )
+          if not result[ 'OK' ]:
+            self._update( "UPDATE `%s` SET taken=0 WHERE id=%s" % ( inTableName, iD ) )
+            self.log.error( "Can't insert row", result[ 'Message' ] )
+            continue
+          insertedRecords.append( record )
+      if not insertedRecords:
         continue
-      result = self._update( "DELETE FROM `%s` WHERE id=%s" % ( _getTableName( "in", typeName ), iD ) )
+      result = self._update( "DELETE FROM `%s` WHERE id IN ( %s )" % ( inTableName,
+                                                                       ", ".join( [ str( record[0] ) for record in insertedRecords ] ) ) )
       if not result[ 'OK' ]:
-        self.log.error( "Can't delete row from the IN table", result[ 'Message' ] )
-      gMonitor.addMark( "insertiontime", Time.toEpoch() - insertionEpoch )
+        self.log.error( "Can't delete rows from the IN table", result[ 'Message' ] )
+      now = Time.toEpoch()
+      for record in insertedRecords:
+        gMonitor.addMark( "insertiontime", now - record[5] )
+
+  def insertRecordBundleDirectly( self, typeName, recordsList ):
+    """
+    Add a bundle of ( startTime, endTime, valuesList ) entries to the type contents in one
+    transaction. The entries are split in buckets and added up in memory, so each bucket
+    is written once for the whole bundle
+    """
+    if self.__readOnly:
+      return S_ERROR( "ReadOnly mode enabled. No modification allowed" )
+    if not typeName in self.dbCatalog:
+      return S_ERROR( "Type %s has not been defined in the db" % typeName )
+    if not recordsList:
+      return S_OK( 0 )
+    self.log.info( "Adding records", "bundle of %s for type %s" % ( len( recordsList ), typeName ) )
+    keyFields = self.dbCatalog[ typeName ][ 'keys' ]
+    numKeys = len( keyFields )
+    typeRows = []
+    bucketRecords = []
+    for startTime, endTime, valuesList in recordsList:
+      valuesList = list( valuesList )
+      #Discover key indexes
+      for keyPos in range( numKeys ):
+        retVal = self.__addKeyValue( typeName, keyFields[ keyPos ], valuesList[ keyPos ] )
+        if not retVal[ 'OK' ]:
+          return retVal
+        valuesList[ keyPos ] = retVal[ 'Value' ]
+      typeRows.append( valuesList + [ startTime, endTime ] )
+      #HACK: One more value to split in the buckets to be able to count total entries
+      bucketRecords.append( ( startTime, endTime, valuesList[ :numKeys ], valuesList[ numKeys: ] + [ 1 ] ) )
+    def insertBundle():
+      retVal = self.insertMany( _getTableName( "type", typeName ), self.dbCatalog[ typeName ][ 'typeFields' ], typeRows )
+      if not retVal[ 'OK' ]:
+        return retVal
+      return self.__writeBucketRecords( typeName, bucketRecords )
+    retVal = self.__runInTransaction( insertBundle )
+    if not retVal[ 'OK' ]:
+      return retVal
+    gMonitor.addMark( "registeradded", len( recordsList ) )
+    gMonitor.addMark( "registeradded:%s" % typeName, len( recordsList ) )
+    return S_OK( len( recordsList ) )
 
 
   def insertRecordDirectly( self, typeName, startTime, endTime, valuesList ):
@@ -658,29 +788,14 @@ class AccountingDB( DB ):
     insertList = list( valuesList )
     insertList.append( startTime )
     insertList.append( endTime )
-    retVal = self._getConnection()
+    retVal = self.insertFields( _getTableName( "type", typeName ),
+                           self.dbCatalog[ typeName ][ 'typeFields' ],
+                           insertList )
     if not retVal[ 'OK' ]:
       return retVal
-    connObj = retVal[ 'Value' ]
-    try:
-      retVal = self.insertFields( _getTableName( "type", typeName ),
-                             self.dbCatalog[ typeName ][ 'typeFields' ],
-                             insertList,
-                             conn = connObj )
-      if not retVal[ 'OK' ]:
-        return retVal
-      #HACK: One more record to split in the buckets to be able to count total entries
-      valuesList.append( 1 )
-      retVal = self.__startTransaction( connObj )
-      if not retVal[ 'OK' ]:
-        return retVal
-      retVal = self.__splitInBuckets( typeName, startTime, endTime, valuesList, connObj = connObj )
-      if not retVal[ 'OK' ]:
-        self.__rollbackTransaction( connObj )
-        return retVal
-      return self.__commitTransaction( connObj )
-    finally:
-      connObj.close()
+    #HACK: One more record to split in the buckets to be able to count total entries
+    valuesList.append( 1 )
+    return self.__runInTransaction( lambda: self.__splitInBuckets( typeName, startTime, endTime, valuesList ) )
 
   def deleteRecord( self, typeName, startTime, endTime, valuesList ):
     """
@@ -722,30 +837,26 @@ class AccountingDB( DB ):
         sqlCond.append( "`%s`.`%s`=%s" % ( mainTable,
                                            self.dbCatalog[ typeName ][ 'typeFields' ][i],
                                            sqlValues[i] ) )
-    retVal = self._getConnection()
-    if not retVal[ 'OK' ]:
-      return retVal
-    connObj = retVal[ 'Value' ]
-    retVal = self.__startTransaction( connObj )
+    retVal = self.__startTransaction()
     if not retVal[ 'OK' ]:
       return retVal
-    retVal = self._update( "DELETE FROM `%s` WHERE %s" % ( mainTable, " AND ".join( sqlCond ) ),
-                           conn = connObj )
+    retVal = self._update( "DELETE FROM `%s` WHERE %s" % ( mainTable, " AND ".join( sqlCond ) ) )
     if not retVal[ 'OK' ]:
+      self.__rollbackTransaction()
       return retVal
     numInsertions = retVal[ 'Value' ]
     #Deleted from type, now the buckets
     #HACK: One more record to split in the buckets to be able to count total entries
     if numInsertions == 0:
+      self.__rollbackTransaction()
       return S_OK( 0 )
     sqlValues.append( 1 )
-    retVal = self.__deleteFromBuckets( typeName, startTime, endTime, sqlValues, numInsertions, connObj = connObj )
+    retVal = self.__deleteFromBuckets( typeName, startTime, endTime, sqlValues, numInsertions )
     if not retVal[ 'OK' ]:
-      self.__rollbackTransaction( connObj )
+      self.__rollbackTransaction()
       return retVal
-    retVal = self.__commitTransaction( connObj )
+    retVal = self.__commitTransaction()
     if not retVal[ 'OK' ]:
-      self.__rollbackTransaction( connObj )
       return retVal
     return S_OK( numInsertions )
 
@@ -777,20 +888,14 @@ class AccountingDB( DB ):
       bucketStartTime = bucketInfo[0]
       bucketProportion = bucketInfo[1]
       bucketLength = bucketInfo[2]
-      for _i in range( max( 1, self.__deadLockRetries ) ):
-        retVal = self.__extractFromBucket( typeName,
-                                           bucketStartTime,
-                                           bucketLength,
-                                           keyValues,
-                                           valuesList, bucketProportion * numInsertions, connObj = connObj )
-        if not retVal[ 'OK' ]:
-          #If failed because of dead lock try restarting
-          if retVal[ 'Message' ].find( "try restarting transaction" ):
-            continue
-          return retVal
-        #If OK, break loop
-        if retVal[ 'OK' ]:
-          break
+      #Called in the deleteRecord transaction, a dead lock rolls it back as a whole
+      retVal = self.__extractFromBucket( typeName,
+                                         bucketStartTime,
+                                         bucketLength,
+                                         keyValues,
+                                         valuesList, bucketProportion * numInsertions, connObj = connObj )
+      if not retVal[ 'OK' ]:
+        return retVal
     return S_OK()
 
   def getBucketsDef( self, typeName ):
@@ -852,51 +957,137 @@ class AccountingDB( DB ):
                                                                             tableName,
                                                                             bucketLength )
     cmd += self.__generateSQLConditionForKeys( typeName, keyValues )
-    return self._update( cmd, conn = connObj )
+    retVal = self._update( cmd, conn = connObj )
+    if not retVal[ 'OK' ] or not retVal[ 'Value' ]:
+      return retVal
+    rollupValues = [ "-(%s*%s)" % ( value, proportion ) for value in bucketValues[ :len( self.dbCatalog[ typeName ][ 'values' ] ) ] ]
+    rollupValues.append( "-(%s*%s)" % ( bucketValues[-1], proportion ) )
+    result = self.__addToRollups( typeName, [ ( startTime, bucketLength, keyValues, rollupValues ) ], connObj = connObj )
+    if not result[ 'OK' ]:
+      return result
+    return retVal
+
+  def __addToRollups( self, typeName, rollupRows, connObj = False ):
+    """
+    Add ( startTime, bucketLength, keyValues, values ) rows to the rollups of a type.
+    keyValues are the ids of all the keys and values the SQL expressions to add to each
+    value field followed by the one for entriesInBucket
+    """
+    if not rollupRows:
+      return S_OK()
+    for keyField in self.dbCatalog[ typeName ][ 'rollups' ]:
+      keyPos = self.dbCatalog[ typeName ][ 'keys' ].index( keyField )
+      sqlFields = [ '`startTime`', '`bucketLength`', "`%s`" % keyField ]
+      sqlUpData = []
+      for valueField in self.dbCatalog[ typeName ][ 'values' ] + [ 'entriesInBucket' ]:
+        valueField = "`%s`" % valueField
+        sqlFields.append( valueField )
+        sqlUpData.append( "%s=%s+VALUES(%s)" % ( valueField, valueField, valueField ) )
+      valuesGroups = []
+      for bStartTime, bLength, keyValues, values in rollupRows:
+        sqlValues = [ bStartTime, bLength, keyValues[ keyPos ] ] + list( values )
+        valuesGroups.append( "( %s )" % ",".join( str( val ) for val in sqlValues ) )
+      cmd = "INSERT INTO `%s` ( %s ) " % ( _getTableName( "rollup", typeName, keyField ), ", ".join( sqlFields ) )
+      cmd += "VALUES %s " % ", ".join( valuesGroups )
+      cmd += "ON DUPLICATE KEY UPDATE %s" % ", ".join( sqlUpData )
+      result = self._update( cmd, conn = connObj )
+      if not result[ 'OK' ]:
+        return result
+    return S_OK()
+
+  def __purgeEmptyRollups( self, typeName ):
+    """
+    Remove the rollup rows left empty after compacting their buckets
+    """
+    for keyField in self.dbCatalog[ typeName ][ 'rollups' ]:
+      result = self._update( "DELETE FROM `%s` WHERE `entriesInBucket` <= 0" % _getTableName( "rollup", typeName, keyField ) )
+      if not result[ 'OK' ]:
+        self.log.error( "[COMPACT] Cannot purge rollup", "%s by %s: %s" % ( typeName, keyField, result[ 'Message' ] ) )
 
 
   def __writeBuckets( self, typeName, buckets, keyValues, valuesList, connObj = False ):
     """ Insert or update a bucket
     """
-#     tableName = _getTableName( "bucket", typeName )
-    #INSERT PART OF THE QUERY
-    sqlFields = [ '`startTime`', '`bucketLength`', '`entriesInBucket`' ]
-    for keyPos in range( len( self.dbCatalog[ typeName ][ 'keys' ] ) ):
-      sqlFields.append( "`%s`" % self.dbCatalog[ typeName ][ 'keys' ][ keyPos ] )
-    sqlUpData = [ "`entriesInBucket`=`entriesInBucket`+VALUES(`entriesInBucket`)" ]
-    for valPos in range( len( self.dbCatalog[ typeName ][ 'values' ] ) ):
-      valueField = "`%s`" % self.dbCatalog[ typeName ][ 'values' ][ valPos ]
-      sqlFields.append( valueField )
-      sqlUpData.append( "%s=%s+VALUES(%s)" % ( valueField, valueField, valueField ) )
-    valuesGroups = []
+    bucketRows = []
     for bucketInfo in buckets:
       bStartTime = bucketInfo[0]
       bProportion = bucketInfo[1]
       bLength = bucketInfo[2]
-      sqlValues = [ bStartTime, bLength, "(%s*%s)" % ( valuesList[-1], bProportion )]
-      for keyPos in range( len( self.dbCatalog[ typeName ][ 'keys' ] ) ):
-        sqlValues.append( keyValues[ keyPos ] )
-      for valPos in range( len( self.dbCatalog[ typeName ][ 'values' ] ) ):
-#         value = valuesList[ valPos ]
-        sqlValues.append( "(%s*%s)" % ( valuesList[ valPos ], bProportion ) )
-      valuesGroups.append( "( %s )" % ",".join( str( val ) for val in sqlValues ) )
-
-    cmd = "INSERT INTO `%s` ( %s ) " % ( _getTableName( "bucket", typeName ), ", ".join( sqlFields ) )
-    cmd += "VALUES %s " % ", ".join( valuesGroups)
-    cmd += "ON DUPLICATE KEY UPDATE %s" % ", ".join( sqlUpData )
+      #Values and the number of entries
+      bucketValues = [ "(%s*%s)" % ( value, bProportion ) for value in valuesList ]
+      bucketRows.append( ( bStartTime, bLength, keyValues, bucketValues ) )
+    return self.__upsertBuckets( typeName, bucketRows, connObj = connObj )
 
-    for _i in range( max( 1, self.__deadLockRetries ) ):
+  def __bucketizeRecords( self, typeName, records, nowEpoch = False ):
+    """
+    Split ( startTime, endTime, keyValues, values ) records in buckets and add them up by bucket
+    and key values. values have to end with the number of entries.
+    Returns a dict ( bucketStartTime, bucketLength, keyValues ) -> added values
+    """
+    if not nowEpoch:
+      nowEpoch = int( Time.toEpoch( Time.dateTime() ) )
+    bucketsData = {}
+    for startTime, endTime, keyValues, values in records:
+      keyValues = tuple( keyValues )
+      values = [ float( value ) for value in values ]
+      for bStartTime, bProportion, bLength in self.calculateBuckets( typeName, startTime, endTime, nowEpoch ):
+        bucketKey = ( bStartTime, bLength, keyValues )
+        if bucketKey not in bucketsData:
+          bucketsData[ bucketKey ] = [ value * bProportion for value in values ]
+        else:
+          bucketValues = bucketsData[ bucketKey ]
+          for valPos in range( len( values ) ):
+            bucketValues[ valPos ] += values[ valPos ] * bProportion
+    return bucketsData
+
+  def __writeBucketRecords( self, typeName, records, connObj = False ):
+    """
+    Bucketize ( startTime, endTime, keyValues, values ) records and write each resulting bucket once
+    """
+    bucketsData = self.__bucketizeRecords( typeName, records )
+    self.log.verbose( "Splitting entries", "%s entries in %s buckets" % ( len( records ), len( bucketsData ) ) )
+    bucketRows = []
+    for bucketKey in sorted( bucketsData ):
+      bucketRows.append( ( bucketKey[0], bucketKey[1], bucketKey[2],
+                           [ "%.10f" % value for value in bucketsData[ bucketKey ] ] ) )
+    return self.__upsertBuckets( typeName, bucketRows, connObj = connObj )
+
+  def __upsertBuckets( self, typeName, bucketRows, connObj = False ):
+    """
+    Add ( startTime, bucketLength, keyValues, values ) rows to the buckets of a type with
+    INSERT ... ON DUPLICATE KEY UPDATE statements of up to BucketsInsertChunkSize rows.
+    values are the SQL expressions to add to each value field followed by the one for entriesInBucket
+    """
+    #INSERT PART OF THE QUERY
+    sqlFields = [ '`startTime`', '`bucketLength`' ]
+    for keyField in self.dbCatalog[ typeName ][ 'keys' ]:
+      sqlFields.append( "`%s`" % keyField )
+    sqlUpData = []
+    for valueField in self.dbCatalog[ typeName ][ 'values' ] + [ 'entriesInBucket' ]:
+      valueField = "`%s`" % valueField
+      sqlFields.append( valueField )
+      sqlUpData.append( "%s=%s+VALUES(%s)" % ( valueField, valueField, valueField ) )
+    chunkSize = max( 1, self.getCSOption( "BucketsInsertChunkSize", 1000 ) )
+    for chunkStart in range( 0, len( bucketRows ), chunkSize ):
+      chunkRows = bucketRows[ chunkStart : chunkStart + chunkSize ]
+      valuesGroups = []
+      for bStartTime, bLength, keyValues, values in chunkRows:
+        sqlValues = [ bStartTime, bLength ] + list( keyValues ) + list( values )
+        valuesGroups.append( "( %s )" % ",".join( str( val ) for val in sqlValues ) )
+
+      cmd = "INSERT INTO `%s` ( %s ) " % ( _getTableName( "bucket", typeName ), ", ".join( sqlFields ) )
+      cmd += "VALUES %s " % ", ".join( valuesGroups )
+      cmd += "ON DUPLICATE KEY UPDATE %s" % ", ".join( sqlUpData )
+
+      #Buckets are always written in a transaction, a dead lock rolls it back as a whole
+      #so the statement must not be retried alone
       result = self._update( cmd, conn = connObj )
       if not result[ 'OK' ]:
-        #If failed because of dead lock try restarting
-        if result[ 'Message' ].find( "try restarting transaction" ):
-          continue
-        return result
-      #If OK, break loopo
-      if result[ 'OK' ]:
+        return S_ERROR( "Cannot update bucket: %s" % result[ 'Message' ] )
+      result = self.__addToRollups( typeName, chunkRows, connObj = connObj )
+      if not result[ 'OK' ]:
         return result
-
-    return S_ERROR( "Cannot update bucket: %s" % result[ 'Message' ] )
+    return S_OK()
 
   def __checkFieldsExistsInType( self, typeName, fields, tableType ):
     """
@@ -968,23 +1159,100 @@ class AccountingDB( DB ):
     nowEpoch = Time.toEpoch( Time.dateTime () )
     bucketTimeLength = self.calculateBucketLengthForTime( typeName, nowEpoch , startTime )
     startTime = startTime - startTime % bucketTimeLength
-    result = self.__queryType( typeName,
-                             startTime,
-                             endTime,
-                             selectFields,
-                             condDict,
-                             groupFields,
-                             orderFields,
-                             "bucket",
-                             connObj = connObj )
+    startTime, endTime = self.__getBucketTimeLimits( typeName, startTime, endTime )
+    queryTables = [ _getTableName( "bucket", typeName ) ]
+    rollupKey = self.__getRollupForQuery( typeName, selectFields, condDict, groupFields, orderFields )
+    if rollupKey:
+      queryTables.insert( 0, _getTableName( "rollup", typeName, rollupKey ) )
+
+    def queryBuckets( queryStartTime, queryEndTime ):
+      for tableName in queryTables:
+        #__queryType modifies the conditions and the grouping
+        queryCondDict, queryGroupFields, queryOrderFields = copy.deepcopy( ( condDict, groupFields, orderFields ) )
+        result = self.__queryType( typeName,
+                                   queryStartTime,
+                                   queryEndTime,
+                                   selectFields,
+                                   queryCondDict,
+                                   queryGroupFields,
+                                   queryOrderFields,
+                                   "bucket",
+                                   connObj = connObj,
+                                   tableName = tableName )
+        if result[ 'OK' ]:
+          break
+        self.log.warn( "Query failed", "on %s: %s" % ( tableName, result[ 'Message' ] ) )
+      return result
+
+    timeColumn = self.__getTimeColumn( selectFields, groupFields, orderFields )
+    if self.__rangeCache.enabled() and startTime and endTime and timeColumn > -1:
+      cacheKey = ( typeName, queryTables[0], repr( selectFields ), repr( sorted( condDict.items() ) ),
+                   repr( groupFields ), repr( orderFields ) )
+      openBucketLength = self.calculateBucketLengthForTime( typeName, nowEpoch, nowEpoch )
+      #Compaction can run in another process, buckets it may merge are not cached
+      compactionTime = 0
+      if len( self.dbBucketsLength[ typeName ] ) > 1:
+        compactionTime = nowEpoch - self.dbBucketsLength[ typeName ][0][0]
+      result = self.__rangeCache.getRange( cacheKey, startTime, endTime, timeColumn, queryBuckets,
+                                           nowEpoch - nowEpoch % openBucketLength, compactionTime )
+    else:
+      result = queryBuckets( startTime, endTime )
     gMonitor.addMark( "querytime", Time.toEpoch() - startQueryEpoch )
     return result
 
-  def __queryType( self, typeName, startTime, endTime, selectFields, condDict, groupFields, orderFields, tableType, connObj = False ):
+  def __getBucketTimeLimits( self, typeName, startTime, endTime ):
+    """
+    Get the first and last bucket start times to query for a time range
+    """
+    #HACK because MySQL and UNIX do not start epoch at the same time
+    if startTime:
+      startTime = startTime + 3600
+      startTime = self.calculateBuckets( typeName, startTime, startTime )[0][0]
+    if endTime:
+      endTime = endTime + 3600
+      endTime = self.calculateBuckets( typeName, endTime, endTime )[0][0]
+    return startTime, endTime
+
+  def __getRollupForQuery( self, typeName, selectFields, condDict, groupFields, orderFields ):
     """
-    Execute a query over a main table
+    Get the rollup key that can answer a bucket query, if any. Queries using no key
+    or only a key with a rollup can be answered by it
     """
-    tableName = _getTableName( tableType, typeName )
+    rollups = self.dbCatalog[ typeName ][ 'rollups' ]
+    if not rollups:
+      return False
+    usedFields = list( selectFields[1] ) + list( condDict )
+    for preGenFields in ( groupFields, orderFields ):
+      if preGenFields:
+        usedFields.extend( preGenFields[1] )
+    usedKeys = []
+    for field in usedFields:
+      if field in self.dbCatalog[ typeName ][ 'keys' ] and field not in usedKeys:
+        usedKeys.append( field )
+    if not usedKeys:
+      return rollups[0]
+    if len( usedKeys ) == 1 and usedKeys[0] in rollups:
+      return usedKeys[0]
+    return False
+
+  def __getTimeColumn( self, selectFields, groupFields, orderFields ):
+    """
+    Get the position of the bucket start time in the rows of a query grouped by it.
+    -1 if the rows of the query can't be split by bucket
+    """
+    if not groupFields or _getPlainFieldColumn( groupFields[0], groupFields[1], 'startTime' ) == -1:
+      return -1
+    if orderFields and ( orderFields[0].strip() != "%s" or list( orderFields[1] ) != [ 'startTime' ] ):
+      return -1
+    return _getPlainFieldColumn( selectFields[0], selectFields[1], 'startTime' )
+
+  def __queryType( self, typeName, startTime, endTime, selectFields, condDict, groupFields, orderFields, tableType,
+                   connObj = False, tableName = False ):
+    """
+    Execute a query over a main table. For buckets the time limits are bucket start times
+    """
+    if not tableName:
+      tableName = _getTableName( tableType, typeName )
     cmd = "SELECT"
     sqlLinkList = []
     #Check if groupFields and orderFields are in ( "%s", ( field1, ) ) form
@@ -1024,16 +1292,10 @@ class AccountingDB( DB ):
     #Calculate time conditions
     sqlTimeCond = []
     if startTime:
-      if tableType == 'bucket':
-        #HACK because MySQL and UNIX do not start epoch at the same time
-        startTime = startTime + 3600
-        startTime = self.calculateBuckets( typeName, startTime, startTime )[0][0]
       sqlTimeCond.append( "`%s`.`startTime` >= %s" % ( tableName, startTime ) )
     if endTime:
       if tableType == "bucket":
         endTimeSQLVar = "startTime"
-        endTime = endTime + 3600
-        endTime = self.calculateBuckets( typeName, endTime, endTime )[0][0]
       else:
         endTimeSQLVar = "endTime"
       sqlTimeCond.append( "`%s`.`%s` <= %s" % ( tableName, endTimeSQLVar, endTime ) )
@@ -1099,7 +1361,7 @@ class AccountingDB( DB ):
       self.__doingCompaction = True
     finally:
       gSynchro.unlock()
-    slow = True
+    slow = not self.getCSOption( "SetBasedCompaction", False )
     for typeName in self.dbCatalog:
       if typeFilter and typeName.find( typeFilter ) == -1:
         self.log.info( "[COMPACT] Skipping %s" % typeName )
@@ -1113,6 +1375,7 @@ class AccountingDB( DB ):
       else:
         self.__compactBucketsForType( typeName )
     self.log.info( "[COMPACT] Compaction finished" )
+    self.__rangeCache.clear()
     self.__lastCompactionEpoch = int( Time.toEpoch() )
     gSynchro.lock()
     try:
@@ -1122,83 +1385,95 @@ class AccountingDB( DB ):
       gSynchro.unlock()
     return S_OK()
 
-  def __selectForCompactBuckets( self, typeName, timeLimit, bucketLength, nextBucketLength, connObj = False ):
-    """
-    Nasty SQL query to get ideal buckets using grouping by date calculations and adding value contents
-    """
-    tableName = _getTableName( "bucket", typeName )
-    selectSQL = "SELECT "
-    sqlSelectList = []
-    for field in self.dbCatalog[ typeName ][ 'keys' ]:
-      sqlSelectList.append( "`%s`.`%s`" % ( tableName, field ) )
-    for field in self.dbCatalog[ typeName ][ 'values' ]:
-      sqlSelectList.append( "SUM( `%s`.`%s` )" % ( tableName, field ) )
-    sqlSelectList.append( "SUM( `%s`.`entriesInBucket` )" % ( tableName ) )
-    sqlSelectList.append( "MIN( `%s`.`startTime` )" % tableName )
-    sqlSelectList.append( "MAX( `%s`.`startTime` )" % tableName )
-    selectSQL += ", ".join( sqlSelectList )
-    selectSQL += " FROM `%s`" % tableName
-    selectSQL += " WHERE `%s`.`startTime` < '%s' AND" % ( tableName, timeLimit )
-    selectSQL += " `%s`.`bucketLength` = %s" % ( tableName, bucketLength )
-    #MAGIC bucketing
-    sqlGroupList = [ _bucketizeDataField( "`%s`.`startTime`" % tableName, nextBucketLength ) ]
-    for field in self.dbCatalog[ typeName ][ 'keys' ]:
-      sqlGroupList.append( "`%s`.`%s`" % ( tableName, field ) )
-    selectSQL += " GROUP BY %s" % ", ".join( sqlGroupList )
-    return self._query( selectSQL, conn = connObj )
-
-  def __deleteForCompactBuckets( self, typeName, timeLimit, bucketLength, connObj = False ):
-    """
-    Delete compacted buckets
-    """
-    tableName = _getTableName( "bucket", typeName )
-    deleteSQL = "DELETE FROM `%s` WHERE " % tableName
-    deleteSQL += "`%s`.`startTime` < '%s' AND " % ( tableName, timeLimit )
-    deleteSQL += "`%s`.`bucketLength` = %s" % ( tableName, bucketLength )
-    return self._update( deleteSQL, conn = connObj )
-
   def __compactBucketsForType( self, typeName ):
     """
-    Compact all buckets for a given type
+    Compact all buckets for a given type with set based SQL, one time window per transaction
     """
     nowEpoch = Time.toEpoch()
-    #retVal = self.__startTransaction( connObj )
-    #if not retVal[ 'OK' ]:
-    #  return retVal
+    tableName = _getTableName( "bucket", typeName )
+    windowLength = self.getCSOption( "CompactionWindow", 86400 )
     for bPos in range( len( self.dbBucketsLength[ typeName ] ) - 1 ):
       self.log.info( "[COMPACT] Query %d of %d" % ( bPos + 1, len( self.dbBucketsLength[ typeName ] ) - 1 ) )
       secondsLimit = self.dbBucketsLength[ typeName ][ bPos ][0]
       bucketLength = self.dbBucketsLength[ typeName ][ bPos ][1]
       timeLimit = ( nowEpoch - nowEpoch % bucketLength ) - secondsLimit
       nextBucketLength = self.dbBucketsLength[ typeName ][ bPos + 1 ][1]
-      self.log.info( "[COMPACT] Compacting data newer that %s with bucket size %s" % ( Time.fromEpoch( timeLimit ), bucketLength ) )
-      #Retrieve the data
-      retVal = self.__selectForCompactBuckets( typeName, timeLimit, bucketLength, nextBucketLength )
+      self.log.info( "[COMPACT] Compacting data older than %s with bucket size %s for %s" % ( Time.fromEpoch( timeLimit ),
+                                                                                            bucketLength, typeName ) )
+      retVal = self._query( "SELECT MIN( `startTime` ) FROM `%s` WHERE `startTime` < %d AND `bucketLength` = %d" % ( tableName,
+                                                                                                                  timeLimit,
+                                                                                                                  bucketLength ) )
       if not retVal[ 'OK' ]:
-        #self.__rollbackTransaction( connObj )
         return retVal
-      bucketsData = retVal[ 'Value' ]
-      self.log.info( "[COMPACT] Got %d records to compact" % len( bucketsData ) )
-      if len( bucketsData ) == 0:
+      firstStartTime = retVal[ 'Value' ][0][0]
+      if firstStartTime is None:
         continue
-      retVal = self.__deleteForCompactBuckets( typeName, timeLimit, bucketLength )
-      if not retVal[ 'OK' ]:
-        #self.__rollbackTransaction( connObj )
-        return retVal
-      self.log.info( "[COMPACT] Compacting %s records %s seconds size for %s" % ( len( bucketsData ), bucketLength, typeName ) )
-      #Add data
-      for record in bucketsData:
-        startTime = record[-2]
-        endTime = record[-1]
-        valuesList = record[:-2]
-        retVal = self.__splitInBuckets( typeName, startTime, endTime, valuesList )
+      #Windows are aligned to the new bucket length so no new bucket is split between two windows
+      windowStep = max( nextBucketLength, windowLength - windowLength % nextBucketLength )
+      windowStart = firstStartTime - firstStartTime % nextBucketLength
+      while windowStart < timeLimit:
+        windowEnd = min( windowStart + windowStep, timeLimit )
+        roundStartTime = time.time()
+        retVal = self.__compactBucketsWindow( typeName, windowStart, windowEnd, bucketLength, nextBucketLength )
         if not retVal[ 'OK' ]:
-          #self.__rollbackTransaction( connObj )
-          self.log.error( "[COMPACT] Error while compacting data for record", "%s: %s" % ( typeName, retVal[ 'Value' ] ) )
-      self.log.info( "[COMPACT] Finished compaction %d of %d" % ( bPos, len( self.dbBucketsLength[ typeName ] ) - 1 ) )
-    #return self.__commitTransaction( connObj )
+          self.log.error( "[COMPACT] Error while compacting window", "%s [%s, %s): %s" % ( typeName,
+                                                                                          Time.fromEpoch( windowStart ),
+                                                                                          Time.fromEpoch( windowEnd ),
+                                                                                          retVal[ 'Message' ] ) )
+          return retVal
+        self.log.verbose( "[COMPACT] Compacted %s buckets from %s (took %.2f secs)" % ( retVal[ 'Value' ],
+                                                                                       Time.fromEpoch( windowStart ),
+                                                                                       time.time() - roundStartTime ) )
+        windowStart += windowStep
+      self.log.info( "[COMPACT] Finished compaction %d of %d" % ( bPos + 1, len( self.dbBucketsLength[ typeName ] ) - 1 ) )
     return S_OK()
 
+  def __compactBucketsWindow( self, typeName, windowStart, windowEnd, bucketLength, nextBucketLength ):
+    """
+    Merge the buckets of bucketLength starting in [ windowStart, windowEnd ) into buckets of
+    nextBucketLength, in the bucket table and in the rollups of the type, in one transaction
+    """
+    tablesToCompact = [ ( _getTableName( "bucket", typeName ), self.dbCatalog[ typeName ][ 'keys' ] ) ]
+    for keyField in self.dbCatalog[ typeName ][ 'rollups' ]:
+      tablesToCompact.append( ( _getTableName( "rollup", typeName, keyField ), [ keyField ] ) )
+    retVal = self.transactionStart()
+    if not retVal[ 'OK' ]:
+      return retVal
+    numCompacted = 0
+    for tableName, keyFields in tablesToCompact:
+      keyFields = [ "`%s`" % field for field in keyFields ]
+      sumFields = [ "`%s`" % field for field in self.dbCatalog[ typeName ][ 'values' ] + [ 'entriesInBucket' ] ]
+      windowCond = "`startTime` >= %d AND `startTime` < %d AND `bucketLength` = %d" % ( windowStart,
+                                                                                       windowEnd,
+                                                                                       bucketLength )
+      newStartTime = _bucketizeDataField( "`startTime`", nextBucketLength )
+      #The derived table is needed to read from the table being inserted
+      selectSQL = "SELECT %s AS `startTime`, %d AS `bucketLength`, %s FROM `%s` WHERE %s GROUP BY %s" % (
+                    newStartTime,
+                    nextBucketLength,
+                    ", ".join( keyFields + [ "SUM(%s) AS %s" % ( field, field ) for field in sumFields ] ),
+                    tableName,
+                    windowCond,
+                    ", ".join( [ newStartTime ] + keyFields ) )
+      cmd = "INSERT INTO `%s` ( `startTime`, `bucketLength`, %s ) " % ( tableName, ", ".join( keyFields + sumFields ) )
+      cmd += "SELECT * FROM ( %s ) AS `compacted` " % selectSQL
+      cmd += "ON DUPLICATE KEY UPDATE %s" % ", ".join( [ "`%s`.%s=`%s`.%s+VALUES(%s)" % ( tableName, field,
+                                                                                          tableName, field,
+                                                                                          field )
+                                                         for field in sumFields ] )
+      retVal = self._update( cmd )
+      if retVal[ 'OK' ]:
+        retVal = self._update( "DELETE FROM `%s` WHERE %s" % ( tableName, windowCond ) )
+      if not retVal[ 'OK' ]:
+        self.transactionRollback()
+        return retVal
+      if tableName == _getTableName( "bucket", typeName ):
+        numCompacted = retVal[ 'Value' ]
+    retVal = self.transactionCommit()
+    if not retVal[ 'OK' ]:
+      return retVal
+    return S_OK( numCompacted )
+
   def __slowCompactBucketsForType( self, typeName ):
     """
     Compact all buckets for a given type
@@ -1233,28 +1508,38 @@ class AccountingDB( DB ):
         if len( bucketsData ) == 0:
           break
 
+        #The buckets of a round are deleted, taken out of the rollups and written back
+        #compacted in one transaction so that a failure does not lose their contents
+        result = self.__startTransaction()
+        if not result[ 'OK' ]:
+          return result
         result = self.__deleteIndividualForCompactBuckets( typeName, bucketsData )
         if not result[ 'OK' ]:
-          #self.__rollbackTransaction( connObj )
+          self.__rollbackTransaction()
           return result
         bucketsData = result[ 'Value' ]
         deleteEndTime = time.time()
         self.log.info( "[COMPACT] Deleted %s out-of-bounds buckets (took %.2f secs)" % ( len( bucketsData ),
                                                                                          deleteEndTime - selectEndTime ) )
         #Add data
-        for record in bucketsData:
-          startTime = record[-2]
-          endTime = record[-2] + record[-1]
-          valuesList = record[:-2]
-          retVal = self.__splitInBuckets( typeName, startTime, endTime, valuesList )
-          if not retVal[ 'OK' ]:
-            self.log.error( "[COMPACT] Error while compacting data for buckets", "%s: %s" % ( typeName, retVal[ 'Value' ] ) )
+        numKeys = len( self.dbCatalog[ typeName ][ 'keys' ] )
+        bucketRecords = [ ( record[-2], record[-2] + record[-1], record[ :numKeys ], record[ numKeys:-2 ] )
+                          for record in bucketsData ]
+        retVal = self.__writeBucketRecords( typeName, bucketRecords )
+        if not retVal[ 'OK' ]:
+          self.log.error( "[COMPACT] Error while compacting data for buckets", "%s: %s" % ( typeName, retVal[ 'Message' ] ) )
+          self.__rollbackTransaction()
+          return retVal
+        retVal = self.__commitTransaction()
+        if not retVal[ 'OK' ]:
+          return retVal
         totalCompacted += len( bucketsData )
         insertElapsedTime = time.time() - deleteEndTime
         self.log.info( "[COMPACT] Records compacted (took %.2f secs, %.2f secs/bucket)" % ( insertElapsedTime,
                                                                                             insertElapsedTime / len( bucketsData ) ) )
       self.log.info( "[COMPACT] Finised compaction %d of %d" % ( bPos, len( self.dbBucketsLength[ typeName ] ) - 1 ) )
     #return self.__commitTransaction( connObj )
+    self.__purgeEmptyRollups( typeName )
     return S_OK()
 
   def __selectIndividualForCompactBuckets( self, typeName, timeLimit, bucketLength, nextBucketLength, querySize, connObj = False ):
@@ -1285,6 +1570,7 @@ class AccountingDB( DB ):
     """
     tableName = _getTableName( "bucket", typeName )
     keyFields = self.dbCatalog[ typeName ][ 'keys' ]
+    numValues = len( self.dbCatalog[ typeName ][ 'values' ] ) + 1
     deleteQueryLimit = 50
     deletedBuckets = []
     for bLimit in range( 0, len( bucketsData ) , deleteQueryLimit ):
@@ -1301,8 +1587,17 @@ class AccountingDB( DB ):
       result = self._update( delSQL, conn = connObj )
       if not result[ 'OK' ]:
         self.log.error( "Cannot delete individual records for compaction", result[ 'Message' ] )
-      else:
-        deletedBuckets.extend( bucketsData[ bLimit : bLimit + deleteQueryLimit ] )
+        return result
+      deletedBuckets.extend( bucketsData[ bLimit : bLimit + deleteQueryLimit ] )
+      #Take the deleted buckets out of the rollups, they are added back once compacted
+      rollupRows = []
+      for record in bucketsData[ bLimit : bLimit + deleteQueryLimit ]:
+        rollupRows.append( ( record[-2], record[-1], record[ :len( keyFields ) ],
+                             [ "-%s" % value for value in record[ -2 - numValues:-2 ] ] ) )
+      result = self.__addToRollups( typeName, rollupRows, connObj = connObj )
+      if not result[ 'OK' ]:
+        self.log.error( "Cannot update rollups for compaction", result[ 'Message' ] )
+        return result
     return S_OK( deletedBuckets )
 
   def __deleteRecordsOlderThanDataTimespan( self, typeName ):
@@ -1313,8 +1608,12 @@ class AccountingDB( DB ):
     dataTimespan = self.dbCatalog[ typeName ][ 'dataTimespan' ]
     if dataTimespan < 86400 * 30:
       return
-    for table, field in ( ( _getTableName( "type", typeName ), 'endTime' ),
-                          ( _getTableName( "bucket", typeName ), 'startTime + %s' % self.dbBucketsLength[ typeName ][-1][1] ) ):
+    bucketEndField = 'startTime + %s' % self.dbBucketsLength[ typeName ][-1][1]
+    tablesAndFields = [ ( _getTableName( "type", typeName ), 'endTime' ),
+                        ( _getTableName( "bucket", typeName ), bucketEndField ) ]
+    for keyField in self.dbCatalog[ typeName ][ 'rollups' ]:
+      tablesAndFields.append( ( _getTableName( "rollup", typeName, keyField ), bucketEndField ) )
+    for table, field in tablesAndFields:
       self.log.info( "[COMPACT] Deleting old records for table %s" % table )
       deleteLimit = 100000
       deleted = deleteLimit
@@ -1346,6 +1645,10 @@ class AccountingDB( DB ):
     retVal = self._update( "DELETE FROM `%s`" % _getTableName( "bucket", typeName ) )
     if not retVal[ 'OK' ]:
       return retVal
+    for keyField in self.dbCatalog[ typeName ][ 'rollups' ]:
+      retVal = self._update( "DELETE FROM `%s`" % _getTableName( "rollup", typeName, keyField ) )
+      if not retVal[ 'OK' ]:
+        return retVal
     #Generate the common part of the query
     #SELECT fields
     startTimeTableField = "`%s`.startTime" % rawTableName
@@ -1440,9 +1743,16 @@ class AccountingDB( DB ):
         startT = entry[0]
         endT = entry[1]
         values = entry[2:]
+        #Buckets and rollups of a record are updated together
+        retVal = self.__startTransaction()
+        if not retVal[ 'OK' ]:
+          return retVal
         retVal = self.__splitInBuckets( typeName, startT, endT, values )
         if not retVal[ 'OK' ]:
-          #self.__rollbackTransaction( connObj )
+          self.__rollbackTransaction()
+          return retVal
+        retVal = self.__commitTransaction()
+        if not retVal[ 'OK' ]:
           return retVal
         rebucketedRecords += 1
         if rebucketedRecords % 1000 == 0:
@@ -1458,26 +1768,78 @@ class AccountingDB( DB ):
     return S_OK()
 
 
-  def __startTransaction( self, connObj ):
-    return self._query( "START TRANSACTION", conn = connObj )
+  def __isDeadLock( self, result ):
+    return not result[ 'OK' ] and result[ 'Message' ].find( "try restarting transaction" ) != -1
+
+  def __runInTransaction( self, function ):
+    """
+    Run function() in a transaction, rolled back if it fails. A dead lock rolls back the
+    whole transaction, so in that case the whole function is run again
+    """
+    for _i in range( max( 1, self.__deadLockRetries ) ):
+      retVal = self.__startTransaction()
+      if not retVal[ 'OK' ]:
+        return retVal
+      retVal = function()
+      if not retVal[ 'OK' ]:
+        self.__rollbackTransaction()
+        if self.__isDeadLock( retVal ):
+          self.log.warn( "Dead lock, restarting transaction", retVal[ 'Message' ] )
+          continue
+        return retVal
+      result = self.__commitTransaction()
+      if not result[ 'OK' ]:
+        return result
+      return retVal
+    return retVal
+
+  #Raw START TRANSACTION/COMMIT statements could run on different pooled connections,
+  #the pool transactions keep the connection pinned to the thread until the end
+  def __startTransaction( self, connObj = False ):
+    return self.transactionStart()
 
-  def __commitTransaction( self, connObj ):
-    return self._query( "COMMIT", conn = connObj )
+  def __commitTransaction( self, connObj = False ):
+    return self.transactionCommit()
 
-  def __rollbackTransaction( self, connObj ):
-    return self._query( "ROLLBACK", conn = connObj )
+  def __rollbackTransaction( self, connObj = False ):
+    return self.transactionRollback()
 
 def _bucketizeDataField( dataField, bucketLength ):
   return "%s - ( %s %% %s )" % ( dataField, dataField, bucketLength )
 
+def _getPlainFieldColumn( formatString, fields, fieldName ):
+  """
+  Get the column of a ( formatString, fields ) SQL list where fieldName is used as is, -1 if none
+  """
+  columns = []
+  depth = 0
+  column = ""
+  for char in formatString:
+    if char == "," and depth == 0:
+      columns.append( column.strip() )
+      column = ""
+      continue
+    if char == "(":
+      depth += 1
+    elif char == ")":
+      depth -= 1
+    column += char
+  columns.append( column.strip() )
+  fieldPos = 0
+  for colPos in range( len( columns ) ):
+    if columns[ colPos ] == "%s" and fieldPos < len( fields ) and fields[ fieldPos ] == fieldName:
+      return colPos
+    fieldPos += columns[ colPos ].count( "%s" )
+  return -1
+
 def _getTableName( tableType, typeName, keyName = None ):
   """
   Generate table name
   """
   if not keyName:
     return "ac_%s_%s" % ( tableType, typeName )
-  elif tableType == "key" :
+  elif tableType in ( "key", "rollup" ):
     return "ac_%s_%s_%s" % ( tableType, typeName, keyName )
   else:
-    raise Exception( "Call to _getTableName with tableType as key but with no keyName" )
+    raise Exception( "Call to _getTableName with keyName but tableType is not key or rollup" )
 
@@ -0,0 +1,138 @@
+# $HeadURL$
+""" Partial range cache for bucketed accounting queries
+
+    Results of queries grouped by bucket startTime are kept as time segments
+    per query. A query for a window overlapping the cached segments only
+    fetches the missing edges from the DB. Buckets still being filled are never
+    cached, and each segment expires after lifeTime seconds, so late records
+    show up at the latest lifeTime seconds after being bucketed. Buckets that
+    can be compacted before their segment expires are not cached either, as
+    compaction can be run by any process.
+"""
+__RCSID__ = "$Id$"
+
+import time
+import threading
+from DIRAC import S_OK
+
+class BucketRangeCache:
+
+  def __init__( self, lifeTime = 600, maxEntries = 1000, maxSegments = 50 ):
+    self.__lifeTime = lifeTime
+    self.__maxEntries = maxEntries
+    self.__maxSegments = maxSegments
+    #cacheKey -> [ lastUse, [ [ segStart, segEnd, expiration, rows ], ... ] ]
+    self.__entries = {}
+    self.__lock = threading.Lock()
+
+  def enabled( self ):
+    return self.__lifeTime > 0
+
+  def clear( self ):
+    self.__lock.acquire()
+    try:
+      self.__entries = {}
+    finally:
+      self.__lock.release()
+
+  def __getLiveSegments( self, cacheKey, now ):
+    self.__lock.acquire()
+    try:
+      if cacheKey not in self.__entries:
+        return []
+      entry = self.__entries[ cacheKey ]
+      entry[0] = now
+      entry[1] = [ seg for seg in entry[1] if seg[2] > now ]
+      return sorted( entry[1] )
+    finally:
+      self.__lock.release()
+
+  def __addSegment( self, cacheKey, segStart, segEnd, rows, timeColumn, now ):
+    """
+    Cache the rows of [ segStart, segEnd ]. Parts already cached meanwhile by
+    a concurrent request for the same query are not added again
+    """
+    self.__lock.acquire()
+    try:
+      if cacheKey not in self.__entries:
+        if len( self.__entries ) >= self.__maxEntries:
+          self.__purge( now )
+        self.__entries[ cacheKey ] = [ now, [] ]
+      entry = self.__entries[ cacheKey ]
+      entry[1] = [ seg for seg in entry[1] if seg[2] > now ]
+      segments = entry[1]
+      #Drop the query if it has been fragmented too much
+      if len( segments ) >= self.__maxSegments:
+        del( segments[:] )
+      pieces = []
+      cursor = segStart
+      for segment in sorted( segments ):
+        if segment[1] < cursor or segment[0] > segEnd:
+          continue
+        if segment[0] > cursor:
+          pieces.append( ( cursor, segment[0] - 1 ) )
+        cursor = segment[1] + 1
+      if cursor <= segEnd:
+        pieces.append( ( cursor, segEnd ) )
+      for pieceStart, pieceEnd in pieces:
+        segments.append( [ pieceStart, pieceEnd, now + self.__lifeTime,
+                           [ row for row in rows if pieceStart <= row[ timeColumn ] <= pieceEnd ] ] )
+    finally:
+      self.__lock.release()
+
+  def __purge( self, now ):
+    """
+    Remove expired entries, and the least recently used ones if still full
+    """
+    for cacheKey in self.__entries.keys():
+      entry = self.__entries[ cacheKey ]
+      entry[1] = [ seg for seg in entry[1] if seg[2] > now ]
+      if not entry[1]:
+        del( self.__entries[ cacheKey ] )
+    if len( self.__entries ) >= self.__maxEntries:
+      lruKeys = sorted( self.__entries, key = lambda cacheKey: self.__entries[ cacheKey ][0] )
+      for cacheKey in lruKeys[ :len( lruKeys ) - self.__maxEntries / 2 ]:
+        del( self.__entries[ cacheKey ] )
+
+  def getRange( self, cacheKey, startTime, endTime, timeColumn, fetchFunc, closedTime, compactionTime = 0 ):
+    """
+    Get the rows with the bucket start ( at position timeColumn ) in [ startTime, endTime ]
+      - fetchFunc( start, end ) has to return S_OK( rows ) for the buckets starting in [ start, end ]
+      - closedTime is the start of the first bucket that can still be filled, rows from
+        there on are always fetched from the DB
+      - compactionTime is the time before which buckets are compacted now. Rows before
+        compactionTime + lifeTime are always fetched from the DB
+    Rows are returned sorted by bucket start
+    """
+    now = time.time()
+    cacheStart = startTime
+    if compactionTime:
+      cacheStart = max( startTime, compactionTime + self.__lifeTime )
+    segments = []
+    gaps = []
+    cursor = startTime
+    for segment in self.__getLiveSegments( cacheKey, now ):
+      if segment[1] < startTime or segment[0] > endTime:
+        continue
+      segments.append( segment )
+      if segment[0] > cursor:
+        gaps.append( ( cursor, segment[0] - 1 ) )
+      cursor = max( cursor, segment[1] + 1 )
+    if cursor <= endTime:
+      gaps.append( ( cursor, endTime ) )
+
+    rows = []
+    for segment in segments:
+      rows.extend( [ row for row in segment[3] if startTime <= row[ timeColumn ] <= endTime ] )
+    for gapStart, gapEnd in gaps:
+      result = fetchFunc( gapStart, gapEnd )
+      if not result[ 'OK' ]:
+        return result
+      fetchedRows = result[ 'Value' ]
+      rows.extend( fetchedRows )
+      cacheEnd = min( gapEnd, closedTime - 1 )
+      gapCacheStart = max( gapStart, cacheStart )
+      if cacheEnd >= gapCacheStart:
+        self.__addSegment( cacheKey, gapCacheStart, cacheEnd, fetchedRows, timeColumn, now )
+    rows.sort( key = lambda row: row[ timeColumn ] )
+    return S_OK( rows )
@@ -0,0 +1,87 @@
+""" Test cases for the BucketRangeCache
+"""
+
+import sys
+if sys.version_info < ( 2, 7 ):
+  import unittest2 as unittest
+else:
+  import unittest
+
+from DIRAC import S_OK, S_ERROR
+from DIRAC.AccountingSystem.private.BucketRangeCache import BucketRangeCache
+
+class FakeBuckets:
+
+  def __init__( self, bucketLength ):
+    self.bucketLength = bucketLength
+    self.queries = []
+    self.fail = False
+
+  def query( self, startTime, endTime ):
+    self.queries.append( ( startTime, endTime ) )
+    if self.fail:
+      return S_ERROR( "Lost connection" )
+    firstBucket = startTime + ( -startTime % self.bucketLength )
+    return S_OK( tuple( [ ( 'Site', bucketStart, bucketStart / self.bucketLength )
+                          for bucketStart in range( firstBucket, endTime + 1, self.bucketLength ) ] ) )
+
+class BucketRangeCacheTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.buckets = FakeBuckets( 100 )
+    self.cache = BucketRangeCache( lifeTime = 600 )
+
+  def test_overlappingWindows( self ):
+    result = self.cache.getRange( 'key', 1000, 2000, 1, self.buckets.query, 1800 )
+    self.assertTrue( result[ 'OK' ] )
+    self.assertEqual( [ row[1] for row in result[ 'Value' ] ], range( 1000, 2001, 100 ) )
+    #Only the open buckets and the new edge are fetched
+    result = self.cache.getRange( 'key', 1500, 2500, 1, self.buckets.query, 2300 )
+    self.assertTrue( result[ 'OK' ] )
+    self.assertEqual( [ row[1] for row in result[ 'Value' ] ], range( 1500, 2501, 100 ) )
+    self.assertEqual( self.buckets.queries, [ ( 1000, 2000 ), ( 1800, 2500 ) ] )
+    #Earlier window with a hole at the beginning
+    result = self.cache.getRange( 'key', 500, 1600, 1, self.buckets.query, 2300 )
+    self.assertEqual( [ row[1] for row in result[ 'Value' ] ], range( 500, 1601, 100 ) )
+    self.assertEqual( self.buckets.queries[-1], ( 500, 999 ) )
+    #Other queries do not share data
+    self.cache.getRange( 'otherKey', 1500, 1600, 1, self.buckets.query, 2300 )
+    self.assertEqual( self.buckets.queries[-1], ( 1500, 1600 ) )
+
+  def test_expiration( self ):
+    self.cache = BucketRangeCache( lifeTime = -1 )
+    self.cache.getRange( 'key', 1000, 2000, 1, self.buckets.query, 3000 )
+    self.cache.getRange( 'key', 1000, 2000, 1, self.buckets.query, 3000 )
+    self.assertEqual( self.buckets.queries, [ ( 1000, 2000 ), ( 1000, 2000 ) ] )
+
+  def test_concurrentFill( self ):
+    #Another request fills the same window while this one is fetching it
+    def concurrentQuery( startTime, endTime ):
+      self.cache.getRange( 'key', 1200, 2000, 1, self.buckets.query, 1800 )
+      return self.buckets.query( startTime, endTime )
+    result = self.cache.getRange( 'key', 1000, 2000, 1, concurrentQuery, 1800 )
+    self.assertEqual( [ row[1] for row in result[ 'Value' ] ], range( 1000, 2001, 100 ) )
+    #Each bucket is cached only once
+    result = self.cache.getRange( 'key', 1000, 2000, 1, self.buckets.query, 1800 )
+    self.assertEqual( [ row[1] for row in result[ 'Value' ] ], range( 1000, 2001, 100 ) )
+    self.assertEqual( self.buckets.queries[-1], ( 1800, 2000 ) )
+
+  def test_compactionTime( self ):
+    #Buckets before 1000 can be compacted within the lifetime of the cache
+    result = self.cache.getRange( 'key', 0, 2000, 1, self.buckets.query, 1800, compactionTime = 400 )
+    self.assertEqual( [ row[1] for row in result[ 'Value' ] ], range( 0, 2001, 100 ) )
+    result = self.cache.getRange( 'key', 0, 2000, 1, self.buckets.query, 1800, compactionTime = 400 )
+    self.assertEqual( [ row[1] for row in result[ 'Value' ] ], range( 0, 2001, 100 ) )
+    self.assertEqual( self.buckets.queries, [ ( 0, 2000 ), ( 0, 999 ), ( 1800, 2000 ) ] )
+
+  def test_errors( self ):
+    self.buckets.fail = True
+    result = self.cache.getRange( 'key', 1000, 2000, 1, self.buckets.query, 3000 )
+    self.assertFalse( result[ 'OK' ] )
+    self.buckets.fail = False
+    self.cache.getRange( 'key', 1000, 2000, 1, self.buckets.query, 3000 )
+    self.assertEqual( self.buckets.queries[-1], ( 1000, 2000 ) )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( BucketRangeCacheTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
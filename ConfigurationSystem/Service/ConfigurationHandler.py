@@ -2,18 +2,52 @@
 __RCSID__ = "$Id$"
 import types
 from DIRAC.ConfigurationSystem.private.ServiceInterface import ServiceInterface
+from DIRAC.ConfigurationSystem.private.Refresher import gRefresher
 from DIRAC.Core.DISET.RequestHandler import RequestHandler
 from DIRAC.Core.Utilities.ReturnValues import S_OK, S_ERROR
+from DIRAC.FrameworkSystem.Client.Logger import gLogger
 
 gServiceInterface = False
+#Transport ids of the clients subscribed to new version notifications
+gSubscribers = set()
 
 def initializeConfigurationHandler( serviceInfo ):
   global gServiceInterface
   gServiceInterface = ServiceInterface( serviceInfo[ 'URL' ] )
+  gRefresher.addListenerToNewVersionEvent( ConfigurationHandler.notifyNewVersion )
   return S_OK()
 
 class ConfigurationHandler( RequestHandler ):
 
+  MSG_DEFINITIONS = { 'NewVersion' : { 'version' : types.StringType } }
+
+  @classmethod
+  def notifyNewVersion( cls, eventName, version ):
+    """
+    Push the new version to all the subscribed clients so they can update right away
+    """
+    for trid in list( gSubscribers ):
+      result = cls.srv_msgCreate( "NewVersion" )
+      if not result[ 'OK' ]:
+        return result
+      msgObj = result[ 'Value' ]
+      msgObj.version = version
+      result = cls.srv_msgSend( trid, msgObj )
+      if not result[ 'OK' ]:
+        gLogger.verbose( "Could not notify new version", "to %s: %s" % ( trid, result[ 'Message' ] ) )
+        gSubscribers.discard( trid )
+    return S_OK()
+
+  auth_conn_connected = [ 'all' ]
+  def conn_connected( self, trid, identity, kwargs ):
+    gSubscribers.add( trid )
+    return S_OK()
+
+  auth_conn_drop = [ 'all' ]
+  def conn_drop( self, trid ):
+    gSubscribers.discard( trid )
+    return S_OK()
+
   types_getVersion = []
   def export_getVersion( self ):
     return S_OK( gServiceInterface.getVersion() )
@@ -31,6 +65,23 @@ class ConfigurationHandler( RequestHandler ):
       retDict[ 'data' ] = gServiceInterface.getCompressedConfigurationData()
     return S_OK( retDict )
 
+  types_getCompressedDeltaIfNewer = [ types.StringType ]
+  def export_getCompressedDeltaIfNewer( self, sClientVersion ):
+    """
+    Like getCompressedDataIfNewer but sending only the modifications since the client
+    version if it is known by the server. Otherwise the full data is sent
+    """
+    sVersion = gServiceInterface.getVersion()
+    retDict = { 'newestVersion' : sVersion }
+    if sClientVersion < sVersion:
+      retVal = gServiceInterface.getCompressedDelta( sClientVersion )
+      if retVal[ 'OK' ]:
+        retDict[ 'delta' ] = retVal[ 'Value' ]
+        retDict[ 'deltaHash' ] = retVal[ 'Hash' ]
+      else:
+        retDict[ 'data' ] = gServiceInterface.getCompressedConfigurationData()
+    return S_OK( retDict )
+
   types_publishSlaveServer = [ types.StringType ]
   def export_publishSlaveServer( self, sURL ):
     gServiceInterface.publishSlaveServer( sURL )
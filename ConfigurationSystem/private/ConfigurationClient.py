@@ -4,7 +4,6 @@ __RCSID__ = "$Id$"
 import types
 import os
 import DIRAC
-from DIRAC.Core.Utilities import List
 from DIRAC.ConfigurationSystem.Client.ConfigurationData import gConfigurationData
 from DIRAC.ConfigurationSystem.private.Refresher import gRefresher
 from DIRAC.Core.Utilities.ReturnValues import S_OK, S_ERROR
@@ -98,13 +97,13 @@ class ConfigurationClient:
 
   def getOption( self, optionPath, typeValue = None ):
     gRefresher.refreshConfigurationIfNeeded()
-    optionValue = gConfigurationData.extractOptionFromCFG( optionPath )
-
-    if optionValue == None:
-      return S_ERROR( "Path %s does not exist or it's not an option" % optionPath )
+    snapshot = gConfigurationData.getSnapshot()
 
     #Value has been returned from the configuration
     if typeValue == None:
+      optionValue = snapshot.getOption( optionPath )
+      if optionValue == None:
+        return S_ERROR( "Path %s does not exist or it's not an option" % optionPath )
       return S_OK( optionValue )
 
     #Casting to typeValue's type
@@ -112,21 +111,12 @@ class ConfigurationClient:
     if not type( typeValue ) == types.TypeType:
       requestedType = type( typeValue )
 
-    if requestedType == types.ListType:
-      try:
-        return S_OK( List.fromChar( optionValue, ',' ) )
-      except Exception:
-        return S_ERROR( "Can't convert value (%s) to comma separated list" % str( optionValue ) )
-    elif requestedType == types.BooleanType:
-      try:
-        return S_OK( optionValue.lower() in ( "y", "yes", "true", "1" ) )
-      except Exception:
-        return S_ERROR( "Can't convert value (%s) to Boolean" % str( optionValue ) )
-    else:
-      try:
-        return S_OK( requestedType( optionValue ) )
-      except:
-        return S_ERROR( "Type mismatch between default (%s) and configured value (%s) " % ( str( typeValue ), optionValue ) )
+    optionValue, casted = snapshot.getTypedOption( optionPath, requestedType )
+    if optionValue == None:
+      return S_ERROR( "Path %s does not exist or it's not an option" % optionPath )
+    if not casted:
+      return S_ERROR( "Type mismatch between default (%s) and configured value (%s) " % ( str( typeValue ), optionValue ) )
+    return S_OK( optionValue )
 
 
   def getSections( self, sectionPath, listOrdered = True ):
@@ -147,12 +137,8 @@ class ConfigurationClient:
 
   def getOptionsDict( self, sectionPath ):
     gRefresher.refreshConfigurationIfNeeded()
-    optionsDict = {}
-    optionList = gConfigurationData.getOptionsFromCFG( sectionPath )
-    if type( optionList ) == types.ListType:
-      for option in optionList:
-        optionsDict[ option ] = gConfigurationData.extractOptionFromCFG( "%s/%s" %
-                                                              ( sectionPath, option ) )
+    optionsDict = gConfigurationData.getSnapshot().getOptionsDict( sectionPath )
+    if type( optionsDict ) == types.DictType:
       return S_OK( optionsDict )
     else:
       return S_ERROR( "Path %s does not exist or it's not a section" % sectionPath )
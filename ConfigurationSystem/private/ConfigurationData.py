@@ -6,11 +6,16 @@ import zlib
 import zipfile
 import threading, thread
 import time
+try:
+  from hashlib import md5
+except ImportError:
+  from md5 import md5
 import DIRAC
-from DIRAC.Core.Utilities import List, Time
+from DIRAC.Core.Utilities import List, Time, DEncode
 from DIRAC.Core.Utilities.ReturnValues import S_OK, S_ERROR
 from DIRAC.Core.Utilities.CFG import CFG
 from DIRAC.Core.Utilities.LockRing import LockRing
+from DIRAC.ConfigurationSystem.private.ConfigurationSnapshot import ConfigurationSnapshot
 from DIRAC.FrameworkSystem.Client.Logger import gLogger
 
 class ConfigurationData:
@@ -21,7 +26,11 @@ class ConfigurationData:
     self.threadingEvent.set()
     self.threadingLock = lr.getLock()
     self.runningThreadsNumber = 0
+    #Flat view of mergedCFG for the lookups. Built on demand after each sync
+    self.__snapshot = None
+    self.__snapshotLock = lr.getLock()
     self.compressedConfigurationData = ""
+    self.remoteCFGHash = ""
     self.configurationPath = "/DIRAC/Configuration"
     self.backupsDir = os.path.join( DIRAC.rootPath, "etc", "csbackup" )
     self._isService = False
@@ -29,6 +38,9 @@ class ConfigurationData:
     self.remoteCFG = CFG()
     self.mergedCFG = CFG()
     self.remoteServerList = []
+    #Previous versions of the remote CFG kept by the servers to send deltas to the clients
+    self.__versionHistory = []
+    self.__deltaCache = {}
     if loadDefaultCFG:
       defaultCFGFile = os.path.join( DIRAC.rootPath, "etc", "dirac.cfg" )
       gLogger.debug( "dirac.cfg should be at", "%s" % defaultCFGFile )
@@ -55,7 +67,72 @@ class ConfigurationData:
     if remoteServers:
       self.remoteServerList.extend( List.fromChar( remoteServers, "," ) )
     self.remoteServerList = List.uniqueElements( self.remoteServerList )
-    self.compressedConfigurationData = zlib.compress( str( self.remoteCFG ), 9 )
+    remoteData = str( self.remoteCFG )
+    self.compressedConfigurationData = zlib.compress( remoteData, 9 )
+    self.remoteCFGHash = md5( remoteData ).hexdigest()
+    self.__snapshotLock.acquire()
+    self.__snapshot = None
+    self.__snapshotLock.release()
+    if self._isService:
+      self.__addToVersionHistory()
+
+  def __addToVersionHistory( self ):
+    """
+    Keep a copy of the first contents seen for each version. Later syncs with the
+    same version ( like the ones done while committing ) don't replace it
+    """
+    #sync may be called with the configuration locked
+    version = self.extractOptionFromCFG( "%s/Version" % self.configurationPath,
+                                         self.remoteCFG,
+                                         disableDangerZones = True ) or "0"
+    if [ True for histVersion, histCFG in self.__versionHistory if histVersion == version ]:
+      return
+    self.__versionHistory.append( ( version, self.remoteCFG.clone() ) )
+    del self.__versionHistory[ :-self.getDeltaHistorySize() ]
+    self.__deltaCache = {}
+
+  def getDeltaHistorySize( self ):
+    try:
+      return max( 1, int( self.extractOptionFromCFG( "%s/DeltaHistorySize" % self.configurationPath,
+                                                     self.localCFG, disableDangerZones = True ) ) )
+    except:
+      return 5
+
+  def getCompressedDelta( self, fromVersion ):
+    """
+    Get the modifications to go from fromVersion to the current version of the remote
+    CFG, DEncoded and compressed. Fails if fromVersion is not in the history.
+    result[ 'Hash' ] is the hash of the serialized remote CFG the delta leads to
+    """
+    remoteCFG = self.remoteCFG
+    remoteHash = self.remoteCFGHash
+    currentVersion = self.getVersion( remoteCFG )
+    cacheKey = ( fromVersion, currentVersion )
+    if cacheKey in self.__deltaCache:
+      delta, remoteHash = self.__deltaCache[ cacheKey ]
+      result = S_OK( delta )
+      result[ 'Hash' ] = remoteHash
+      return result
+    for histVersion, histCFG in list( self.__versionHistory ):
+      if histVersion == fromVersion:
+        break
+    else:
+      return S_ERROR( "Version %s is not known" % fromVersion )
+    self.dangerZoneStart()
+    try:
+      modList = histCFG.getModifications( remoteCFG )
+    finally:
+      self.dangerZoneEnd()
+    delta = zlib.compress( DEncode.encode( modList ), 9 )
+    #Deltas bigger than the whole configuration are useless
+    if len( delta ) >= len( self.compressedConfigurationData ):
+      return S_ERROR( "Delta is bigger than the configuration" )
+    #Only cache it if the configuration did not change while generating it
+    if self.getVersion( remoteCFG ) == currentVersion and self.remoteCFGHash == remoteHash:
+      self.__deltaCache[ cacheKey ] = ( delta, remoteHash )
+    result = S_OK( delta )
+    result[ 'Hash' ] = remoteHash
+    return result
 
   def loadFile( self, fileName ):
     try:
@@ -88,6 +165,32 @@ class ConfigurationData:
     self.unlock()
     self.sync()
 
+  def applyRemoteCompressedDelta( self, data, newVersion, dataHash = False ):
+    """
+    Apply in place the modifications sent by a server to get to newVersion. If they
+    can't be applied the remote CFG is left in an unknown state and has to be reloaded.
+    If dataHash is given the serialized result has to match it: applying modifications
+    does not keep the position of the added sections
+    """
+    try:
+      modList = DEncode.decode( zlib.decompress( data ) )[0]
+    except Exception, e:
+      return S_ERROR( "Cannot decode configuration delta: %s" % str( e ) )
+    self.lock()
+    try:
+      result = self.remoteCFG.applyModifications( modList )
+    except Exception, e:
+      result = S_ERROR( "Exception while applying configuration delta: %s" % str( e ) )
+    self.unlock()
+    if not result[ 'OK' ]:
+      return result
+    self.sync()
+    if self.getVersion() != newVersion:
+      return S_ERROR( "Version after applying delta is %s instead of %s" % ( self.getVersion(), newVersion ) )
+    if dataHash and self.remoteCFGHash != dataHash:
+      return S_ERROR( "Configuration after applying delta differs from the server one" )
+    return S_OK()
+
   def loadConfigurationData( self, fileName = False ):
     name = self.getName()
     self.lock()
@@ -103,6 +206,22 @@ class ConfigurationData:
     self.unlock()
     self.sync()
 
+  def getSnapshot( self ):
+    """
+    Get the read only snapshot of the merged configuration. Readers keep using the
+    snapshot they got even if a new one is built in the meantime
+    """
+    snapshot = self.__snapshot
+    if snapshot is not None:
+      return snapshot
+    self.__snapshotLock.acquire()
+    try:
+      if self.__snapshot is None:
+        self.__snapshot = ConfigurationSnapshot( self.mergedCFG )
+      return self.__snapshot
+    finally:
+      self.__snapshotLock.release()
+
   def getCommentFromCFG( self, path, cfg = False ):
     if not cfg:
       cfg = self.mergedCFG
@@ -118,7 +237,7 @@ class ConfigurationData:
 
   def getSectionsFromCFG( self, path, cfg = False, ordered = False ):
     if not cfg:
-      cfg = self.mergedCFG
+      return self.getSnapshot().getSections( path )
     self.dangerZoneStart()
     try:
       levelList = [ level.strip() for level in path.split( "/" ) if level.strip() != "" ]
@@ -131,7 +250,7 @@ class ConfigurationData:
 
   def getOptionsFromCFG( self, path, cfg = False, ordered = False ):
     if not cfg:
-      cfg = self.mergedCFG
+      return self.getSnapshot().getOptions( path )
     self.dangerZoneStart()
     try:
       levelList = [ level.strip() for level in path.split( "/" ) if level.strip() != "" ]
@@ -144,7 +263,7 @@ class ConfigurationData:
 
   def extractOptionFromCFG( self, path, cfg = False, disableDangerZones = False ):
     if not cfg:
-      cfg = self.mergedCFG
+      return self.getSnapshot().getOption( path )
     if not disableDangerZones:
       self.dangerZoneStart()
     try:
@@ -249,6 +368,14 @@ class ConfigurationData:
     except:
       return False
 
+  def pushNotificationsEnabled( self ):
+    try:
+      val = self.extractOptionFromCFG( "%s/EnablePushNotifications" % self.configurationPath,
+                                        self.mergedCFG )
+      return val.lower() in ( "yes", "true", "y" )
+    except:
+      return False
+
   def getAutoPublish( self ):
     value = self.extractOptionFromCFG( "%s/AutoPublish" % self.configurationPath,
                                         self.localCFG )
@@ -0,0 +1,130 @@
+# $HeadURL$
+"""
+Read only, flattened view of a CFG: a dict from the full path of every option
+to its value and another one from every section path to its ordered subsections
+and options. Once built it is never modified, so reading it does not need any
+lock. Typed values are memoized per path and type.
+"""
+__RCSID__ = "$Id$"
+
+import types
+from DIRAC.Core.Utilities import List
+
+class ConfigurationSnapshot:
+
+  def __init__( self, cfg ):
+    self.__options = {}
+    #Pre split values for the comma separated lists
+    self.__lists = {}
+    #Section path -> ( sections, options ) in order
+    self.__sections = {}
+    #( path, type ) -> casted value
+    self.__typedValues = {}
+    self.__addSection( "/", cfg )
+
+  @staticmethod
+  def normalizePath( path ):
+    return "/" + "/".join( [ level.strip() for level in path.split( "/" ) if level.strip() ] )
+
+  def __addSection( self, sectionPath, cfg ):
+    if sectionPath == "/":
+      prefix = "/"
+    else:
+      prefix = "%s/" % sectionPath
+    sections = []
+    options = []
+    for key in cfg.listAll():
+      keyPath = prefix + key
+      if cfg.isOption( key ):
+        value = cfg[ key ]
+        options.append( key )
+        self.__options[ keyPath ] = value
+        self.__lists[ keyPath ] = List.fromChar( value, "," )
+      else:
+        sections.append( key )
+        self.__addSection( keyPath, cfg[ key ] )
+    self.__sections[ sectionPath ] = ( sections, options )
+
+  def __getKey( self, path, pathDict ):
+    if path in pathDict:
+      return path
+    path = self.normalizePath( path )
+    if path in pathDict:
+      return path
+    return None
+
+  def getOption( self, path ):
+    """
+    Get the value of an option or None if it does not exist
+    """
+    key = self.__getKey( path, self.__options )
+    if key is None:
+      return None
+    return self.__options[ key ]
+
+  def getListOption( self, path ):
+    """
+    Get the value of an option split by commas or None if it does not exist
+    """
+    key = self.__getKey( path, self.__lists )
+    if key is None:
+      return None
+    return list( self.__lists[ key ] )
+
+  def getTypedOption( self, path, requestedType ):
+    """
+    Get the value of an option casted to requestedType. Returns a tuple with the
+    casted value ( None if the option does not exist ) and a flag telling if the
+    cast succeeded
+    """
+    memoKey = ( path, requestedType )
+    if memoKey in self.__typedValues:
+      return self.__typedValues[ memoKey ], True
+    if requestedType == types.ListType:
+      return self.getListOption( path ), True
+    optionValue = self.getOption( path )
+    if optionValue is None:
+      return None, True
+    if requestedType == types.BooleanType:
+      value = optionValue.lower() in ( "y", "yes", "true", "1" )
+    else:
+      try:
+        value = requestedType( optionValue )
+      except Exception:
+        return optionValue, False
+    #Only immutable values can be shared between callers
+    if type( value ) in ( types.StringType, types.UnicodeType, types.IntType, types.LongType,
+                          types.FloatType, types.BooleanType ):
+      self.__typedValues[ memoKey ] = value
+    return value, True
+
+  def getSections( self, sectionPath ):
+    """
+    Get the ordered list of subsections of a section or None if it does not exist
+    """
+    key = self.__getKey( sectionPath, self.__sections )
+    if key is None:
+      return None
+    return list( self.__sections[ key ][0] )
+
+  def getOptions( self, sectionPath ):
+    """
+    Get the ordered list of options of a section or None if it does not exist
+    """
+    key = self.__getKey( sectionPath, self.__sections )
+    if key is None:
+      return None
+    return list( self.__sections[ key ][1] )
+
+  def getOptionsDict( self, sectionPath ):
+    """
+    Get a dict with the options of a section and their values or None if it does not exist
+    """
+    key = self.__getKey( sectionPath, self.__sections )
+    if key is None:
+      return None
+    if key == "/":
+      prefix = "/"
+    else:
+      prefix = "%s/" % key
+    return dict( [ ( option, self.__options[ prefix + option ] ) for option in self.__sections[ key ][1] ] )
@@ -15,12 +15,25 @@ from DIRAC.Core.Utilities.ReturnValues import S_OK, S_ERROR
 def _updateFromRemoteLocation( serviceClient ):
   gLogger.debug( "", "Trying to refresh from %s" % serviceClient.serviceURL )
   localVersion = gConfigurationData.getVersion()
-  retVal = serviceClient.getCompressedDataIfNewer( localVersion )
+  retVal = serviceClient.getCompressedDeltaIfNewer( localVersion )
+  if not retVal[ 'OK' ] and retVal[ 'Message' ].find( "Unknown method" ) > -1:
+    #Old servers can only send the full data
+    retVal = serviceClient.getCompressedDataIfNewer( localVersion )
   if retVal[ 'OK' ]:
     dataDict = retVal[ 'Value' ]
     if localVersion < dataDict[ 'newestVersion' ] :
       gLogger.debug( "New version available", "Updating to version %s..." % dataDict[ 'newestVersion' ] )
-      gConfigurationData.loadRemoteCFGFromCompressedMem( dataDict[ 'data' ] )
+      if 'delta' in dataDict:
+        result = gConfigurationData.applyRemoteCompressedDelta( dataDict[ 'delta' ], dataDict[ 'newestVersion' ],
+                                                                dataDict.get( 'deltaHash', False ) )
+        if not result[ 'OK' ]:
+          gLogger.warn( "Could not apply configuration delta, getting the full data", result[ 'Message' ] )
+          retVal = serviceClient.getCompressedData()
+          if not retVal[ 'OK' ]:
+            return retVal
+          dataDict[ 'data' ] = retVal[ 'Value' ]
+      if 'data' in dataDict:
+        gConfigurationData.loadRemoteCFGFromCompressedMem( dataDict[ 'data' ] )
       gLogger.debug( "Updated to version %s" % gConfigurationData.getVersion() )
       gEventDispatcher.triggerEvent( "CSNewVersion", dataDict[ 'newestVersion' ], threaded = True )
     return S_OK()
@@ -40,6 +53,8 @@ class Refresher( threading.Thread ):
     gEventDispatcher.registerEvent( "CSNewVersion" )
     random.seed()
     self.__triggeredRefreshLock = LockRing.LockRing().getLock()
+    self.__subscription = False
+    self.__subscriptionLock = LockRing.LockRing().getLock()
 
   def disable( self ):
     self.__refreshEnabled = False
@@ -83,6 +98,55 @@ class Refresher( threading.Thread ):
     thd.start()
 
 
+  def __subscribe( self, sURL ):
+    """
+    Subscribe to the new version notifications pushed by a configuration server.
+    Polling is kept as a fallback in case the subscription is lost
+    """
+    if not gConfigurationData.pushNotificationsEnabled():
+      return
+    self.__subscriptionLock.acquire()
+    try:
+      if self.__subscription:
+        return
+      from DIRAC.Core.DISET.MessageClient import MessageClient
+      msgClient = MessageClient( sURL,
+                                 useCertificates = gConfigurationData.useServerCertificate(),
+                                 skipCACheck = gConfigurationData.skipCACheck() )
+      msgClient.subscribeToMessage( "NewVersion", self.__cbNewVersion )
+      msgClient.subscribeToDisconnect( self.__cbSubscriptionDropped )
+      result = msgClient.connect()
+      if not result[ 'OK' ]:
+        gLogger.verbose( "Can't subscribe to new versions", "from %s: %s" % ( sURL, result[ 'Message' ] ) )
+        return
+      gLogger.verbose( "Subscribed to new versions from %s" % sURL )
+      self.__subscription = msgClient
+    finally:
+      self.__subscriptionLock.release()
+
+  def __cbSubscriptionDropped( self, msgClient ):
+    gLogger.verbose( "Lost subscription to new versions", msgClient.serviceURL )
+    self.__subscription = False
+
+  def __cbNewVersion( self, msgObj ):
+    if not self.__refreshEnabled or msgObj.version <= gConfigurationData.getVersion():
+      return S_OK()
+    gLogger.debug( "New version notified", "%s from %s" % ( msgObj.version, msgObj.msgClient.serviceURL ) )
+    thd = threading.Thread( target = self.__refreshFromNotifier, args = ( msgObj.msgClient.serviceURL, ) )
+    thd.setDaemon( 1 )
+    thd.start()
+    return S_OK()
+
+  def __refreshFromNotifier( self, sURL ):
+    from DIRAC.Core.DISET.RPCClient import RPCClient
+    self.__lastUpdateTime = time.time()
+    oClient = RPCClient( sURL, timeout = self.__timeout,
+                         useCertificates = gConfigurationData.useServerCertificate(),
+                         skipCACheck = gConfigurationData.skipCACheck() )
+    retVal = _updateFromRemoteLocation( oClient )
+    if not retVal[ 'OK' ]:
+      gLogger.error( "Error while updating the configuration", retVal[ 'Message' ] )
+
   def forceRefresh( self ):
     if self.__refreshEnabled:
       return self.__refresh()
@@ -122,6 +186,7 @@ class Refresher( threading.Thread ):
       if not dRetVal[ 'OK' ]:
         gLogger.error( "Can't update from master server", dRetVal[ 'Message' ] )
         return False
+      self.__subscribe( sMasterServer )
       if gConfigurationData.getAutoPublish():
         gLogger.info( "Publishing to master server..." )
         dRetVal = oClient.publishSlaveServer( self.__url )
@@ -158,6 +223,7 @@ class Refresher( threading.Thread ):
                          skipCACheck = gConfigurationData.skipCACheck() )
       dRetVal = _updateFromRemoteLocation( oClient )
       if dRetVal[ 'OK' ]:
+        self.__subscribe( sServer )
         return dRetVal
       else:
         updatingErrorsList.append( dRetVal[ 'Message' ] )
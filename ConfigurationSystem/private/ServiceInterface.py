@@ -12,6 +12,7 @@ from DIRAC.ConfigurationSystem.Client.ConfigurationData import gConfigurationDat
 from DIRAC.ConfigurationSystem.private.Refresher import gRefresher
 from DIRAC.FrameworkSystem.Client.Logger import gLogger
 from DIRAC.Core.Utilities.ReturnValues import S_OK, S_ERROR
+from DIRAC.Core.Utilities.EventDispatcher import gEventDispatcher
 from DIRAC.Core.DISET.RPCClient import RPCClient
 
 class ServiceInterface( threading.Thread ):
@@ -70,6 +71,11 @@ class ServiceInterface( threading.Thread ):
     if gConfigurationData.isMaster():
       gConfigurationData.generateNewVersion()
       gConfigurationData.writeRemoteConfigurationToDisk()
+      self.__announceNewVersion()
+
+  def __announceNewVersion( self ):
+    #Slaves and clients subscribed to this server will be notified
+    gEventDispatcher.triggerEvent( "CSNewVersion", gConfigurationData.getVersion(), threaded = True )
 
   def publishSlaveServer( self, sSlaveURL ):
     if not gConfigurationData.isMaster():
@@ -154,11 +160,15 @@ class ServiceInterface( threading.Thread ):
     gLogger.info( "Writing new version to disk!" )
     retVal = gConfigurationData.writeRemoteConfigurationToDisk( "%s@%s" % ( commiter, gConfigurationData.getVersion() ) )
     gLogger.info( "New version it is!" )
+    self.__announceNewVersion()
     return retVal
 
   def getCompressedConfigurationData( self ):
     return gConfigurationData.getCompressedData()
 
+  def getCompressedDelta( self, fromVersion ):
+    return gConfigurationData.getCompressedDelta( fromVersion )
+
   def getVersion( self ):
     return gConfigurationData.getVersion()
 
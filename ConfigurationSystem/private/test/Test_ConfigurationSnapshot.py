@@ -0,0 +1,73 @@
+""" Test cases for the flat ConfigurationSnapshot
+"""
+
+import sys
+if sys.version_info < ( 2, 7 ):
+  import unittest2 as unittest
+else:
+  import unittest
+
+from DIRAC.Core.Utilities.CFG import CFG
+from DIRAC.ConfigurationSystem.private.ConfigurationSnapshot import ConfigurationSnapshot
+
+CFG_DATA = """
+Top = 1
+DIRAC
+{
+  Setup = Test
+  Configuration
+  {
+    Servers = dips://a:9135/Configuration/Server, dips://b:9135/Configuration/Server
+  }
+}
+Systems
+{
+  WMS
+  {
+    MaxJobs = 10
+    Enabled = yes
+    Ratio = x
+  }
+}
+"""
+
+class ConfigurationSnapshotTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    cfg = CFG()
+    cfg.loadFromBuffer( CFG_DATA )
+    self.snapshot = ConfigurationSnapshot( cfg )
+
+  def test_options( self ):
+    self.assertEqual( self.snapshot.getOption( "/DIRAC/Setup" ), "Test" )
+    self.assertEqual( self.snapshot.getOption( "DIRAC//Setup " ), "Test" )
+    self.assertEqual( self.snapshot.getOption( "/Top" ), "1" )
+    self.assertEqual( self.snapshot.getOption( "/DIRAC" ), None )
+    self.assertEqual( self.snapshot.getOption( "/DIRAC/Nope" ), None )
+    self.assertEqual( self.snapshot.getListOption( "/DIRAC/Configuration/Servers" ),
+                      [ "dips://a:9135/Configuration/Server", "dips://b:9135/Configuration/Server" ] )
+
+  def test_typed( self ):
+    self.assertEqual( self.snapshot.getTypedOption( "/Systems/WMS/MaxJobs", int ), ( 10, True ) )
+    self.assertEqual( self.snapshot.getTypedOption( "/Systems/WMS/MaxJobs", int ), ( 10, True ) )
+    self.assertEqual( self.snapshot.getTypedOption( "/Systems/WMS/Enabled", bool ), ( True, True ) )
+    self.assertEqual( self.snapshot.getTypedOption( "/Systems/WMS/Ratio", float ), ( "x", False ) )
+    self.assertEqual( self.snapshot.getTypedOption( "/Systems/WMS/Missing", int ), ( None, True ) )
+    #Lists are copied for each caller
+    servers = self.snapshot.getTypedOption( "/DIRAC/Configuration/Servers", list )[0]
+    servers.append( "dips://c:9135/Configuration/Server" )
+    self.assertEqual( len( self.snapshot.getTypedOption( "/DIRAC/Configuration/Servers", list )[0] ), 2 )
+
+  def test_sections( self ):
+    self.assertEqual( self.snapshot.getSections( "/" ), [ "DIRAC", "Systems" ] )
+    self.assertEqual( self.snapshot.getOptions( "" ), [ "Top" ] )
+    self.assertEqual( self.snapshot.getSections( "/DIRAC" ), [ "Configuration" ] )
+    self.assertEqual( self.snapshot.getOptions( "/Systems/WMS" ), [ "MaxJobs", "Enabled", "Ratio" ] )
+    self.assertEqual( self.snapshot.getSections( "/Top" ), None )
+    self.assertEqual( self.snapshot.getOptionsDict( "/Systems/WMS" ),
+                      { "MaxJobs" : "10", "Enabled" : "yes", "Ratio" : "x" } )
+    self.assertEqual( self.snapshot.getOptionsDict( "/Nope" ), None )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( ConfigurationSnapshotTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
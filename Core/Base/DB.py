@@ -74,7 +74,7 @@ class DB( MySQL ):
       self.maxQueueSize = int( result['Value'] )
 
     MySQL.__init__( self, self.dbHost, self.dbUser, self.dbPass,
-                   self.dbName, self.dbPort, maxQueueSize = maxQueueSize, debug = debug )
+                   self.dbName, self.dbPort, maxQueueSize = self.maxQueueSize, debug = debug )
 
     if not self._connected:
       raise RuntimeError( 'Can not connect to DB %s, exiting...' % self.dbName )
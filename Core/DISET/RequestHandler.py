@@ -9,6 +9,8 @@ from DIRAC.Core.Utilities.ReturnValues import S_OK, S_ERROR, isReturnStructure
 from DIRAC.FrameworkSystem.Client.Logger import gLogger
 from DIRAC.ConfigurationSystem.Client.Config import gConfig
 from DIRAC.Core.DISET.private.MessageBroker import getGlobalMessageBroker
+from DIRAC.Core.DISET.private.PerformanceStats import PerformanceStats
+from DIRAC.Core.Security import Properties
 from DIRAC.Core.Utilities import Time
 import DIRAC
 
@@ -73,6 +75,8 @@ class RequestHandler( object ):
     cls.__msgBroker = msgBroker
     cls.__trPool = msgBroker.getTransportPool()
     cls.__monitor = monitor
+    cls.__perfStats = PerformanceStats( cls.srv_getCSOption( "SlowCallThreshold", 5 ),
+                                        cls.srv_getCSOption( "MaxSlowCalls", 20 ) )
     cls.log = gLogger
 
   def getRemoteAddress( self ):
@@ -130,7 +134,10 @@ class RequestHandler( object ):
       gLogger.error( message )
       retVal = S_ERROR( message )
     self.__logRemoteQueryResponse( retVal, time.time() - startTime )
-    return self.__trPool.send( self.__trid, retVal )
+    result = self.__trPool.send( self.__trid, retVal )
+    if actionType == "RPC" and result[ 'OK' ]:
+      self.__perfStats.recordResponseSize( actionTuple[1], self.__trPool.get( self.__trid ).getLastSentSize() )
+    return result
 
 #####
 #
@@ -227,9 +234,32 @@ class RequestHandler( object ):
                                                                          retVal[ 'Message' ] ) )
     args = retVal[ 'Value' ]
     self.__logRemoteQuery( "RPC/%s" % method, args )
-    return self.__RPCCallFunction( method, args )
+    requestSize = self.__trPool.get( self.__trid ).getLastReceivedSize()
+    return self.__RPCCallFunction( method, args, requestSize = requestSize )
 
-  def __RPCCallFunction( self, method, args ):
+  def _rh_executePipelinedRPC( self, method, args ):
+    """
+    Execute an RPC received in a pipelined connection. The result is returned instead of sent
+
+    @type method: string
+    @param method: Method to execute
+    @type args: tuple
+    @param args: Arguments of the method
+    @return: S_OK/S_ERROR
+    """
+    startTime = time.time()
+    self.serviceInfoDict[ 'actionTuple' ] = ( 'RPC', method )
+    self.__logRemoteQuery( "RPC/%s" % method, args )
+    #The connection is being read by the pipeline so it can't be watched
+    retVal = self.__RPCCallFunction( method, args, watchConnection = False )
+    if not isReturnStructure( retVal ):
+      message = "Method %s for action RPC does not have a return value!" % method
+      gLogger.error( message )
+      retVal = S_ERROR( message )
+    self.__logRemoteQueryResponse( retVal, time.time() - startTime )
+    return retVal
+
+  def __RPCCallFunction( self, method, args, watchConnection = True, requestSize = None ):
     realMethod = "export_%s" % method
     gLogger.debug( "RPC to %s" % realMethod )
     try:
@@ -240,16 +270,25 @@ class RequestHandler( object ):
     if not dRetVal[ 'OK' ]:
       return dRetVal
     self.__lockManager.lock( "RPC/%s" % method )
-    self.__msgBroker.addTransportId( self.__trid,
-                                     self.serviceInfoDict[ 'serviceName' ],
-                                     idleRead = True )
+    if watchConnection:
+      self.__msgBroker.addTransportId( self.__trid,
+                                       self.serviceInfoDict[ 'serviceName' ],
+                                       idleRead = True )
+    if self.srv_getCSOption( "MaskRequestParams", True ):
+      callId = self.__perfStats.startCall( method )
+    else:
+      callId = self.__perfStats.startCall( method, args )
+    callOK = False
     try:
       try:
         uReturnValue = oMethod( *args )
+        callOK = isReturnStructure( uReturnValue ) and uReturnValue[ 'OK' ]
         return uReturnValue
       finally:
+        self.__perfStats.endCall( callId, callOK, requestSize )
         self.__lockManager.unlock( "RPC/%s" % method )
-        self.__msgBroker.removeTransport( self.__trid, closeTransport = False )
+        if watchConnection:
+          self.__msgBroker.removeTransport( self.__trid, closeTransport = False )
     except Exception, v:
       gLogger.exception( "Uncaught exception when serving RPC", "Function %s" % method )
       return S_ERROR( "Server error while serving %s: %s" % ( method, str( v ) ) )
@@ -471,6 +510,17 @@ class RequestHandler( object ):
 
     return S_OK( dInfo )
 
+  types_getPerformanceStats = []
+  auth_getPerformanceStats = [ Properties.SERVICE_ADMINISTRATOR ]
+  def export_getPerformanceStats( self ):
+    """
+    Latency and payload size distributions per method, calls in flight and
+    the slowest calls seen by this service. Latencies are in seconds
+    """
+    stats = self.__perfStats.getStats()
+    stats[ 'name' ] = self.serviceInfoDict[ 'serviceName' ]
+    return S_OK( stats )
+
 ####
 #
 #  Utilities methods
@@ -12,6 +12,7 @@ except:
 from DIRAC import gLogger, S_OK, S_ERROR
 from DIRAC.Core.DISET.private.Service import Service
 from DIRAC.Core.DISET.private.GatewayService import GatewayService
+from DIRAC.Core.DISET.private.EventLoop import EventLoop
 from DIRAC.Core.DISET.RequestHandler import RequestHandler
 from DIRAC.Core.Utilities import Network, Time
 from DIRAC.Core.Base.private.ModuleLoader import ModuleLoader
@@ -35,6 +36,7 @@ class ServiceReactor:
     self.__maxFD = 0
     self.__listeningConnections = {}
     self.__stats = ReactorStats()
+    self.__eventLoop = None
 
   def initialize( self, servicesList ):
     try:
@@ -116,9 +118,63 @@ class ServiceReactor:
           p = multiprocessing.Process( target = self.__startCloneProcess, args = ( svcName, i ) )
           p.start()
           gLogger.always( "Started clone process %s for %s" % ( i, svcName ) )
+    for svcName in self.__services:
+      if self.__services[ svcName ].getConfig().useEventLoop():
+        return self.__serveEventLoop()
     while self.__alive:
       self.__acceptIncomingConnection()
 
+  def __serveEventLoop( self ):
+    """
+    Accept connections and wait for their proposals in an event loop. Only connections
+    with a proposal ready are handed to the services for processing in their thread pools
+    """
+    self.__eventLoop = EventLoop()
+    for svcName in self.__listeningConnections:
+      if self.__services[ svcName ].getConfig().useEventLoop():
+        gLogger.always( "Using event loop for %s" % svcName )
+      self.__eventLoop.addListener( self.__listeningConnections[ svcName ][ 'socket' ],
+                                    lambda svcName = svcName : self.__acceptInEventLoop( svcName ) )
+    while self.__alive:
+      self.__eventLoop.runOnce( 10 )
+      self.__renewServerContexts()
+    return S_OK()
+
+  def __acceptInEventLoop( self, svcName ):
+    retVal = self.__listeningConnections[ svcName ][ 'transport' ].acceptConnection()
+    if not retVal[ 'OK' ]:
+      gLogger.warn( "Error while accepting a connection: ", retVal[ 'Message' ] )
+      return
+    clientTransport = retVal[ 'Value' ]
+    self.__maxFD = max( self.__maxFD, clientTransport.oSocket.fileno() )
+    #Is it banned?
+    clientIP = clientTransport.getRemoteAddress()[0]
+    if clientIP in Registry.getBannedIPs():
+      gLogger.warn( "Client connected from banned ip %s" % clientIP )
+      clientTransport.close()
+      return
+    self.__stats.connectionStablished()
+    service = self.__services[ svcName ]
+    svcCfg = service.getConfig()
+    if not svcCfg.useEventLoop():
+      service.handleConnection( clientTransport )
+      return
+    self.__eventLoop.addConnection( clientTransport,
+                                    lambda readyTransport : service.handleConnection( readyTransport,
+                                                                                      handshaked = True ),
+                                    svcCfg.getEventLoopTimeout() )
+
+  def __renewServerContexts( self ):
+    now = time.time()
+    renewed = False
+    for svcName in self.__listeningConnections:
+      tr = self.__listeningConnections[ svcName ][ 'transport' ]
+      if now - tr.latestServerRenewTime() > self.__services[ svcName ].getConfig().getContextLifeTime():
+        result = tr.renewServerContext()
+        if result[ 'OK' ]:
+          renewed = True
+    return renewed
+
   #This function runs in a different process
   def __startCloneProcess( self, svcName, i ):
     self.__services[ svcName ].setCloneProcessId( i )
@@ -163,15 +219,7 @@ class ServiceReactor:
       self.__stats.connectionStablished()
       self.__services[ svcName ].handleConnection( clientTransport )
       #Renew context?
-      now = time.time()
-      renewed = False
-      for svcName in self.__listeningConnections:
-         tr = self.__listeningConnections[ svcName ][ 'transport' ]
-         if now - tr.latestServerRenewTime() > self.__services[ svcName ].getConfig().getContextLifeTime():
-           result = tr.renewServerContext()
-           if result[ 'OK' ]:
-             renewed = True
-      if renewed:
+      if self.__renewServerContexts():
         sockets = self.__getListeningSocketsList()
 
 
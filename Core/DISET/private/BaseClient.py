@@ -1,8 +1,13 @@
 # $HeadURL$
 __RCSID__ = "$Id$"
 
+import os
 import types
 import thread
+try:
+  from hashlib import md5
+except:
+  from md5 import md5
 import DIRAC
 from DIRAC.Core.DISET.private.Protocols import gProtocolDict
 from DIRAC.FrameworkSystem.Client.Logger import gLogger
@@ -10,8 +15,9 @@ from DIRAC.Core.Utilities import List, Network
 from DIRAC.Core.Utilities.ReturnValues import S_OK, S_ERROR
 from DIRAC.ConfigurationSystem.Client.Config import gConfig
 from DIRAC.ConfigurationSystem.Client.PathFinder import getServiceURL
-from DIRAC.Core.Security import CS
+from DIRAC.Core.Security import CS, Locations
 from DIRAC.Core.DISET.private.TransportPool import getGlobalTransportPool
+from DIRAC.Core.DISET.private.ClientConnectionPool import getGlobalClientConnectionPool
 from DIRAC.Core.DISET.ThreadConfig import ThreadConfig
 
 class BaseClient:
@@ -31,6 +37,7 @@ class BaseClient:
   KW_PROXY_CHAIN = "proxyChain"
   KW_SKIP_CA_CHECK = "skipCACheck"
   KW_KEEP_ALIVE_LAPSE = "keepAliveLapse"
+  KW_REUSE_CONNECTION = "reuseConnection"
 
   __threadConfig = ThreadConfig()
 
@@ -45,10 +52,12 @@ class BaseClient:
     self.__idDict = {}
     self.__extraCredentials = ""
     self.__enableThreadCheck = False
+    self.__reuseConnection = False
+    self.__lastConnectionReused = False
     for initFunc in ( self.__discoverSetup, self.__discoverVO, self.__discoverTimeout,
                       self.__discoverURL, self.__discoverCredentialsToUse,
                       self.__checkTransportSanity,
-                      self.__setKeepAliveLapse ):
+                      self.__setKeepAliveLapse, self.__discoverConnectionReuse ):
       result = initFunc()
       if not result[ 'OK' ] and self.__initStatus[ 'OK' ]:
         self.__initStatus = result
@@ -213,18 +222,26 @@ and this is thread %s
       #raise Exception( msgTxt )
 
 
-  def _connect( self ):
+  def _connect( self, allowReuse = True ):
     deco = self.__threadConfig.getDecorator()
     if callable( deco ):
-      return deco( self.__innerConnect )()
-    return self.__innerConnect()
+      return deco( lambda : self.__innerConnect( allowReuse ) )()
+    return self.__innerConnect( allowReuse )
 
-  def __innerConnect( self ):
+  def __innerConnect( self, allowReuse = True ):
     self.__discoverExtraCredentials()
     if not self.__initStatus[ 'OK' ]:
       return self.__initStatus
     if self.__enableThreadCheck:
       self.__checkThreadID()
+    self.__lastConnectionReused = False
+    if self.__reuseConnection and allowReuse:
+      transport = getGlobalClientConnectionPool().get( self.__getConnectionKey() )
+      if transport:
+        gLogger.debug( "Reusing connection to: %s" % self.serviceURL )
+        self.__lastConnectionReused = True
+        trid = getGlobalTransportPool().add( transport )
+        return S_OK( ( trid, transport ) )
     gLogger.debug( "Connecting to: %s" % self.serviceURL )
     try:
       transport = gProtocolDict[ self.__URLTuple[0] ][ 'transport' ]( self.__URLTuple[1:3], **self.kwargs )
@@ -236,15 +253,74 @@ and this is thread %s
     trid = getGlobalTransportPool().add( transport )
     return S_OK( ( trid, transport ) )
 
-  def _disconnect( self, trid ):
+  def _disconnect( self, trid, keepConnection = False ):
+    """
+    Close the connection or, if keepConnection is true and connection reuse is
+    enabled, give it back to the client connection pool
+    """
+    if keepConnection and self.__reuseConnection:
+      transport = getGlobalTransportPool().get( trid )
+      if transport:
+        getGlobalTransportPool().remove( trid )
+        getGlobalClientConnectionPool().put( self.__getConnectionKey(), transport )
+        return
     getGlobalTransportPool().close( trid )
 
+  def _connectionWasReused( self ):
+    return self.__lastConnectionReused
+
+  def __discoverConnectionReuse( self ):
+    if self.KW_REUSE_CONNECTION in self.kwargs:
+      self.__reuseConnection = self.kwargs[ self.KW_REUSE_CONNECTION ]
+    else:
+      self.__reuseConnection = gConfig.getValue( "/DIRAC/ConnectionReuse/Enabled", False )
+    return S_OK()
+
+  def __getConnectionKey( self ):
+    """
+    Connections can only be reused for the same destination, credentials and extra credentials
+    """
+    credKey = [ self.__getCredentialsKey() ]
+    for kw in ( self.KW_SKIP_CA_CHECK, self.KW_TIMEOUT ):
+      credKey.append( self.kwargs.get( kw ) )
+    return ( self.serviceURL, tuple( credKey ), str( self.__extraCredentials ) )
+
+  def __getCredentialsKey( self ):
+    """
+    Identify the credentials the transport will actually present, following the
+    same precedence as the SSL transport. Proxy files are resolved at call time
+    (X509_USER_PROXY can be switched between users) and stamped with their
+    inode, mtime and size so a replaced proxy file gives a different key
+    """
+    if self.kwargs.get( self.KW_USE_CERTIFICATES ):
+      certKeyTuple = Locations.getHostCertificateAndKeyLocation()
+      if not certKeyTuple:
+        return ( 'certificates', None )
+      return ( 'certificates', ) + tuple( [ self.__fileStamp( path ) for path in certKeyTuple ] )
+    if self.KW_PROXY_STRING in self.kwargs:
+      return ( 'proxyString', md5( self.kwargs[ self.KW_PROXY_STRING ] ).hexdigest() )
+    proxyPath = self.kwargs.get( self.KW_PROXY_LOCATION )
+    if not proxyPath:
+      proxyPath = Locations.getProxyLocation()
+    return ( 'proxy', self.__fileStamp( proxyPath ) )
+
+  def __fileStamp( self, path ):
+    if not path:
+      return None
+    try:
+      stat = os.stat( path )
+    except OSError:
+      return ( path, None )
+    return ( os.path.realpath( path ), stat.st_ino, stat.st_mtime, stat.st_size )
+
   def _proposeAction( self, transport, action ):
     if not self.__initStatus[ 'OK' ]:
       return self.__initStatus
     stConnectionInfo = ( ( self.__URLTuple[3], self.setup, self.vo ),
                          action,
                          self.__extraCredentials )
+    if self.__reuseConnection and action[0] == "RPC":
+      stConnectionInfo += ( { 'keepConnection' : True }, )
     retVal = transport.sendData( S_OK( stConnectionInfo ) )
     if not retVal[ 'OK' ]:
       return retVal
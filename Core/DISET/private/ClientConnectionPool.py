@@ -0,0 +1,153 @@
+# $HeadURL$
+"""
+Per process pool of established client transports. RPC clients return their
+connections here after a call if the server agreed to keep them open, and take
+them back for the next call to the same destination with the same credentials,
+saving the connection and the SSL handshake.
+"""
+__RCSID__ = "$Id$"
+
+import time
+import select
+import threading
+from DIRAC.FrameworkSystem.Client.Logger import gLogger
+from DIRAC.ConfigurationSystem.Client.Config import gConfig
+from DIRAC.Core.Utilities.ThreadScheduler import gThreadScheduler
+
+class ClientConnectionPool:
+
+  def __init__( self, maxIdleTime = 30, maxPerDestination = 5 ):
+    self.__maxIdleTime = maxIdleTime
+    self.__maxPerDestination = maxPerDestination
+    self.__lock = threading.Lock()
+    #key -> [ ( transport, lastUsed ), ... ]
+    self.__idle = {}
+    self.__stats = { 'hits' : 0, 'misses' : 0, 'handshakesSaved' : 0,
+                     'discarded' : 0, 'evicted' : 0, 'overflow' : 0 }
+    result = gThreadScheduler.addPeriodicTask( max( 5, maxIdleTime / 2 ), self.evictIdle )
+    if not result[ 'OK' ]:
+      gLogger.error( "Cannot add connection eviction task to thread scheduler", result[ 'Message' ] )
+
+  def setMaxIdleTime( self, maxIdleTime ):
+    self.__maxIdleTime = maxIdleTime
+
+  def setMaxPerDestination( self, maxPerDestination ):
+    self.__maxPerDestination = maxPerDestination
+
+  def __close( self, transport ):
+    try:
+      transport.close()
+    except:
+      pass
+
+  def __isAlive( self, transport ):
+    """
+    An idle connection must not have anything to read. If it does the server
+    closed it or sent something unexpected, so it can't be reused
+    """
+    try:
+      oSocket = transport.getSocket()
+      inList, dummy, exList = select.select( [ oSocket ], [], [ oSocket ], 0 )
+    except Exception:
+      return False
+    return not inList and not exList and not transport.byteStream
+
+  def get( self, key ):
+    """
+    Get an established transport for key or None if there's no usable one
+    """
+    now = time.time()
+    while True:
+      self.__lock.acquire()
+      try:
+        idleList = self.__idle.get( key )
+        if not idleList:
+          self.__stats[ 'misses' ] += 1
+          return None
+        #Most recently used first
+        transport, lastUsed = idleList.pop()
+        if not idleList:
+          del self.__idle[ key ]
+      finally:
+        self.__lock.release()
+      if now - lastUsed > self.__maxIdleTime or not self.__isAlive( transport ):
+        self.__lock.acquire()
+        self.__stats[ 'discarded' ] += 1
+        self.__lock.release()
+        self.__close( transport )
+        continue
+      self.__lock.acquire()
+      self.__stats[ 'hits' ] += 1
+      self.__stats[ 'handshakesSaved' ] += 1
+      self.__lock.release()
+      return transport
+
+  def put( self, key, transport ):
+    """
+    Return a transport to the pool after a successful call
+    """
+    self.__lock.acquire()
+    try:
+      idleList = self.__idle.setdefault( key, [] )
+      if len( idleList ) < self.__maxPerDestination:
+        idleList.append( ( transport, time.time() ) )
+        return
+      self.__stats[ 'overflow' ] += 1
+    finally:
+      self.__lock.release()
+    self.__close( transport )
+
+  def evictIdle( self ):
+    """
+    Close connections that have been idle for too long
+    """
+    limit = time.time() - self.__maxIdleTime
+    toClose = []
+    self.__lock.acquire()
+    try:
+      for key in list( self.__idle ):
+        idleList = self.__idle[ key ]
+        stillValid = [ idleTuple for idleTuple in idleList if idleTuple[1] >= limit ]
+        toClose.extend( [ idleTuple[0] for idleTuple in idleList if idleTuple[1] < limit ] )
+        if stillValid:
+          self.__idle[ key ] = stillValid
+        else:
+          del self.__idle[ key ]
+      self.__stats[ 'evicted' ] += len( toClose )
+    finally:
+      self.__lock.release()
+    for transport in toClose:
+      self.__close( transport )
+
+  def closeAll( self ):
+    self.__lock.acquire()
+    try:
+      idle = self.__idle
+      self.__idle = {}
+    finally:
+      self.__lock.release()
+    for key in idle:
+      for transport, lastUsed in idle[ key ]:
+        self.__close( transport )
+
+  def getStats( self ):
+    """
+    Get counters and number of idle connections
+    """
+    self.__lock.acquire()
+    try:
+      stats = dict( self.__stats )
+      stats[ 'idleConnections' ] = sum( [ len( idleList ) for idleList in self.__idle.values() ] )
+      stats[ 'destinations' ] = len( self.__idle )
+    finally:
+      self.__lock.release()
+    return stats
+
+gClientConnectionPool = None
+
+def getGlobalClientConnectionPool():
+  global gClientConnectionPool
+  if not gClientConnectionPool:
+    gClientConnectionPool = ClientConnectionPool( gConfig.getValue( "/DIRAC/ConnectionReuse/MaxIdleTime", 30 ),
+                                                  gConfig.getValue( "/DIRAC/ConnectionReuse/MaxPerDestination", 5 ) )
+  return gClientConnectionPool
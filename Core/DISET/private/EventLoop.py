@@ -0,0 +1,279 @@
+# $HeadURL$
+"""
+Event loop used by the ServiceReactor to multiplex incoming connections and
+by the services to wait on connections kept open for reuse by the clients.
+Connections are handshaked and their action proposal is read without
+blocking, so that they only take a thread once there's work to do.
+"""
+__RCSID__ = "$Id$"
+
+import os
+import time
+import select
+import errno
+import threading
+
+from DIRAC import gLogger, S_OK, S_ERROR
+
+class Poller:
+  """
+  Wrapper around epoll, poll or select, whichever is available
+  """
+
+  def __init__( self ):
+    self.__fds = {}
+    if hasattr( select, "epoll" ):
+      self.__mode = "epoll"
+      self.__poller = select.epoll()
+      self.__readMask = select.EPOLLIN | select.EPOLLPRI
+      self.__writeMask = select.EPOLLOUT
+      self.__errorMask = select.EPOLLERR | select.EPOLLHUP
+    elif hasattr( select, "poll" ):
+      self.__mode = "poll"
+      self.__poller = select.poll()
+      self.__readMask = select.POLLIN | select.POLLPRI
+      self.__writeMask = select.POLLOUT
+      self.__errorMask = select.POLLERR | select.POLLHUP | select.POLLNVAL
+    else:
+      self.__mode = "select"
+      self.__poller = None
+
+  def getMode( self ):
+    return self.__mode
+
+  def __len__( self ):
+    return len( self.__fds )
+
+  def __getMask( self, read, write ):
+    mask = 0
+    if read:
+      mask |= self.__readMask
+    if write:
+      mask |= self.__writeMask
+    return mask
+
+  def register( self, fd, read = True, write = False ):
+    if self.__mode != "select":
+      if fd in self.__fds:
+        self.__poller.modify( fd, self.__getMask( read, write ) )
+      else:
+        self.__poller.register( fd, self.__getMask( read, write ) )
+    self.__fds[ fd ] = ( read, write )
+
+  def unregister( self, fd ):
+    if fd not in self.__fds:
+      return
+    del self.__fds[ fd ]
+    if self.__mode != "select":
+      try:
+        self.__poller.unregister( fd )
+      except ( IOError, OSError, KeyError, ValueError ):
+        pass
+
+  def poll( self, timeout ):
+    """
+    Wait for events. Returns a list of ( fd, readable, writable, error )
+    """
+    try:
+      if self.__mode == "select":
+        rList = [ fd for fd in self.__fds if self.__fds[ fd ][0] ]
+        wList = [ fd for fd in self.__fds if self.__fds[ fd ][1] ]
+        rList, wList, eList = select.select( rList, wList, list( self.__fds ), timeout )
+        events = {}
+        for fd in rList:
+          events[ fd ] = [ fd, True, False, False ]
+        for fd in wList:
+          events.setdefault( fd, [ fd, False, False, False ] )[2] = True
+        for fd in eList:
+          events.setdefault( fd, [ fd, False, False, False ] )[3] = True
+        return [ tuple( ev ) for ev in events.values() ]
+      if self.__mode == "poll":
+        #poll timeout is in ms
+        evList = self.__poller.poll( timeout * 1000 )
+      else:
+        evList = self.__poller.poll( timeout )
+    except ( select.error, IOError, OSError ), e:
+      if e.args and e.args[0] == errno.EINTR:
+        return []
+      raise
+    return [ ( fd, bool( ev & self.__readMask ), bool( ev & self.__writeMask ), bool( ev & self.__errorMask ) )
+             for fd, ev in evList ]
+
+
+class EventLoop:
+  """
+  Handles listening sockets and pending client connections until they
+  have sent a full proposal. Then the connection is handed to its callback
+  """
+
+  __proposalMaxSize = 1024
+
+  def __init__( self ):
+    self.__poller = Poller()
+    self.__listeners = {}
+    self.__pending = {}
+    self.__lastTimeoutCheck = time.time()
+    #Connections can be added from other threads. They're queued and the loop is woken up
+    self.__incoming = []
+    self.__incomingLock = threading.Lock()
+    self.__wakeUpRead, self.__wakeUpWrite = os.pipe()
+    self.__poller.register( self.__wakeUpRead )
+    self.__loopThread = None
+    gLogger.info( "Event loop using %s" % self.__poller.getMode() )
+
+  def startInThread( self ):
+    """
+    Run the loop forever in a daemon thread
+    """
+    if self.__loopThread:
+      return
+    self.__loopThread = threading.Thread( target = self.__loopForever )
+    self.__loopThread.setDaemon( True )
+    self.__loopThread.start()
+
+  def __loopForever( self ):
+    while True:
+      try:
+        self.runOnce( 10 )
+      except Exception:
+        gLogger.exception( "Exception in event loop" )
+        time.sleep( 1 )
+
+  def getNumPendingConnections( self ):
+    return len( self.__pending ) + len( self.__incoming )
+
+  def addListener( self, oSocket, acceptCallback ):
+    """
+    Call acceptCallback() every time oSocket is ready to accept a connection
+    """
+    fd = oSocket.fileno()
+    self.__listeners[ fd ] = ( oSocket, acceptCallback )
+    self.__poller.register( fd )
+
+  def removeListener( self, oSocket ):
+    for fd in list( self.__listeners ):
+      if self.__listeners[ fd ][0] == oSocket:
+        del self.__listeners[ fd ]
+        self.__poller.unregister( fd )
+
+  def addConnection( self, clientTransport, readyCallback, timeout, handshaked = False ):
+    """
+    Handshake clientTransport and wait for its proposal without blocking.
+    Once the proposal is in the transport buffer readyCallback( clientTransport ) is called.
+    Can be called from any thread
+    """
+    self.__incomingLock.acquire()
+    try:
+      self.__incoming.append( ( clientTransport, readyCallback, timeout, handshaked ) )
+    finally:
+      self.__incomingLock.release()
+    try:
+      os.write( self.__wakeUpWrite, "x" )
+    except OSError:
+      pass
+    return S_OK()
+
+  def __processIncoming( self ):
+    try:
+      os.read( self.__wakeUpRead, 4096 )
+    except OSError:
+      pass
+    self.__incomingLock.acquire()
+    try:
+      incoming = self.__incoming
+      self.__incoming = []
+    finally:
+      self.__incomingLock.release()
+    for clientTransport, readyCallback, timeout, handshaked in incoming:
+      try:
+        fd = clientTransport.getSocket().fileno()
+      except Exception, e:
+        gLogger.warn( "Cannot get file descriptor of connection", str( e ) )
+        self.__closeTransport( clientTransport )
+        continue
+      self.__pending[ fd ] = { 'transport' : clientTransport,
+                               'callback' : readyCallback,
+                               'handshaked' : handshaked,
+                               'deadline' : time.time() + timeout }
+      self.__advance( fd )
+
+  def __closeTransport( self, clientTransport ):
+    try:
+      clientTransport.close()
+    except:
+      pass
+
+  def __drop( self, fd, reason = False ):
+    connData = self.__pending.pop( fd, None )
+    self.__poller.unregister( fd )
+    if not connData:
+      return
+    if reason:
+      gLogger.verbose( "Dropping pending connection", reason )
+    self.__closeTransport( connData[ 'transport' ] )
+
+  def __advance( self, fd ):
+    """
+    Move a pending connection forward as much as possible without blocking
+    """
+    connData = self.__pending[ fd ]
+    clientTransport = connData[ 'transport' ]
+    if not connData[ 'handshaked' ]:
+      try:
+        result = clientTransport.handshakeStep()
+      except Exception, e:
+        result = S_ERROR( "Exception while handshaking: %s" % str( e ) )
+      if not result[ 'OK' ]:
+        self.__drop( fd, result[ 'Message' ] )
+        return
+      if result[ 'Value' ] != True:
+        self.__poller.register( fd, read = result[ 'Value' ] == "read", write = result[ 'Value' ] == "write" )
+        return
+      connData[ 'handshaked' ] = True
+    #There may already be data waiting in the transport
+    result = clientTransport.bufferAvailableData( self.__proposalMaxSize )
+    if not result[ 'OK' ]:
+      self.__drop( fd, result[ 'Message' ] )
+      return
+    if not result[ 'Value' ]:
+      self.__poller.register( fd, read = True )
+      return
+    #Proposal is there. Release it from the loop
+    del self.__pending[ fd ]
+    self.__poller.unregister( fd )
+    try:
+      connData[ 'callback' ]( clientTransport )
+    except Exception:
+      gLogger.exception( "Exception while dispatching connection" )
+      self.__closeTransport( clientTransport )
+
+  def __checkTimeouts( self ):
+    now = time.time()
+    if now - self.__lastTimeoutCheck < 1:
+      return
+    self.__lastTimeoutCheck = now
+    for fd in [ fd for fd in self.__pending if self.__pending[ fd ][ 'deadline' ] < now ]:
+      self.__drop( fd, "Timeout waiting for handshake or proposal" )
+
+  def runOnce( self, timeout = 1 ):
+    """
+    Wait for events up to timeout seconds and process them
+    """
+    for fd, readable, writable, error in self.__poller.poll( timeout ):
+      if fd == self.__wakeUpRead:
+        self.__processIncoming()
+        continue
+      if fd in self.__listeners:
+        try:
+          self.__listeners[ fd ][1]()
+        except Exception:
+          gLogger.exception( "Exception while accepting connection" )
+        continue
+      if fd not in self.__pending:
+        self.__poller.unregister( fd )
+        continue
+      if error and not readable and not writable:
+        self.__drop( fd, "Connection error" )
+        continue
+      self.__advance( fd )
+    self.__checkTimeouts()
@@ -15,18 +15,103 @@ class InnerRPCClient( BaseClient ):
       retVal[ 'rpcStub' ] = stub
       return retVal
     trid, transport = retVal[ 'Value' ]
+    keepConnection = False
     try:
       retVal = self._proposeAction( transport, ( "RPC", functionName ) )
+      if not retVal[ 'OK' ] and self._connectionWasReused():
+        #The server may have closed the idle connection. Nothing has been executed so retry with a new one
+        self._disconnect( trid )
+        retVal = self._connect( allowReuse = False )
+        if not retVal[ 'OK' ]:
+          retVal[ 'rpcStub' ] = stub
+          return retVal
+        trid, transport = retVal[ 'Value' ]
+        retVal = self._proposeAction( transport, ( "RPC", functionName ) )
       if not retVal[ 'OK' ]:
         retVal[ 'rpcStub' ] = stub
         return retVal
+      keepConnection = retVal.get( 'keepConnection', False )
       retVal = transport.sendData( S_OK( args ) )
       if not retVal[ 'OK' ]:
+        keepConnection = False
         return retVal
       receivedData = transport.receiveData()
       if type( receivedData ) == types.DictType:
         receivedData[ 'rpcStub' ] = stub
+      else:
+        keepConnection = False
       return receivedData
     finally:
-      self._disconnect( trid )
+      self._disconnect( trid, keepConnection )
+
+  def executeRPCPipeline( self, callList, maxPerConnection = 500 ):
+    """
+    Execute several RPC calls sending them all through the same connection. The
+    server executes them concurrently and sends the results back when available
+
+    :param list callList: list of ( functionName, args ) tuples
+    :param int maxPerConnection: max number of calls to send through one connection
+    :return: S_OK with the list of results in the same order as callList
+    """
+    results = []
+    for start in range( 0, len( callList ), maxPerConnection ):
+      retVal = self.__executePipelineChunk( callList[ start : start + maxPerConnection ] )
+      if not retVal[ 'OK' ]:
+        return retVal
+      results.extend( retVal[ 'Value' ] )
+    return S_OK( results )
 
+  def __executeSequentially( self, callList ):
+    return S_OK( [ self.executeRPC( functionName, args ) for functionName, args in callList ] )
+
+  def __isPipelineUnsupported( self, retVal ):
+    #Servers and gateways without pipeline support reject the action
+    return retVal[ 'Message' ].find( "Pipeline is not a known action type" ) > -1 or \
+           retVal[ 'Message' ].find( "Unknown type of action" ) > -1
+
+  def __executePipelineChunk( self, callList ):
+    stubs = [ ( self._getBaseStub(), functionName, args ) for functionName, args in callList ]
+    retVal = self._connect()
+    if not retVal[ 'OK' ]:
+      return retVal
+    trid, transport = retVal[ 'Value' ]
+    try:
+      retVal = self._proposeAction( transport, ( "Pipeline", "execute" ) )
+      if not retVal[ 'OK' ] and self._connectionWasReused():
+        self._disconnect( trid )
+        retVal = self._connect( allowReuse = False )
+        if not retVal[ 'OK' ]:
+          return retVal
+        trid, transport = retVal[ 'Value' ]
+        retVal = self._proposeAction( transport, ( "Pipeline", "execute" ) )
+      if not retVal[ 'OK' ]:
+        if self.__isPipelineUnsupported( retVal ):
+          return self.__executeSequentially( callList )
+        return retVal
+      #Send everything before reading any reply
+      for reqId in range( len( callList ) ):
+        functionName, args = callList[ reqId ]
+        retVal = transport.sendData( S_OK( ( reqId, functionName, args ) ) )
+        if not retVal[ 'OK' ]:
+          return retVal
+      retVal = transport.sendData( S_OK( None ) )
+      if not retVal[ 'OK' ]:
+        return retVal
+      results = [ None ] * len( callList )
+      for iReply in range( len( callList ) ):
+        retVal = transport.receiveData()
+        if type( retVal ) != types.DictType:
+          return S_ERROR( "Invalid pipeline reply" )
+        if not retVal[ 'OK' ]:
+          if iReply == 0 and self.__isPipelineUnsupported( retVal ):
+            return self.__executeSequentially( callList )
+          return retVal
+        try:
+          reqId, result = retVal[ 'Value' ]
+          result[ 'rpcStub' ] = stubs[ reqId ]
+        except Exception:
+          return S_ERROR( "Invalid pipeline reply" )
+        results[ reqId ] = result
+      return S_OK( results )
+    finally:
+      self._disconnect( trid )
@@ -6,6 +6,8 @@ from DIRAC import S_OK, S_ERROR
 from DIRAC.FrameworkSystem.Client.Logger import gLogger
 from DIRAC.Core.Utilities import List
 from DIRAC.ConfigurationSystem.Client.Helpers import CSGlobals
+from DIRAC.ConfigurationSystem.Client.Config import gConfig
+from DIRAC.ConfigurationSystem.Client.PathFinder import getServiceSection
 
 class MessageFactory:
 
@@ -39,13 +41,23 @@ class MessageFactory:
     return msgName in result[ 'Value' ]
 
   def __loadHandler( self, serviceName ):
-    #TODO: Load handlers as the Service does (1. CS 2. SysNameSystem/Service/servNameHandler.py)
+    #Load handlers as the Service does (1. CS 2. SysNameSystem/Service/servNameHandler.py)
     sL = List.fromChar( serviceName, "/" )
     if len( sL ) != 2:
       return S_ERROR( "Service name is not valid: %s" % serviceName )
     sysName = sL[0]
     svcHandlerName = "%sHandler" % sL[1]
-    loadedObjs = loadObjects( "%sSystem/Service" % sysName,
+    handlerDir = "%sSystem/Service" % sysName
+    handlerPath = gConfig.getValue( "%s/HandlerPath" % getServiceSection( serviceName ), "" )
+    if handlerPath:
+      #HandlerPath is like DIRAC/ConfigurationSystem/Service/ConfigurationHandler.py
+      hL = List.fromChar( handlerPath, "/" )
+      if len( hL ) > 2:
+        handlerDir = "/".join( hL[1:-1] )
+        svcHandlerName = hL[-1]
+        if svcHandlerName.find( ".py", len( svcHandlerName ) - 3 ) > -1:
+          svcHandlerName = svcHandlerName[ :-3 ]
+    loadedObjs = loadObjects( handlerDir,
                           reFilter = re.compile( "^%s\.py$" % svcHandlerName ) )
     if svcHandlerName not in loadedObjs:
       return S_ERROR( "Could not find %s for getting messages definition" % serviceName )
@@ -0,0 +1,163 @@
+# $HeadURL$
+"""
+In process instrumentation of the requests served by a handler: latency and
+payload size histograms per method, calls in flight and a sample of the slowest
+calls with their arguments and the stack they were stuck in.
+"""
+__RCSID__ = "$Id$"
+
+import sys
+import time
+import thread
+import threading
+import traceback
+from DIRAC.Core.Utilities.Histogram import Histogram
+from DIRAC.Core.Utilities.ThreadScheduler import gThreadScheduler
+from DIRAC.FrameworkSystem.Client.Logger import gLogger
+
+class PerformanceStats:
+
+  def __init__( self, slowCallThreshold = 5, maxSlowCalls = 20 ):
+    self.__slowCallThreshold = slowCallThreshold
+    self.__maxSlowCalls = maxSlowCalls
+    self.__lock = threading.Lock()
+    self.__startTime = time.time()
+    self.__methods = {}
+    #callId -> dict with the info of the call being served
+    self.__inFlight = {}
+    self.__callCounter = 0
+    self.__slowCalls = []
+    if slowCallThreshold > 0:
+      result = gThreadScheduler.addPeriodicTask( max( 1, slowCallThreshold / 2 ), self.captureSlowStacks )
+      if not result[ 'OK' ]:
+        gLogger.error( "Cannot add slow call sampler to thread scheduler", result[ 'Message' ] )
+
+  def __getMethodStats( self, method ):
+    if method not in self.__methods:
+      self.__methods[ method ] = { 'latency' : Histogram(),
+                                   'requestSize' : Histogram(),
+                                   'responseSize' : Histogram(),
+                                   'errors' : 0,
+                                   'inFlight' : 0,
+                                   'maxInFlight' : 0 }
+    return self.__methods[ method ]
+
+  def startCall( self, method, args = None ):
+    """
+    Mark the beginning of a call. Returns the id to use in endCall
+    """
+    self.__lock.acquire()
+    try:
+      self.__callCounter += 1
+      callId = self.__callCounter
+      self.__inFlight[ callId ] = { 'method' : method, 'args' : args, 'start' : time.time(),
+                                    'thread' : thread.get_ident(), 'stack' : None }
+      methodStats = self.__getMethodStats( method )
+      methodStats[ 'inFlight' ] += 1
+      methodStats[ 'maxInFlight' ] = max( methodStats[ 'maxInFlight' ], methodStats[ 'inFlight' ] )
+    finally:
+      self.__lock.release()
+    return callId
+
+  def endCall( self, callId, ok = True, requestSize = None ):
+    """
+    Mark the end of a call and record its latency and request size
+    """
+    now = time.time()
+    self.__lock.acquire()
+    try:
+      callInfo = self.__inFlight.pop( callId, None )
+      if not callInfo:
+        return
+      elapsed = now - callInfo[ 'start' ]
+      methodStats = self.__getMethodStats( callInfo[ 'method' ] )
+      methodStats[ 'inFlight' ] -= 1
+      #Latency in microseconds
+      methodStats[ 'latency' ].add( elapsed * 1000000 )
+      if not ok:
+        methodStats[ 'errors' ] += 1
+      if requestSize is not None:
+        methodStats[ 'requestSize' ].add( requestSize )
+      if self.__slowCallThreshold > 0 and elapsed >= self.__slowCallThreshold:
+        self.__addSlowCall( callInfo, elapsed, ok )
+    finally:
+      self.__lock.release()
+
+  def recordResponseSize( self, method, responseSize ):
+    """
+    Record the size of a response once it has been sent
+    """
+    self.__lock.acquire()
+    try:
+      self.__getMethodStats( method )[ 'responseSize' ].add( responseSize )
+    finally:
+      self.__lock.release()
+
+  def __addSlowCall( self, callInfo, elapsed, ok ):
+    if callInfo[ 'args' ] is None:
+      argsList = "<masked>"
+    else:
+      argsList = [ str( arg )[:100] for arg in callInfo[ 'args' ] ]
+    slowCall = { 'method' : callInfo[ 'method' ],
+                 'args' : argsList,
+                 'startTime' : callInfo[ 'start' ],
+                 'elapsed' : elapsed,
+                 'OK' : ok,
+                 'stack' : callInfo[ 'stack' ] or '' }
+    self.__slowCalls.append( slowCall )
+    #Keep the slowest ones
+    if len( self.__slowCalls ) > self.__maxSlowCalls:
+      self.__slowCalls.sort( key = lambda sc : -sc[ 'elapsed' ] )
+      del self.__slowCalls[ self.__maxSlowCalls: ]
+
+  def captureSlowStacks( self ):
+    """
+    Capture the stack of the calls that have been running for longer than the threshold
+    """
+    limit = time.time() - self.__slowCallThreshold
+    self.__lock.acquire()
+    try:
+      slowCalls = [ callInfo for callInfo in self.__inFlight.values()
+                    if callInfo[ 'start' ] < limit and not callInfo[ 'stack' ] ]
+    finally:
+      self.__lock.release()
+    if not slowCalls:
+      return
+    frames = sys._current_frames()
+    for callInfo in slowCalls:
+      frame = frames.get( callInfo[ 'thread' ] )
+      if frame:
+        callInfo[ 'stack' ] = "".join( traceback.format_stack( frame ) )
+
+  def getStats( self, percentiles = ( 50, 90, 99, 99.9 ) ):
+    """
+    Get a summary of the stats per method. Latencies are in seconds and sizes in bytes
+    """
+    now = time.time()
+    self.__lock.acquire()
+    try:
+      methods = {}
+      for method, methodStats in self.__methods.items():
+        latency = methodStats[ 'latency' ].getSummary( percentiles )
+        for key in latency:
+          if key != 'count':
+            latency[ key ] = latency[ key ] / 1000000.0
+        methods[ method ] = { 'latency' : latency,
+                              'latencyBuckets' : [ ( low / 1000000.0, high / 1000000.0, count )
+                                                   for low, high, count in methodStats[ 'latency' ].getBuckets() ],
+                              'requestSize' : methodStats[ 'requestSize' ].getSummary( percentiles ),
+                              'responseSize' : methodStats[ 'responseSize' ].getSummary( percentiles ),
+                              'errors' : methodStats[ 'errors' ],
+                              'inFlight' : methodStats[ 'inFlight' ],
+                              'maxInFlight' : methodStats[ 'maxInFlight' ] }
+      inFlight = [ { 'method' : callInfo[ 'method' ], 'running' : now - callInfo[ 'start' ] }
+                   for callInfo in self.__inFlight.values() ]
+      slowCalls = [ dict( slowCall ) for slowCall in self.__slowCalls ]
+    finally:
+      self.__lock.release()
+    slowCalls.sort( key = lambda sc : -sc[ 'elapsed' ] )
+    return { 'methods' : methods,
+             'inFlight' : inFlight,
+             'slowCalls' : slowCalls,
+             'slowCallThreshold' : self.__slowCallThreshold,
+             'since' : self.__startTime }
@@ -1,6 +1,7 @@
 
 import os
 import time
+import types
 import DIRAC
 import threading
 from DIRAC import gConfig, gLogger, S_OK, S_ERROR, gMonitor
@@ -10,6 +11,7 @@ from DIRAC.FrameworkSystem.Client.MonitoringClient import MonitoringClient
 from DIRAC.Core.DISET.private.ServiceConfiguration import ServiceConfiguration
 from DIRAC.Core.DISET.private.TransportPool import getGlobalTransportPool
 from DIRAC.Core.DISET.private.MessageBroker import MessageBroker, MessageSender
+from DIRAC.Core.DISET.private.EventLoop import EventLoop
 from DIRAC.Core.Utilities.ThreadScheduler import gThreadScheduler
 from DIRAC.Core.DISET.RequestHandler import RequestHandler
 from DIRAC.Core.Utilities.ThreadPool import ThreadPool
@@ -24,7 +26,8 @@ class Service:
   SVC_VALID_ACTIONS = { 'RPC' : 'export',
                         'FileTransfer': 'transfer',
                         'Message' : 'msg',
-                        'Connection' : 'Message' }
+                        'Connection' : 'Message',
+                        'Pipeline' : 'RPC' }
   SVC_SECLOG_CLIENT = SecurityLogClient()
 
   def __init__( self, serviceData ):
@@ -45,6 +48,8 @@ class Service:
     self._transportPool = getGlobalTransportPool()
     self.__cloneId = 0
     self.__maxFD = 0
+    self.__reuseLoop = None
+    self.__reuseLoopLock = threading.Lock()
 
   def setCloneProcessId( self, cloneId ):
     self.__cloneId = cloneId
@@ -273,14 +278,18 @@ class Service:
 
   #End of initialization functions
 
-  def handleConnection( self, clientTransport ):
+  def handleConnection( self, clientTransport, handshaked = False ):
+    """
+    Queue a connection to be processed by the thread pool. If handshaked is true
+    the handshake has already been done (event loop mode) and it's skipped
+    """
     self._stats[ 'connections' ] += 1
     self._monitor.setComponentExtraParam( 'queries', self._stats[ 'connections' ] )
     self._threadPool.generateJobAndQueueIt( self._processInThread,
-                                             args = ( clientTransport, ) )
+                                             args = ( clientTransport, handshaked ) )
 
   #Threaded process function
-  def _processInThread( self, clientTransport ):
+  def _processInThread( self, clientTransport, handshaked = False ):
     self.__maxFD = max( self.__maxFD, clientTransport.oSocket.fileno() )
     self._lockManager.lockGlobal()
     try:
@@ -289,13 +298,14 @@ class Service:
       monReport = False
     try:
       #Handshake
-      try:
-        result = clientTransport.handshake()
-        if not result[ 'OK' ]:
-          clientTransport.close()
+      if not handshaked:
+        try:
+          result = clientTransport.handshake()
+          if not result[ 'OK' ]:
+            clientTransport.close()
+            return
+        except:
           return
-      except:
-        return
       #Add to the transport pool
       trid = self._transportPool.add( clientTransport )
       if not trid:
@@ -314,6 +324,10 @@ class Service:
       handlerObj = result[ 'Value' ]
       #Execute the action
       result = self._processProposal( trid, proposalTuple, handlerObj )
+      #Keep the connection for the next proposal if the client asked for it
+      if result[ 'OK' ] and result.get( 'keepConnection' ):
+        self.__keepConnection( trid )
+        return result
       #Close the connection if required
       if result[ 'closeTransport' ] or not result[ 'OK' ]:
         if not result[ 'OK' ]:
@@ -326,6 +340,26 @@ class Service:
         self.__endReportToMonitoring( *monReport )
 
 
+  def __keepConnection( self, trid ):
+    """
+    Wait without holding a thread for the next proposal in a connection reused by the client
+    """
+    clientTransport = self._transportPool.get( trid )
+    if not clientTransport:
+      return
+    self.__reuseLoopLock.acquire()
+    try:
+      if not self.__reuseLoop:
+        self.__reuseLoop = EventLoop()
+        self.__reuseLoop.startInThread()
+    finally:
+      self.__reuseLoopLock.release()
+    self._transportPool.remove( trid )
+    self.__reuseLoop.addConnection( clientTransport,
+                                    lambda readyTransport : self.handleConnection( readyTransport, handshaked = True ),
+                                    self._cfg.getReusedConnectionTimeout(),
+                                    handshaked = True )
+
   def _createIdentityString( self, credDict, clientTransport = None ):
     if 'username' in credDict:
       if 'group' in credDict:
@@ -447,8 +481,16 @@ class Service:
     return S_OK( handlerInstance )
 
   def _processProposal( self, trid, proposalTuple, handlerObj ):
+    #Can the connection be kept open after the action?
+    keepConnection = False
+    if len( proposalTuple ) > 3 and type( proposalTuple[3] ) == types.DictType:
+      keepConnection = proposalTuple[3].get( 'keepConnection', False ) and \
+                       proposalTuple[1][0] == 'RPC' and self._cfg.allowConnectionReuse()
     #Notify the client we're ready to execute the action
-    retVal = self._transportPool.send( trid, S_OK() )
+    readyMsg = S_OK()
+    if keepConnection:
+      readyMsg[ 'keepConnection' ] = True
+    retVal = self._transportPool.send( trid, readyMsg )
     if not retVal[ 'OK' ]:
       return retVal
 
@@ -469,6 +511,11 @@ class Service:
                                        disconnectCallback = self._mbDisconnect,
                                        listenToConnection = False )
 
+    if proposalTuple[1][0] == 'Pipeline':
+      result = self._executePipeline( trid, proposalTuple )
+      result[ 'closeTransport' ] = True
+      return result
+
     result = self._executeAction( trid, proposalTuple, handlerObj )
     if result[ 'OK' ] and messageConnection:
       self._msgBroker.listenToTransport( trid )
@@ -477,6 +524,8 @@ class Service:
         self._msgBroker.removeTransport( trid )
 
     result[ 'closeTransport' ] = not messageConnection or not result[ 'OK' ]
+    if keepConnection:
+      result[ 'keepConnection' ] = True
     return result
 
   def _mbConnect( self, trid, handlerObj = None ):
@@ -494,6 +543,95 @@ class Service:
       gLogger.exception( "Exception while executing handler action" )
       return S_ERROR( "Server error while executing action: %s" % str( e ) )
 
+  def _executePipeline( self, trid, proposalTuple ):
+    """
+    Execute a pipeline of RPC requests sent over the same connection. Requests are
+    ( requestId, method, args ) messages terminated by a None. They are executed
+    concurrently in the thread pool while they're being received. Once all have
+    been received the replies are sent as ( requestId, result ) in completion order
+    """
+    clientTransport = self._transportPool.get( trid )
+    if not clientTransport:
+      return S_ERROR( "Client disconnected" )
+    credDict = clientTransport.getConnectingCredentials()
+    maxRequests = self._cfg.getMaxPipelinedRequests()
+    pipeline = { 'pending' : [], 'results' : [], 'lock' : threading.Condition() }
+    numRequests = 0
+    #Receive and queue the requests. Nothing is sent until the client has sent all of them
+    while True:
+      retVal = self._transportPool.receive( trid )
+      if not retVal[ 'OK' ]:
+        return retVal
+      request = retVal[ 'Value' ]
+      if request is None:
+        break
+      try:
+        reqId, method, args = request
+      except Exception:
+        return S_ERROR( "Invalid pipelined request" )
+      numRequests += 1
+      pipeline[ 'lock' ].acquire()
+      try:
+        if numRequests > maxRequests:
+          pipeline[ 'results' ].append( ( reqId, S_ERROR( "Too many requests in pipeline (max %s)" % maxRequests ) ) )
+          continue
+        pipeline[ 'pending' ].append( ( reqId, method, args ) )
+      finally:
+        pipeline[ 'lock' ].release()
+      self._threadPool.generateJobAndQueueIt( self.__processPipelinedRequest,
+                                               args = ( trid, proposalTuple, credDict, pipeline ),
+                                               blocking = False )
+    #Send the replies. This thread also executes whatever the pool hasn't picked up yet
+    numSent = 0
+    while numSent < numRequests:
+      if not self.__processPipelinedRequest( trid, proposalTuple, credDict, pipeline ):
+        pipeline[ 'lock' ].acquire()
+        try:
+          if not pipeline[ 'results' ]:
+            pipeline[ 'lock' ].wait( 1 )
+        finally:
+          pipeline[ 'lock' ].release()
+      pipeline[ 'lock' ].acquire()
+      try:
+        results = pipeline[ 'results' ]
+        pipeline[ 'results' ] = []
+      finally:
+        pipeline[ 'lock' ].release()
+      for reqId, result in results:
+        retVal = self._transportPool.send( trid, S_OK( ( reqId, result ) ) )
+        if not retVal[ 'OK' ]:
+          return retVal
+        numSent += 1
+    return S_OK()
+
+  def __processPipelinedRequest( self, trid, proposalTuple, credDict, pipeline ):
+    """
+    Execute one pending request of a pipeline. Returns False if there was nothing to do
+    """
+    pipeline[ 'lock' ].acquire()
+    try:
+      if not pipeline[ 'pending' ]:
+        return False
+      reqId, method, args = pipeline[ 'pending' ].pop( 0 )
+    finally:
+      pipeline[ 'lock' ].release()
+    result = self._authorizeProposal( ( 'RPC', method ), trid, credDict )
+    if result[ 'OK' ]:
+      result = self._instantiateHandler( trid, proposalTuple )
+    if result[ 'OK' ]:
+      try:
+        result = result[ 'Value' ]._rh_executePipelinedRPC( method, args )
+      except Exception, e:
+        gLogger.exception( "Exception while executing pipelined request" )
+        result = S_ERROR( "Server error while executing action: %s" % str( e ) )
+    pipeline[ 'lock' ].acquire()
+    try:
+      pipeline[ 'results' ].append( ( reqId, result ) )
+      pipeline[ 'lock' ].notify()
+    finally:
+      pipeline[ 'lock' ].release()
+    return True
+
   def _mbReceivedMsg( self, trid, msgObj ):
     result = self._authorizeProposal( ( 'Message', msgObj.getName() ),
                                       trid,
@@ -86,6 +86,36 @@ class ServiceConfiguration:
     except:
       return 1
 
+  def useEventLoop( self ):
+    optionValue = self.getOption( "EventLoop" )
+    if not optionValue:
+      return False
+    return str( optionValue ).lower() in ( "y", "yes", "true", "1" )
+
+  def getEventLoopTimeout( self ):
+    try:
+      return int( self.getOption( "EventLoopTimeout" ) )
+    except:
+      return 300
+
+  def allowConnectionReuse( self ):
+    optionValue = self.getOption( "AllowConnectionReuse" )
+    if not optionValue:
+      return True
+    return str( optionValue ).lower() in ( "y", "yes", "true", "1" )
+
+  def getReusedConnectionTimeout( self ):
+    try:
+      return int( self.getOption( "ReusedConnectionTimeout" ) )
+    except:
+      return 60
+
+  def getMaxPipelinedRequests( self ):
+    try:
+      return int( self.getOption( "MaxPipelinedRequests" ) )
+    except:
+      return 1000
+
   def getPort( self ):
     try:
       return int( self.getOption( "Port" ) )
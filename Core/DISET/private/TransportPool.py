@@ -147,6 +147,11 @@ class TransportPool:
       return S_ERROR( "No transport with id %s defined" % trid )
     self.__remove( trid )
 
+  # Remove without closing
+
+  def remove( self, trid ):
+    self.__remove( trid )
+
   def __remove( self, trid ):
     self.__modLock.acquire()
     try:
@@ -3,7 +3,6 @@ __RCSID__ = "$Id$"
 
 import time
 import select
-import cStringIO
 try:
   from hashlib import md5
 except:
@@ -35,6 +34,8 @@ class BaseTransport:
     self.sentKeepAlives = 0
     self.waitingForKeepAlivePong = False
     self.__keepAliveLapse = 0
+    self.__lastSentSize = 0
+    self.__lastReceivedSize = 0
     self.oSocket = None
     if 'keepAliveLapse' in kwargs:
       try:
@@ -50,12 +51,28 @@ class BaseTransport:
   def getLastActionTimestamp( self ):
     return self.__lastActionTimestamp
 
+  def getLastSentSize( self ):
+    return self.__lastSentSize
+
+  def getLastReceivedSize( self ):
+    return self.__lastReceivedSize
+
   def getKeepAliveLapse( self ):
     return self.__keepAliveLapse
 
   def handshake( self ):
     return S_OK()
 
+  def handshakeStep( self ):
+    """
+    Advance the server side handshake without blocking.
+    Returns S_OK( True ) once done or S_OK( "read" / "write" ) if it has to wait for the socket
+    """
+    result = self.handshake()
+    if not result[ 'OK' ]:
+      return result
+    return S_OK( True )
+
   def close( self ):
     self.oSocket.close()
 
@@ -111,12 +128,62 @@ class BaseTransport:
     except Exception, e:
       return S_ERROR( "Exception while reading from peer: %s" % str( e ) )
 
+  def _readNoWait( self, bufSize = 4096 ):
+    """
+    Read whatever is available in the socket. Returns S_OK( None ) if there's nothing to read
+    """
+    try:
+      inList, dummy, dummy = select.select( [ self.oSocket ], [], [], 0 )
+      if self.oSocket not in inList:
+        return S_OK( None )
+      return S_OK( self.oSocket.recv( bufSize ) )
+    except Exception, e:
+      return S_ERROR( "Exception while reading from peer: %s" % str( e ) )
+
   def _write( self, buffer ):
     return S_OK( self.oSocket.send( buffer ) )
 
+  def hasBufferedMessage( self ):
+    """
+    Check if a full message or keep alive header is already in the receive buffer
+    """
+    keepAliveMagicLen = len( BaseTransport.keepAliveMagic )
+    if self.byteStream.find( BaseTransport.keepAliveMagic, 0, keepAliveMagicLen ) == 0:
+      return True
+    iSeparatorPosition = self.byteStream.find( ":", 0, 10 )
+    if iSeparatorPosition == -1:
+      #Garbage will be reported by receiveData
+      return len( self.byteStream ) >= 10
+    try:
+      pkgSize = int( self.byteStream[ :iSeparatorPosition ] )
+    except ValueError:
+      return True
+    return len( self.byteStream ) - iSeparatorPosition - 1 >= pkgSize
+
+  def bufferAvailableData( self, maxBufferSize = 0 ):
+    """
+    Read without blocking the data already available in the socket into the receive buffer.
+    Returns S_OK( True ) when there's a full message in the buffer, so receiveData won't block
+    """
+    self.__updateLastActionTimestamp()
+    while not self.hasBufferedMessage():
+      result = self._readNoWait( 16384 )
+      if not result[ 'OK' ]:
+        return result
+      data = result[ 'Value' ]
+      if data is None:
+        return S_OK( False )
+      if not data:
+        return S_ERROR( "Peer closed connection" )
+      self.byteStream += data
+      if maxBufferSize and len( self.byteStream ) > maxBufferSize:
+        return S_ERROR( "Read limit exceeded (%s chars)" % maxBufferSize )
+    return S_OK( True )
+
   def sendData( self, uData, prefix = False ):
     self.__updateLastActionTimestamp()
     sCodedData = DEncode.encode( uData )
+    self.__lastSentSize = len( sCodedData )
     if prefix:
       dataToSend = "%s%s:%s" % ( prefix, len( sCodedData ), sCodedData )
     else:
@@ -175,16 +242,27 @@ class BaseTransport:
       #From here it must be a real message!
       #Process the size and remove the msg length from the bytestream
       pkgSize = int( self.byteStream[ :iSeparatorPosition ] )
+      #Both the threaded and the event loop paths read the messages here
+      self.__lastReceivedSize = pkgSize
       pkgData = self.byteStream[ iSeparatorPosition + 1: ]
       readSize = len( pkgData )
       if readSize >= pkgSize:
         #If we already have all the data we need
         data = pkgData[ :pkgSize ]
         self.byteStream = pkgData[ pkgSize: ]
+        try:
+          data = DEncode.decode( data )[0]
+        except Exception, e:
+          return S_ERROR( "Could not decode received data: %s" % str( e ) )
       else:
-        #If we still need to read stuff
-        pkgMem = cStringIO.StringIO()
-        pkgMem.write( pkgData )
+        #If we still need to read stuff, decode while receiving
+        decoder = DEncode.StreamDecoder()
+        decodeError = False
+        try:
+          decoder.feed( pkgData )
+        except Exception, e:
+          decodeError = str( e )
+        pkgData = ""
         #Receive while there's still data to be received
         while readSize < pkgSize:
           retVal = self._read( pkgSize - readSize, skipReadyCheck = True )
@@ -193,22 +271,26 @@ class BaseTransport:
           if not retVal[ 'Value' ]:
             return S_ERROR( "Peer closed connection" )
           rcvData = retVal[ 'Value' ]
+          if readSize + len( rcvData ) > pkgSize:
+            #Keep whatever belongs to the next message
+            self.byteStream = rcvData[ pkgSize - readSize: ]
+            rcvData = rcvData[ :pkgSize - readSize ]
+          else:
+            self.byteStream = ""
           readSize += len( rcvData )
-          pkgMem.write( rcvData )
+          if not decodeError:
+            try:
+              decoder.feed( rcvData, eof = readSize == pkgSize )
+            except Exception, e:
+              decodeError = str( e )
           if maxBufferSize and readSize > maxBufferSize:
             return S_ERROR( "Read limit exceeded (%s chars)" % maxBufferSize )
-        #Data is here! take it out from the bytestream, dencode and return
-        if readSize == pkgSize:
-          data = pkgMem.getvalue()
-          self.byteStream = ""
-        else: #readSize > pkgSize:
-          pkgMem.seek( 0, 0 )
-          data = pkgMem.read( pkgSize )
-          self.byteStream = pkgMem.read()
-      try:
-        data = DEncode.decode( data )[0]
-      except Exception, e:
-        return S_ERROR( "Could not decode received data: %s" % str( e ) )
+        #Data is here!
+        if not decodeError and not decoder.isComplete():
+          decodeError = "Truncated data"
+        if decodeError:
+          return S_ERROR( "Could not decode received data: %s" % decodeError )
+        data = decoder.getObject()
       if idleReceive:
         self.receivedMessages.append( data )
         return S_OK()
@@ -323,6 +323,31 @@ class SocketInfo:
       except Exception, v:
         gLogger.warn( "Error while handshaking", v )
         return S_ERROR( "Error while handshaking" )
+    return self.__handshakeDone()
+
+  def startServerHandshake( self ):
+    self.sslSocket.set_accept_state()
+
+  def handshakeStep( self ):
+    """
+    Try to advance the handshake without blocking.
+    Returns S_OK( credentials ) when done, or S_OK( "read"/"write" ) if it has to wait for the socket
+    """
+    try:
+      self.sslSocket.do_handshake()
+    except GSI.SSL.WantReadError:
+      return S_OK( "read" )
+    except GSI.SSL.WantWriteError:
+      return S_OK( "write" )
+    except GSI.SSL.Error, v:
+      gLogger.warn( "Error while handshaking", v )
+      return S_ERROR( "Error while handshaking" )
+    except Exception, v:
+      gLogger.warn( "Error while handshaking", v )
+      return S_ERROR( "Error while handshaking" )
+    return self.__handshakeDone()
+
+  def __handshakeDone( self ):
     credentialsDict = self.gatherPeerCredentials()
     if self.infoDict[ 'clientMode' ]:
       hostnameCN = credentialsDict[ 'CN' ]
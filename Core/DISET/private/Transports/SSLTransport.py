@@ -24,6 +24,7 @@ class SSLTransport( BaseTransport ):
   def __init__( self, *args, **kwargs ):
     self.__writesDone = 0
     self.__locked = False
+    self.__handshakeStarted = False
     BaseTransport.__init__( self, *args, **kwargs )
 
   def __lock( self, timeout = 1000 ):
@@ -97,6 +98,20 @@ class SSLTransport( BaseTransport ):
       self.peerCredentials[ key ] = creds[ key ]
     return S_OK()
 
+  def handshakeStep( self ):
+    if not self.__handshakeStarted:
+      self.oSocketInfo.startServerHandshake()
+      self.__handshakeStarted = True
+    retVal = self.oSocketInfo.handshakeStep()
+    if not retVal[ 'OK' ]:
+      return retVal
+    creds = retVal[ 'Value' ]
+    if creds in ( "read", "write" ):
+      return S_OK( creds )
+    for key in creds.keys():
+      self.peerCredentials[ key ] = creds[ key ]
+    return S_OK( True )
+
   def setClientSocket( self, oSocket ):
     if self.serverMode():
       raise RuntimeError( "Must be initialized as client mode" )
@@ -139,6 +154,22 @@ class SSLTransport( BaseTransport ):
     finally:
       self.__unlock()
 
+  def _readNoWait( self, bufSize = 4096 ):
+    self.__lock()
+    try:
+      try:
+        return S_OK( self.oSocket.recv( bufSize ) )
+      except GSI.SSL.WantReadError:
+        return S_OK( None )
+      except GSI.SSL.WantWriteError:
+        return S_OK( None )
+      except GSI.SSL.ZeroReturnError:
+        return S_OK( "" )
+      except Exception, e:
+        return S_ERROR( "Exception while reading from peer: %s" % str( e ) )
+    finally:
+      self.__unlock()
+
   def isLocked( self ):
     return self.__locked
 
@@ -70,6 +70,9 @@ except Exception:
 
 #START OF CFG MODULE
 
+#Tokens of the cfg syntax. += has to go first so it's not taken as =
+gCFGTokenRE = re.compile( r"\+=|[{}=]" )
+
 class CFG( object ):
 
   class Template( string.Template ):
@@ -653,27 +656,36 @@ class CFG( object ):
     @param tabLevelString: Tab string to apply to entries before representing them
     @return: String with the contents of the CFG
     """
+    lines = []
+    self.__serializeLines( lines, tabLevelString )
+    return "".join( lines )
+
+  def __serializeLines( self, lines, tabLevelString ):
+    """
+    Append the serialization of the CFG to a list of lines
+    """
     indentation = "  "
-    cfgString = ""
     for entryName in self.__orderedList:
       if entryName in self.__commentDict:
-        for commentLine in List.fromChar( self.__commentDict[ entryName ], "\n" ):
-          cfgString += "%s#%s\n" % ( tabLevelString, commentLine )
-      if entryName in self.listSections():
-        cfgString += "%s%s\n%s{\n" % ( tabLevelString, entryName, tabLevelString )
-        cfgString += self.__dataDict[ entryName ].serialize( "%s%s" % ( tabLevelString, indentation ) )
-        cfgString += "%s}\n" % tabLevelString
-      elif entryName in self.listOptions():
-        valueList = List.fromChar( self.__dataDict[ entryName ] )
-        if len( valueList ) == 0:
-          cfgString += "%s%s = \n" % ( tabLevelString, entryName )
+        for commentLine in self.__commentDict[ entryName ].split( "\n" ):
+          commentLine = commentLine.strip()
+          if commentLine:
+            lines.append( "%s#%s\n" % ( tabLevelString, commentLine ) )
+      if entryName not in self.__dataDict:
+        raise ValueError( "Oops. There is an entry in the order which is not a section nor an option" )
+      value = self.__dataDict[ entryName ]
+      if type( value ) == types.StringType:
+        valueList = [ field.strip() for field in value.split( "," ) if field.strip() ]
+        if not valueList:
+          lines.append( "%s%s = \n" % ( tabLevelString, entryName ) )
         else:
-          cfgString += "%s%s = %s\n" % ( tabLevelString, entryName, valueList[0] )
-          for value in valueList[1:]:
-            cfgString += "%s%s += %s\n" % ( tabLevelString, entryName, value )
+          lines.append( "%s%s = %s\n" % ( tabLevelString, entryName, valueList[0] ) )
+          for field in valueList[1:]:
+            lines.append( "%s%s += %s\n" % ( tabLevelString, entryName, field ) )
       else:
-        raise ValueError( "Oops. There is an entry in the order which is not a section nor an option" )
-    return cfgString
+        lines.append( "%s%s\n%s{\n" % ( tabLevelString, entryName, tabLevelString ) )
+        value.__serializeLines( lines, "%s%s" % ( tabLevelString, indentation ) )
+        lines.append( "%s}\n" % tabLevelString )
 
   @gCFGSynchro
   def clone( self ):
@@ -738,21 +750,26 @@ class CFG( object ):
     @return: A list of modifications
     """
     modList = []
+    #Position of each key to avoid searching the ordered lists
+    oldPositions = dict( [ ( key, iPos ) for iPos, key in enumerate( self.__orderedList ) ] )
+    newPositions = dict( [ ( key, iPos ) for iPos, key in enumerate( newerCfg.__orderedList ) ] )
     #Options
     oldOptions = self.listOptions( True )
     newOptions = newerCfg.listOptions( True )
+    oldOptionsSet = set( oldOptions )
+    newOptionsSet = set( newOptions )
     for newOption in newOptions:
-      iPos = newerCfg.__orderedList.index( newOption )
+      iPos = newPositions[ newOption ]
       newOptPath = "%s/%s" % ( parentPath, newOption )
       if ignoreMask and newOptPath in ignoreMask:
         continue
-      if newOption not in oldOptions:
+      if newOption not in oldOptionsSet:
         modList.append( ( 'addOpt', newOption, iPos,
                           newerCfg[ newOption ],
                           newerCfg.getComment( newOption ) ) )
       else:
         modified = False
-        if iPos != self.__orderedList.index( newOption ):
+        if iPos != oldPositions[ newOption ]:
           modified = True
         elif newerCfg[ newOption ] != self[ newOption ]:
           modified = True
@@ -766,23 +783,25 @@ class CFG( object ):
       oldOptPath = "%s/%s" % ( parentPath, oldOption )
       if ignoreMask and oldOptPath in ignoreMask:
         continue
-      if oldOption not in newOptions:
+      if oldOption not in newOptionsSet:
         modList.append( ( 'delOpt', oldOption, -1, '' ) )
     #Sections
     oldSections = self.listSections( True )
     newSections = newerCfg.listSections( True )
+    oldSectionsSet = set( oldSections )
+    newSectionsSet = set( newSections )
     for newSection in newSections:
-      iPos = newerCfg.__orderedList.index( newSection )
+      iPos = newPositions[ newSection ]
       newSecPath = "%s/%s" % ( parentPath, newSection )
       if ignoreMask and newSecPath in ignoreMask:
         continue
-      if newSection not in oldSections:
+      if newSection not in oldSectionsSet:
         modList.append( ( 'addSec', newSection, iPos,
                           str( newerCfg[ newSection ] ),
                           newerCfg.getComment( newSection ) ) )
       else:
         modified = False
-        if iPos != self.__orderedList.index( newSection ):
+        if iPos != oldPositions[ newSection ]:
           modified = True
         elif newerCfg.getComment( newSection ) != self.getComment( newSection ):
           modified = True
@@ -798,7 +817,7 @@ class CFG( object ):
       oldSecPath = "%s/%s" % ( parentPath, oldSection )
       if ignoreMask and oldSecPath in ignoreMask:
         continue
-      if oldSection not in newSections:
+      if oldSection not in newSectionsSet:
         modList.append( ( 'delSec', oldSection, -1, '' ) )
     return modList
 
@@ -900,44 +919,58 @@ class CFG( object ):
     @param data: Contents of the CFG
     @return: This CFG
     """
-    commentRE = re.compile( "^\s*#" )
     self.reset()
     levelList = []
     currentLevel = self
     currentlyParsedString = ""
-    currentComment = ""
     for line in data.split( "\n" ):
       line = line.strip()
-      if len( line ) < 1:
+      if not line or line[0] == "#":
         continue
-      if commentRE.match( line ):
-          continue
-      for index in range( len( line ) ):
-        if line[ index ] == "{":
-          currentlyParsedString = currentlyParsedString.strip()
-          currentLevel.createNewSection( currentlyParsedString, currentComment )
+      #Anything between the tokens is part of the name of the next section
+      lastEnd = 0
+      for token in gCFGTokenRE.finditer( line ):
+        tokenString = token.group()
+        if tokenString == "{":
+          sectionName = ( currentlyParsedString + line[ lastEnd : token.start() ] ).strip()
+          if not sectionName or sectionName in currentLevel.__dataDict or sectionName.find( "/" ) > -1:
+            currentLevel.createNewSection( sectionName, "" )
+            newLevel = currentLevel[ sectionName ]
+          else:
+            newLevel = CFG()
+            currentLevel.__orderedList.append( sectionName )
+            currentLevel.__commentDict[ sectionName ] = ""
+            currentLevel.__dataDict[ sectionName ] = newLevel
           levelList.append( currentLevel )
-          currentLevel = currentLevel[ currentlyParsedString ]
+          currentLevel = newLevel
           currentlyParsedString = ""
-          currentComment = ""
-        elif line[ index ] == "}":
+        elif tokenString == "}":
+          currentlyParsedString += line[ lastEnd : token.start() ]
           currentLevel = levelList.pop()
-        elif line[ index ] == "=":
-          lFields = line.split( "=" )
-          currentLevel.setOption( lFields[0].strip(),
-           "=".join( lFields[1:] ).strip(),
-           currentComment )
+        elif tokenString == "=":
+          optionName = line[ : token.start() ].strip()
+          value = line[ token.end(): ].strip()
+          if not optionName or optionName.find( "/" ) > -1:
+            currentLevel.setOption( optionName, value, "" )
+          else:
+            if optionName not in currentLevel.__dataDict:
+              currentLevel.__orderedList.append( optionName )
+            currentLevel.__commentDict[ optionName ] = ""
+            currentLevel.__dataDict[ optionName ] = str( value )
           currentlyParsedString = ""
-          currentComment = ""
           break
-        elif line[ index: index + 2 ] == "+=":
-          valueList = line.split( "+=" )
-          currentLevel.appendToOption( valueList[0].strip(), ", %s" % "+=".join( valueList[1:] ).strip() )
+        else:
+          optionName = line[ : token.start() ].strip()
+          value = ", %s" % line[ token.end(): ].strip()
+          if type( currentLevel.__dataDict.get( optionName ) ) == types.StringType and optionName.find( "/" ) == -1:
+            currentLevel.__dataDict[ optionName ] += str( value )
+          else:
+            currentLevel.appendToOption( optionName, value )
           currentlyParsedString = ""
-          currentComment = ""
           break
-        else:
-          currentlyParsedString += line[ index ]
+        lastEnd = token.end()
+      else:
+        currentlyParsedString += line[ lastEnd: ]
     return self
 
   @gCFGSynchro
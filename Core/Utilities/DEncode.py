@@ -221,15 +221,69 @@ g_dEncodeFunctions[ types.DictType ] = encodeDict
 g_dDecodeFunctions[ "d" ] = decodeDict
 
 
+#Fast path encoding. Strings and ints inside containers, which are the bulk of the
+#payloads, are encoded inline instead of through one g_dEncodeFunctions call each.
+#Output is byte identical to the generic path (see encodeGeneric). Types and builtins
+#are bound as default arguments to avoid global lookups in the loops
+def _encodeFast( uObject, eList, strType = types.StringType, intType = types.IntType,
+                 dictType = types.DictType, listType = types.ListType, tupleType = types.TupleType,
+                 encFuncs = g_dEncodeFunctions, sorted = sorted, type = type, len = len, str = str ):
+  oType = type( uObject )
+  if oType is dictType:
+    extend = eList.extend
+    eList.append( "d" )
+    for key in sorted( uObject ):
+      kType = type( key )
+      if kType is strType:
+        extend( ( "s", str( len( key ) ), ":", key ) )
+      elif kType is intType:
+        extend( ( "i", str( key ), "e" ) )
+      else:
+        _encodeFast( key, eList )
+      value = uObject[ key ]
+      vType = type( value )
+      if vType is strType:
+        extend( ( "s", str( len( value ) ), ":", value ) )
+      elif vType is intType:
+        extend( ( "i", str( value ), "e" ) )
+      elif vType is dictType or vType is listType or vType is tupleType:
+        _encodeFast( value, eList )
+      else:
+        encFuncs[ vType ]( value, eList )
+    eList.append( "e" )
+  elif oType is listType or oType is tupleType:
+    extend = eList.extend
+    if oType is listType:
+      eList.append( "l" )
+    else:
+      eList.append( "t" )
+    for value in uObject:
+      vType = type( value )
+      if vType is strType:
+        extend( ( "s", str( len( value ) ), ":", value ) )
+      elif vType is intType:
+        extend( ( "i", str( value ), "e" ) )
+      elif vType is dictType or vType is listType or vType is tupleType:
+        _encodeFast( value, eList )
+      else:
+        encFuncs[ vType ]( value, eList )
+    eList.append( "e" )
+  else:
+    encFuncs[ oType ]( uObject, eList )
+
 #Encode function
 def encode( uObject ):
-  try:
-    eList = []
-    #print "ENCODE FUNCTION : %s" % g_dEncodeFunctions[ type( uObject ) ]
-    g_dEncodeFunctions[ type( uObject ) ]( uObject, eList )
-    return "".join( eList )
-  except Exception:
-    raise
+  eList = []
+  _encodeFast( uObject, eList )
+  return "".join( eList )
+
+def encodeGeneric( uObject ):
+  """
+  Encode using only the per type functions in g_dEncodeFunctions
+  """
+  eList = []
+  g_dEncodeFunctions[ type( uObject ) ]( uObject, eList )
+  return "".join( eList )
 
 def decode( data ):
   if not data:
@@ -241,6 +295,210 @@ def decode( data ):
     raise
 
 
+#Incremental decoding
+class StreamDecoder( object ):
+  """
+  Incremental decoder for DEncoded data. Chunks are fed as they arrive and
+  objects are built while reading, so the complete encoded buffer never has
+  to be held in memory. Only the bytes of the token being parsed are kept.
+  """
+
+  __containerTypes = ( "l", "t", "d" )
+
+  def __init__( self ):
+    self.__buffer = bytearray()
+    self.__pos = 0
+    self.__consumed = 0
+    #Each frame is [ typeChar, container, pendingKey, hasPendingKey ]
+    self.__stack = []
+    self.__complete = False
+    self.__value = None
+
+  def isComplete( self ):
+    return self.__complete
+
+  def getObject( self ):
+    if not self.__complete:
+      raise Exception( "Decoding is not complete yet" )
+    return self.__value
+
+  def getConsumedBytes( self ):
+    """
+    Number of bytes that belong to the decoded object
+    """
+    return self.__consumed + self.__pos
+
+  def getPendingData( self ):
+    """
+    Data fed after the end of the decoded object
+    """
+    return str( self.__buffer[ self.__pos: ] )
+
+  def feed( self, data, eof = False ):
+    """
+    Feed a chunk of encoded data. Returns True once a full object has been decoded
+    """
+    if self.__complete:
+      self.__buffer.extend( data )
+      return True
+    self.__buffer.extend( data )
+    view = memoryview( self.__buffer )
+    try:
+      self.__parse( view, eof )
+    finally:
+      del view
+    if not self.__complete and self.__pos:
+      #Drop what has already been decoded
+      del self.__buffer[ :self.__pos ]
+      self.__consumed += self.__pos
+      self.__pos = 0
+    return self.__complete
+
+  def __parse( self, view, eof ):
+    buf = self.__buffer
+    bufLen = len( buf )
+    stack = self.__stack
+    find = buf.find
+    pos = self.__pos
+    #Keep the position in a local and only store it back once a token is fully processed
+    try:
+      while pos < bufLen:
+        typeChar = view[ pos ]
+        if typeChar == "s":
+          colon = find( ":", pos + 1 )
+          if colon == -1:
+            return
+          end = colon + 1 + int( view[ pos + 1:colon ].tobytes() )
+          if end > bufLen:
+            return
+          value = view[ colon + 1:end ].tobytes()
+          pos = end
+        elif typeChar == "i" or typeChar == "I" or typeChar == "f":
+          end = find( "e", pos + 1 )
+          if end == -1:
+            return
+          if typeChar == "i":
+            value = int( view[ pos + 1:end ].tobytes() )
+          elif typeChar == "I":
+            value = long( view[ pos + 1:end ].tobytes() )
+          else:
+            if end + 1 == bufLen and not eof:
+              #Can't know yet if it's an exponent
+              return
+            if end + 1 < bufLen and view[ end + 1 ] in ( "+", "-" ):
+              eI = end
+              end = find( "e", eI + 1 )
+              if end == -1:
+                return
+              value = float( view[ pos + 1:eI ].tobytes() ) * 10 ** int( view[ eI + 1:end ].tobytes() )
+            else:
+              value = float( view[ pos + 1:end ].tobytes() )
+          pos = end + 1
+        elif typeChar == "d" or typeChar == "l" or typeChar == "t":
+          pos += 1
+          if typeChar == "d":
+            stack.append( [ typeChar, {}, None, False ] )
+          else:
+            stack.append( [ typeChar, [], None, False ] )
+          continue
+        elif typeChar == "e":
+          if not stack or stack[-1][0] not in self.__containerTypes:
+            raise Exception( "Unexpected end of container at position %s" % ( self.__consumed + pos ) )
+          frame = stack.pop()
+          pos += 1
+          if frame[0] == "t":
+            value = tuple( frame[1] )
+          else:
+            value = frame[1]
+        elif typeChar == "b":
+          if pos + 2 > bufLen:
+            return
+          value = view[ pos + 1 ] != "0"
+          pos += 2
+        elif typeChar == "n":
+          value = None
+          pos += 1
+        elif typeChar == "u":
+          colon = find( ":", pos + 1 )
+          if colon == -1:
+            return
+          end = colon + 1 + int( view[ pos + 1:colon ].tobytes() )
+          if end > bufLen:
+            return
+          value = unicode( view[ colon + 1:end ].tobytes(), 'utf-8' )
+          pos = end
+        elif typeChar == "z":
+          if pos + 2 > bufLen:
+            return
+          dataType = view[ pos + 1 ]
+          if dataType not in ( "a", "d", "t" ):
+            raise Exception( "Unexpected type %s while decoding a datetime object" % dataType )
+          pos += 2
+          stack.append( [ typeChar, dataType, None, False ] )
+          continue
+        else:
+          raise Exception( "Unexpected type %s while decoding at position %s" % ( typeChar,
+                                                                                   self.__consumed + pos ) )
+        #Store the value in its container
+        if stack:
+          frame = stack[-1]
+          fType = frame[0]
+          if fType == "d":
+            if frame[3]:
+              frame[1][ frame[2] ] = value
+              frame[3] = False
+            else:
+              frame[2] = value
+              frame[3] = True
+            continue
+          elif fType != "z":
+            frame[1].append( value )
+            continue
+        self.__addValue( value )
+        if self.__complete:
+          return
+    finally:
+      self.__pos = pos
+
+  def __addValue( self, value ):
+    while self.__stack:
+      frame = self.__stack[-1]
+      if frame[0] == "z":
+        self.__stack.pop()
+        if frame[1] == 'a':
+          value = datetime.datetime( *value )
+        elif frame[1] == 'd':
+          value = datetime.date( *value )
+        else:
+          value = datetime.time( *value )
+        continue
+      if frame[0] == "d":
+        if frame[3]:
+          frame[1][ frame[2] ] = value
+          frame[2] = None
+          frame[3] = False
+        else:
+          frame[2] = value
+          frame[3] = True
+      else:
+        frame[1].append( value )
+      return
+    self.__value = value
+    self.__complete = True
+
+def decodeStream( chunkIterable ):
+  """
+  Decode an object out of an iterable of encoded chunks
+  """
+  decoder = StreamDecoder()
+  for chunk in chunkIterable:
+    if decoder.feed( chunk ):
+      break
+  if not decoder.isComplete():
+    decoder.feed( "", eof = True )
+  return ( decoder.getObject(), decoder.getConsumedBytes() )
+
+
 if __name__ == "__main__":
   gObject = {2:"3", True : ( 3, None ), 2.0 * 10 ** 20 : 2.0 * 10 ** -10 }
   print "Initial: %s" % gObject
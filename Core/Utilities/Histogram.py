@@ -0,0 +1,107 @@
+# $HeadURL$
+"""
+Log-linear histogram in the style of HdrHistogram: values are integers, every
+power of two is split in a fixed number of linear sub-buckets so the relative
+error of any reported value is bounded (12.5% with the default 8 sub-buckets)
+and memory only grows with the logarithm of the value range.
+"""
+__RCSID__ = "$Id$"
+
+class Histogram:
+
+  def __init__( self, subBucketBits = 3 ):
+    self.__subBits = subBucketBits
+    self.__exactLimit = 1 << ( subBucketBits + 1 )
+    self.__counts = {}
+    self.__total = 0
+    self.__sum = 0
+    self.__min = None
+    self.__max = None
+
+  def __bucketIndex( self, value ):
+    if value < self.__exactLimit:
+      return value
+    shift = value.bit_length() - self.__subBits - 1
+    return ( shift << self.__subBits ) + ( value >> shift )
+
+  def __bucketRange( self, index ):
+    if index < self.__exactLimit:
+      return index, index
+    shift = ( index >> self.__subBits ) - 1
+    mantissa = index - ( shift << self.__subBits )
+    return mantissa << shift, ( ( mantissa + 1 ) << shift ) - 1
+
+  def add( self, value, count = 1 ):
+    """
+    Record a non negative value count times
+    """
+    value = max( 0, int( value ) )
+    index = self.__bucketIndex( value )
+    self.__counts[ index ] = self.__counts.get( index, 0 ) + count
+    self.__total += count
+    self.__sum += value * count
+    if self.__min is None or value < self.__min:
+      self.__min = value
+    if self.__max is None or value > self.__max:
+      self.__max = value
+
+  def merge( self, otherHistogram ):
+    """
+    Add the contents of another histogram with the same resolution
+    """
+    data = otherHistogram.getRawData()
+    for index, count in data[ 'counts' ].items():
+      self.__counts[ index ] = self.__counts.get( index, 0 ) + count
+    self.__total += data[ 'total' ]
+    self.__sum += data[ 'sum' ]
+    if data[ 'min' ] is not None:
+      if self.__min is None or data[ 'min' ] < self.__min:
+        self.__min = data[ 'min' ]
+      if self.__max is None or data[ 'max' ] > self.__max:
+        self.__max = data[ 'max' ]
+
+  def getRawData( self ):
+    return { 'counts' : dict( self.__counts ), 'total' : self.__total, 'sum' : self.__sum,
+             'min' : self.__min, 'max' : self.__max }
+
+  def getCount( self ):
+    return self.__total
+
+  def getMean( self ):
+    if not self.__total:
+      return 0
+    return float( self.__sum ) / self.__total
+
+  def getPercentile( self, percentile ):
+    """
+    Get the highest value equivalent to the requested percentile (0-100)
+    """
+    if not self.__total:
+      return 0
+    target = max( 1, percentile / 100.0 * self.__total )
+    accumulated = 0
+    for index in sorted( self.__counts ):
+      accumulated += self.__counts[ index ]
+      if accumulated >= target:
+        return min( self.__bucketRange( index )[1], self.__max )
+    return self.__max
+
+  def getSummary( self, percentiles = ( 50, 90, 99, 99.9 ) ):
+    """
+    Get count, mean, min, max and the requested percentiles in a dict
+    """
+    summary = { 'count' : self.__total, 'mean' : self.getMean(),
+                'min' : self.__min or 0, 'max' : self.__max or 0 }
+    for percentile in percentiles:
+      summary[ 'p%s' % percentile ] = self.getPercentile( percentile )
+    return summary
+
+  def getBuckets( self ):
+    """
+    Get a sorted list of ( lowValue, highValue, count ) for the non empty buckets
+    """
+    buckets = []
+    for index in sorted( self.__counts ):
+      low, high = self.__bucketRange( index )
+      buckets.append( ( low, high, self.__counts[ index ] ) )
+    return buckets
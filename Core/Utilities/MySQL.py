@@ -7,11 +7,12 @@
 
     __init__( host, user, passwd, name, [maxConnsInQueue=10] )
 
-    Initializes the Queue and tries to connect to the DB server,
+    Initializes the connection pool and tries to connect to the DB server,
     using the _connect method.
-    "maxConnsInQueue" defines the size of the Queue of open connections
-    that are kept for reuse. It also defined the maximum number of open
-    connections available from the object.
+    "maxConnsInQueue" defines the maximum number of open connections to the
+    DB, shared by all the threads. Each thread leases one connection for the
+    duration of a call and gives it back to the pool afterwards, threads asking
+    for a connection when all of them are in use wait for one to be released.
     maxConnsInQueue = 0 means unlimited and it is not supported.
 
 
@@ -39,6 +40,13 @@
     Returns S_OK with fetchall() out in Value or S_ERROR upon failure.
 
 
+    _queryIter( cmd, [batchSize, args] )
+
+    Generator executing SQL command "cmd" with a server side cursor in a
+    dedicated connection. Yields S_OK with up to batchSize rows at a time,
+    or S_ERROR upon failure, so big result sets are never fully loaded in memory.
+
+
     _update( cmd, [conn] )
 
     Executes SQL command "cmd" and issue a commit
@@ -48,6 +56,10 @@
     is used and is not  in the Queue
     Returns S_OK with number of updated registers in Value or S_ERROR upon failure.
 
+    Both _query and _update accept an "args" list or dict. Then "cmd" is a
+    parameterised statement using %s or %(name)s placeholders, and the values are
+    escaped by the client library instead of one _escapeString call per value.
+
 
     _createTables( tableDict )
 
@@ -56,10 +68,14 @@
 
     _getConnection()
 
-    Gets a connection from the Queue (or open a new one if none is available)
-    Returns S_OK with connection in Value or S_ERROR
-    the calling method is responsible for closing this connection once it is no
-    longer needed.
+    Checks that a connection can be obtained from the pool.
+    Returns S_OK with connection in Value or S_ERROR. The connection is already
+    back in the pool, methods taking a connection argument ignore it.
+
+
+    getConnectionPoolStats()
+
+    Returns S_OK with the gauges and counters of the connection pool.
 
 
 
@@ -90,6 +106,13 @@
       String type values will be appropriately escaped.
 
 
+    insertMany( self, tableName, inFields, rows, onDuplicate = None ):
+
+      Insert many rows in "tableName" with multi row INSERT statements that fit
+      in the max_allowed_packet of the server, all in the same transaction.
+      onDuplicate can be 'IGNORE' or a list of fields to update when the key exists.
+
+
     updateFields( self, tableName, updateFields = None, updateValues = None,
                   condDict = None,
                   limit = False, conn = None,
@@ -161,14 +184,8 @@ import warnings
 with warnings.catch_warnings():
   warnings.simplefilter( 'ignore', DeprecationWarning )
   import MySQLdb
+  import MySQLdb.cursors
 
-# Get rid of the annoying Deprecation warning of the current MySQLdb
-# FIXME: compile a newer MySQLdb version
-import warnings
-with warnings.catch_warnings():
-  warnings.simplefilter( 'ignore', DeprecationWarning )
-  import MySQLdb
-  
 # This is for proper initialization of embeded server, it should only be called once
 MySQLdb.server_init( ['--defaults-file=/opt/dirac/etc/my.cnf', '--datadir=/opt/mysql/db'], ['mysqld'] )
 gInstancesCount = 0
@@ -177,7 +194,7 @@ gDebugFile = None
 import collections
 import time
 import threading
-from types import StringTypes, DictType, ListType, TupleType, BooleanType
+from types import StringTypes, DictType, ListType, TupleType, BooleanType, IntType, LongType, FloatType
 
 MAXCONNECTRETRY = 10
 
@@ -207,6 +224,14 @@ def _checkFields( inFields, inValues ):
 
   return S_OK()
 
+def _isConnectionLost( x ):
+  """
+    Check if an exception means that the connection to the server is not usable anymore
+  """
+  if isinstance( x, MySQLdb.InterfaceError ):
+    return True
+  return isinstance( x, MySQLdb.OperationalError ) and bool( x.args ) and x.args[0] in ( 2006, 2013 )
+
 def _quotedList( fieldList = None ):
   """
     Quote a list of MySQL Field Names with "`"
@@ -236,20 +261,42 @@ class MySQL:
 
   class ConnectionPool( object ):
     """
-    Management of connections per thread
+    Bounded pool of connections to a DB shared by all the threads. A thread checks
+    out a connection for each operation and checks it in when done. Nested checkouts
+    from the same thread get the same connection, and while a transaction is open
+    the connection stays pinned to its thread. Idle connections are only pinged
+    when they haven't been used for checkInterval seconds
     """
-    __connData = MutableStruct( 'ConnData', [ 'conn', 'dbName', 'last', 'intrans' ] )
+    __connData = MutableStruct( 'ConnData', [ 'conn', 'last', 'intrans', 'refs', 'broken' ] )
 
-    def __init__( self, host, user, passwd, port = 3306, graceTime = 600 ):
+    def __init__( self, host, user, passwd, port = 3306, dbName = '', maxConnections = 10,
+                  graceTime = 600, waitTimeout = 30, checkInterval = 30 ):
       self.__host = host
       self.__user = user
       self.__passwd = passwd
       self.__port = port
+      self.__dbName = dbName
+      self.__maxConnections = max( 1, maxConnections )
       self.__graceTime = graceTime
-      self.__spares = collections.deque()
-      self.__maxSpares = 10
-      self.__lastClean = 0
-      self.__assigned = {}
+      self.__waitTimeout = waitTimeout
+      self.__checkInterval = checkInterval
+      self.__lock = threading.Condition()
+      self.__idle = collections.deque()
+      self.__leases = {}
+      self.__unbound = {}
+      self.__numConnections = 0
+      self.__waiting = 0
+      self.__lastClean = time.time()
+      self.__stats = { 'created' : 0, 'discarded' : 0, 'checkouts' : 0, 'waits' : 0,
+                       'timeouts' : 0, 'pings' : 0, 'waitTime' : 0.0, 'maxWaitTime' : 0.0 }
+
+    def setMaxConnections( self, maxConnections ):
+      self.__lock.acquire()
+      try:
+        self.__maxConnections = max( self.__maxConnections, maxConnections )
+        self.__lock.notifyAll()
+      finally:
+        self.__lock.release()
 
     @property
     def __thid( self ):
@@ -259,7 +306,8 @@ class MySQL:
       conn = MySQLdb.connect( host = self.__host,
                               port = self.__port,
                               user = self.__user,
-                              passwd = self.__passwd )
+                              passwd = self.__passwd,
+                              db = self.__dbName )
 
       self.__execute( conn, "SET AUTOCOMMIT=1" )
       return conn
@@ -270,140 +318,259 @@ class MySQL:
       cursor.close()
       return res
 
-    def get( self, dbName, retries = 10 ):
-      retries = max( 0, min( MAXCONNECTRETRY, retries ) )
-      self.clean()
-      result = self.__getWithRetry( dbName, retries, retries )
-      if not result[ 'OK' ]:
-        return result
-      return S_OK( result[ 'Value' ].conn )
-
-    def __getWithRetry( self, dbName, totalRetries = 10, retriesLeft = 10 ):
-      sleepTime = 5 * ( totalRetries - retriesLeft )
-      if sleepTime > 0:
-        time.sleep( sleepTime )
-      try:
-        connData, thid = self.__innerGet()
-      except MySQLdb.MySQLError, excp:
-        if retriesLeft >= 0:
-          return self.__getWithRetry( dbName, totalRetries, retriesLeft - 1 )
-        return S_ERROR( "Could not connect: %s" % excp )
-
-      if not connData.intrans and not self.__ping( connData.conn ):
-        try:
-          self.__assigned.pop( thid )
-        except KeyError:
-          pass
-        if retriesLeft >= 0:
-          return self.__getWithRetry( dbName, totalRetries, retriesLeft )
-        return S_ERROR( "Could not connect" )
-
-      if connData.dbName != dbName:
-        try:
-          connData.conn.select_db( dbName )
-          connData.dbName = dbName
-        except MySQLdb.MySQLError, excp:
-          try:
-            self.__assigned.pop( thid ).conn.close()
-          except Exception:
-            pass
-          if retriesLeft >= 0:
-            return self.__getWithRetry( dbName, totalRetries, retriesLeft - 1 )
-          return S_ERROR( "Could not select db %s: %s" % ( dbName, excp ) )
-      return S_OK( connData )
-
     def __ping( self, conn ):
+      self.__stats[ 'pings' ] += 1
       try:
-        conn.ping( True )
+        conn.ping()
         return True
       except:
         return False
 
-    def __innerGet( self ):
-      thid = self.__thid
-      now = time.time()
+    def __close( self, connData ):
       try:
-        data = self.__assigned[ thid ]
-        data.last = now
-        return data, thid
-      except KeyError:
+        connData.conn.close()
+      except Exception:
         pass
-      #Not cached
+
+    def __discard( self, connData ):
+      """
+      Close a connection and free its slot
+      """
+      if connData:
+        self.__close( connData )
+      self.__lock.acquire()
       try:
-        connData = self.__spares.pop()
-      except IndexError:
-        connData = self.__connData( self.__newConn(), "", now, False )
+        self.__numConnections -= 1
+        self.__stats[ 'discarded' ] += 1
+        self.__lock.notify()
+      finally:
+        self.__lock.release()
+
+    def __isOpen( self, conn ):
+      return bool( getattr( conn, 'open', 0 ) )
+
+    def __checkIn( self, connData ):
+      if connData.broken or not self.__isOpen( connData.conn ):
+        self.__discard( connData )
+        return
+      self.__lock.acquire()
+      try:
+        connData.last = time.time()
+        self.__idle.append( connData )
+        self.__lock.notify()
+      finally:
+        self.__lock.release()
+
+    def __checkOut( self, retries = MAXCONNECTRETRY ):
+      """
+      Get a valid connection not used by anybody else, waiting up to waitTimeout
+      seconds if all of them are in use
+      """
+      attempt = 0
+      while True:
+        startWait = time.time()
+        connData = None
+        self.__lock.acquire()
+        try:
+          while True:
+            if self.__idle:
+              #Most recently used first, the others can expire
+              connData = self.__idle.pop()
+              break
+            if self.__numConnections < self.__maxConnections:
+              self.__numConnections += 1
+              break
+            remaining = self.__waitTimeout - ( time.time() - startWait )
+            if remaining <= 0:
+              self.__stats[ 'timeouts' ] += 1
+              return S_ERROR( "Timeout waiting for a connection to %s (%s in use)" % ( self.__dbName,
+                                                                                      self.__numConnections ) )
+            self.__waiting += 1
+            try:
+              self.__lock.wait( remaining )
+            finally:
+              self.__waiting -= 1
+          waitTime = time.time() - startWait
+          self.__stats[ 'checkouts' ] += 1
+          if waitTime > 0.001:
+            self.__stats[ 'waits' ] += 1
+          self.__stats[ 'waitTime' ] += waitTime
+          self.__stats[ 'maxWaitTime' ] = max( self.__stats[ 'maxWaitTime' ], waitTime )
+        finally:
+          self.__lock.release()
+
+        if connData:
+          #A connection closed by its user can't be trusted even if recently used
+          if self.__isOpen( connData.conn ) and \
+             ( time.time() - connData.last < self.__checkInterval or self.__ping( connData.conn ) ):
+            connData.refs = 0
+            return S_OK( connData )
+          self.__discard( connData )
+          continue
 
-      self.__assigned[ thid ] = connData
-      return self.__assigned[ thid ], thid
+        try:
+          conn = self.__newConn()
+        except MySQLdb.MySQLError, excp:
+          self.__discard( None )
+          attempt += 1
+          if attempt > retries:
+            return S_ERROR( "Could not connect: %s" % excp )
+          time.sleep( min( 5 * attempt, 30 ) )
+          continue
+        self.__lock.acquire()
+        self.__stats[ 'created' ] += 1
+        self.__lock.release()
+        return S_OK( self.__connData( conn, time.time(), False, 0, False ) )
+
+    def get( self, retries = 10 ):
+      """
+      Check out a connection for the current thread. It has to be given back with release()
+      """
+      retries = max( 0, min( MAXCONNECTRETRY, retries ) )
+      thid = self.__thid
+      connData = self.__leases.get( thid )
+      if connData:
+        connData.refs += 1
+        return S_OK( connData.conn )
+      self.clean()
+      result = self.__checkOut( retries )
+      if not result[ 'OK' ]:
+        return result
+      connData = result[ 'Value' ]
+      connData.refs = 1
+      self.__leases[ thid ] = connData
+      return S_OK( connData.conn )
+
+    def release( self, broken = False ):
+      """
+      Give back the connection checked out by the current thread. If broken
+      the connection won't be reused
+      """
+      thid = self.__thid
+      connData = self.__leases.get( thid )
+      if not connData:
+        return
+      if broken:
+        connData.broken = True
+      connData.refs -= 1
+      if connData.refs > 0 or connData.intrans:
+        return
+      del self.__leases[ thid ]
+      self.__checkIn( connData )
+
+    def getStreamingConnection( self ):
+      """
+      Check out a connection not bound to the current thread. Server side cursors keep
+      the connection busy until all rows are read so they can't share it
+      """
+      result = self.__checkOut()
+      if not result[ 'OK' ]:
+        return result
+      connData = result[ 'Value' ]
+      self.__unbound[ id( connData.conn ) ] = connData
+      return S_OK( connData.conn )
 
-    def __pop( self, thid ):
-      try:
-        connData = self.__assigned.pop( thid )
-      except KeyError:
+    def releaseStreamingConnection( self, conn, reusable = True ):
+      connData = self.__unbound.pop( id( conn ), None )
+      if not connData:
         return
-      if not connData.intrans and len( self.__spares ) < self.__maxSpares:
-        self.__spares.append( connData )
-      else:
-        connData.conn.close()
+      if not reusable:
+        connData.broken = True
+      self.__checkIn( connData )
+
+    def inTransaction( self ):
+      connData = self.__leases.get( self.__thid )
+      return bool( connData and connData.intrans )
 
     def clean( self, now = False ):
+      """
+      Close connections idle for more than graceTime and the ones left by dead threads
+      """
       if not now:
         now = time.time()
+      if now - self.__lastClean < 60:
+        return
       self.__lastClean = now
-      for thid in list( self.__assigned ):
+      toClose = []
+      self.__lock.acquire()
+      try:
+        while self.__idle and now - self.__idle[0].last > self.__graceTime:
+          toClose.append( self.__idle.popleft() )
+      finally:
+        self.__lock.release()
+      for thid in list( self.__leases ):
         if not thid.isAlive():
-          self.__pop( thid )
-          continue
-        try:
-          data = self.__assigned[ thid ]
-        except KeyError:
-          continue
-        if now - data.last > self.__graceTime:
-          self.__pop( thid )
+          connData = self.__leases.pop( thid, None )
+          if connData:
+            toClose.append( connData )
+      for connData in toClose:
+        self.__discard( connData )
+
+    def getStats( self ):
+      """
+      Gauges and counters of the pool
+      """
+      self.__lock.acquire()
+      try:
+        stats = dict( self.__stats )
+        stats[ 'maxConnections' ] = self.__maxConnections
+        stats[ 'connections' ] = self.__numConnections
+        stats[ 'idle' ] = len( self.__idle )
+        stats[ 'inUse' ] = self.__numConnections - len( self.__idle )
+        stats[ 'waiting' ] = self.__waiting
+      finally:
+        self.__lock.release()
+      if stats[ 'checkouts' ]:
+        stats[ 'avgWaitTime' ] = stats[ 'waitTime' ] / stats[ 'checkouts' ]
+      else:
+        stats[ 'avgWaitTime' ] = 0.0
+      return stats
 
-    def transactionStart( self, dbName ):
-      print "TRANS START"
-      result = self.__getWithRetry( dbName )
+    def transactionStart( self ):
+      result = self.get()
       if not result[ 'OK' ]:
         return result
-      connData = result[ 'Value' ]
+      connData = self.__leases[ self.__thid ]
       try:
         if connData.intrans:
-          raise RuntimeError( "Staring a MySQL transaction inside another one" )
-      	self.__execute( connData.conn, "SET AUTOCOMMIT=0" )
+          return S_ERROR( "Starting a MySQL transaction inside another one" )
+        self.__execute( connData.conn, "SET AUTOCOMMIT=0" )
         self.__execute( connData.conn, "START TRANSACTION WITH CONSISTENT SNAPSHOT" )
         connData.intrans = True
         return S_OK()
       except MySQLdb.MySQLError, excp:
+        connData.broken = True
         return S_ERROR( "Could not begin transaction: %s" % excp )
+      finally:
+        #The connection stays pinned to the thread while intrans
+        self.release()
 
-    def transactionCommit( self, dbName ):
-      print "TRANS COMMIT"
-      return self.__endTransaction( dbName, True )
+    def transactionCommit( self ):
+      return self.__endTransaction( True )
 
-    def transactionRollback( self, dbName ):
-      print "TRANS ROLLBACK"
-      return self.__endTransaction( dbName, False )
+    def transactionRollback( self ):
+      return self.__endTransaction( False )
 
-    def __endTransaction( self, dbName, commit ):
-      result = self.__getWithRetry( dbName )
-      if not result[ 'OK' ]:
-        return result
-      connData = result[ 'Value' ]
+    def __endTransaction( self, commit ):
+      connData = self.__leases.get( self.__thid )
+      if not connData or not connData.intrans:
+        return S_ERROR( "No transaction in progress" )
       try:
-        if not connData.intrans:
-          gLogger.warn( "MySQL connection has reconnected. Transaction may be inconsistent" )
         if commit:
           result = connData.conn.commit()
         else:
           result = connData.conn.rollback()
-      	self.__execute( connData.conn, "SET AUTOCOMMIT=1" )
+        self.__execute( connData.conn, "SET AUTOCOMMIT=1" )
         connData.conn.commit()
-        connData.intrans = False
         return S_OK( result )
       except MySQLdb.MySQLError, excp:
+        connData.broken = True
         return S_ERROR( "Could not end transaction: %s" % excp )
+      finally:
+        connData.intrans = False
+        if connData.refs <= 0:
+          connData.refs = 1
+          self.release()
 
   __connectionPools = {}
 
@@ -431,9 +598,12 @@ class MySQL:
     self.__passwd = str( passwd )
     self.__dbName = str( dbName )
     self.__port = port
-    cKey = ( self.__hostName, self.__userName, self.__passwd, self.__port )
+    self.__maxStatementSize = 0
+    cKey = ( self.__hostName, self.__userName, self.__passwd, self.__port, self.__dbName )
     if cKey not in MySQL.__connectionPools:
-      MySQL.__connectionPools[ cKey ] = MySQL.ConnectionPool( *cKey )
+      MySQL.__connectionPools[ cKey ] = MySQL.ConnectionPool( *cKey, maxConnections = maxQueueSize )
+    else:
+      MySQL.__connectionPools[ cKey ].setMaxConnections( maxQueueSize )
     self.__connectionPool = MySQL.__connectionPools[ cKey ]
 
     self.__initialized = True
@@ -472,17 +642,21 @@ class MySQL:
       return S_ERROR( '%s: (%s)' % ( err, str( e ) ) )
 
 
-  def __escapeString( self, myString ):
+  def __escapeString( self, myString, connection = None ):
     """
     To be used for escaping any MySQL string before passing it to the DB
     this should prevent passing non-MySQL accepted characters to the DB
     It also includes quotation marks " around the given string
     """
 
-    retDict = self.__getConnection()
-    if not retDict['OK']:
-      return retDict
-    connection = retDict['Value']
+    if not connection:
+      retDict = self.__getConnection()
+      if not retDict['OK']:
+        return retDict
+      try:
+        return self.__escapeString( myString, retDict['Value'] )
+      finally:
+        self.__releaseConnection()
 
     specialValues = ( 'UTC_TIMESTAMP', 'TIMESTAMPADD', 'TIMESTAMPDIFF' )
 
@@ -545,27 +719,36 @@ class MySQL:
     if not inValues:
       return S_OK( inEscapeValues )
 
-    for value in inValues:
-      if type( value ) in StringTypes:
-        retDict = self.__escapeString( value )
-        if not retDict['OK']:
-          return retDict
-        inEscapeValues.append( retDict['Value'] )
-      elif type( value ) == TupleType or type( value ) == ListType:
-        tupleValues = []
-        for v in list( value ):
-          retDict = self.__escapeString( v )
+    # One connection for all the values
+    retDict = self.__getConnection()
+    if not retDict['OK']:
+      return retDict
+    connection = retDict['Value']
+
+    try:
+      for value in inValues:
+        if type( value ) in StringTypes:
+          retDict = self.__escapeString( value, connection )
           if not retDict['OK']:
             return retDict
-          tupleValues.append( retDict['Value'] )
-        inEscapeValues.append( '(' + ', '.join( tupleValues ) + ')' ) 
-      elif type( value ) == BooleanType:
-        inEscapeValues = [str( value )]
-      else:
-        retDict = self.__escapeString( str( value ) )
-        if not retDict['OK']:
-          return retDict
-        inEscapeValues.append( retDict['Value'] )
+          inEscapeValues.append( retDict['Value'] )
+        elif type( value ) == TupleType or type( value ) == ListType:
+          tupleValues = []
+          for v in list( value ):
+            retDict = self.__escapeString( v, connection )
+            if not retDict['OK']:
+              return retDict
+            tupleValues.append( retDict['Value'] )
+          inEscapeValues.append( '(' + ', '.join( tupleValues ) + ')' ) 
+        elif type( value ) == BooleanType:
+          inEscapeValues = [str( value )]
+        else:
+          retDict = self.__escapeString( str( value ), connection )
+          if not retDict['OK']:
+            return retDict
+          inEscapeValues.append( retDict['Value'] )
+    finally:
+      self.__releaseConnection()
     return S_OK( inEscapeValues )
 
 
@@ -595,12 +778,13 @@ class MySQL:
       return self._except( '_connect', x, 'Could not connect to DB.' )
 
 
-  def _query( self, cmd, conn = None, debug = False ):
+  def _query( self, cmd, conn = None, debug = False, args = None ):
     """
     execute MySQL query command
     return S_OK structure with fetchall result as tuple
     it returns an empty tuple if no matching rows are found
     return S_ERROR upon error
+    if args is given cmd is a parameterised statement and args are its values
     """
     if debug:
       self.logger.debug( '_query:', cmd )
@@ -620,7 +804,7 @@ class MySQL:
 
     try:
       cursor = connection.cursor()
-      if cursor.execute( cmd ):
+      if cursor.execute( cmd, args ):
         res = cursor.fetchall()
       else:
         res = ()
@@ -640,14 +824,17 @@ class MySQL:
           self.logger.verbose( '_query: %s ...' % str( res[:10] ) )
 
       retDict = S_OK( res )
+      broken = False
     except Exception , x:
       self.log.warn( '_query:', cmd )
       retDict = self._except( '_query', x, 'Execution failed.' )
+      broken = _isConnectionLost( x )
 
     try:
       cursor.close()
     except Exception:
       pass
+    self.__releaseConnection( broken )
 
     if gDebugFile:
       print >> gDebugFile, time.time() - start, cmd.replace( '\n', '' )
@@ -656,10 +843,57 @@ class MySQL:
     return retDict
 
 
-  def _update( self, cmd, conn = None, debug = False ):
+  def _queryIter( self, cmd, batchSize = 1000, args = None, debug = False ):
+    """
+    execute MySQL query command using a server side cursor
+    yield S_OK structures with tuples of up to batchSize rows until all the rows
+    have been read, or a S_ERROR upon error
+    The query uses its own connection so other queries can be done while iterating
+    """
+    if debug:
+      self.logger.debug( '_queryIter:', cmd )
+    else:
+      self.logger.verbose( '_queryIter:', cmd[:min( len( cmd ) , 512 )] )
+
+    if not self.__initialized:
+      yield S_ERROR( 'DB not properly initialized' )
+      return
+
+    retDict = self.__connectionPool.getStreamingConnection()
+    if not retDict['OK']:
+      yield retDict
+      return
+    connection = retDict[ 'Value' ]
+
+    cursor = None
+    complete = False
+    try:
+      try:
+        cursor = connection.cursor( MySQLdb.cursors.SSCursor )
+        cursor.execute( cmd, args )
+        rows = cursor.fetchmany( batchSize )
+        while rows:
+          yield S_OK( rows )
+          rows = cursor.fetchmany( batchSize )
+        complete = True
+      except Exception, x:
+        self.log.warn( '_queryIter:', cmd )
+        yield self._except( '_queryIter', x, 'Execution failed.' )
+    finally:
+      # A partially read server side cursor leaves the connection unusable
+      if complete:
+        try:
+          cursor.close()
+        except Exception:
+          complete = False
+      self.__connectionPool.releaseStreamingConnection( connection, reusable = complete )
+
+
+  def _update( self, cmd, conn = None, debug = False, args = None ):
     """ execute MySQL update command
         return S_OK with number of updated registers upon success
         return S_ERROR upon error
+        if args is given cmd is a parameterised statement and args are its values
     """
     if debug:
       self.logger.debug( '_update:', cmd )
@@ -672,14 +906,14 @@ class MySQL:
     if gDebugFile:
       start = time.time()
 
-    retDict = self.__getConnection( conn = conn )
+    retDict = self.__getConnection()
     if not retDict['OK']:
       return retDict
     connection = retDict['Value']
 
     try:
       cursor = connection.cursor()
-      res = cursor.execute( cmd )
+      res = cursor.execute( cmd, args )
       # connection.commit()
       if debug:
         self.log.debug( '_update:', res )
@@ -688,14 +922,17 @@ class MySQL:
       retDict = S_OK( res )
       if cursor.lastrowid:
         retDict[ 'lastRowId' ] = cursor.lastrowid
+      broken = False
     except Exception, x:
       self.log.warn( '_update: %s: %s' % ( cmd, str( x ) ) )
       retDict = self._except( '_update', x, 'Execution failed.' )
+      broken = _isConnectionLost( x )
 
     try:
       cursor.close()
     except Exception:
       pass
+    self.__releaseConnection( broken )
 
     if gDebugFile:
       print >> gDebugFile, time.time() - start, cmd.replace( '\n', '' )
@@ -715,29 +952,30 @@ class MySQL:
     if type( cmdList ) != ListType:
       return S_ERROR( "_transaction: wrong type (%s) for cmdList" % type( cmdList ) )
 
-    # # get connection
-    connection = conn
-    if not connection:
-      retDict = self.__getConnection()
-      if not retDict['OK']:
-        return retDict
-      connection = retDict[ 'Value' ]
+    # # get connection, the one passed is only kept for backward compatibility
+    retDict = self.__getConnection()
+    if not retDict['OK']:
+      return retDict
+    connection = retDict[ 'Value' ]
 
     # # list with cmds and their results
     cmdRet = []
     try:
-      cursor = connection.cursor()
-      for cmd in cmdList:
-        cmdRet.append( ( cmd, cursor.execute( cmd ) ) )
-      connection.commit()
-    except Exception, error:
-      self.logger.execption( error )
-      # # rollback, put back connection to the pool
-      connection.rollback()
-      return S_ERROR( error )
-    # # close cursor, put back connection to the pool
-    cursor.close()
-    return S_OK( cmdRet )
+      try:
+        cursor = connection.cursor()
+        for cmd in cmdList:
+          cmdRet.append( ( cmd, cursor.execute( cmd ) ) )
+        connection.commit()
+      except Exception, error:
+        self.logger.exception( error )
+        # # rollback, put back connection to the pool
+        connection.rollback()
+        return S_ERROR( error )
+      # # close cursor, put back connection to the pool
+      cursor.close()
+      return S_OK( cmdRet )
+    finally:
+      self.__releaseConnection()
 
   def _createViews( self, viewsDict, force = False ):
     """ create view based on query
@@ -985,19 +1223,22 @@ class MySQL:
 
   def _getConnection( self ):
     """
-    Return a new connection to the DB
-    It uses the private method __getConnection
+    Return a connection to the DB
+    Connections are checked out from the pool by each method, so the returned one
+    is only kept for backward compatibility with the methods taking a connection
+    argument and must not be used directly
     """
     self.log.debug( '_getConnection:' )
 
-    retDict = self.__getConnection( trial = 0 )
+    retDict = self.__getConnection()
+    if retDict['OK']:
+      self.__releaseConnection()
     return retDict
 
-  def __getConnection( self, conn = None, trial = 0 ):
+  def __getConnection( self ):
     """
-    Return a new connection to the DB,
-    Arguments are kept for backward compatibility
-    TODO: Remove ALL references to those arguments
+    Check out a connection from the pool for the current thread,
+    it has to be given back with __releaseConnection
     """
     self.log.debug( '__getConnection:' )
 
@@ -1006,7 +1247,17 @@ class MySQL:
       gLogger.error( error )
       return S_ERROR( error )
 
-    return self.__connectionPool.get( self.__dbName )
+    return self.__connectionPool.get()
+
+  def __releaseConnection( self, broken = False ):
+    self.__connectionPool.release( broken )
+
+  def getConnectionPoolStats( self ):
+    """
+    Gauges and counters of the connection pool of this DB: connections in use,
+    idle, threads waiting and the time they have spent waiting
+    """
+    return S_OK( self.__connectionPool.getStats() )
 
 ########################################################################################
 #
@@ -1015,13 +1266,13 @@ class MySQL:
 ########################################################################################
 
   def transactionStart( self ):
-    return self.__connectionPool.transactionStart( self.__dbName )
+    return self.__connectionPool.transactionStart()
 
   def transactionCommit( self ):
-    return self.__connectionPool.transactionCommit( self.__dbName )
+    return self.__connectionPool.transactionCommit()
 
   def transactionRollback( self ):
-    return self.__connectionPool.transactionRollback( self.__dbName )
+    return self.__connectionPool.transactionRollback()
 
   @property
   def transaction( self ):
@@ -1519,6 +1770,136 @@ class MySQL:
     return self._update( 'INSERT INTO %s %s VALUES %s' %
                          ( table, inFieldString, inValueString ), conn, debug = True )
 
+#############################################################################
+  def __getMaxStatementSize( self ):
+    """
+      Max size of a statement, from the max_allowed_packet of the server
+    """
+    if not self.__maxStatementSize:
+      maxPacket = 1048576
+      retDict = self._query( 'SELECT @@max_allowed_packet', debug = True )
+      if retDict['OK'] and retDict['Value']:
+        maxPacket = int( retDict['Value'][0][0] )
+      # Leave some room for the protocol overhead
+      self.__maxStatementSize = int( maxPacket * 0.9 )
+    return self.__maxStatementSize
+
+  def insertMany( self, tableName, inFields, rows, onDuplicate = None, conn = None ):
+    """
+      Insert the rows in "tableName" assigning the values of each row to the
+      fields "inFields". The rows are inserted with as few multi row statements
+      as allowed by max_allowed_packet, executed in the same transaction.
+      onDuplicate can be None (fail on duplicated keys), 'IGNORE' (skip them) or
+      a list of fields to update with the new values if the row already exists.
+      String type values will be appropriately escaped, None values are inserted as NULL.
+      return S_OK( number of affected rows ). For plain inserts 'lastRowIds' holds the
+      auto increment ids of the new rows, which are consecutive within a statement
+      as long as innodb_autoinc_lock_mode is not 2
+    """
+    table = _quotedList( [tableName] )
+    if not table:
+      error = 'Invalid tableName argument'
+      self.log.warn( 'insertMany:', error )
+      return S_ERROR( error )
+
+    inFieldString = _quotedList( inFields )
+    if inFieldString == None:
+      error = 'Invalid inFields arguments'
+      self.log.warn( 'insertMany:', error )
+      return S_ERROR( error )
+
+    if not rows:
+      return S_OK( 0 )
+
+    insertType = 'INSERT'
+    suffix = ''
+    if onDuplicate:
+      if type( onDuplicate ) in StringTypes and onDuplicate.upper() == 'IGNORE':
+        insertType = 'INSERT IGNORE'
+      elif type( onDuplicate ) in ( ListType, TupleType ) and _quotedList( onDuplicate ):
+        quotedFields = [ _quotedList( [ field ] ) for field in onDuplicate ]
+        suffix = ' ON DUPLICATE KEY UPDATE %s' % ', '.join( [ '%s=VALUES(%s)' % ( field, field )
+                                                              for field in quotedFields ] )
+      else:
+        error = 'Invalid onDuplicate argument'
+        self.log.warn( 'insertMany:', error )
+        return S_ERROR( error )
+
+    # Escape all the rows with the same connection
+    retDict = self.__getConnection()
+    if not retDict['OK']:
+      return retDict
+    connection = retDict['Value']
+    try:
+      nFields = len( inFields )
+      escapedRows = []
+      for row in rows:
+        if len( row ) != nFields:
+          return S_ERROR( 'Mismatch between inFields and row values' )
+        values = []
+        for value in row:
+          valueType = type( value )
+          if value is None:
+            values.append( 'NULL' )
+          elif valueType in ( IntType, LongType, BooleanType ):
+            values.append( str( value ) )
+          elif valueType == FloatType:
+            values.append( repr( value ) )
+          else:
+            retDict = self.__escapeString( value, connection )
+            if not retDict['OK']:
+              return retDict
+            values.append( retDict['Value'] )
+        escapedRows.append( '(%s)' % ', '.join( values ) )
+    finally:
+      self.__releaseConnection()
+
+    # Group the rows in statements
+    prefix = '%s INTO %s (%s) VALUES ' % ( insertType, table, inFieldString )
+    maxSize = self.__getMaxStatementSize() - len( prefix ) - len( suffix )
+    statements = []
+    chunk = []
+    chunkSize = 0
+    for escapedRow in escapedRows:
+      if chunk and chunkSize + len( escapedRow ) + 1 > maxSize:
+        statements.append( ( prefix + ','.join( chunk ) + suffix, len( chunk ) ) )
+        chunk = []
+        chunkSize = 0
+      chunk.append( escapedRow )
+      chunkSize += len( escapedRow ) + 1
+    statements.append( ( prefix + ','.join( chunk ) + suffix, len( chunk ) ) )
+
+    self.log.verbose( 'insertMany:', 'inserting %d rows into table %s with %d statements' %
+                      ( len( escapedRows ), table, len( statements ) ) )
+
+    ownTransaction = len( statements ) > 1 and not self.__connectionPool.inTransaction()
+    if ownTransaction:
+      retDict = self.transactionStart()
+      if not retDict['OK']:
+        return retDict
+
+    affected = 0
+    rowIds = []
+    for cmd, nRows in statements:
+      retDict = self._update( cmd, conn )
+      if not retDict['OK']:
+        if ownTransaction:
+          self.transactionRollback()
+        return retDict
+      affected += retDict['Value']
+      if insertType == 'INSERT' and not suffix and retDict.get( 'lastRowId' ):
+        rowIds.extend( range( retDict['lastRowId'], retDict['lastRowId'] + nRows ) )
+
+    if ownTransaction:
+      retDict = self.transactionCommit()
+      if not retDict['OK']:
+        return retDict
+
+    result = S_OK( affected )
+    if rowIds:
+      result['lastRowIds'] = rowIds
+    return result
+
 #####################################################################################
 #
 #   This is a test code for this class, it requires access to a MySQL DB
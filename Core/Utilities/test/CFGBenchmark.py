@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+########################################################################
+# $HeadURL $
+# File: CFGBenchmark.py
+########################################################################
+
+""" :mod: CFGBenchmark
+    ==================
+
+    .. module: CFGBenchmark
+    :synopsis: benchmark for CFG parsing, serialization and comparison
+
+    Builds a synthetic configuration with nSections sections shaped like a
+    production CS (sites, CEs, queues, users, groups), checks that the CFG
+    parser and serializer produce the same results as the previous line by line
+    implementation kept below as reference, and reports the time taken by
+    loadFromBuffer, serialize, mergeWith and getModifications. Fails if the
+    outputs differ or if the current implementation is slower than the reference.
+
+    Usage: CFGBenchmark.py [ nSections [ nIterations ] ]
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import re
+import sys
+import time
+## SUT
+from DIRAC.Core.Utilities.CFG import CFG
+
+def referenceLoadFromBuffer( data ):
+  """ previous char by char parser """
+  cfg = CFG()
+  commentRE = re.compile( "^\s*#" )
+  levelList = []
+  currentLevel = cfg
+  currentlyParsedString = ""
+  for line in data.split( "\n" ):
+    line = line.strip()
+    if len( line ) < 1:
+      continue
+    if commentRE.match( line ):
+      continue
+    for index in range( len( line ) ):
+      if line[ index ] == "{":
+        currentlyParsedString = currentlyParsedString.strip()
+        currentLevel.createNewSection( currentlyParsedString, "" )
+        levelList.append( currentLevel )
+        currentLevel = currentLevel[ currentlyParsedString ]
+        currentlyParsedString = ""
+      elif line[ index ] == "}":
+        currentLevel = levelList.pop()
+      elif line[ index ] == "=":
+        lFields = line.split( "=" )
+        currentLevel.setOption( lFields[0].strip(), "=".join( lFields[1:] ).strip(), "" )
+        currentlyParsedString = ""
+        break
+      elif line[ index: index + 2 ] == "+=":
+        valueList = line.split( "+=" )
+        currentLevel.appendToOption( valueList[0].strip(), ", %s" % "+=".join( valueList[1:] ).strip() )
+        currentlyParsedString = ""
+        break
+      else:
+        currentlyParsedString += line[ index ]
+  return cfg
+
+def referenceSerialize( cfg, tabLevelString = "" ):
+  """ previous recursive string concatenation """
+  cfgString = ""
+  for entryName in cfg.listAll():
+    for commentLine in [ line.strip() for line in cfg.getComment( entryName ).split( "\n" ) if line.strip() ]:
+      cfgString += "%s#%s\n" % ( tabLevelString, commentLine )
+    if entryName in cfg.listSections():
+      cfgString += "%s%s\n%s{\n" % ( tabLevelString, entryName, tabLevelString )
+      cfgString += referenceSerialize( cfg[ entryName ], "%s  " % tabLevelString )
+      cfgString += "%s}\n" % tabLevelString
+    else:
+      valueList = [ field.strip() for field in cfg[ entryName ].split( "," ) if field.strip() ]
+      if len( valueList ) == 0:
+        cfgString += "%s%s = \n" % ( tabLevelString, entryName )
+      else:
+        cfgString += "%s%s = %s\n" % ( tabLevelString, entryName, valueList[0] )
+        for value in valueList[1:]:
+          cfgString += "%s%s += %s\n" % ( tabLevelString, entryName, value )
+  return cfgString
+
+def generateConfiguration( nSections ):
+  """ CS like configuration with about nSections sections """
+  lines = [ "DIRAC", "{", "  Setup = Production", "  Configuration", "  {",
+            "    Version = 2013-01-01 00:00:00.000000", "    Name = Benchmark", "  }", "}",
+            "Resources", "{", "  Sites", "  {", "    LCG", "    {" ]
+  #Each site has a CEs section, 2 CEs and 2 queues per CE
+  nSites = max( 1, nSections * 3 / 4 / 8 )
+  for siteIndex in xrange( nSites ):
+    lines.extend( [ "      LCG.Site%05d.org" % siteIndex, "      {",
+                    "        Name = SITE%05d" % siteIndex,
+                    "        SE = SITE%05d-DISK, SITE%05d-TAPE" % ( siteIndex, siteIndex ),
+                    "        CE = ce1.site%05d.org, ce2.site%05d.org" % ( siteIndex, siteIndex ),
+                    "        CEs", "        {" ] )
+    for ceIndex in ( 1, 2 ):
+      lines.extend( [ "          ce%d.site%05d.org" % ( ceIndex, siteIndex ), "          {",
+                      "            CEType = CREAM", "            SubmissionMode = Direct",
+                      "            Queues", "            {" ] )
+      for queue in ( "long", "short" ):
+        lines.extend( [ "              cream-pbs-%s" % queue, "              {",
+                        "                maxCPUTime = 2880", "                SI00 = 2500",
+                        "                MaxTotalJobs = 1000", "                MaxWaitingJobs = 50",
+                        "              }" ] )
+      lines.extend( [ "            }", "          }" ] )
+    lines.extend( [ "        }", "      }" ] )
+  lines.extend( [ "    }", "  }", "}", "Registry", "{", "  Users", "  {" ] )
+  for userIndex in xrange( max( 1, nSections / 4 ) ):
+    lines.extend( [ "    user%05d" % userIndex, "    {",
+                    "      DN = /DC=org/DC=example/OU=People/CN=user%05d" % userIndex,
+                    "      Email = user%05d@example.org" % userIndex,
+                    "      Groups = user", "      Groups += production, lhcb_user",
+                    "    }" ] )
+  lines.extend( [ "  }", "}" ] )
+  return "\n".join( lines ) + "\n"
+
+def modifyConfiguration( cfg ):
+  """ copy of cfg with some options changed, added and removed """
+  newCfg = cfg.clone()
+  newCfg.setOption( "/DIRAC/Configuration/Version", "2013-01-02 00:00:00.000000" )
+  users = newCfg.getAsDict( "/Registry/Users" ).keys()
+  for user in users[ :10 ]:
+    newCfg.setOption( "/Registry/Users/%s/Email" % user, "%s@example.com" % user )
+  for user in users[ 10:20 ]:
+    newCfg.deleteKey( "/Registry/Users/%s" % user )
+  newCfg.createNewSection( "/Registry/Users/newuser" )
+  newCfg.setOption( "/Registry/Users/newuser/DN", "/DC=org/DC=example/OU=People/CN=newuser" )
+  return newCfg
+
+def timeIt( func, args, nIterations ):
+  """ average time in seconds of func( *args ) """
+  start = time.time()
+  for _i in xrange( nIterations ):
+    func( *args )
+  return ( time.time() - start ) / nIterations
+
+def benchmark( nSections, nIterations ):
+  """ compare current and reference implementations, returns False on any difference or slowdown """
+  data = generateConfiguration( nSections )
+  print "Configuration: %.2f MiB" % ( len( data ) / 1048576.0 )
+  cfg = CFG().loadFromBuffer( data )
+  refCfg = referenceLoadFromBuffer( data )
+  allOK = True
+  serialized = cfg.serialize()
+  if not cfg == refCfg or serialized != referenceSerialize( refCfg ):
+    print "Parsed configurations differ!"
+    allOK = False
+  if CFG().loadFromBuffer( serialized ).serialize() != serialized:
+    print "Serialization round trip failed!"
+    allOK = False
+  newCfg = modifyConfiguration( cfg )
+  modList = cfg.getModifications( newCfg )
+  patchedCfg = cfg.clone()
+  patchedCfg.applyModifications( modList )
+  if patchedCfg.serialize() != newCfg.serialize():
+    print "getModifications/applyModifications round trip failed!"
+    allOK = False
+  for name, current, reference in ( ( "loadFromBuffer", ( CFG().loadFromBuffer, ( data, ) ),
+                                                        ( referenceLoadFromBuffer, ( data, ) ) ),
+                                    ( "serialize", ( cfg.serialize, () ),
+                                                   ( referenceSerialize, ( cfg, ) ) ),
+                                    ( "mergeWith", ( cfg.mergeWith, ( newCfg, ) ), None ),
+                                    ( "getModifications", ( cfg.getModifications, ( newCfg, ) ), None ) ):
+    elapsed = timeIt( current[0], current[1], nIterations )
+    if not reference:
+      print "  %17s %8.4f s" % ( name, elapsed )
+      continue
+    refElapsed = timeIt( reference[0], reference[1], nIterations )
+    print "  %17s %8.4f s reference %8.4f s speedup x%.1f" % ( name, elapsed, refElapsed,
+                                                               refElapsed / max( elapsed, 0.000001 ) )
+    if elapsed > refElapsed:
+      print "%s is slower than the reference implementation!" % name
+      allOK = False
+  return allOK
+
+if __name__ == "__main__":
+  nSections = 10000
+  nIterations = 3
+  if len( sys.argv ) > 1:
+    nSections = int( sys.argv[1] )
+  if len( sys.argv ) > 2:
+    nIterations = int( sys.argv[2] )
+  sys.exit( not benchmark( nSections, nIterations ) )
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+########################################################################
+# $HeadURL $
+# File: DEncodeBenchmark.py
+########################################################################
+
+""" :mod: DEncodeBenchmark
+    ======================
+
+    .. module: DEncodeBenchmark
+    :synopsis: throughput benchmark for DEncode
+
+    Round trips representative payloads (job attributes, replicas, accounting
+    bundles) through DEncode, checks that the fast encoder produces the same
+    output as the generic one and reports the throughput of each codec path.
+
+    Usage: DEncodeBenchmark.py [ nEntries [ nIterations ] ]
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import sys
+import time
+import datetime
+## SUT
+from DIRAC.Core.Utilities import DEncode
+
+def jobAttributesPayload( nJobs ):
+  """ JobMonitoring-like getJobsAttributes reply """
+  now = datetime.datetime.utcnow()
+  jobs = {}
+  for jobID in xrange( nJobs ):
+    jobs[ jobID ] = { 'JobID' : str( jobID ), 'Status' : 'Running', 'MinorStatus' : 'Application',
+                      'Site' : 'LCG.CERN.ch', 'Owner' : 'someuser', 'OwnerGroup' : 'vo_user',
+                      'SubmissionTime' : now, 'LastUpdateTime' : now,
+                      'RescheduleCounter' : 0, 'VerifiedFlag' : True, 'CPUTime' : 1234.5 }
+  return { 'OK' : True, 'Value' : jobs }
+
+def replicasPayload( nFiles ):
+  """ FileCatalog getReplicas reply """
+  successful = {}
+  for index in xrange( nFiles ):
+    lfn = "/vo/data/2013/RAW/%08d.raw" % index
+    successful[ lfn ] = dict( [ ( "SE-%s" % se, "srm://se%s.example.org:8443/srm/v2?SFN=%s" % ( se, lfn ) )
+                                for se in range( 3 ) ] )
+  return { 'OK' : True, 'Value' : { 'Successful' : successful, 'Failed' : {} } }
+
+def accountingPayload( nRecords ):
+  """ DataStore commitRegisters bundle """
+  now = datetime.datetime.utcnow()
+  records = []
+  for index in xrange( nRecords ):
+    records.append( ( 'DataOperation', now, now,
+                      [ 'user', 'putAndRegister', 'Site', 'CERN-USER', 'Succeeded', 'CERN-DST', 'CERN-USER',
+                        long( index ), 10L ** 12, 1.5, 2.5, index % 2 == 0 ] ) )
+  return ( 'commitRegisters', ( records, ) )
+
+def benchmark( name, payload, nIterations ):
+  """ time encode/decode of payload, returns False if the codec paths differ """
+  data = DEncode.encodeGeneric( payload )
+  if DEncode.encode( payload ) != data:
+    print "%s: fast and generic encoding differ!" % name
+    return False
+  if DEncode.decodeStream( [ data ] )[0] != DEncode.decode( data )[0] or DEncode.decode( data )[0] != payload:
+    print "%s: round trip failed!" % name
+    return False
+  mbytes = len( data ) / 1048576.0
+  print "%s: %.2f MiB encoded" % ( name, mbytes )
+  for fName, func, arg in ( ( "encodeGeneric", DEncode.encodeGeneric, payload ),
+                            ( "encode", DEncode.encode, payload ),
+                            ( "decode", DEncode.decode, data ),
+                            ( "decodeStream", DEncode.decodeStream, [ data[ i : i + 16384 ]
+                                                                      for i in range( 0, len( data ), 16384 ) ] ) ):
+    start = time.time()
+    for _i in xrange( nIterations ):
+      func( arg )
+    elapsed = ( time.time() - start ) / nIterations
+    print "  %15s %8.4f s %8.2f MiB/s" % ( fName, elapsed, mbytes / max( elapsed, 0.000001 ) )
+  return True
+
+if __name__ == "__main__":
+  nEntries = 20000
+  nIterations = 5
+  if len( sys.argv ) > 1:
+    nEntries = int( sys.argv[1] )
+  if len( sys.argv ) > 2:
+    nIterations = int( sys.argv[2] )
+  allOK = True
+  for pName, pFunc in ( ( "Job attributes", jobAttributesPayload ),
+                        ( "Replicas", replicasPayload ),
+                        ( "Accounting bundle", accountingPayload ) ):
+    allOK = benchmark( pName, pFunc( nEntries ), nIterations ) and allOK
+  sys.exit( not allOK )
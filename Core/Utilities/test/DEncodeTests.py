@@ -0,0 +1,79 @@
+########################################################################
+# $HeadURL $
+# File: DEncodeTests.py
+########################################################################
+
+""" :mod: DEncodeTests
+    ==================
+
+    .. module: DEncodeTests
+    :synopsis: test cases for DEncode
+
+    test cases for DEncode
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import datetime
+import unittest
+## SUT
+from DIRAC.Core.Utilities import DEncode
+
+########################################################################
+class DEncodeTestCase( unittest.TestCase ):
+  """
+  .. class:: DEncodeTestCase
+
+  """
+  def setUp( self ):
+    """ test setup """
+    replicas = {}
+    for i in range( 500 ):
+      replicas[ "/vo/data/file_%s" % i ] = dict( [ ( "SE-%s" % j, "srm://se%s/vo/data/file_%s" % ( j, i ) )
+                                                   for j in range( 3 ) ] )
+    self.objects = [ 1, -2, 3L, 1.5, 2.0 * 10 ** 20, 2.0 * 10 ** -10, True, False, None, "", "abc", u"\xe9t\xe9",
+                     [], (), {}, datetime.datetime.utcnow(), datetime.date.today(), datetime.time( 12, 3, 4 ),
+                     { 2 : "3", True : ( 3, None ), "list" : [ 1, [ 2, ( 3, { "a" : "b" } ) ] ] },
+                     { "OK" : True, "Value" : { "Successful" : replicas, "Failed" : {} } } ]
+
+  def test01StreamDecoder( self ):
+    """ incremental decoding with different chunk sizes """
+    for obj in self.objects:
+      data = DEncode.encode( obj )
+      for chunkSize in ( 1, 2, 7, 1024, len( data ) ):
+        decoder = DEncode.StreamDecoder()
+        for index in range( 0, len( data ), chunkSize ):
+          decoder.feed( data[ index : index + chunkSize ] )
+        decoder.feed( "", eof = True )
+        self.assertEqual( decoder.isComplete(), True )
+        self.assertEqual( decoder.getObject(), DEncode.decode( data )[0] )
+        self.assertEqual( decoder.getConsumedBytes(), len( data ) )
+
+  def test02DecodeStream( self ):
+    """ decodeStream and trailing data """
+    data = DEncode.encode( self.objects[-1] )
+    decoder = DEncode.StreamDecoder()
+    self.assertEqual( decoder.feed( data + "i1e" ), True )
+    self.assertEqual( decoder.getPendingData(), "i1e" )
+    self.assertEqual( DEncode.decodeStream( [ data[:10], data[10:] ] ), DEncode.decode( data ) )
+
+  def test03Errors( self ):
+    """ broken data """
+    decoder = DEncode.StreamDecoder()
+    self.assertRaises( Exception, decoder.feed, "lx" )
+    decoder = DEncode.StreamDecoder()
+    decoder.feed( "l" )
+    self.assertEqual( decoder.isComplete(), False )
+    self.assertRaises( Exception, decoder.getObject )
+
+  def test04FastEncoding( self ):
+    """ fast encoding is byte identical to the generic one """
+    for obj in self.objects + [ [ 10L ** 30, -1.25e-7, ( u"\xfc", ( datetime.datetime.utcnow(), ) ) ],
+                                { 1.5 : [ { None : False } ], ( 1, 2 ) : { 3L : "x" } } ]:
+      self.assertEqual( DEncode.encode( obj ), DEncode.encodeGeneric( obj ) )
+      self.assertEqual( DEncode.decode( DEncode.encode( obj ) )[0], obj )
+
+if __name__ == "__main__":
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( DEncodeTestCase )
+  unittest.TextTestRunner( verbosity = 3 ).run( suite )
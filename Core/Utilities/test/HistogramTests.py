@@ -0,0 +1,72 @@
+########################################################################
+# $HeadURL $
+# File: HistogramTests.py
+########################################################################
+
+""" :mod: HistogramTests
+    ====================
+
+    .. module: HistogramTests
+    :synopsis: test cases for Histogram
+
+    test cases for Histogram
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import random
+import unittest
+## SUT
+from DIRAC.Core.Utilities.Histogram import Histogram
+
+########################################################################
+class HistogramTestCase( unittest.TestCase ):
+  """
+  .. class:: HistogramTestCase
+
+  """
+  def test01Buckets( self ):
+    """ every value falls in a bucket covering it """
+    histo = Histogram()
+    for value in range( 0, 5000 ) + [ 10 ** 6, 2 ** 40 + 3 ]:
+      histo.add( value )
+    previousHigh = -1
+    for low, high, count in histo.getBuckets():
+      self.assert_( low > previousHigh )
+      self.assert_( low <= high )
+      self.assert_( high - low <= max( 1, low / 8 ) )
+      previousHigh = high
+    self.assertEqual( histo.getCount(), 5002 )
+    self.assertEqual( sum( [ count for low, high, count in histo.getBuckets() ] ), 5002 )
+
+  def test02Percentiles( self ):
+    """ percentiles within the relative error """
+    histo = Histogram()
+    values = [ random.randint( 1, 10 ** 6 ) for _i in range( 10000 ) ]
+    for value in values:
+      histo.add( value )
+    values.sort()
+    for percentile in ( 50, 90, 99 ):
+      exact = values[ int( percentile / 100.0 * len( values ) ) - 1 ]
+      self.assert_( abs( histo.getPercentile( percentile ) - exact ) <= exact * 0.13 )
+    self.assertEqual( histo.getPercentile( 100 ), values[-1] )
+    summary = histo.getSummary()
+    self.assertEqual( summary[ 'min' ], values[0] )
+    self.assertEqual( summary[ 'max' ], values[-1] )
+
+  def test03Merge( self ):
+    """ merging histograms """
+    histoA = Histogram()
+    histoB = Histogram()
+    for value in range( 100 ):
+      histoA.add( value )
+      histoB.add( value * 1000 )
+    histoA.merge( histoB )
+    self.assertEqual( histoA.getCount(), 200 )
+    self.assertEqual( histoA.getSummary()[ 'max' ], 99000 )
+    self.assertEqual( Histogram().getPercentile( 50 ), 0 )
+
+if __name__ == "__main__":
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( HistogramTestCase )
+  unittest.TextTestRunner( verbosity = 3 ).run( suite )
@@ -30,6 +30,7 @@ from DIRAC.Core.Utilities.File import makeGuid, getSize
 from DIRAC.Core.Utilities.List import randomize
 from DIRAC.Core.Utilities.SiteSEMapping import getSEsForSite, isSameSiteSE, getSEsForCountry
 from DIRAC.Resources.Catalog.FileCatalog import FileCatalog
+from DIRAC.Resources.Catalog.FileCatalogClient import FileCatalogClient
 from DIRAC.Resources.Storage.StorageElement import StorageElement
 from DIRAC.Resources.Storage.StorageFactory import StorageFactory
 from DIRAC.ResourceStatusSystem.Client.ResourceStatus import ResourceStatus
@@ -208,14 +209,41 @@ class DataManager( object ):
       directories = [directory]
     else:
       directories = directory
-    res = self.__getCatalogDirectoryContents( directories )
-    if not res['OK']:
-      return res
+    self.log.debug( 'Obtaining the replicas for %d directories:' % len( directories ) )
+    activeDirs = list( directories )
     allReplicas = {}
-    for lfn, metadata in res['Value'].items():
-      allReplicas[lfn] = metadata['Replicas']
+    while activeDirs:
+      currentDir = activeDirs.pop( 0 )
+      for res in self.__iterDirectoryReplicas( currentDir ):
+        if not res['OK']:
+          self.log.debug( "Problem getting the %s directory replicas" % currentDir, res['Message'] )
+          break
+        activeDirs.extend( res['Value']['SubDirs'] )
+        allReplicas.update( res['Value']['Files'] )
+    self.log.debug( "Found %d files" % len( allReplicas ) )
     return S_OK( allReplicas )
 
+  def __iterDirectoryReplicas( self, directory ):
+    """ yield S_OK( { 'Files' : { lfn : { SE : PFN } }, 'SubDirs' : [ path ] } ) pages for :directory:,
+        fetched page by page from the DFC when it is the read catalog
+
+    :param self: self reference
+    :param str directory: folder name
+    """
+    for _catalogName, oCatalog, _master in self.fc.getReadCatalogs():
+      if isinstance( oCatalog, FileCatalogClient ):
+        for res in oCatalog.getDirectoryReplicasIter( directory ):
+          yield res
+        return
+      break
+    res = returnSingleResult( self.fc.listDirectory( directory, verbose = True ) )
+    if not res['OK']:
+      yield res
+      return
+    yield S_OK( { 'Files' : dict( [ ( lfn, metadata.get( 'Replicas', {} ) )
+                                    for lfn, metadata in res['Value']['Files'].items() ] ),
+                  'SubDirs' : res['Value']['SubDirs'].keys() } )
+
   def getFilesFromDirectory( self, directory, days = 0, wildcard = '*' ):
     """ get all files from :directory: older than :days: days matching to :wildcard:
 
@@ -10,7 +10,7 @@ import os.path
 import time
 import sys
 from types  import DictType, ListType
-from DIRAC  import gConfig
+from DIRAC  import gConfig, S_OK, S_ERROR
 from DIRAC.Core.Security import CS
 from DIRAC.Core.Security.ProxyInfo import getProxyInfo
 from DIRAC.Core.Utilities.List import uniqueElements
@@ -1313,54 +1313,75 @@ File Catalog Client $Revision: 1.17 $Date:
     
     # Get directory contents now
     try:
-      result =  self.fc.listDirectory(path,_long)                   
       dList = DirectoryListing()
-      if result['OK']:
-        if result['Value']['Successful']:
-          for entry in result['Value']['Successful'][path]['Files']:
-            fname = entry.split('/')[-1]
-            # print entry, fname
-            # fname = entry.replace(self.cwd,'').replace('/','')
-            if _long:
-              fileDict = result['Value']['Successful'][path]['Files'][entry]['MetaData']
-              repDict = result['Value']['Successful'][path]['Files'][entry].get( "Replicas", {} )
-              if fileDict:
-                dList.addFile(fname,fileDict,repDict,numericid)
-            else:  
-              dList.addSimpleFile(fname)
-          for entry in result['Value']['Successful'][path]['SubDirs']:
-            dname = entry.split('/')[-1]
-            # print entry, dname
-            # dname = entry.replace(self.cwd,'').replace('/','')  
+      for result in self.__listDirectoryPages(path,_long):
+        if not result['OK']:
+          print "Error:",result['Message']
+          return
+        pathDict = result['Value']
+        for entry in pathDict['Files']:
+          fname = entry.split('/')[-1]
+          # print entry, fname
+          # fname = entry.replace(self.cwd,'').replace('/','')
+          if _long:
+            fileDict = pathDict['Files'][entry]['MetaData']
+            repDict = pathDict['Files'][entry].get( "Replicas", {} )
+            if fileDict:
+              dList.addFile(fname,fileDict,repDict,numericid)
+          else:  
+            dList.addSimpleFile(fname)
+        for entry in pathDict['SubDirs']:
+          dname = entry.split('/')[-1]
+          # print entry, dname
+          # dname = entry.replace(self.cwd,'').replace('/','')  
+          if _long:
+            dirDict = pathDict['SubDirs'][entry]
+            if dirDict:
+              dList.addDirectory(dname,dirDict,numericid)
+          else:    
+            dList.addSimpleFile(dname)
+          
+        for entry in pathDict['Links']:
+          pass
+          
+        if 'Datasets' in pathDict:
+          for entry in pathDict['Datasets']:
+            dname = os.path.basename( entry )    
             if _long:
-              dirDict = result['Value']['Successful'][path]['SubDirs'][entry]
-              if dirDict:
-                dList.addDirectory(dname,dirDict,numericid)
+              dsDict = pathDict['Datasets'][entry]['Metadata']  
+              if dsDict:
+                dList.addDataset(dname,dsDict,numericid)
             else:    
               dList.addSimpleFile(dname)
-          
-          for entry in result['Value']['Successful'][path]['Links']:
-            pass
-          
-          if 'Datasets' in result['Value']['Successful'][path]:
-            for entry in result['Value']['Successful'][path]['Datasets']:
-              dname = os.path.basename( entry )    
-              if _long:
-                dsDict = result['Value']['Successful'][path]['Datasets'][entry]['Metadata']  
-                if dsDict:
-                  dList.addDataset(dname,dsDict,numericid)
-              else:    
-                dList.addSimpleFile(dname)
               
-          if _long:
-            dList.printListing(reverse,timeorder)      
-          else:
-            dList.printOrdered()
+      if _long:
+        dList.printListing(reverse,timeorder)      
       else:
-        print "Error:",result['Message']
+        dList.printOrdered()
     except Exception, x:
       print "Error:", str(x)
 
+  def __listDirectoryPages(self,path,verbose):
+    """ Yield the directory contents page by page when the catalog supports it,
+        as a single page otherwise or if the first page can not be obtained
+    """
+    if hasattr( self.fc, 'listDirectoryIter' ):
+      firstPage = True
+      for result in self.fc.listDirectoryIter(path,verbose):
+        if firstPage and not result['OK']:
+          break
+        firstPage = False
+        yield result
+      if not firstPage:
+        return
+    result = self.fc.listDirectory(path,verbose)
+    if not result['OK']:
+      yield result
+    elif path in result['Value']['Successful']:
+      yield S_OK( result['Value']['Successful'][path] )
+    elif path in result['Value']['Failed']:
+      yield S_ERROR( result['Value']['Failed'][path] )
+
   def complete_ls(self, text, line, begidx, endidx):
     result = []
     args = line.split()
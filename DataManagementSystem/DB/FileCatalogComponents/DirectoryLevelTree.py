@@ -51,6 +51,11 @@ class DirectoryLevelTree(DirectoryTreeBase):
     """
     
     dpath = os.path.normpath( path )    
+    cached = self.pathCache.get( dpath )
+    if cached:
+      res = S_OK( cached[0] )
+      res['Level'] = cached[1]
+      return res
     req = "SELECT DirID,Level from FC_DirectoryLevelTree WHERE DirName='%s'" % dpath
     result = self.db._query(req,connection)
     if not result['OK']:
@@ -59,21 +64,35 @@ class DirectoryLevelTree(DirectoryTreeBase):
     if not result['Value']:
       return S_OK('')
     
-    res = S_OK(result['Value'][0][0])  
-    res['Level'] = result['Value'][0][1]
+    dirID, level = result['Value'][0]
+    self._cacheDirectory( dpath, dirID, level )
+    res = S_OK( dirID )
+    res['Level'] = level
     return res
   
   def findDirs( self, paths, connection=False ):
     """ Find DirIDs for the given path list
     """
-    dpaths = ','.join( [ "'"+os.path.normpath( path )+"'" for path in paths ] )
-    req = "SELECT DirName,DirID from FC_DirectoryLevelTree WHERE DirName in (%s)" % dpaths
+    dirDict = {}
+    missing = []
+    for path in paths:
+      dpath = os.path.normpath( path )
+      cached = self.pathCache.get( dpath )
+      if cached:
+        dirDict[dpath] = cached[0]
+      else:
+        missing.append( dpath )
+    if not missing:
+      return S_OK( dirDict )
+
+    dpaths = ','.join( [ "'"+dpath+"'" for dpath in missing ] )
+    req = "SELECT DirName,DirID,Level from FC_DirectoryLevelTree WHERE DirName in (%s)" % dpaths
     result = self.db._query(req,connection)
     if not result['OK']:
       return result
-    dirDict = {}
-    for dirName, dirID in result['Value']:
+    for dirName, dirID, level in result['Value']:
       dirDict[dirName] = dirID
+      self._cacheDirectory( dirName, dirID, level )
 
     return S_OK( dirDict )
   
@@ -81,7 +100,7 @@ class DirectoryLevelTree(DirectoryTreeBase):
     """ Remove directory
     """
 
-    result = self.findDir(path)
+    result = self.findDirForUpdate(path)
     if not result['OK']:
       return result   
     if not result['Value']:
@@ -92,12 +111,18 @@ class DirectoryLevelTree(DirectoryTreeBase):
     dirID = result['Value']
     req = "DELETE FROM FC_DirectoryLevelTree WHERE DirID=%d" % dirID
     result = self.db._update(req)
+    self._uncacheDirectory( os.path.normpath( path ), dirID )
     result['DirID'] = dirID
     return result
 
   def __getNumericPath(self,dirID,connection=False):
     """ Get the enumerated path of the given directory
     """
+    cached = self.levelCache.get( dirID )
+    if cached:
+      result = S_OK( list( cached[1] ) )
+      result['Level'] = cached[0]
+      return result
     epathString = ','.join( [ 'LPATH%d' % (i+1) for i in range( MAX_LEVELS ) ] )
     req = 'SELECT LEVEL,%s FROM FC_DirectoryLevelTree WHERE DirID=%d' % (epathString,dirID)
     result = self.db._query(req,connection)
@@ -111,6 +136,9 @@ class DirectoryLevelTree(DirectoryTreeBase):
     epathList = []
     for i in range(level):
       epathList.append(row[i+1])
+    # A new directory gets its last LPATH once inserted, do not keep it before
+    if not level or epathList[-1]:
+      self.levelCache.add( dirID, ( level, tuple( epathList ) ) )
       
     result = S_OK(epathList)
     result['Level'] = level   
@@ -119,7 +147,7 @@ class DirectoryLevelTree(DirectoryTreeBase):
   def makeDir(self,path):
     """ Create a new directory entry
     """      
-    result = self.findDir(path)
+    result = self.findDirForUpdate(path)
     if not result['OK']:
       return result
     dirID = result['Value']
@@ -140,7 +168,7 @@ class DirectoryLevelTree(DirectoryTreeBase):
       level = len(elements)
       if level > MAX_LEVELS:
         return S_ERROR('Too many directory levels: %d' % level)
-      result = self.getParent(path)
+      result = self.findDirForUpdate(os.path.dirname(path))
       if not result['OK']:
         return result
       parentDirID = result['Value']
@@ -159,15 +187,13 @@ class DirectoryLevelTree(DirectoryTreeBase):
         names.append('LPATH%d' % i) 
         values.append(epathList[i-1])
       
-    result = self.db._getConnection()
-    conn = result['Value']  
     #result = self.db._query("LOCK TABLES FC_DirectoryLevelTree WRITE; ",conn)
-    result = self.db._insert('FC_DirectoryLevelTree',names,values,conn)    
+    result = self.db._insert('FC_DirectoryLevelTree',names,values)    
     if not result['OK']:
       #resUnlock = self.db._query("UNLOCK TABLES;",conn)      
       if result['Message'].find('Duplicate') != -1:
         #The directory is already added
-        resFind = self.findDir(path)
+        resFind = self.findDirForUpdate(path)
         if not resFind['OK']:
           return resFind
         dirID = resFind['Value']
@@ -180,24 +206,23 @@ class DirectoryLevelTree(DirectoryTreeBase):
     
     # Update the path number
     if parentDirID:
-#       lPath = "LPATH%d" % (level)
-#       req = " SELECT @tmpvar:=max(%s)+1 FROM FC_DirectoryLevelTree WHERE Parent=%d; " % (lPath,parentDirID)
-#       resultLock = self.db._query("LOCK TABLES FC_DirectoryLevelTree WRITE; ",conn)
-#       result = self.db._query(req,conn)
-#       req = "UPDATE FC_DirectoryLevelTree SET %s=@tmpvar WHERE DirID=%d; " % (lPath,dirID)
-#       result = self.db._update(req,conn)
-#       result = self.db._query("UNLOCK TABLES;",conn)
+      # The transaction keeps the lock and @tmpvar on the same connection
       lPath = "LPATH%d" % (level)
+      result = self.db.transactionStart()
+      if not result['OK']:
+        return result
       req = " SELECT @tmpvar:=max(%s)+1 FROM FC_DirectoryLevelTree WHERE Parent=%d FOR UPDATE; " % ( lPath, parentDirID )
-      resultLock = self.db._query( "START TRANSACTION; ", conn )
-      result = self.db._query(req,conn)
-      req = "UPDATE FC_DirectoryLevelTree SET %s=@tmpvar WHERE DirID=%d; " % (lPath,dirID)   
-      result = self.db._update(req,conn)
-      result = self.db._query( "COMMIT;", conn )
+      result = self.db._query( req )
+      if result['OK']:
+        req = "UPDATE FC_DirectoryLevelTree SET %s=@tmpvar WHERE DirID=%d; " % (lPath,dirID)   
+        result = self.db._update( req )
+      if result['OK']:
+        result = self.db.transactionCommit()
+      else:
+        self.db.transactionRollback()
+      self.levelCache.delete( dirID )
       if not result['OK']:
         return result
-    else:
-      result = self.db._query( "ROLLBACK;", conn )
       
     result = S_OK(dirID)
     result['NewDirectory'] = True
@@ -248,6 +273,9 @@ class DirectoryLevelTree(DirectoryTreeBase):
   def getDirectoryPath(self,dirID):
     """ Get directory name by directory ID
     """
+    dirPath = self.idCache.get( int(dirID) )
+    if dirPath:
+      return S_OK( dirPath )
     req = "SELECT DirName FROM FC_DirectoryLevelTree WHERE DirID=%d" % int(dirID)
     result = self.db._query(req)
     if not result['OK']:
@@ -255,6 +283,7 @@ class DirectoryLevelTree(DirectoryTreeBase):
     if not result['Value']:
       return S_ERROR('Directory with id %d not found' % int(dirID) )
     
+    self.idCache.add( int(dirID), result['Value'][0][0] )
     return S_OK(result['Value'][0][0])
 
   def getDirectoryPaths(self,dirIDList):
@@ -263,19 +292,30 @@ class DirectoryLevelTree(DirectoryTreeBase):
     dirs = dirIDList
     if type(dirIDList) != ListType:
       dirs = [dirIDList]
+
+    resultDict = {}
+    missing = []
+    for dir_ in dirs:
+      dirPath = self.idCache.get( int(dir_) )
+      if dirPath:
+        resultDict[int(dir_)] = dirPath
+      else:
+        missing.append( dir_ )
+    if not missing:
+      return S_OK(resultDict)
       
-    dirListString = ','.join( [ str(dir_) for dir_ in dirs ] )
+    dirListString = ','.join( [ str(dir_) for dir_ in missing ] )
 
     req = "SELECT DirID,DirName FROM FC_DirectoryLevelTree WHERE DirID in ( %s )" % dirListString
     result = self.db._query(req)
     if not result['OK']:
       return result
-    if not result['Value']:
+    if not result['Value'] and not resultDict:
       return S_ERROR('Directories not found: %s' % dirListString )
 
-    resultDict = {}
     for row in result['Value']:
       resultDict[int(row[0])] = row[1]
+      self.idCache.add( int(row[0]), row[1] )
 
     return S_OK(resultDict) 
  
@@ -329,9 +369,14 @@ class DirectoryLevelTree(DirectoryTreeBase):
     """ Get IDs of all the directories in the parent hierarchy for a directory
         specified by its ID
     """    
+    cached = self.ancestorCache.get( dirID )
+    if cached:
+      return S_OK( list( cached ) )
     result = self.__getNumericPath( dirID )
     if not result['OK']:
       return result
+    if not 'Level' in result:
+      return S_ERROR( 'Directory with ID %d not found' % dirID )
     level = result['Level']
     if level == 0:
       return S_OK( [dirID] )
@@ -349,7 +394,11 @@ class DirectoryLevelTree(DirectoryTreeBase):
     if not result['Value']:
       return S_ERROR( 'No result for the path of Directory with ID %d' % dirID )
 
-    return S_OK([ x[1] for x in result['Value'] ] + [dirID] )
+    pathIDs = [ x[1] for x in result['Value'] ] + [dirID]
+    # The ancestors of a directory do not change even when the LPATHs are renumbered
+    if len( pathIDs ) == level + 1:
+      self.ancestorCache.add( dirID, tuple( pathIDs ) )
+    return S_OK( pathIDs )
     
   def getChildren(self,path,connection=False):
     """ Get child directory IDs for the given directory 
@@ -523,14 +572,21 @@ class DirectoryLevelTree(DirectoryTreeBase):
       if not result['OK']:
         continue
 
-      connection = self._getConnection()
-      result = self.db._query("LOCK TABLES FC_DirectoryLevelTree WRITE", connection )
+      # The transaction pins one connection to this thread, so the table lock
+      # is taken, used and released on the same session
+      result = self.db.transactionStart()
+      if not result['OK']:
+        return result
+      result = self.db._query( "LOCK TABLES FC_DirectoryLevelTree WRITE" )
       if not result['OK']:
-        self.db._query("UNLOCK TABLES", connection )
+        self.db.transactionRollback()
         return result
-      result = self.__rebuildLevelIndexes( parentID, connection)
-      self.db._query("UNLOCK TABLES", connection )       
+      result = self.__rebuildLevelIndexes( parentID )
+      self.db._query( "UNLOCK TABLES" )
+      self.db.transactionCommit()
       
+    # Directory IDs and level indexes may have changed
+    self._clearCache()
     return S_OK()
 
   def _getConnection( self, connection=False ):
@@ -3,11 +3,20 @@
 ########################################################################
 
 """ DIRAC FileCatalog mix-in class to manage directory metadata
+
+    Besides the FC_Meta_<name> tables holding the values set on directories,
+    each indexed metadata has a FC_MetaIdx_<name> table with the inheritance
+    resolved: one ( DirID, Value, SrcDirID ) row for every directory getting
+    the value set on SrcDirID. They are kept up to date when setting or removing
+    metadata and creating or removing directories, so metadata queries are
+    resolved with a single joined query. An index is only used once marked
+    Ready in FC_MetaIndexes: missing ones are built in the background by a
+    single builder, the queries using the metadata tables in the meantime.
 """
 
 __RCSID__ = "$Id$"
 
-import os, types
+import os, types, socket, time, threading
 from DIRAC import S_OK, S_ERROR, gLogger
 from DIRAC.DataManagementSystem.DB.FileCatalogComponents.Utilities import queryTime
 
@@ -42,6 +51,19 @@ class DirectoryMetadata:
                                        },
                              "Indexes": { "MetaSetID": ["MetaSetID"] }
                            }
+  _tables["FC_MetaIndexes"] = { "Fields": {
+                                           "MetaName": "VARCHAR(64) CHARACTER SET latin1 COLLATE latin1_bin NOT NULL",
+                                           "Status": "VARCHAR(16) NOT NULL DEFAULT 'Building'",
+                                           "Builder": "VARCHAR(128) NOT NULL DEFAULT ''",
+                                           "UpdateTime": "DATETIME"
+                                          },
+                                "PrimaryKey": "MetaName"
+                              }
+
+  # A builder not giving news for that long is considered dead
+  metaIndexBuildTimeout = 600
+  # Number of directories indexed between two news of the builder
+  metaIndexBuildStep = 100
 
   def __init__( self, database = None ):
     self.db = None
@@ -83,21 +105,15 @@ class DirectoryMetadata:
         return S_ERROR( 'Attempt to add an existing metadata with different type: %s/%s' %
                         ( ptype, result['Value'][pname] ) )
 
-    valueType = ptype
-    if ptype.lower()[:3] == 'int':
-      valueType = 'INT'
-    elif ptype.lower() == 'string':
-      valueType = 'VARCHAR(128)'
-    elif ptype.lower() == 'float':
-      valueType = 'FLOAT'
-    elif ptype.lower() == 'date':
-      valueType = 'DATETIME'
-    elif ptype == "MetaSet":
-      valueType = "VARCHAR(64)"
-
+    valueType = self.__getValueType( ptype )
     req = "CREATE TABLE FC_Meta_%s ( DirID INTEGER NOT NULL, Value %s, PRIMARY KEY (DirID), INDEX (Value) )" \
                               % ( pname, valueType )
     result = self.db._query( req )
+    if not result['OK']:
+      return result
+    # Kept up to date from now on, it is filled with the values transformed
+    # from meta parameters when first needed
+    result = self.db._query( self.__getIndexTableDefinition( 'FC_MetaIdx_%s' % pname, valueType ) )
     if not result['OK']:
       return result
 
@@ -112,6 +128,22 @@ class DirectoryMetadata:
 
     return S_OK( "Added new metadata: %d" % metadataID )
 
+  def __getValueType( self, ptype ):
+    """ Get the MySQL type of the values of a metadata of the given type
+    """
+    valueType = ptype
+    if ptype.lower()[:3] == 'int':
+      valueType = 'INT'
+    elif ptype.lower() == 'string':
+      valueType = 'VARCHAR(128)'
+    elif ptype.lower() == 'float':
+      valueType = 'FLOAT'
+    elif ptype.lower() == 'date':
+      valueType = 'DATETIME'
+    elif ptype == "MetaSet":
+      valueType = "VARCHAR(64)"
+    return valueType
+
   def deleteMetadataField( self, pname, credDict ):
     """ Remove metadata field
     """
@@ -121,6 +153,7 @@ class DirectoryMetadata:
     error = ''
     if not result['OK']:
       error = result["Message"]
+    self.__dropMetaIndex( pname )
     req = "DELETE FROM FC_MetaFields WHERE MetaName='%s'" % pname
     result = self.db._update( req )
     if not result['OK']:
@@ -230,7 +263,7 @@ class DirectoryMetadata:
       return result
     metaFields = result['Value']
 
-    result = self.db.dtree.findDir( dpath )
+    result = self.db.dtree.findDirForUpdate( dpath )
     if not result['OK']:
       return result
     if not result['Value']:
@@ -259,6 +292,7 @@ class DirectoryMetadata:
             return result
         else:
           return result
+      self.__indexDirectoryMeta( metaName, dirID )
 
     return S_OK()
 
@@ -270,7 +304,7 @@ class DirectoryMetadata:
       return result
     metaFields = result['Value']
 
-    result = self.db.dtree.findDir( dpath )
+    result = self.db.dtree.findDirForUpdate( dpath )
     if not result['OK']:
       return result
     if not result['Value']:
@@ -285,6 +319,8 @@ class DirectoryMetadata:
         result = self.db._update( req )
         if not result['OK']:
           failedMeta[meta] = result['Value']
+          continue
+        self.__updateMetaIndex( meta, "DELETE FROM FC_MetaIdx_%s WHERE SrcDirID=%d" % ( meta, dirID ) )
       else:
         # Meta parameter case
         req = "DELETE FROM FC_DirMeta WHERE MetaKey='%s' AND DirID=%d" % ( meta, dirID )
@@ -303,7 +339,7 @@ class DirectoryMetadata:
     """ Set an meta parameter - metadata which is not used in the the data
         search operations
     """
-    result = self.db.dtree.findDir( dpath )
+    result = self.db.dtree.findDirForUpdate( dpath )
     if not result['OK']:
       return result
     if not result['Value']:
@@ -613,6 +649,69 @@ class DirectoryMetadata:
     else:
       return S_OK( result['Value'][0][0] )
 
+  def __findDirIDsByMetaTables( self, metaDict, pathSelection ):
+    """ Find the directories conforming to all the metadata in metaDict
+        with one query per metadata and the subdirectories expanded here
+    """
+    dirList = []
+    first = True
+    for meta, value in metaDict.items():
+      if value == "Missing":
+        result = self.__findSubdirMissingMeta( meta, pathSelection )
+      else:
+        result = self.__findSubdirByMeta( meta, value, pathSelection )
+      if not result['OK']:
+        return result
+      mList = result['Value']
+      if first:
+        dirList = mList
+        first = False
+      else:
+        newList = []
+        for d in dirList:
+          if d in mList:
+            newList.append( d )
+        dirList = newList
+    return S_OK( dirList )
+
+  def __findDirIDsByMetaIndex( self, metaDict, pathSelection, credDict ):
+    """ Find the directories conforming to all the metadata in metaDict
+        with a single query joining the metadata index tables. Returns None
+        if some indexes are not ready yet
+    """
+    result = self.__checkMetaIndexes( metaDict.keys(), credDict )
+    if not result['OK']:
+      return result
+    if not result['Value']:
+      return S_OK( None )
+
+    if pathSelection:
+      req = "SELECT DISTINCT P.DirID FROM ( %s ) AS P" % pathSelection
+    else:
+      req = "SELECT DISTINCT P.DirID FROM %s AS P" % self.db.dtree.getTreeTable()
+    missingList = []
+    for i, meta in enumerate( metaDict ):
+      value = metaDict[meta]
+      alias = "I%d" % i
+      if value == "Missing":
+        req += " LEFT JOIN FC_MetaIdx_%s AS %s ON %s.DirID=P.DirID" % ( meta, alias, alias )
+        missingList.append( "%s.DirID IS NULL" % alias )
+        continue
+      result = self.__createMetaSelection( meta, value, "%s." % alias )
+      if not result['OK']:
+        return result
+      selectString = result['Value'].strip()
+      req += " JOIN FC_MetaIdx_%s AS %s ON %s.DirID=P.DirID" % ( meta, alias, alias )
+      if selectString:
+        req += " AND %s" % selectString
+    if missingList:
+      req += " WHERE %s" % " AND ".join( missingList )
+
+    result = self.db._query( req )
+    if not result['OK']:
+      return result
+    return S_OK( [ row[0] for row in result['Value'] ] )
+
   @queryTime
   def findDirIDsByMetadata( self, queryDict, path, credDict ):
     """ Find Directories satisfying the given metadata and being subdirectories of 
@@ -654,25 +753,14 @@ class DirectoryMetadata:
         if not result['OK']:
           return result
         pathSelection = result['Value']
-      dirList = []
-      first = True
-      for meta, value in finalMetaDict.items():
-        if value == "Missing":
-          result = self.__findSubdirMissingMeta( meta, pathSelection )
-        else:
-          result = self.__findSubdirByMeta( meta, value, pathSelection )
+      result = self.__findDirIDsByMetaIndex( finalMetaDict, pathSelection, credDict )
+      if not result['OK']:
+        gLogger.warn( "Metadata index query failed, using the metadata tables", result['Message'] )
+      if not result['OK'] or result['Value'] is None:
+        result = self.__findDirIDsByMetaTables( finalMetaDict, pathSelection )
         if not result['OK']:
           return result
-        mList = result['Value']
-        if first:
-          dirList = mList
-          first = False
-        else:
-          newList = []
-          for d in dirList:
-            if d in mList:
-              newList.append( d )
-          dirList = newList
+      dirList = result['Value']
     else:
       if pathDirID:
         result = self.db.dtree.getSubdirectoriesByID( pathDirID, includeParent = True )
@@ -888,6 +976,182 @@ class DirectoryMetadata:
       result = S_OK( {} )
     return result
 
+  def __getIndexTableDefinition( self, table, valueType ):
+    return "CREATE TABLE IF NOT EXISTS %s ( DirID INTEGER NOT NULL, Value %s, SrcDirID INTEGER NOT NULL, " \
+           "PRIMARY KEY (DirID,SrcDirID), INDEX (SrcDirID), INDEX (Value) )" % ( table, valueType )
+
+  def __getMetaIndexes( self ):
+    """ Get the names of the metadata having an index table, ready or not
+    """
+    result = self.db._query( "SHOW TABLES LIKE 'FC\\_MetaIdx\\_%'" )
+    if not result['OK']:
+      return result
+    return S_OK( [ row[0][len( 'FC_MetaIdx_' ):] for row in result['Value'] ] )
+
+  def __checkMetaIndexes( self, metaList, credDict ):
+    """ Check that the indexes of the given metadata are ready to be used,
+        starting the build of the missing ones in the background
+    """
+    result = self.db._query( "SELECT MetaName FROM FC_MetaIndexes WHERE Status='Ready'" )
+    if not result['OK']:
+      return result
+    readyList = [ row[0] for row in result['Value'] ]
+    missingList = [ meta for meta in metaList if not meta in readyList ]
+    if not missingList:
+      return S_OK( True )
+    result = self.getMetadataFields( credDict )
+    if not result['OK']:
+      return result
+    metaFields = result['Value']
+    for meta in missingList:
+      if not meta in metaFields:
+        return S_ERROR( 'Unknown metadata field %s' % meta )
+      result = self.__claimMetaIndexBuild( meta )
+      if not result['OK']:
+        return result
+      builder = result['Value']
+      if not builder:
+        # Being built by somebody else
+        continue
+      # Created before the build so that the changes made meanwhile go to it
+      result = self.db._query( self.__getIndexTableDefinition( 'FC_MetaIdx_%s' % meta,
+                                                               self.__getValueType( metaFields[meta] ) ) )
+      if not result['OK']:
+        self.db._update( "DELETE FROM FC_MetaIndexes WHERE MetaName='%s' AND Builder='%s'" % ( meta, builder ) )
+        return result
+      buildThread = threading.Thread( target = self.__buildMetaIndex, args = ( meta, builder ) )
+      buildThread.setDaemon( 1 )
+      buildThread.start()
+    return S_OK( False )
+
+  def __claimMetaIndexBuild( self, meta ):
+    """ Become the builder of the index of the given metadata, unless another
+        one is alive. Returns the builder name, or None if not claimed
+    """
+    builder = "%s:%d:%.6f" % ( socket.gethostname(), os.getpid(), time.time() )
+    req = "INSERT IGNORE INTO FC_MetaIndexes (MetaName,Status,Builder,UpdateTime) "
+    req += "VALUES ('%s','Building','%s',UTC_TIMESTAMP())" % ( meta, builder )
+    result = self.db._update( req )
+    if not result['OK']:
+      return result
+    if not result['Value']:
+      # Take over from a builder that died
+      req = "UPDATE FC_MetaIndexes SET Builder='%s',UpdateTime=UTC_TIMESTAMP() " % builder
+      req += "WHERE MetaName='%s' AND Status='Building' " % meta
+      req += "AND UpdateTime < UTC_TIMESTAMP() - INTERVAL %d SECOND" % self.metaIndexBuildTimeout
+      result = self.db._update( req )
+      if not result['OK']:
+        return result
+      if not result['Value']:
+        return S_OK( None )
+    return S_OK( builder )
+
+  def __buildMetaIndex( self, meta, builder ):
+    """ Fill the index table of the given metadata from the values set on directories
+        and mark it as ready. The table is updated by the metadata changes while
+        being built and the values already there are kept
+    """
+    gLogger.info( "Building the index of metadata %s" % meta )
+    try:
+      result = self.db._query( "SELECT DirID FROM FC_Meta_%s" % meta )
+      if not result['OK']:
+        gLogger.error( "Failed to build the index of metadata %s" % meta, result['Message'] )
+        self.__dropMetaIndex( meta, builder )
+        return
+      keepAlive = "UPDATE FC_MetaIndexes SET UpdateTime=UTC_TIMESTAMP() WHERE MetaName='%s' AND Builder='%s'" % \
+                  ( meta, builder )
+      for i, row in enumerate( result['Value'] ):
+        if i and not i % self.metaIndexBuildStep:
+          result = self.db._update( keepAlive )
+          if result['OK'] and not result['Value']:
+            # The index was dropped meanwhile
+            gLogger.info( "Stopped building the index of metadata %s" % meta )
+            return
+        result = self.__getDirectoryMetaIndexRequest( meta, row[0], "FC_MetaIdx_%s" % meta )
+        if result['OK']:
+          result = self.db._update( result['Value'] )
+        if not result['OK']:
+          gLogger.error( "Failed to build the index of metadata %s" % meta, result['Message'] )
+          self.__dropMetaIndex( meta, builder )
+          return
+      result = self.db._update( "UPDATE FC_MetaIndexes SET Status='Ready',UpdateTime=UTC_TIMESTAMP() "
+                                "WHERE MetaName='%s' AND Builder='%s'" % ( meta, builder ) )
+      if not result['OK']:
+        gLogger.error( "Failed to build the index of metadata %s" % meta, result['Message'] )
+      elif result['Value']:
+        gLogger.info( "Index of metadata %s ready" % meta )
+    except Exception:
+      gLogger.exception( "Exception while building the index of metadata %s" % meta )
+      self.__dropMetaIndex( meta, builder )
+
+  def __dropMetaIndex( self, meta, builder = None ):
+    """ Drop the index of the given metadata, it will be rebuilt when needed.
+        If builder is given, only while it is still building it
+    """
+    req = "DELETE FROM FC_MetaIndexes WHERE MetaName='%s'" % meta
+    if builder:
+      req += " AND Builder='%s'" % builder
+    result = self.db._update( req )
+    if not result['OK']:
+      return result
+    if builder and not result['Value']:
+      return S_OK()
+    return self.db._update( "DROP TABLE IF EXISTS FC_MetaIdx_%s" % meta )
+
+  def __updateMetaIndex( self, meta, req ):
+    """ Apply a change to the index of the given metadata. If it fails
+        the index is dropped to be rebuilt rather than being left inconsistent
+    """
+    result = self.db._update( req )
+    if not result['OK']:
+      gLogger.warn( "Failed to update the index of metadata %s, dropping it" % meta, result['Message'] )
+      self.__dropMetaIndex( meta )
+    return result
+
+  def __getDirectoryMetaIndexRequest( self, meta, dirID, table ):
+    """ Get the request indexing the value of meta set on dirID for the directory and its subdirectories
+    """
+    result = self.db.dtree.getSubdirectoriesByID( dirID, requestString = True, includeParent = True )
+    if not result['OK']:
+      return result
+    req = "INSERT IGNORE INTO %s (DirID,Value,SrcDirID) SELECT S.DirID,M.Value,M.DirID" % table
+    req += " FROM FC_Meta_%s AS M JOIN ( %s ) AS S WHERE M.DirID=%d" % ( meta, result['Value'], dirID )
+    return S_OK( req )
+
+  def __indexDirectoryMeta( self, meta, dirID ):
+    """ Index the value of meta just set on dirID
+    """
+    result = self.__getDirectoryMetaIndexRequest( meta, dirID, "FC_MetaIdx_%s" % meta )
+    if not result['OK']:
+      self.__dropMetaIndex( meta )
+      return result
+    indexRequest = result['Value']
+    result = self.db.transactionStart()
+    if not result['OK']:
+      self.__dropMetaIndex( meta )
+      return result
+    result = self.db._update( "DELETE FROM FC_MetaIdx_%s WHERE SrcDirID=%d" % ( meta, dirID ) )
+    if result['OK']:
+      result = self.db._update( indexRequest )
+    if not result['OK']:
+      self.db.transactionRollback()
+      gLogger.warn( "Failed to update the index of metadata %s, dropping it" % meta, result['Message'] )
+      self.__dropMetaIndex( meta )
+      return result
+    return self.db.transactionCommit()
+
+  def inheritMetaIndex( self, dirID, parentID ):
+    """ Give a new directory the indexed metadata of its parent
+    """
+    result = self.__getMetaIndexes()
+    if not result['OK']:
+      return result
+    for meta in result['Value']:
+      req = "INSERT IGNORE INTO FC_MetaIdx_%s (DirID,Value,SrcDirID) " % meta
+      req += "SELECT %d,Value,SrcDirID FROM FC_MetaIdx_%s WHERE DirID=%d" % ( dirID, meta, parentID )
+      self.__updateMetaIndex( meta, req )
+    return S_OK()
+
   def removeMetadataForDirectory( self, dirList, credDict ):
     """ Remove all the metadata for the given directory list
     """
@@ -913,6 +1177,8 @@ class DirectoryMetadata:
         failed[meta] = result['Message']
       else:
         successful[meta] = 'OK'
+        self.__updateMetaIndex( meta, "DELETE FROM FC_MetaIdx_%s WHERE DirID IN ( %s ) OR SrcDirID IN ( %s )" %
+                                      ( meta, dirListString, dirListString ) )
 
     return S_OK( {'Successful':successful, 'Failed':failed} )
 
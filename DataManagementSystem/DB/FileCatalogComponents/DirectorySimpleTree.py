@@ -36,6 +36,9 @@ class DirectorySimpleTree(DirectoryTreeBase):
 
   def findDir(self,path):
     
+    cached = self.pathCache.get( path )
+    if cached:
+      return S_OK( cached[0] )
     req = "SELECT DirID from FC_DirectoryTree WHERE DirName='%s'" % path
     result = self.db._query(req)
     if not result['OK']:
@@ -44,13 +47,14 @@ class DirectorySimpleTree(DirectoryTreeBase):
     if not result['Value']:
       return S_OK('')
     
+    self._cacheDirectory( path, result['Value'][0][0] )
     return S_OK(result['Value'][0][0])  
   
   def removeDir(self,path):
     """ Remove directory
     """
 
-    result = self.findDir(path)
+    result = self.findDirForUpdate(path)
     if not result['OK']:
       return result   
     if not result['Value']:
@@ -59,11 +63,12 @@ class DirectorySimpleTree(DirectoryTreeBase):
     dirID = result['Value']
     req = "DELETE FROM FC_DirectoryTree WHERE DirID=%d" % dirID
     result = self.db._update(req)
+    self._uncacheDirectory( path, dirID )
     return result
 
   def makeDir(self,path):
         
-    result = self.findDir(path)
+    result = self.findDirForUpdate(path)
     if not result['OK']:
       return result
     dirID = result['Value']
@@ -13,6 +13,87 @@ import stat
 
 DEBUG = 0
 
+#############################################################################
+class DirectoryCache:
+  """ Bounded least recently used cache with expiring entries, counting hits and misses.
+      Only existing directories are cached, so entries only go stale when directories
+      are removed or renumbered, which is bounded by the life time in other processes.
+      Write paths do not trust the path cache, see findDirForUpdate
+  """
+
+  def __init__( self, maxSize = 10000, lifeTime = 300 ):
+    self.__lock = threading.Lock()
+    self.__entries = {}
+    self.hits = 0
+    self.misses = 0
+    self.configure( maxSize, lifeTime )
+
+  def configure( self, maxSize, lifeTime ):
+    self.maxSize = max( 0, int( maxSize ) )
+    self.lifeTime = lifeTime
+    self.clear()
+
+  def get( self, key ):
+    """ Get the cached value for key or None
+    """
+    if not self.maxSize:
+      return None
+    now = time.time()
+    self.__lock.acquire()
+    try:
+      entry = self.__entries.get( key )
+      if entry is None or entry[1] < now:
+        self.misses += 1
+        return None
+      self.hits += 1
+      entry[2] = now
+      return entry[0]
+    finally:
+      self.__lock.release()
+
+  def add( self, key, value ):
+    if not self.maxSize:
+      return
+    now = time.time()
+    self.__lock.acquire()
+    try:
+      if key not in self.__entries and len( self.__entries ) >= self.maxSize:
+        # Evict the least recently used tenth in one go
+        lruKeys = sorted( self.__entries, key = lambda cKey: self.__entries[cKey][2] )
+        for cKey in lruKeys[:max( 1, self.maxSize / 10 )]:
+          del self.__entries[cKey]
+      self.__entries[key] = [ value, now + self.lifeTime, now ]
+    finally:
+      self.__lock.release()
+
+  def delete( self, key ):
+    self.__lock.acquire()
+    try:
+      self.__entries.pop( key, None )
+    finally:
+      self.__lock.release()
+
+  def clear( self ):
+    self.__lock.acquire()
+    try:
+      self.__entries = {}
+    finally:
+      self.__lock.release()
+
+  def getStats( self ):
+    """ Size and hit rate of the cache
+    """
+    lookups = self.hits + self.misses
+    hitRate = 0.
+    if lookups:
+      hitRate = 100. * self.hits / lookups
+    return { 'Size' : len( self.__entries ),
+             'MaxSize' : self.maxSize,
+             'LifeTime' : self.lifeTime,
+             'Hits' : self.hits,
+             'Misses' : self.misses,
+             'HitRate' : hitRate }
+
 #############################################################################
 class DirectoryTreeBase:
 
@@ -49,6 +130,11 @@ class DirectoryTreeBase:
       self.setDatabase( database )
     self.lock = threading.Lock()
     self.treeTable = ''
+    # path -> ( DirID, Level ), DirID -> path, DirID -> ( Level, LPATHs ), DirID -> ancestor DirIDs
+    self.pathCache = DirectoryCache()
+    self.idCache = DirectoryCache()
+    self.levelCache = DirectoryCache()
+    self.ancestorCache = DirectoryCache()
 
   def _getConnection( self, connection ):
     if connection:
@@ -63,6 +149,47 @@ class DirectoryTreeBase:
     """ Get the string of the Directory Tree type
     """
     return self.treeTable
+
+  def configureCache( self, maxSize, lifeTime ):
+    """ Set the size and the entry life time of the directory caches, a size of 0 disables them
+    """
+    for cache in ( self.pathCache, self.idCache, self.levelCache, self.ancestorCache ):
+      cache.configure( maxSize, lifeTime )
+
+  def getCacheStats( self ):
+    """ Get the size and hit rate of the directory caches
+    """
+    return S_OK( { 'PathToID' : self.pathCache.getStats(),
+                   'IDToPath' : self.idCache.getStats(),
+                   'IDToLevel' : self.levelCache.getStats(),
+                   'IDToAncestors' : self.ancestorCache.getStats() } )
+
+  def _cacheDirectory( self, path, dirID, level = None ):
+    """ Keep the path <-> DirID correspondence of an existing directory
+    """
+    self.pathCache.add( path, ( dirID, level ) )
+    self.idCache.add( dirID, path )
+
+  def _uncacheDirectory( self, path, dirID ):
+    """ Forget a directory, to be called when it is removed
+    """
+    self.pathCache.delete( path )
+    self.idCache.delete( dirID )
+    self.levelCache.delete( dirID )
+    self.ancestorCache.delete( dirID )
+
+  def findDirForUpdate( self, path ):
+    """ Find the directory ID in the database, bypassing the path cache. To be used
+        before writing in or about a directory: a cached entry can still point to the
+        DirID of a directory removed and recreated meanwhile by another service instance
+    """
+    for key in set( [ path, os.path.normpath( path ) ] ):
+      self.pathCache.delete( key )
+    return self.findDir( path )
+
+  def _clearCache( self ):
+    for cache in ( self.pathCache, self.idCache, self.levelCache, self.ancestorCache ):
+      cache.clear()
     
   def setDatabase( self, database ):
     self.db = database
@@ -97,6 +224,15 @@ class DirectoryTreeBase:
   def getSubdirectoriesByID( self, path, requestString, includeParent ):    
     return S_ERROR( 'Should be implemented in a derived class' )  
 
+  def getPathIDsByID( self, dirID ):
+    """ Get IDs of all the directories in the parent hierarchy of a directory
+        specified by its ID, going through its path unless the tree does better
+    """
+    result = self.getDirectoryPath( dirID )
+    if not result['OK']:
+      return result
+    return self.getPathIDs( result['Value'] )
+
   def makeDirectory(self,path,credDict,status=0):
     """Create a new directory. The return value is the dictionary
        containing all the parameters of the newly created directory
@@ -136,6 +272,14 @@ class DirectoryTreeBase:
     if not dirDict:
       self.removeDir( path )
       return S_ERROR( 'Failed to create directory %s' % path )
+
+    # The new directory inherits the indexed metadata of its parent
+    if path != '/' and self.db.dmeta:
+      result = self.findDirForUpdate( os.path.dirname( path ) )
+      if result['OK'] and result['Value']:
+        result = self.db.dmeta.inheritMetaIndex( dirID, result['Value'] )
+      if not result['OK']:
+        gLogger.warn( "Failed to index the metadata of new directory %s" % path, result['Message'] )
     return S_OK( dirID )
 
 #####################################################################
@@ -147,23 +291,22 @@ class DirectoryTreeBase:
     if not path or path[0] != '/':
       return S_ERROR( 'Not an absolute path' )
 
-    result = self.existsDir( path )
+    # The returned DirID is used to register files, so it is not taken from the cache
+    result = self.findDirForUpdate( path )
     if not result['OK']:
       return result
-    result = result['Value']
-    if result['Exists']:
-      return S_OK( result['DirID'] )
+    if result['Value']:
+      return S_OK( result['Value'] )
 
     if path == '/':
       result = self.makeDirectory( path, credDict )
       return result
 
     parentDir = os.path.dirname( path )
-    result = self.existsDir( parentDir )
+    result = self.findDirForUpdate( parentDir )
     if not result['OK']:
       return result
-    result = result['Value']
-    if result['Exists']:
+    if result['Value']:
       result = self.makeDirectory( path, credDict )
     else:
       result = self.makeDirectories( parentDir, credDict )
@@ -289,15 +432,22 @@ class DirectoryTreeBase:
         failed[dir_] = result['Message']
       else: 
         successful[dir_] = result
+        # The usage counters of an empty directory are all null
+        res = self.db._update( "DELETE FROM FC_DirectoryUsage WHERE DirID=%d" % dirDict[dir_] )
+        if not res['OK']:
+          gLogger.warn( "Failed to remove FC_DirectoryUsage entries of %s" % dir_, res['Message'] )
     return S_OK({'Successful':successful,'Failed':failed}) 
 
 #####################################################################
-  def __getDirID( self, path ):
+  def __getDirID( self, path, forUpdate = False ):
     """ Get directory ID from the given path or already evaluated ID
     """
 
     if type( path ) in StringTypes:
-      result = self.findDir( path )
+      if forUpdate:
+        result = self.findDirForUpdate( path )
+      else:
+        result = self.findDir( path )
       if not result['OK']:
         return result
       dirID = result['Value']
@@ -353,7 +503,7 @@ class DirectoryTreeBase:
   def __setDirectoryParameter( self, path, pname, pvalue ):
     """ Set a numerical directory parameter
     """
-    result = self.__getDirID( path )
+    result = self.__getDirID( path, forUpdate = True )
     if not result['OK']:
       return result
     dirID = result['Value']
@@ -378,7 +528,7 @@ class DirectoryTreeBase:
     """ Set the directory owner
     """
 
-    result = self.__getDirID( path )
+    result = self.__getDirID( path, forUpdate = True )
     if not result['OK']:
       return result
     dirID = result['Value']
@@ -421,7 +571,7 @@ class DirectoryTreeBase:
     """ Set the directory owner
     """
 
-    result = self.__getDirID( path )
+    result = self.__getDirID( path, forUpdate = True )
     if not result['OK']:
       return result
     dirID = result['Value']
@@ -645,20 +795,14 @@ class DirectoryTreeBase:
     result['LFNIDList'] = lfnIDList
     return result
 
-  def __getDirectoryContents( self, path, details = False ):
-    """ Get contents of a given directory
+  def __getSubdirectories( self, path, details = False ):
+    """ Get the paths of the subdirectories of the given directory, with their parameters if details
     """
-    result = self.findDir( path )
-    if not result['OK']:
-      return result
-    directoryID = result['Value']
     directories = {}
-    links = {}
     result = self.getChildren( path )
     if not result['OK']:
       return result
 
-    # Get subdirectories
     dirIDList = result['Value']
     for dirID in dirIDList:
       result = self.getDirectoryPath( dirID )
@@ -673,16 +817,37 @@ class DirectoryTreeBase:
           directories[dirName] = result['Value']
       else:
         directories[dirName] = True
-    result = self.db.fileManager.getFilesInDirectory( directoryID, verbose = details )
+    return S_OK( directories )
+
+  def __getDirectoryContents( self, path, details = False, continuation = '', pageSize = 0 ):
+    """ Get contents of a given directory. If pageSize is given only the pageSize files following
+        the continuation are listed, and the subdirectories and datasets only with the first page
+    """
+    result = self.findDir( path )
     if not result['OK']:
       return result
-    files = result['Value']
-    result = self.db.datasetManager.getDatasetsInDirectory( directoryID, verbose = details )
+    directoryID = result['Value']
+    directories = {}
+    links = {}
+    datasets = {}
+    if not continuation:
+      result = self.__getSubdirectories( path, details )
+      if not result['OK']:
+        return result
+      directories = result['Value']
+      result = self.db.datasetManager.getDatasetsInDirectory( directoryID, verbose = details )
+      if not result['OK']:
+        return result
+      datasets = result['Value']
+    result = self.db.fileManager.getFilesInDirectory( directoryID, verbose = details,
+                                                      startName = continuation, maxItems = pageSize )
     if not result['OK']:
       return result
-    datasets = result['Value']
+    files = result['Value']
     pathDict = {'Files': files, 'SubDirs':directories, 'Links':links, 'Datasets':datasets }
 
+    if pageSize:
+      pathDict['Continuation'] = result['Continuation']
     return S_OK( pathDict )
 
   def listDirectory( self, lfns, verbose = False ):
@@ -729,31 +894,72 @@ class DirectoryTreeBase:
       if resSE['OK']:
         sePrefixDict = resSE['Value']
       result['Value']['SEPrefixes'] = sePrefixDict
-      
+
     return result
 
+  def listDirectoryPage( self, path, verbose = False, continuation = '', pageSize = 1000 ):
+    """ Get one page of the directory listing: the pageSize files following the continuation,
+        and the subdirectories and datasets with the first page. The returned continuation
+        is empty once the last page has been reached
+    """
+    result = self.findDir( path )
+    if not result['OK']:
+      return result
+    if not result['Value']:
+      return S_ERROR( 'Directory %s not found' % path )
+    return self.__getDirectoryContents( path, details = verbose, continuation = continuation, pageSize = pageSize )
+
+  def getDirectoryReplicasPage( self, path, allStatus = False, continuation = '', pageSize = 1000 ):
+    """ Get the replicas of the pageSize files of the directory following the continuation.
+        The subdirectory paths are given with the first page, to allow walking directory trees
+    """
+    result = self.findDir( path )
+    if not result['OK']:
+      return result
+    directoryID = result['Value']
+    if not directoryID:
+      return S_ERROR( 'Directory %s not found' % path )
+    subDirs = []
+    if not continuation:
+      result = self.__getSubdirectories( path )
+      if not result['OK']:
+        return result
+      subDirs = result['Value'].keys()
+    result = self.db.fileManager.getDirectoryReplicas( directoryID, path, allStatus,
+                                                       startName = continuation, maxItems = pageSize )
+    if not result['OK']:
+      return result
+    pageDict = { 'Files' : result['Value'],
+                 'SubDirs' : subDirs,
+                 'Continuation' : result['Continuation'] }
+
+    if self.db.lfnPfnConvention:
+      sePrefixDict = {}
+      resSE = self.db.seManager.getSEPrefixes()
+      if resSE['OK']:
+        sePrefixDict = resSE['Value']
+      pageDict['SEPrefixes'] = sePrefixDict
+
+    return S_OK( pageDict )
+
   def getDirectorySize( self, lfns, longOutput = False, rawFileTables = False ):
     """ Get the total size of the requested directories. If long flag
         is True, get also physical size per Storage Element
     """
     start = time.time()
 
-    result = self.db._getConnection()
-    if not result['OK']:
-      return result
-    connection = result['Value']
+    # Pooled connections are checked out by each query and must not be closed here
+    connection = False
 
     if rawFileTables:
       resultLogical = self._getDirectoryLogicalSize( lfns, connection )
     else:
       resultLogical = self._getDirectoryLogicalSizeFromUsage( lfns, connection )
     if not resultLogical['OK']:
-      connection.close()
       return resultLogical
 
     resultDict = resultLogical['Value']
     if not resultDict['Successful']:
-      connection.close()
       return resultLogical
 
     if longOutput:
@@ -766,16 +972,16 @@ class DirectoryTreeBase:
         resultDict['QueryTime'] = time.time() - start
         result = S_OK( resultDict )
         result['Message'] = "Failed to get the physical size on storage"
-        connection.close()
         return result
       for lfn in resultPhysical['Value']['Successful']:
         resultDict['Successful'][lfn]['PhysicalSize'] = resultPhysical['Value']['Successful'][lfn]
-    connection.close()
     resultDict['QueryTime'] = time.time() - start
     return S_OK( resultDict )
 
   def _getDirectoryLogicalSizeFromUsage( self, lfns, connection ):
-    """ Get the total "logical" size of the requested directories
+    """ Get the total "logical" size of the requested directories. The size and number
+        of files are read from the FC_DirectoryUsage counters of the directory, the number
+        of subdirectories is still counted in the directory tree
     """
     paths = lfns.keys()
     successful = {}
@@ -1020,7 +1226,8 @@ class DirectoryTreeBase:
     return S_OK( {'Successful':successful, 'Failed':failed} )
 
   def _rebuildDirectoryUsage( self ):
-    """ Recreate and replenish the Storage Usage tables
+    """ Recreate and replenish the Storage Usage tables. The usage is kept exact by the
+        file and replica operations, this is only needed to repair it
     """
 
     req = "DROP TABLE IF EXISTS FC_DirectoryUsage_backup"
@@ -1087,7 +1294,8 @@ class DirectoryTreeBase:
             result = self.db._update( req )
             if not result['OK']:
               return result
-          return result
+          else:
+            return result
 
       # Get the logical size
       req = "SELECT SUM(Size),COUNT(Size) from FC_Files WHERE DirID=%d " % int( dirID )
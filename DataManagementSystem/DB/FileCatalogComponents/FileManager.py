@@ -247,6 +247,31 @@ class FileManager(FileManagerBase):
       files[filesDict[fileID]].update(rowDict)
     return S_OK(files)
 
+  def _getDirectoryFileNames( self, dirID, startName, maxItems, allStatus=False, connection=False ):
+    """ Get the names of at most maxItems files of the directory coming after startName
+        in name order, using the ( DirID, FileName ) index
+    """
+    connection = self._getConnection(connection)
+    req = "SELECT FileName FROM FC_Files WHERE DirID=%d" % dirID
+    if not allStatus:
+      statusIDs = []
+      for status in self.db.visibleFileStatus:
+        res = self._getStatusInt( status, connection=connection )
+        if res['OK']:
+          statusIDs.append( res['Value'] )
+      if statusIDs:
+        req = "%s AND Status IN (%s)" % (req,intListToString(statusIDs))
+    if startName:
+      res = self.db._escapeString( startName )
+      if not res['OK']:
+        return res
+      req = "%s AND FileName > %s" % ( req, res['Value'] )
+    req = "%s ORDER BY FileName LIMIT %d" % ( req, maxItems )
+    res = self.db._query(req,connection)
+    if not res['OK']:
+      return res
+    return S_OK( [ row[0] for row in res['Value'] ] )
+
   def _getFileMetadataByID( self, fileIDs, connection=False ):
     """ Get standard file metadata for a list of files specified by FileID
     """
@@ -300,9 +325,23 @@ class FileManager(FileManagerBase):
       insertTuples.append("(%d,%d,%d,%d,%d,'%s')" % (dirID,size,s_uid,s_gid,statusID,fileName))
       directorySESizeDict.setdefault( dirID, {} )
       directorySESizeDict[dirID].setdefault( 0, {'Files':0,'Size':0} )
-      directorySESizeDict[dirID][0]['Size'] += lfns[lfn]['Size']
+      directorySESizeDict[dirID][0]['Size'] += size
       directorySESizeDict[dirID][0]['Files'] += 1
 
+    # The files, their info and the directory usage are changed in the same transaction
+    res = self._changeWithDirectoryUsage( lambda: self.__insertFilesAndInfo( lfns, insertTuples, connection ),
+                                          directorySESizeDict, '+' )
+    if not res['OK']:
+      for lfn in lfns.keys():
+        failed[lfn] = res['Message']
+        lfns.pop(lfn)
+
+    return S_OK({'Successful':lfns,'Failed':failed})
+
+  def __insertFilesAndInfo(self,lfns,insertTuples,connection=False):
+    """ Insert the FC_Files rows given by insertTuples and the FC_FileInfo rows of the
+        corresponding lfns, setting their FileID. All of them are inserted or none
+    """
     req = "INSERT INTO FC_Files (DirID,Size,UID,GID,Status,FileName) VALUES %s" % (','.join(insertTuples))
     res = self.db._update(req,connection)
     if not res['OK']:
@@ -310,42 +349,20 @@ class FileManager(FileManagerBase):
     # Get the fileIDs for the inserted files
     res = self._findFiles(lfns.keys(),['FileID'],connection=connection)
     if not res['OK']:
-      for lfn in lfns.keys():
-        failed[lfn] = 'Failed post insert check'
-        lfns.pop(lfn)
-    else:
-      failed.update(res['Value']['Failed'])
-      for lfn in res['Value']['Failed'].keys():
-        lfns.pop(lfn)
-      for lfn,fileDict in res['Value']['Successful'].items():
-        lfns[lfn]['FileID'] = fileDict['FileID']
+      return res
+    if res['Value']['Failed']:
+      return S_ERROR('Failed post insert check')
     insertTuples = []
-    toDelete = []
-    for lfn in lfns.keys():
-      fileInfo = lfns[lfn]     
-      fileID = fileInfo['FileID']
-      dirID = fileInfo['DirID']
+    for lfn,fileDict in res['Value']['Successful'].items():
+      fileInfo = lfns[lfn]
+      fileInfo['FileID'] = fileDict['FileID']
       checksum = fileInfo['Checksum']
       checksumtype = fileInfo.get('ChecksumType','Adler32')
       guid = fileInfo.get('GUID','')
       mode = fileInfo.get('Mode',self.db.umask)
-      toDelete.append(fileID)
-      insertTuples.append("(%d,'%s','%s','%s',UTC_TIMESTAMP(),UTC_TIMESTAMP(),%d)" % (fileID,guid,checksum,checksumtype,mode))
-    if insertTuples:
-      req = "INSERT INTO FC_FileInfo (FileID,GUID,Checksum,ChecksumType,CreationDate,ModificationDate,Mode) VALUES %s" % ','.join( insertTuples )
-      res = self.db._update(req)
-      if not res['OK']:
-        self._deleteFiles(toDelete,connection=connection)
-        for lfn in lfns.keys():
-          failed[lfn] = res['Message']
-          lfns.pop(lfn)
-      else:
-        # Update the directory usage
-        result = self._updateDirectoryUsage(directorySESizeDict,'+',connection=connection)
-        if not result['OK']:
-          gLogger.warn( "Failed to insert FC_DirectoryUsage", result['Message'] )
-          
-    return S_OK({'Successful':lfns,'Failed':failed})
+      insertTuples.append("(%d,'%s','%s','%s',UTC_TIMESTAMP(),UTC_TIMESTAMP(),%d)" % (fileInfo['FileID'],guid,checksum,checksumtype,mode))
+    req = "INSERT INTO FC_FileInfo (FileID,GUID,Checksum,ChecksumType,CreationDate,ModificationDate,Mode) VALUES %s" % ','.join( insertTuples )
+    return self.db._update(req,connection)
 
   def _getFileIDFromGUID(self,guid,connection=False):
     connection = self._getConnection(connection)
@@ -379,7 +396,7 @@ class FileManager(FileManagerBase):
 
   def __deleteFileReplicas(self,fileIDs,connection=False):
     connection = self._getConnection(connection)
-    res = self.__getFileIDReplicas(fileIDs,connection=connection)
+    res = self.__getFileIDReplicas(fileIDs,allStatus=True,connection=connection)
     if not res['OK']:
       return res
     repIDs = res['Value'].keys()
@@ -441,17 +458,38 @@ class FileManager(FileManagerBase):
       res = self._getRepIDsForReplica(insertTuples, connection=connection)
       if not res['OK']:
         return res
+      existingTuples = set()
       for fileID,repDict in res['Value'].items():
         for seID,repID in repDict.items():
           successful[fileIDLFNs[fileID]] = True
-          insertTuples.remove((fileID,seID))
+          existingTuples.add((fileID,seID))
+      insertTuples = [ tuple_ for tuple_ in insertTuples if tuple_ not in existingTuples ]
 
     if not insertTuples:
       return S_OK({'Successful':successful,'Failed':failed})
 
-    req = "INSERT INTO FC_Replicas (FileID,SEID,Status) VALUES %s" % \
-          (','.join(["(%d,%d,%d)" % (tuple_[0],tuple_[1],statusID) for tuple_ in insertTuples]))
-    res = self.db._update(req,connection)
+    replicaType = 'Replica'
+    if master:
+      replicaType = 'Master'
+    # The replicas, their info and the directory usage are changed in the same transaction:
+    # the usage is known once the replicas are inserted, their info is inserted afterwards
+    res = self._changeWithDirectoryUsage( lambda: self.__insertReplicaInfo( lfns, replicaType, connection ),
+                                          lambda: self.__insertReplicaRows( lfns, fileIDLFNs, insertTuples, statusID, connection ),
+                                          '+' )
+    if not res['OK']:
+      for lfn in lfns.keys():
+        failed[lfn] = res['Message']
+    else:
+      for lfn in lfns.keys():
+        successful[lfn] = True
+    return S_OK({'Successful':successful,'Failed':failed})
+
+  def __insertReplicaRows(self,lfns,fileIDLFNs,insertTuples,statusID,connection=False):
+    """ Insert the ( FileID, SEID ) FC_Replicas rows, setting the RepID of the lfns,
+        and return the corresponding directory usage change
+    """
+    res = self.db.insertMany( 'FC_Replicas', ['FileID','SEID','Status'],
+                              [ (tuple_[0],tuple_[1],statusID) for tuple_ in insertTuples ] )
     if not res['OK']:
       return res
     res = self._getRepIDsForReplica(insertTuples, connection=connection)
@@ -468,32 +506,21 @@ class FileManager(FileManagerBase):
         directorySESizeDict[dirID].setdefault( seID, {'Files':0,'Size':0} )
         directorySESizeDict[dirID][seID]['Size'] += lfns[lfn]['Size']
         directorySESizeDict[dirID][seID]['Files'] += 1
+    return S_OK( directorySESizeDict )
 
-    replicaType = 'Replica'
-    if master:
-      replicaType = 'Master'
+  def __insertReplicaInfo(self,lfns,replicaType,connection=False):
+    """ Insert the FC_ReplicaInfo rows of the replicas inserted by __insertReplicaRows
+    """
     insertReplicas = []
-    toDelete = []
     for lfn in lfns.keys():
       fileDict = lfns[lfn]
       repID = fileDict.get( 'RepID', 0 )
       if repID:
         pfn = fileDict['PFN']
-        toDelete.append(repID)
-        insertReplicas.append("(%d,'%s',UTC_TIMESTAMP(),UTC_TIMESTAMP(),'%s')" % (repID,replicaType,pfn))    
-    if insertReplicas:
-      req = "INSERT INTO FC_ReplicaInfo (RepID,RepType,CreationDate,ModificationDate,PFN) VALUES %s" % (','.join(insertReplicas))
-      res = self.db._update(req,connection)
-      if not res['OK']:
-        for lfn in lfns.keys():
-          failed[lfn] = res['Message']
-        self.__deleteReplicas(toDelete,connection=connection)
-      else:
-        # Update the directory usage
-        self._updateDirectoryUsage(directorySESizeDict,'+',connection=connection)
-        for lfn in lfns.keys():
-          successful[lfn] = True
-    return S_OK({'Successful':successful,'Failed':failed})
+        insertReplicas.append( (repID,replicaType,'UTC_TIMESTAMP()','UTC_TIMESTAMP()',pfn) )
+    return self.db.insertMany( 'FC_ReplicaInfo',
+                               ['RepID','RepType','CreationDate','ModificationDate','PFN'],
+                               insertReplicas )
 
   def _getRepIDsForReplica(self,replicaTuples,connection=False):
     connection = self._getConnection(connection)
@@ -531,9 +558,10 @@ class FileManager(FileManagerBase):
 
     lfnFileIDDict = res['Value']['Successful']
     toRemove = []
-    directorySESizeDict = {}
+    fileIDDict = {}
     for lfn,fileDict in lfnFileIDDict.items():
       fileID = fileDict['FileID']
+      fileIDDict[fileID] = fileDict
       se = lfns[lfn]['SE']
       if type(se) in StringTypes:
         res = self.db.seManager.findSE(se)
@@ -541,28 +569,26 @@ class FileManager(FileManagerBase):
           return res
       seID = res['Value']
       toRemove.append((fileID,seID))
-      # Now prepare the storage usage update
-      dirID = fileDict['DirID']
-      directorySESizeDict.setdefault( dirID, {} )
-      directorySESizeDict[dirID].setdefault( seID, {'Files':0,'Size':0} )
-      directorySESizeDict[dirID][seID]['Size'] += fileDict['Size']
-      directorySESizeDict[dirID][seID]['Files'] += 1
+    if not toRemove:
+      return S_OK({"Successful":successful,"Failed":failed})
     res = self._getRepIDsForReplica(toRemove, connection)
     if not res['OK']:
       for lfn in lfnFileIDDict.keys():
         failed[lfn] = res['Message']
     else:
       repIDs = []
+      replicaTuples = []
       for fileID,seDict in res['Value'].items():
         for seID,repID in seDict.items():
-          repIDs.append(repID)    
-      res = self.__deleteReplicas(repIDs,connection=connection)
+          repIDs.append(repID)
+          replicaTuples.append((fileID,seID))
+      # The usage to subtract is taken from the replicas locked in the removal transaction
+      res = self._changeWithDirectoryUsage( lambda: self.__deleteReplicas(repIDs,connection=connection),
+                                            lambda: self._getUsageForUpdate(fileIDDict.keys(),replicaTuples), '-' )
       if not res['OK']:
         for lfn in lfnFileIDDict.keys():
           failed[lfn] = res['Message']
       else:
-        # Update the directory usage
-        self._updateDirectoryUsage(directorySESizeDict,'-',connection=connection)
         for lfn in lfnFileIDDict.keys():
           successful[lfn] = True
     return S_OK({"Successful":successful,"Failed":failed})
@@ -749,19 +775,106 @@ class FileManager(FileManagerBase):
       fileIDDict[repID] = ( fileID, seID, statusID )
     return S_OK(fileIDDict)
 
-  def _getDirectoryReplicas( self, dirID, allStatus=False, connection=False ):
-    """ Get replicas for files in a given directory
+  def _getLFNReplicas( self, lfns, allStatus = False, connection = False ):
+    """ Get the { SE : PFN } replicas of the given LFNs with one joined query per
+        chunk of LFNs instead of separate passes for the files, replicas and PFNs.
+        SE names are taken from the SEManager cache
     """
-    replicaStatusIDs = []
+    connection = self._getConnection(connection)
+    dirDict = self._getFileDirectories(lfns)
+    failed = {}
+    result = self.db.dtree.findDirs( dirDict.keys() )
+    if not result['OK']:
+      return result
+    directoryIDs = result['Value']
+    directoryPaths = {}
+    for dirPath in dirDict:
+      if not dirPath in directoryIDs:
+        for fileName in dirDict[dirPath]:
+          fname = '%s/%s' % (dirPath,fileName)
+          fname = fname.replace('//','/')
+          failed[fname] = 'No such directory'
+      else:
+        directoryPaths[directoryIDs[dirPath]] = dirPath
+
+    statusCondition = ''
     if not allStatus:
+      statusIDs = []
       for status in self.db.visibleReplicaStatus:
         result = self._getStatusInt( status, connection=connection )
+        if result['OK']:
+          statusIDs.append( result['Value'] )
+      statusCondition = ' AND FR.Status IN (%s)' % intListToString( statusIDs )
+    # Files without visible replicas are still found thanks to the outer joins
+    if not self.db.lfnPfnConvention or self.db.lfnPfnConvention == "Weak":
+      req = "SELECT FF.DirID,FF.FileName,FR.SEID,FI.PFN FROM FC_Files AS FF"
+      req += " LEFT JOIN FC_Replicas AS FR ON ( FF.FileID=FR.FileID%s )" % statusCondition
+      req += " LEFT JOIN FC_ReplicaInfo AS FI ON FR.RepID=FI.RepID"
+    else:
+      req = "SELECT FF.DirID,FF.FileName,FR.SEID,'' FROM FC_Files AS FF"
+      req += " LEFT JOIN FC_Replicas AS FR ON ( FF.FileID=FR.FileID%s )" % statusCondition
+
+    # Chunks of about 1000 LFNs, a directory is never split
+    chunks = []
+    wheres = []
+    nFiles = 0
+    for dirID, dirPath in directoryPaths.items():
+      wheres.append( "( FF.DirID=%d AND FF.FileName IN (%s) )" % ( dirID, stringListToString( dirDict[dirPath] ) ) )
+      nFiles += len( dirDict[dirPath] )
+      if nFiles >= 1000:
+        chunks.append( wheres )
+        wheres = []
+        nFiles = 0
+    if wheres:
+      chunks.append( wheres )
+
+    replicas = {}
+    refreshed = False
+    for wheres in chunks:
+      result = self.db._query( "%s WHERE %s" % ( req, " OR ".join( wheres ) ), connection )
+      if not result['OK']:
+        return result
+      for dirID, fileName, seID, pfn in result['Value']:
+        fname = '%s/%s' % ( directoryPaths[dirID], fileName )
+        fname = fname.replace('//','/')
+        lfnReplicas = replicas.setdefault( fname, {} )
+        if seID is None:
+          continue
+        if not seID in self.db.seids and not refreshed:
+          # SE added by another service instance
+          self.db.seManager._refreshSEs()
+          refreshed = True
+        res = self.db.seManager.getSEName( seID )
+        if not res['OK']:
+          continue
+        lfnReplicas[res['Value']] = pfn or ''
+
+    # Files without visible replicas are in replicas with {}, all keyed by their normalized LFN
+    for dirPath in dirDict:
+      for fileName in dirDict[dirPath]:
+        fname = '%s/%s' % (dirPath,fileName)
+        fname = fname.replace('//','/')
+        if not fname in replicas and not fname in failed:
+          failed[fname] = "No such file"
+
+    return S_OK( ( replicas, failed ) )
+
+  def _getDirectoryReplicas( self, dirID, allStatus=False, fileNames=None ):
+    """ Get replicas for files in a given directory, or only for the given fileNames.
+        Returns a generator of S_OK( batch of ( FileName, FileID, SEID, PFN ) rows ) or S_ERROR.
+        The rows are streamed on a dedicated connection which stays busy until the
+        generator is exhausted, so no other queries should be made while iterating
+    """
+    replicaStatusIDs = []
+    if not allStatus:
+      for status in self.db.visibleReplicaStatus:
+        result = self._getStatusInt( status )
         if result['OK']:
           replicaStatusIDs.append( result['Value'] )
     fileStatusIDs = []
     if not allStatus:
       for status in self.db.visibleFileStatus:
-        result = self._getStatusInt( status, connection=connection )
+        result = self._getStatusInt( status )
         if result['OK']:
           fileStatusIDs.append( result['Value'] )
     
@@ -781,6 +894,7 @@ class FileManager(FileManagerBase):
         req += ' AND FR.Status in (%s)' % intListToString( replicaStatusIDs )
       if fileStatusIDs:
         req += ' AND FF.Status in (%s)' % intListToString( fileStatusIDs )                                                                             
+    if fileNames:
+      req += ' AND FF.FileName IN (%s)' % stringListToString( fileNames )
     
-    result = self.db._query( req, connection )
-    return result
+    return self.db._queryIter( req )
@@ -168,6 +168,11 @@ class FileManagerBase:
     """
     return S_ERROR( "To be implemented on derived class" )
 
+  def _getDirectoryFileNames( self, dirID, startName, maxItems, allStatus = False, connection = False ):
+    """To be implemented on derived class
+    """
+    return S_ERROR( "To be implemented on derived class" )
+
   def _getFileLFNs(self,fileIDs):
     """ Get the file LFNs for a given list of file IDs
     """
@@ -377,31 +382,118 @@ class FileManagerBase:
 
     return S_OK( {'Successful':successful, 'Failed':failed} )
 
-  def _updateDirectoryUsage( self, directorySEDict, change, connection = False ):
-    connection = self._getConnection( connection )
-    for directoryID in directorySEDict.keys():
+  def __getDirectoryUsageRequest( self, directorySEDict, change ):
+    """ Get the request applying the change ( '+' or '-' ) of the usage given as
+        { DirID : { SEID : { 'Files' : n, 'Size' : bytes } } }, SEID 0 being the logical usage,
+        to the directories and all their ancestors. The changes are summed up per directory
+        and SE to update each FC_DirectoryUsage row only once
+    """
+    sign = 1
+    if change == '-':
+      sign = -1
+    usageDeltas = {}
+    for directoryID, dirDict in directorySEDict.items():
       result = self.db.dtree.getPathIDsByID( directoryID )
       if not result['OK']:
         return result
-      parentIDs = result['Value']
-      dirDict = directorySEDict[directoryID]
-      for seID in dirDict.keys() :
-        seDict = dirDict[seID]
-        files = seDict['Files']
-        size = seDict['Size']
-        insertTuples = []
-        for dirID in parentIDs:
-          insertTuples.append( '(%d,%d,%d,%d,UTC_TIMESTAMP())' % ( dirID, seID, size, files ) )
-    
-        req = "INSERT INTO FC_DirectoryUsage (DirID,SEID,SESize,SEFiles,LastUpdate) "
-        req += "VALUES %s" % ','.join( insertTuples )
-        req += " ON DUPLICATE KEY UPDATE SESize=SESize%s%d, SEFiles=SEFiles%s%d, LastUpdate=UTC_TIMESTAMP() " \
-                                                           % ( change, size, change, files )
-        res = self.db._update( req )
-        if not res['OK']:
-          gLogger.warn( "Failed to update FC_DirectoryUsage", res['Message'] )
-    return S_OK()
-    
+      for dirID in result['Value']:
+        for seID, seDict in dirDict.items():
+          delta = usageDeltas.setdefault( ( dirID, seID ), [0, 0] )
+          delta[0] += sign * seDict['Size']
+          delta[1] += sign * seDict['Files']
+    # Rows are always updated in the same order to avoid dead locks between transactions
+    insertTuples = []
+    for dirID, seID in sorted( usageDeltas ):
+      size, files = usageDeltas[( dirID, seID )]
+      if size or files:
+        insertTuples.append( '(%d,%d,%d,%d,UTC_TIMESTAMP())' % ( dirID, seID, size, files ) )
+    if not insertTuples:
+      return S_OK( '' )
+    req = "INSERT INTO FC_DirectoryUsage (DirID,SEID,SESize,SEFiles,LastUpdate) "
+    req += "VALUES %s" % ','.join( insertTuples )
+    req += " ON DUPLICATE KEY UPDATE SESize=SESize+VALUES(SESize), SEFiles=SEFiles+VALUES(SEFiles), "
+    req += "LastUpdate=UTC_TIMESTAMP()"
+    return S_OK( req )
+
+  def _getUsageForUpdate( self, fileIDs, replicaTuples = None ):
+    """ Lock the given files and their replicas, or only the ( FileID, SEID ) replicas if
+        replicaTuples is given, and get the directory usage they account for. To be called
+        in the transaction removing them: a concurrent removal waits for it and then finds
+        nothing left to subtract
+    """
+    directorySEDict = {}
+    if not fileIDs:
+      return S_OK( directorySEDict )
+    req = "SELECT FileID,DirID,Size FROM FC_Files WHERE FileID IN (%s) FOR UPDATE" % intListToString( fileIDs )
+    res = self.db._query( req )
+    if not res['OK']:
+      return res
+    fileDict = {}
+    for fileID, dirID, size in res['Value']:
+      fileDict[fileID] = ( dirID, int( size ) )
+      if replicaTuples is None:
+        seDict = directorySEDict.setdefault( dirID, {} ).setdefault( 0, {'Files':0,'Size':0} )
+        seDict['Size'] += int( size )
+        seDict['Files'] += 1
+    if not fileDict:
+      return S_OK( directorySEDict )
+    req = "SELECT FileID,SEID FROM FC_Replicas WHERE FileID IN (%s)" % intListToString( fileDict.keys() )
+    if replicaTuples is not None:
+      if not replicaTuples:
+        return S_OK( directorySEDict )
+      req += " AND (FileID,SEID) IN (%s)" % ','.join( [ "(%d,%d)" % tuple_ for tuple_ in replicaTuples ] )
+    res = self.db._query( "%s FOR UPDATE" % req )
+    if not res['OK']:
+      return res
+    for fileID, seID in res['Value']:
+      dirID, size = fileDict[fileID]
+      seDict = directorySEDict.setdefault( dirID, {} ).setdefault( seID, {'Files':0,'Size':0} )
+      seDict['Size'] += size
+      seDict['Files'] += 1
+    return S_OK( directorySEDict )
+
+  def _changeWithDirectoryUsage( self, changeFunction, directorySEDict, change ):
+    """ Call changeFunction() modifying files or replicas and update the corresponding
+        directory usage in the same transaction, so that the usage is always exact.
+        directorySEDict can also be a function returning it, called in the transaction
+        before the change, e.g. to lock the rows to remove with _getUsageForUpdate
+    """
+    result = self.db.transactionStart()
+    if not result['OK']:
+      return result
+    try:
+      return self.__changeWithDirectoryUsage( changeFunction, directorySEDict, change )
+    except Exception, x:
+      gLogger.exception( "Exception while changing the directory usage" )
+      self.db.transactionRollback()
+      return S_ERROR( "Failed to change the directory usage: %s" % str( x ) )
+
+  def __changeWithDirectoryUsage( self, changeFunction, directorySEDict, change ):
+    """ Body of _changeWithDirectoryUsage, run in the transaction
+    """
+    if callable( directorySEDict ):
+      result = directorySEDict()
+    else:
+      result = S_OK( directorySEDict )
+    if result['OK']:
+      result = self.__getDirectoryUsageRequest( result['Value'], change )
+    if not result['OK']:
+      self.db.transactionRollback()
+      return result
+    usageRequest = result['Value']
+    result = changeFunction()
+    if result['OK'] and usageRequest:
+      res = self.db._update( usageRequest )
+      if not res['OK']:
+        result = res
+    if not result['OK']:
+      self.db.transactionRollback()
+      return result
+    res = self.db.transactionCommit()
+    if not res['OK']:
+      return res
+    return result
+
   def _populateFileAncestors( self, lfns, connection = False ):
     connection = self._getConnection( connection )
     successful = {}
@@ -663,28 +755,8 @@ class FileManagerBase:
     lfns = res['Value']['Successful']
     for lfn, lfnDict in lfns.items():
       fileIDLfns[lfnDict['FileID']] = lfn
-
-    # Resolve the replicas to calculate reduction in storage usage
-    res = self._getFileReplicas( fileIDLfns.keys(), connection = connection )
-    if not res['OK']:
-      return res
-    directorySESizeDict = {}
-    for fileID, seDict in res['Value'].items():
-      dirID = lfns[fileIDLfns[fileID]]['DirID']
-      size = lfns[lfn]['Size']
-      directorySESizeDict.setdefault( dirID, {} )
-      directorySESizeDict[dirID].setdefault( 0, {'Files':0,'Size':0} )
-      directorySESizeDict[dirID][0]['Size'] += size
-      directorySESizeDict[dirID][0]['Files'] += 1
-      for seName in seDict.keys():
-        res = self.db.seManager.findSE( seName )
-        if not res['OK']:
-          return res
-        seID = res['Value']
-        size = lfns[fileIDLfns[fileID]]['Size']
-        directorySESizeDict[dirID].setdefault( seID, {'Files':0,'Size':0} )
-        directorySESizeDict[dirID][seID]['Size'] += size
-        directorySESizeDict[dirID][seID]['Files'] += 1
+    if not fileIDLfns:
+      return S_OK( {"Successful":successful, "Failed":failed} )
 
     #Remove files from Ancestor tables
     res = self._removeFileAncestors(fileIDLfns.keys(), connection = connection )
@@ -694,14 +766,14 @@ class FileManagerBase:
       for fid, reason in res['Value']['Failed'].items():
         failed[fileIDLfns[fid]] = reason
         
-    # Now do removal  
-    res = self._deleteFiles( fileIDLfns.keys(), connection = connection )
+    # Now do removal together with the directory usage update, the usage to subtract
+    # is taken from the files and replicas locked in the removal transaction
+    res = self._changeWithDirectoryUsage( lambda: self._deleteFiles( fileIDLfns.keys(), connection = connection ),
+                                          lambda: self._getUsageForUpdate( fileIDLfns.keys() ), '-' )
     if not res['OK']:
       for lfn in fileIDLfns.values():
         failed[lfn] = res['Message']
     else:
-      # Update the directory usage
-      self._updateDirectoryUsage( directorySESizeDict, '-', connection = connection )
       for lfn in fileIDLfns.values():
         successful[lfn] = True
     return S_OK( {"Successful":successful, "Failed":failed} )
@@ -851,6 +923,14 @@ class FileManagerBase:
         failed[lfn] = res['Message']
     return S_OK( {'Successful':successful, 'Failed':failed} )
 
+  def __setExistingReplicaHost( self, fileID, se, newSE, connection ):
+    """ Set the replica host, failing if there is no replica to move
+    """
+    res = self._setReplicaHost( fileID, se, newSE, connection = connection )
+    if res['OK'] and not res['Value']:
+      return S_ERROR( "Replica does not exist" )
+    return res
+
   def setReplicaHost( self, lfns, connection = False ):
     """ Set replica host in the catalog """
     connection = self._getConnection( connection )
@@ -863,12 +943,30 @@ class FileManagerBase:
         continue
       newSE = info['NewSE']
       se = info['SE']
-      res = self._findFiles( [lfn], ['FileID'], connection = connection )
+      res = self._findFiles( [lfn], ['FileID', 'DirID', 'Size'], connection = connection )
       if not res['Value']['Successful'].has_key( lfn ):
         failed[lfn] = res['Value']['Failed'][lfn]
         continue
-      fileID = res['Value']['Successful'][lfn]['FileID']
-      res = self._setReplicaHost( fileID, se, newSE, connection = connection )
+      fileDict = res['Value']['Successful'][lfn]
+      fileID = fileDict['FileID']
+      seIDs = []
+      for seName in ( se, newSE ):
+        res = self.db.seManager.findSE( seName )
+        if not res['OK']:
+          break
+        seIDs.append( res['Value'] )
+      if not res['OK']:
+        failed[lfn] = res['Message']
+        continue
+      seID, newSEID = seIDs
+      if seID == newSEID:
+        successful[lfn] = True
+        continue
+      # The replica usage moves from the old SE to the new one
+      directorySESizeDict = { fileDict['DirID'] : { seID : { 'Files' : -1, 'Size' : -fileDict['Size'] },
+                                                    newSEID : { 'Files' : 1, 'Size' : fileDict['Size'] } } }
+      res = self._changeWithDirectoryUsage( lambda: self.__setExistingReplicaHost( fileID, se, newSE, connection ),
+                                            directorySESizeDict, '+' )
       if res['OK']:
         successful[lfn] = res['Value']
       else:
@@ -988,10 +1086,10 @@ class FileManagerBase:
     result = S_OK( replicas )
     return result
 
-  def getReplicas( self, lfns, allStatus, connection = False ):
-    """ Get file replicas from the catalog """
-    connection = self._getConnection( connection )
-
+  def _getLFNReplicas( self, lfns, allStatus, connection = False ):
+    """ Get the { SE : PFN } replicas of the given LFNs, returns S_OK( ( replicas, failed ) ).
+        Derived classes can resolve the LFNs and their replicas in bulk
+    """
     # Get FileID <-> LFN correspondence first
     res = self._findFileIDs( lfns, connection = connection )
     if not res['OK']:
@@ -1004,7 +1102,16 @@ class FileManagerBase:
     result = self.__getReplicasForIDs( fileIDLFNs, allStatus, connection)
     if not result['OK']:
       return result
-    replicas = result['Value']
+    return S_OK( ( result['Value'], failed ) )
+
+  def getReplicas( self, lfns, allStatus, connection = False ):
+    """ Get file replicas from the catalog """
+    connection = self._getConnection( connection )
+
+    result = self._getLFNReplicas( lfns, allStatus, connection = connection )
+    if not result['OK']:
+      return result
+    replicas, failed = result['Value']
     
     result = S_OK( { "Successful": replicas, 'Failed': failed } )
     
@@ -1114,10 +1221,38 @@ class FileManagerBase:
       return S_OK(self.statusDict[statusID])
     return S_OK('Unknown')
 
-  def getFilesInDirectory( self, dirID, verbose = False, connection = False ):
+  def __getFileNamesPage( self, dirID, startName, maxItems, allStatus, connection ):
+    """ Get the names of at most maxItems files of the directory following startName,
+        and the continuation to get the next ones ( '' if there are no more )
+    """
+    res = self._getDirectoryFileNames( dirID, startName, maxItems, allStatus = allStatus, connection = connection )
+    if not res['OK']:
+      return res
+    fileNames = res['Value']
+    continuation = ''
+    if len( fileNames ) == maxItems:
+      continuation = fileNames[-1]
+    return S_OK( ( fileNames, continuation ) )
+
+  def getFilesInDirectory( self, dirID, verbose = False, connection = False, startName = '', maxItems = 0 ):
+    """ Get the files of the given directory with their metadata. If maxItems is given,
+        only the maxItems files following startName in name order are returned and
+        the name to start the next page from is set in result['Continuation']
+    """
     connection = self._getConnection( connection )
     files = {}
-    res = self._getDirectoryFiles( dirID, [], ['FileID', 'Size',
+    fileNames = []
+    continuation = ''
+    if maxItems:
+      res = self.__getFileNamesPage( dirID, startName, maxItems, False, connection )
+      if not res['OK']:
+        return res
+      fileNames, continuation = res['Value']
+      if not fileNames:
+        res = S_OK( files )
+        res['Continuation'] = continuation
+        return res
+    res = self._getDirectoryFiles( dirID, fileNames, ['FileID', 'Size',
                                                'Checksum', 'ChecksumType',
                                                'Type', 'UID',
                                                'GID', 'CreationDate',
@@ -1141,29 +1276,50 @@ class FileManagerBase:
         fileName = fileIDNames[fileID]
         files[fileName]['Replicas'] = seDict
         
-    return S_OK( files )
+    result = S_OK( files )
+    if maxItems:
+      result['Continuation'] = continuation
+    return result
 
-  def getDirectoryReplicas( self, dirID, path, allStatus = False, connection = False ):
-    
+  def getDirectoryReplicas( self, dirID, path, allStatus = False, connection = False, startName = '', maxItems = 0 ):
+    """ Get the { SE : PFN } replicas of the files of the given directory. If maxItems
+        is given, it is done for the maxItems files following startName in name order
+        and the name to start the next page from is set in result['Continuation']
+    """
     connection = self._getConnection( connection )
-    result = self._getDirectoryReplicas( dirID, allStatus, connection)
-    if not result['OK']:
-      return result
-    
     resultDict = {}
     seDict = {}
-    for fileName, fileID, seID, pfn in result['Value']:
-      resultDict.setdefault( fileName, {} )
-      if not seID in seDict:
-        res = self.db.seManager.getSEName(seID)
-        if not res['OK']:
-          seDict[seID] = 'Unknown'
-        else:  
-          seDict[seID] = res['Value']
-      se = seDict[seID]    
-      resultDict[fileName][se] = pfn
-
-    return S_OK( resultDict )
+    fileNames = None
+    continuation = ''
+    if maxItems:
+      res = self.__getFileNamesPage( dirID, startName, maxItems, allStatus, connection )
+      if not res['OK']:
+        return res
+      fileNames, continuation = res['Value']
+      if not fileNames:
+        res = S_OK( resultDict )
+        res['Continuation'] = continuation
+        return res
+    # SE names are resolved once the streaming cursor is closed, so its connection
+    # is given back to the pool before making any other query
+    for result in self._getDirectoryReplicas( dirID, allStatus, fileNames = fileNames ):
+      if not result['OK']:
+        return result
+      for fileName, fileID, seID, pfn in result['Value']:
+        resultDict.setdefault( fileName, {} )[seID] = pfn
+    for seID in set( [ seID for seIDs in resultDict.values() for seID in seIDs ] ):
+      res = self.db.seManager.getSEName( seID )
+      if not res['OK']:
+        seDict[seID] = 'Unknown'
+      else:  
+        seDict[seID] = res['Value']
+    for fileName, seIDs in resultDict.items():
+      resultDict[fileName] = dict( [ ( seDict[seID], pfn ) for seID, pfn in seIDs.items() ] )
+
+    result = S_OK( resultDict )
+    if maxItems:
+      result['Continuation'] = continuation
+    return result
 
   def _getFileDirectories( self, lfns ):
     dirDict = {}
@@ -118,6 +118,30 @@ class FileManagerFlat(FileManagerBase):
       files[fileName] = dict(zip(metadata,tuple_[1:]))
     return S_OK(files)
 
+  def _getDirectoryFileNames(self,dirID,startName,maxItems,allStatus=False,connection=False):
+    """ Get the names of at most maxItems files of the directory coming after startName
+        in name order, using the ( DirID, FileName ) index
+    """
+    connection = self._getConnection(connection)
+    req = "SELECT FileName FROM FC_Files WHERE DirID=%d" % dirID
+    if not allStatus:
+      statusIDs = []
+      res = self.db.getStatusInt('AprioriGood',connection=connection)
+      if res['OK']:
+        statusIDs.append(res['Value'])
+      if statusIDs:
+        req = "%s AND Status IN (%s)" % (req,intListToString(statusIDs))
+    if startName:
+      res = self.db._escapeString(startName)
+      if not res['OK']:
+        return res
+      req = "%s AND FileName > %s" % (req,res['Value'])
+    req = "%s ORDER BY FileName LIMIT %d" % (req,maxItems)
+    res = self.db._query(req,connection)
+    if not res['OK']:
+      return res
+    return S_OK([ row[0] for row in res['Value'] ])
+
   ######################################################
   #
   # _addFiles related methods
@@ -128,6 +152,7 @@ class FileManagerFlat(FileManagerBase):
     # Add the files
     failed = {}
     directoryFiles = {}
+    directorySESizeDict = {}
     insertTuples = []
     res = self.db.getStatusInt('AprioriGood',connection=connection)
     statusID = 0
@@ -145,9 +170,13 @@ class FileManagerFlat(FileManagerBase):
       if not directoryFiles.has_key(dirName):
         directoryFiles[dirName] = []
       directoryFiles[dirName].append(fileName)  
+      directorySESizeDict.setdefault( dirID, {} )
+      directorySESizeDict[dirID].setdefault( 0, {'Files':0,'Size':0} )
+      directorySESizeDict[dirID][0]['Size'] += size
+      directorySESizeDict[dirID][0]['Files'] += 1
       insertTuples.append("(%d,%d,%d,%d,%d,'%s','%s','%s','%s',UTC_TIMESTAMP(),UTC_TIMESTAMP(),%d)" % (dirID,size,uid,gid,statusID,fileName,guid,checksum,checksumtype,self.db.umask))
     req = "INSERT INTO FC_Files (DirID,Size,UID,GID,Status,FileName,GUID,Checksum,ChecksumType,CreationDate,ModificationDate,Mode) VALUES %s" % (','.join(insertTuples))
-    res = self.db._update(req,connection)
+    res = self._changeWithDirectoryUsage( lambda: self.db._update(req,connection), directorySESizeDict, '+' )
     if not res['OK']:
       return res
     # Get the fileIDs for the inserted files
@@ -221,7 +250,6 @@ class FileManagerFlat(FileManagerBase):
     if master:
       replicaType = 'Master'
     insertTuples = {}
-    deleteTuples = []
     successful = {}
     failed = {}
     directorySESizeDict = {}  
@@ -250,17 +278,14 @@ class FileManagerFlat(FileManagerBase):
       directorySESizeDict[dirID][seID]['Size'] += lfns[lfn]['Size']
       directorySESizeDict[dirID][seID]['Files'] += 1
       insertTuples[lfn] = ("(%d,%d,%d,'%s',UTC_TIMESTAMP(),UTC_TIMESTAMP(),'%s')" % (fileID,seID,statusID,replicaType,pfn))
-      deleteTuples.append((fileID,seID))
     if insertTuples:
       req = "INSERT INTO FC_Replicas (FileID,SEID,Status,RepType,CreationDate,ModificationDate,PFN) VALUES %s" % ','.join(insertTuples.values())
-      res = self.db._update(req,connection)
+      # The directory usage is updated in the same transaction
+      res = self._changeWithDirectoryUsage( lambda: self.db._update(req,connection), directorySESizeDict, '+' )
       if not res['OK']:
-        self.__deleteReplicas(deleteTuples,connection=connection)
         for lfn in insertTuples.keys():
           failed[lfn] = res['Message']
       else:
-        # Update the directory usage
-        self._updateDirectoryUsage(directorySESizeDict,'+',connection=connection)
         for lfn in insertTuples.keys():
           successful[lfn] = True
     return S_OK({'Successful':successful,'Failed':failed})
@@ -294,30 +319,21 @@ class FileManagerFlat(FileManagerBase):
     failed = res['Value']['Failed']
     lfnFileIDDict = res['Value']['Successful']
     toRemove = []
-    directorySESizeDict = {}
+    fileIDs = []
     for lfn,fileDict in lfnFileIDDict.items():
       fileID = fileDict['FileID']
-      se = lfns[lfn]['SE']
-      toRemove.append((fileID,se))
-      #Now prepare the storage usage dict
-      res = self.db.seManager.findSE(se)
+      res = self.db.seManager.findSE(lfns[lfn]['SE'])
       if not res['OK']:
         return res
-      seID = res['Value']
-      dirID = fileDict['DirID']
-      if not directorySESizeDict.has_key(dirID):
-        directorySESizeDict[dirID] = {}
-      if not directorySESizeDict[dirID].has_key(seID):
-        directorySESizeDict[dirID][seID] = {'Files':0,'Size':0}
-      directorySESizeDict[dirID][seID]['Size'] += fileDict['Size']
-      directorySESizeDict[dirID][seID]['Files'] += 1
-    res = self.__deleteReplicas(toRemove)
+      toRemove.append((fileID,res['Value']))
+      fileIDs.append(fileID)
+    # The usage to subtract is taken from the replicas locked in the removal transaction
+    res = self._changeWithDirectoryUsage( lambda: self.__deleteReplicas(toRemove),
+                                          lambda: self._getUsageForUpdate(fileIDs,toRemove), '-' )
     if not res['OK']:
       for lfn in lfnFileIDDict.keys():
         failed[lfn] = res['Message']
     else:
-      # Update the directory usage
-      self._updateDirectoryUsage(directorySESizeDict,'-',connection=connection)
       for lfn in lfnFileIDDict.keys():
         successful[lfn] = True
     return S_OK({'Successful':successful,'Failed':failed})
@@ -379,7 +395,7 @@ class FileManagerFlat(FileManagerBase):
   # _getFileReplicas related methods
   #
 
-  def _getFileReplicas(self,fileIDs,fields=['PFN'],connection=False):
+  def _getFileReplicas(self,fileIDs,fields=['PFN'],allStatus=False,connection=False):
     connection = self._getConnection(connection)
     if not fileIDs:
       return S_ERROR("No such file or directory")
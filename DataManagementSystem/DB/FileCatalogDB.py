@@ -48,6 +48,7 @@ class FileCatalogDB(DB):
     self.dmeta = None
     self.fmeta = None
     self.statusDict = {}
+    self.maxDirectoryPageSize = 10000
 
   def setConfig(self,databaseConfig):
 
@@ -73,6 +74,7 @@ class FileCatalogDB(DB):
     self.validReplicaStatus = databaseConfig['ValidReplicaStatus']
     self.visibleFileStatus = databaseConfig['VisibleFileStatus']
     self.visibleReplicaStatus = databaseConfig['VisibleReplicaStatus']
+    self.maxDirectoryPageSize = databaseConfig.get( 'MaxDirectoryPageSize', 10000 )
 
     # Obtain the plugins to be used for DB interaction
     self. objectLoader = ObjectLoader()
@@ -96,6 +98,8 @@ class FileCatalogDB(DB):
     if not result['OK']:
       return result
     self.dtree = result['Value']
+    self.dtree.configureCache( databaseConfig.get( 'DirectoryCacheSize', 10000 ),
+                               databaseConfig.get( 'DirectoryCacheLifeTime', 300 ) )
     
     result = self.__loadCatalogComponent( databaseConfig['FileManager'] )
     if not result['OK']:
@@ -879,6 +883,54 @@ class FileCatalogDB(DB):
     successful = res['Value']['Successful']
     return S_OK( { 'Successful':successful, 'Failed':failed, 'SEPrefixes': res['Value'].get( 'SEPrefixes', {} )} )
 
+  def __checkDirectoryPage( self, path, pageSize, credDict ):
+    """ Check the read access to a directory listed by pages, get the path and the page size to use
+    """
+    res = self._checkPathPermissions( 'Read', path, credDict )
+    if not res['OK']:
+      return res
+    if not res['Value']['Successful']:
+      return S_ERROR( res['Value']['Failed'].values()[0] )
+    path = res['Value']['Successful'].keys()[0]
+    if pageSize <= 0 or pageSize > self.maxDirectoryPageSize:
+      pageSize = self.maxDirectoryPageSize
+    return S_OK( ( path, pageSize ) )
+
+  def listDirectoryPage(self,path,credDict,verbose=False,continuation='',pageSize=1000):
+    """
+        List one page of a directory
+        :param str path: directory to list
+        :param creDict credential
+        :param str continuation: continuation returned with the previous page, empty for the first one
+        :param int pageSize: maximum number of files in the page
+
+        :return dictionary indexed "Files", "Datasets", "SubDirs", "Links" and "Continuation",
+         the subdirectories and datasets are only given with the first page and the continuation
+         is empty for the last one
+    """
+    res = self.__checkDirectoryPage( path, pageSize, credDict )
+    if not res['OK']:
+      return res
+    path, pageSize = res['Value']
+    return self.dtree.listDirectoryPage( path, verbose, continuation, pageSize )
+
+  def getDirectoryReplicasPage(self,path,allStatus,credDict,continuation='',pageSize=1000):
+    """
+        Get the replicas of one page of files of a directory
+        :param str path: directory
+        :param creDict credential
+        :param str continuation: continuation returned with the previous page, empty for the first one
+        :param int pageSize: maximum number of files in the page
+
+        :return dictionary indexed "Files" ( file name -> { SE : PFN } ), "SubDirs" ( only with
+         the first page ), "Continuation" ( empty for the last page ) and "SEPrefixes"
+    """
+    res = self.__checkDirectoryPage( path, pageSize, credDict )
+    if not res['OK']:
+      return res
+    path, pageSize = res['Value']
+    return self.dtree.getDirectoryReplicasPage( path, allStatus, continuation, pageSize )
+
   def getDirectorySize(self,lfns,longOutput,fromFiles,credDict):
     """
         Get the sizes of a list of directories
@@ -1014,6 +1066,14 @@ class FileCatalogDB(DB):
     counterDict.update(res['Value'])
     return S_OK(counterDict)
 
+  def getDirectoryCacheStats(self,credDict):
+    res = self._checkAdminPermission(credDict)
+    if not res['OK']:
+      return res
+    if not res['Value']:
+      return S_ERROR("Permission denied")
+    return self.dtree.getCacheStats()
+
   ########################################################################
   #
   #  Security based methods
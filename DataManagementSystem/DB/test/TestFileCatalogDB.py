@@ -3,6 +3,7 @@ Script.parseCommandLine()
 
 import unittest
 import itertools
+import time
 from DIRAC.DataManagementSystem.DB.FileCatalogDB import FileCatalogDB
 
 seName = "mySE"
@@ -353,6 +354,221 @@ class ReplicaCase( FileCatalogDBTestCase ):
 
 
 
+class GetReplicasCase( FileCatalogDBTestCase ):
+
+  def test_getReplicas( self ):
+    """
+      Tests getReplicas for LFNs in several directories, with and without visible replicas,
+      missing, and not normalized
+    """
+    replicaFiles = { testDir + '/replicas1/file1' : [ 'testSE' ],
+                     testDir + '/replicas2/file2' : [ 'testSE', 'otherSE' ],
+                     testDir + '/replicas2/file3' : [ 'testSE' ] }
+    guid = 4000
+    for lfn, seList in replicaFiles.items():
+      guid += 1
+      result = self.db.addFile( { lfn: { 'PFN': lfn, 'SE': seList[0], 'Size':123, 'GUID':guid, 'Checksum':'0' } },
+                                credDict )
+      self.assert_( result['OK'] and lfn in result['Value']['Successful'], "addFile failed %s" % result )
+      for se in seList[1:]:
+        result = self.db.addReplica( { lfn : { "PFN" : lfn, "SE" : se } }, credDict )
+        self.assert_( result['OK'] and lfn in result['Value']['Successful'], "addReplica failed %s" % result )
+    # No visible replica left
+    hiddenFile = testDir + '/replicas2/file3'
+    result = self.db.setReplicaStatus( { hiddenFile : { "Status" : "Trash", "SE" : "testSE" } }, credDict )
+    self.assert_( result['OK'] and hiddenFile in result['Value']['Successful'], "setReplicaStatus failed %s" % result )
+
+    missingFile = testDir + '/replicas2/missing'
+    queried = [ testDir + '/replicas1//file1', testDir + '/replicas2/file2', hiddenFile, missingFile, nonExistingFile ]
+    result = self.db.getReplicas( queried, False, credDict )
+    self.assert_( result['OK'], "getReplicas failed %s" % result )
+    successful = result['Value']['Successful']
+    failed = result['Value']['Failed']
+    self.assertEqual( sorted( successful ), sorted( replicaFiles ) )
+    for lfn in replicaFiles:
+      if lfn == hiddenFile:
+        self.assertEqual( successful[lfn], {} )
+      else:
+        self.assertEqual( sorted( successful[lfn] ), sorted( replicaFiles[lfn] ) )
+    self.assertEqual( sorted( failed ), sorted( [ missingFile, nonExistingFile ] ) )
+
+    result = self.db.getReplicas( [ hiddenFile ], True, credDict )
+    self.assert_( result['OK'], "getReplicas failed %s" % result )
+    self.assertEqual( result['Value']['Successful'].keys(), [ hiddenFile ] )
+    self.assertEqual( result['Value']['Successful'][hiddenFile].keys(), [ 'testSE' ] )
+
+    result = self.db.removeFile( replicaFiles.keys(), credDict )
+    self.assert_( result['OK'], "removeFile failed %s" % result )
+    for path in ( testDir + '/replicas1', testDir + '/replicas2' ):
+      result = self.db.removeDirectory( [path], credDict )
+      self.assert_( result["OK"], "removeDirectory failed: %s" % result )
+
+
+class DirectoryUsageCase( FileCatalogDBTestCase ):
+
+  def __getUsage( self, path ):
+    """ Get the non empty FC_DirectoryUsage counters of a directory as { SE : ( size, files ) },
+        the logical usage being given for SE ''
+    """
+    result = self.db.dtree.findDir( path )
+    self.assert_( result['OK'] and result['Value'], "findDir failed for %s: %s" % ( path, result ) )
+    result = self.db._query( "SELECT SEID,SESize,SEFiles FROM FC_DirectoryUsage WHERE DirID=%d" % result['Value'] )
+    self.assert_( result['OK'], "Failed to get the usage of %s: %s" % ( path, result ) )
+    usage = {}
+    for seID, size, files in result['Value']:
+      if not size and not files:
+        continue
+      seName = ''
+      if seID:
+        seName = self.db.seManager.getSEName( seID )['Value']
+      usage[seName] = ( int( size ), int( files ) )
+    return usage
+
+  def test_directoryUsage( self ):
+    """
+      Tests that the directory usage follows the file and replica changes,
+      and is not changed twice by a repeated change
+    """
+    usageDir = testDir + '/usage'
+    usageFile = usageDir + '/usagefile'
+    result = self.db.addFile( { usageFile: { 'PFN': 'usagefile',
+                                          'SE': 'testSE' ,
+                                          'Size':123,
+                                          'GUID':3000,
+                                          'Checksum':'0' } }, credDict )
+    self.assert_( result['OK'] and usageFile in result['Value']['Successful'], "addFile failed %s" % result )
+    self.assertEqual( self.__getUsage( usageDir ), { '' : ( 123, 1 ), 'testSE' : ( 123, 1 ) } )
+
+    for _i in range( 2 ):
+      result = self.db.addReplica( {usageFile : {"PFN" : "usagefile", "SE" : "otherSE"}}, credDict )
+      self.assert_( result['OK'] and usageFile in result['Value']['Successful'], "addReplica failed %s" % result )
+      self.assertEqual( self.__getUsage( usageDir ), { '' : ( 123, 1 ), 'testSE' : ( 123, 1 ), 'otherSE' : ( 123, 1 ) } )
+
+    result = self.db.setReplicaHost( {usageFile : {"SE" : "otherSE", "NewSE" : "thirdSE"}}, credDict )
+    self.assert_( result['OK'] and usageFile in result['Value']['Successful'], "setReplicaHost failed %s" % result )
+    self.assertEqual( self.__getUsage( usageDir ), { '' : ( 123, 1 ), 'testSE' : ( 123, 1 ), 'thirdSE' : ( 123, 1 ) } )
+    result = self.db.setReplicaHost( {usageFile : {"SE" : "otherSE", "NewSE" : "thirdSE"}}, credDict )
+    self.assert_( result['OK'] and usageFile in result['Value']['Failed'], "setReplicaHost should fail for a moved replica %s" % result )
+    self.assertEqual( self.__getUsage( usageDir ), { '' : ( 123, 1 ), 'testSE' : ( 123, 1 ), 'thirdSE' : ( 123, 1 ) } )
+
+    for _i in range( 2 ):
+      result = self.db.removeReplica( {usageFile : { "SE" : "thirdSE"}}, credDict )
+      self.assert_( result['OK'] and usageFile in result['Value']['Successful'], "removeReplica failed %s" % result )
+      self.assertEqual( self.__getUsage( usageDir ), { '' : ( 123, 1 ), 'testSE' : ( 123, 1 ) } )
+
+    for _i in range( 2 ):
+      result = self.db.removeFile( [usageFile], credDict )
+      self.assert_( result['OK'] and usageFile in result['Value']['Successful'], "removeFile failed %s" % result )
+      self.assertEqual( self.__getUsage( usageDir ), {} )
+
+    result = self.db.removeDirectory( [usageDir], credDict )
+    self.assert_( result["OK"], "removeDirectory failed: %s" % result )
+
+
+class MetadataIndexCase( FileCatalogDBTestCase ):
+
+  metaDir = testDir + '/metaidx'
+  # Deepest first, to be removed in that order
+  metaSubDirs = [ 'a/b/c', 'a/b', 'a', 'd/e', 'd' ]
+
+  def __findByTables( self, queryDict, pathSelection ):
+    return self.db.dmeta._DirectoryMetadata__findDirIDsByMetaTables( queryDict, pathSelection )
+
+  def __findByIndex( self, queryDict, pathSelection ):
+    return self.db.dmeta._DirectoryMetadata__findDirIDsByMetaIndex( queryDict, pathSelection, credDict )
+
+  def __waitForIndexes( self, metaList ):
+    """ Trigger the build of the indexes and wait for them to be ready
+    """
+    for _i in range( 60 ):
+      result = self.db._query( "SELECT MetaName FROM FC_MetaIndexes WHERE Status='Ready'" )
+      self.assert_( result['OK'], "Failed to get the ready indexes: %s" % result )
+      if set( metaList ) <= set( [ row[0] for row in result['Value'] ] ):
+        return
+      result = self.db.dmeta.findDirIDsByMetadata( dict( [ ( meta, 'Missing' ) for meta in metaList ] ),
+                                                   self.metaDir, credDict )
+      self.assert_( result['OK'], "findDirIDsByMetadata failed: %s" % result )
+      time.sleep( 0.5 )
+    self.fail( "Indexes of %s not built" % metaList )
+
+  def test_metadataIndex( self ):
+    """
+      Tests that the metadata index gives the same directories as the metadata tables
+      for inherited, overridden and missing metadata, also while it is not built
+    """
+    for meta, ptype in ( ( 'idxTestMeta', 'INT' ), ( 'idxTestTag', 'VARCHAR(32)' ) ):
+      result = self.db.dmeta.addMetadataField( meta, ptype, credDict )
+      self.assert_( result['OK'], "addMetadataField failed: %s" % result )
+    dirs = [ self.metaDir + '/' + subDir for subDir in self.metaSubDirs ]
+    for path in dirs:
+      result = self.db.createDirectory( path, credDict )
+      self.assert_( result['OK'], "createDirectory failed: %s" % result )
+    dirIDs = {}
+    for path in dirs + [ self.metaDir ]:
+      result = self.db.dtree.findDir( path )
+      self.assert_( result['OK'] and result['Value'], "findDir failed for %s: %s" % ( path, result ) )
+      dirIDs[path] = result['Value']
+
+    # Inherited by a/b and a/b/c
+    for path, metaDict in ( ( self.metaDir + '/a', { 'idxTestMeta' : 1 } ),
+                            ( self.metaDir + '/d', { 'idxTestMeta' : 2 } ),
+                            # Overrides the previous value
+                            ( self.metaDir + '/d', { 'idxTestMeta' : 3 } ),
+                            ( self.metaDir + '/a/b', { 'idxTestTag' : 'x' } ) ):
+      result = self.db.setMetadata( path, metaDict, credDict )
+      self.assert_( result['OK'], "setMetadata failed: %s" % result )
+
+    result = self.db.dtree.getSubdirectoriesByID( dirIDs[self.metaDir], includeParent = True, requestString = True )
+    self.assert_( result['OK'], "getSubdirectoriesByID failed: %s" % result )
+    pathSelection = result['Value']
+    queries = [ ( { 'idxTestMeta' : 1 }, [ 'a', 'a/b', 'a/b/c' ] ),
+                ( { 'idxTestMeta' : 2 }, [] ),
+                ( { 'idxTestMeta' : 3 }, [ 'd', 'd/e' ] ),
+                ( { 'idxTestMeta' : { '>' : 1 } }, [ 'd', 'd/e' ] ),
+                ( { 'idxTestMeta' : 'Missing' }, [ '' ] ),
+                ( { 'idxTestMeta' : 1, 'idxTestTag' : 'x' }, [ 'a/b', 'a/b/c' ] ),
+                ( { 'idxTestMeta' : 1, 'idxTestTag' : 'Missing' }, [ 'a' ] ),
+                ( { 'idxTestMeta' : 'Missing', 'idxTestTag' : 'Missing' }, [ '' ] ) ]
+
+    def checkQueries():
+      for queryDict, subDirs in queries:
+        expected = sorted( [ dirIDs[( self.metaDir + '/' + subDir ).rstrip( '/' )] for subDir in subDirs ] )
+        result = self.__findByTables( queryDict, pathSelection )
+        self.assert_( result['OK'], "Metadata tables query failed: %s" % result )
+        self.assertEqual( sorted( result['Value'] ), expected, "Wrong directories for %s" % queryDict )
+        result = self.__findByIndex( queryDict, pathSelection )
+        self.assert_( result['OK'] and result['Value'] is not None, "Metadata index query failed: %s" % result )
+        self.assertEqual( sorted( result['Value'] ), expected, "Wrong directories for %s from the index" % queryDict )
+
+    # Not usable while being built, the metadata tables are used meanwhile
+    for meta in ( 'idxTestMeta', 'idxTestTag' ):
+      self.db.dmeta._DirectoryMetadata__dropMetaIndex( meta )
+    result = self.__findByIndex( { 'idxTestMeta' : 1 }, pathSelection )
+    self.assert_( result['OK'] and result['Value'] is None, "Index should not be ready: %s" % result )
+    result = self.db.dmeta.findDirIDsByMetadata( { 'idxTestMeta' : 1 }, self.metaDir, credDict )
+    self.assert_( result['OK'], "findDirIDsByMetadata failed: %s" % result )
+    self.assertEqual( sorted( result['Value'] ), sorted( [ dirIDs[self.metaDir + '/' + subDir] for subDir in [ 'a', 'a/b', 'a/b/c' ] ] ) )
+    self.__waitForIndexes( [ 'idxTestMeta', 'idxTestTag' ] )
+    checkQueries()
+
+    # Directories created once the index is built inherit it
+    newDir = self.metaDir + '/a/b/f'
+    result = self.db.createDirectory( newDir, credDict )
+    self.assert_( result['OK'], "createDirectory failed: %s" % result )
+    result = self.db.dtree.findDir( newDir )
+    self.assert_( result['OK'] and result['Value'], "findDir failed for %s: %s" % ( newDir, result ) )
+    dirIDs[newDir] = result['Value']
+    queries[0][1].append( 'a/b/f' )
+    queries[5][1].append( 'a/b/f' )
+    checkQueries()
+
+    for path in [ newDir ] + dirs + [ self.metaDir ]:
+      result = self.db.removeDirectory( [path], credDict )
+      self.assert_( result["OK"], "removeDirectory failed: %s" % result )
+    for meta in ( 'idxTestMeta', 'idxTestTag' ):
+      self.db.dmeta.deleteMetadataField( meta, credDict )
+
+
 class DirectoryCase( FileCatalogDBTestCase ):
 
   def test_directoryOperations( self ):
@@ -404,6 +620,61 @@ class DirectoryCase( FileCatalogDBTestCase ):
     self.assert_( nonExistingDir in result["Value"]["Failed"], "listDirectory : %s should be in Failed %s" % ( nonExistingDir, result ) )
 
 
+    # Listing by pages, with a number of files multiple of the page size
+    pageDir = testDir + '/pages'
+    pageSubDir = pageDir + '/subdir'
+    pageFiles = [ '%s/file%d' % ( pageDir, i ) for i in range( 4 ) ]
+    result = self.db.createDirectory( pageSubDir, credDict )
+    self.assert_( result['OK'], "addDirectory failed when adding new directory %s" % result )
+    result = self.db.addFile( dict( [ ( lfn, { 'PFN': lfn.split( "/" )[-1],
+                                               'SE': 'testSE' ,
+                                               'Size':123,
+                                               'GUID':2000 + i,
+                                               'Checksum':'0' } ) for i, lfn in enumerate( pageFiles ) ] ), credDict )
+    self.assert_( result['OK'], "addFile failed when adding new files %s" % result )
+
+    pages = []
+    continuation = ''
+    while len( pages ) < 5:
+      result = self.db.listDirectoryPage( pageDir, credDict, continuation = continuation, pageSize = 2 )
+      self.assert_( result["OK"], "listDirectoryPage failed: %s" % result )
+      pages.append( result["Value"] )
+      continuation = result["Value"]["Continuation"]
+      if not continuation:
+        break
+    self.assertEqual( [ sorted( page["Files"].keys() ) for page in pages ], [ ['file0', 'file1'], ['file2', 'file3'], [] ], \
+                      "listDirectoryPage : incorrect pages for %s (%s)" % ( pageDir, pages ) )
+    self.assertEqual( pages[0]["SubDirs"].keys(), [pageSubDir], "listDirectoryPage : incorrect subdirectories %s" % pages )
+    self.assertEqual( [ page["SubDirs"] for page in pages[1:] ], [ {}, {} ], \
+                      "listDirectoryPage : subdirectories should only come with the first page %s" % pages )
+
+    # Listing an empty directory by pages
+    result = self.db.listDirectoryPage( pageSubDir, credDict, pageSize = 2 )
+    self.assert_( result["OK"], "listDirectoryPage failed: %s" % result )
+    self.assertEqual( ( result["Value"]["Files"], result["Value"]["SubDirs"], result["Value"]["Continuation"] ), ( {}, {}, '' ), \
+                      "listDirectoryPage : incorrect content for empty %s (%s)" % ( pageSubDir, result ) )
+
+    result = self.db.listDirectoryPage( nonExistingDir, credDict, pageSize = 2 )
+    self.assert_( not result["OK"], "listDirectoryPage should fail for %s: %s" % ( nonExistingDir, result ) )
+
+    # Replicas by pages, with a last page not full
+    result = self.db.getDirectoryReplicasPage( pageDir, False, credDict, pageSize = 3 )
+    self.assert_( result["OK"], "getDirectoryReplicasPage failed: %s" % result )
+    self.assertEqual( sorted( result["Value"]["Files"].keys() ), ['file0', 'file1', 'file2'], \
+                      "getDirectoryReplicasPage : incorrect first page %s" % result )
+    self.assertEqual( result["Value"]["Files"]["file0"].keys(), ['testSE'], "getDirectoryReplicasPage : incorrect replicas %s" % result )
+    self.assertEqual( result["Value"]["SubDirs"], [pageSubDir], "getDirectoryReplicasPage : incorrect subdirectories %s" % result )
+    result = self.db.getDirectoryReplicasPage( pageDir, False, credDict, continuation = result["Value"]["Continuation"], pageSize = 3 )
+    self.assert_( result["OK"], "getDirectoryReplicasPage failed: %s" % result )
+    self.assertEqual( ( result["Value"]["Files"].keys(), result["Value"]["SubDirs"], result["Value"]["Continuation"] ), \
+                      ( ['file3'], [], '' ), "getDirectoryReplicasPage : incorrect last page %s" % result )
+
+    result = self.db.removeFile( pageFiles, credDict )
+    self.assert_( result["OK"], "removeFile failed: %s" % result )
+    for path in ( pageSubDir, pageDir ):
+      result = self.db.removeDirectory( [path], credDict )
+      self.assert_( result["OK"], "removeDirectory failed: %s" % result )
+
 
     # Cleaning after us
     result = self.db.removeFile( testFile, credDict )
@@ -436,7 +707,10 @@ if __name__ == '__main__':
     suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( UserGroupCase ) )
     suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( FileCase ) )
     suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( ReplicaCase ) )
+    suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( GetReplicasCase ) )
     suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( DirectoryCase ) )
+    suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( DirectoryUsageCase ) )
+    suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( MetadataIndexCase ) )
 
     testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
 
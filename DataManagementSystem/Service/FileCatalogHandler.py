@@ -20,6 +20,7 @@ from DIRAC.Core.DISET.RequestHandler import RequestHandler, getServiceOption
 from DIRAC import gLogger, S_OK, S_ERROR
 from DIRAC.DataManagementSystem.DB.FileCatalogDB import FileCatalogDB
 from DIRAC.Core.Utilities.List import sortList
+from DIRAC.Core.Utilities import DEncode
 
 # This is a global instance of the FileCatalogDB class
 gFileCatalogDB = None
@@ -59,7 +60,10 @@ def initializeFileCatalogHandler( serviceInfo ):
                     'ValidFileStatus'     : ['AprioriGood','Trash','Removing','Probing'],
                     'ValidReplicaStatus'  : ['AprioriGood','Trash','Removing','Probing'],
                     'VisibleFileStatus'   : ['AprioriGood'],
-                    'VisibleReplicaStatus': ['AprioriGood']}
+                    'VisibleReplicaStatus': ['AprioriGood'],
+                    'DirectoryCacheSize'  : 10000,
+                    'MaxDirectoryPageSize': 10000,
+                    'DirectoryCacheLifeTime': 300}
   for configKey in sortList( defaultConfig.keys() ):
     defaultValue = defaultConfig[configKey]
     configValue = getServiceOption( serviceInfo, configKey, defaultValue )
@@ -302,6 +306,58 @@ class FileCatalogHandler( RequestHandler ):
     """ Get replicas for files in the supplied directory """
     return gFileCatalogDB.getDirectoryReplicas( lfns, allStatus, self.getRemoteCredentials() )
 
+  types_listDirectoryPage = [ StringTypes, BooleanType, StringTypes, [ IntType, LongType ] ]
+  def export_listDirectoryPage( self, path, verbose, continuation, pageSize ):
+    """ List one page of the contents of the supplied directory, starting after the continuation
+        returned with the previous page ( '' for the first page )
+    """
+    return gFileCatalogDB.listDirectoryPage( path, self.getRemoteCredentials(), verbose = verbose,
+                                             continuation = continuation, pageSize = pageSize )
+
+  types_getDirectoryReplicasPage = [ StringTypes, BooleanType, StringTypes, [ IntType, LongType ] ]
+  def export_getDirectoryReplicasPage( self, path, allStatus, continuation, pageSize ):
+    """ Get replicas for one page of files in the supplied directory, starting after the
+        continuation returned with the previous page ( '' for the first page )
+    """
+    return gFileCatalogDB.getDirectoryReplicasPage( path, allStatus, self.getRemoteCredentials(),
+                                                    continuation = continuation, pageSize = pageSize )
+
+  def transfer_toClient( self, fileId, token, fileHelper ):
+    """ Stream the pages of a directory listing or of the directory replicas. fileId is
+        ( 'listDirectory' or 'getDirectoryReplicas', path, verbose or allStatus, pageSize ),
+        each page is sent as a DEncoded S_OK( page ) as soon as it is read from the DB
+    """
+    try:
+      method, path, flag, pageSize = fileId
+    except ( ValueError, TypeError ):
+      method = None
+    if not method in ( 'listDirectory', 'getDirectoryReplicas' ):
+      fileHelper.markAsTransferred()
+      return S_ERROR( "Invalid directory stream request %s" % str( fileId ) )
+
+    credDict = self.getRemoteCredentials()
+    continuation = ''
+    while True:
+      if method == 'listDirectory':
+        result = gFileCatalogDB.listDirectoryPage( path, credDict, verbose = flag,
+                                                   continuation = continuation, pageSize = pageSize )
+      else:
+        result = gFileCatalogDB.getDirectoryReplicasPage( path, flag, credDict,
+                                                          continuation = continuation, pageSize = pageSize )
+      if not result['OK']:
+        fileHelper.sendError( result['Message'] )
+        return result
+      continuation = result['Value']['Continuation']
+      result = fileHelper.sendData( DEncode.encode( result ) )
+      if not result['OK']:
+        return result
+      if 'AbortTransfer' in result and result[ 'AbortTransfer' ]:
+        return S_OK()
+      if not continuation:
+        break
+    fileHelper.sendEOF()
+    return S_OK()
+
   ########################################################################
   #
   # Administrative database operations
@@ -312,6 +368,11 @@ class FileCatalogHandler( RequestHandler ):
     """ Get the number of registered directories, files and replicas in various tables """
     return gFileCatalogDB.getCatalogCounters( self.getRemoteCredentials() )
 
+  types_getDirectoryCacheStats = []
+  def export_getDirectoryCacheStats( self ):
+    """ Get the size and hit rate of the directory caches of the service """
+    return gFileCatalogDB.getDirectoryCacheStats( self.getRemoteCredentials() )
+
   types_rebuildDirectoryUsage = []
   @staticmethod
   def export_rebuildDirectoryUsage():
@@ -0,0 +1,86 @@
+""" Test cases for the directory streaming of the FileCatalogHandler
+"""
+
+import unittest, importlib
+from mock import MagicMock
+
+from DIRAC import S_OK, S_ERROR
+from DIRAC.Core.Utilities import DEncode
+
+class FakeCatalogDB:
+  """ Directory of numFiles files listed pageSize files at a time
+  """
+
+  def __init__( self, numFiles ):
+    self.fileNames = [ 'file%03d' % i for i in range( numFiles ) ]
+    self.continuations = []
+
+  def listDirectoryPage( self, path, credDict, verbose = False, continuation = '', pageSize = 1000 ):
+    self.continuations.append( continuation )
+    if path != '/dir':
+      return S_ERROR( 'Directory %s not found' % path )
+    fileNames = [ fileName for fileName in self.fileNames if fileName > continuation ][:pageSize]
+    subDirs = {}
+    if not continuation:
+      subDirs = { '/dir/subdir' : True }
+    nextContinuation = ''
+    if len( fileNames ) == pageSize:
+      nextContinuation = fileNames[-1]
+    return S_OK( { 'Files' : dict( [ ( fileName, {} ) for fileName in fileNames ] ),
+                   'SubDirs' : subDirs, 'Links' : {}, 'Datasets' : {},
+                   'Continuation' : nextContinuation } )
+
+class FileCatalogHandlerTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.fch_m = importlib.import_module( 'DIRAC.DataManagementSystem.Service.FileCatalogHandler' )
+    self.handler = self.fch_m.FileCatalogHandler.__new__( self.fch_m.FileCatalogHandler )
+    self.handler.getRemoteCredentials = MagicMock( return_value = {} )
+    self.fileHelper = MagicMock()
+    self.fileHelper.sendData.return_value = S_OK()
+
+  def tearDown( self ):
+    self.fch_m.gFileCatalogDB = None
+
+  def __sentPages( self ):
+    return [ DEncode.decode( call[0][0] )[0]['Value'] for call in self.fileHelper.sendData.call_args_list ]
+
+  def test_pages( self ):
+    for numFiles, numPages in ( ( 25, 3 ), ( 20, 3 ), ( 0, 1 ) ):
+      self.fch_m.gFileCatalogDB = FakeCatalogDB( numFiles )
+      self.fileHelper.reset_mock()
+      result = self.handler.transfer_toClient( ( 'listDirectory', '/dir', False, 10 ), '', self.fileHelper )
+      self.assertTrue( result['OK'] )
+      pages = self.__sentPages()
+      self.assertEqual( len( pages ), numPages )
+      fileNames = []
+      for page in pages:
+        fileNames.extend( sorted( page['Files'] ) )
+      self.assertEqual( fileNames, self.fch_m.gFileCatalogDB.fileNames )
+      #Subdirectories only come with the first page
+      self.assertEqual( pages[0]['SubDirs'].keys(), [ '/dir/subdir' ] )
+      for page in pages[1:]:
+        self.assertEqual( page['SubDirs'], {} )
+      self.assertEqual( pages[-1]['Continuation'], '' )
+      self.assertTrue( self.fileHelper.sendEOF.called )
+
+  def test_errors( self ):
+    self.fch_m.gFileCatalogDB = FakeCatalogDB( 5 )
+    result = self.handler.transfer_toClient( ( 'removeDirectory', '/dir', False, 10 ), '', self.fileHelper )
+    self.assertFalse( result['OK'] )
+    self.assertTrue( self.fileHelper.markAsTransferred.called )
+    result = self.handler.transfer_toClient( ( 'listDirectory', '/other', False, 10 ), '', self.fileHelper )
+    self.assertFalse( result['OK'] )
+    self.assertTrue( self.fileHelper.sendError.called )
+    self.assertFalse( self.fileHelper.sendData.called )
+    #The client going away stops the stream
+    self.fileHelper.sendData.return_value = S_OK()
+    self.fileHelper.sendData.return_value['AbortTransfer'] = True
+    self.fch_m.gFileCatalogDB = FakeCatalogDB( 25 )
+    result = self.handler.transfer_toClient( ( 'listDirectory', '/dir', False, 10 ), '', self.fileHelper )
+    self.assertTrue( result['OK'] )
+    self.assertEqual( self.fch_m.gFileCatalogDB.continuations, [ '' ] )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( FileCatalogHandlerTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -9,6 +9,25 @@ from types import ListType, DictType
 import os
 from DIRAC                              import S_OK, S_ERROR
 from DIRAC.Core.Base.Client             import Client
+from DIRAC.Core.DISET.TransferClient    import TransferClient
+from DIRAC.Core.Utilities               import DEncode
+
+class DirectoryPageSink:
+  """ Data sink decoding the directory pages streamed by the FileCatalog service
+      and handing each of them to a callback as soon as it is complete
+  """
+  def __init__( self, callback ):
+    self.__callback = callback
+    self.__decoder = DEncode.StreamDecoder()
+
+  def write( self, data ):
+    while self.__decoder.feed( data ):
+      page = self.__decoder.getObject()
+      data = self.__decoder.getPendingData()
+      self.__decoder = DEncode.StreamDecoder()
+      self.__callback( page )
+      if not data:
+        break
 
 class FileCatalogClient(Client):
   """ Client code to the DIRAC File Catalogue
@@ -54,6 +73,78 @@ class FileCatalogClient(Client):
       
     return S_OK( lfnDict )  
 
+  def __pageToLFNs( self, path, pageDict, entryTypes, replicas = False ):
+    """ Force the entries of a directory page to be LFNs, and resolve the PFNs from the SE prefixes
+    """
+    seDict = pageDict.pop( 'SEPrefixes', {} )
+    for entryType in entryTypes:
+      entryDict = pageDict[entryType]
+      for fname in entryDict.keys():
+        detailsDict = entryDict.pop( fname )
+        lfn = '%s/%s' % ( path, os.path.basename( fname ) )
+        if replicas:
+          for se in detailsDict:
+            if not detailsDict[se] and se in seDict:
+              detailsDict[se] = seDict[se] + lfn
+        entryDict[lfn] = detailsDict
+    return pageDict
+
+  def __iterPages( self, method, path, flag, pageSize, entryTypes, rpc, url, timeout, replicas = False ):
+    rpcClient = self._getRPC(rpc=rpc, url=url, timeout=timeout)
+    continuation = ''
+    while True:
+      result = getattr( rpcClient, method )( path, flag, continuation, pageSize )
+      if not result['OK']:
+        yield result
+        return
+      pageDict = result['Value']
+      continuation = pageDict.pop( 'Continuation' )
+      yield S_OK( self.__pageToLFNs( path, pageDict, entryTypes, replicas ) )
+      if not continuation:
+        return
+
+  def listDirectoryIter(self, lfn, verbose=False, pageSize=1000, rpc='', url='', timeout=120):
+    """ List the given directory's contents page by page. Yields S_OK( pageDict ) with the
+        "Files", "SubDirs", "Links" and "Datasets" of at most pageSize files, the subdirectories
+        and datasets being only in the first page, or S_ERROR at the first error
+    """
+    path = lfn.rstrip( '/' ) or '/'
+    for result in self.__iterPages( 'listDirectoryPage', path, verbose, pageSize,
+                                    ['Files', 'SubDirs', 'Links'], rpc, url, timeout ):
+      yield result
+
+  def getDirectoryReplicasIter(self, lfn, allStatus=False, pageSize=1000, rpc='', url='', timeout=120):
+    """ Get the replicas of the given directory's files page by page. Yields S_OK( pageDict )
+        with the "Files" ( lfn -> { SE : PFN } ) of at most pageSize files, and the "SubDirs"
+        paths in the first page, or S_ERROR at the first error
+    """
+    path = lfn.rstrip( '/' ) or '/'
+    for result in self.__iterPages( 'getDirectoryReplicasPage', path, allStatus, pageSize,
+                                    ['Files'], rpc, url, timeout, replicas = True ):
+      yield result
+
+  def streamDirectory( self, lfn, callback, verbose = False, pageSize = 1000, replicas = False, allStatus = False, url = '' ):
+    """ Same as listDirectoryIter, or getDirectoryReplicasIter if replicas is True, but with all
+        the pages sent by the service over a single transfer connection. callback( S_OK( pageDict ) )
+        is called for each page as soon as it has been received
+    """
+    path = lfn.rstrip( '/' ) or '/'
+    if replicas:
+      fileId = ( 'getDirectoryReplicas', path, allStatus, pageSize )
+      entryTypes = ['Files']
+    else:
+      fileId = ( 'listDirectory', path, verbose, pageSize )
+      entryTypes = ['Files', 'SubDirs', 'Links']
+
+    def pageCallback( result ):
+      if result['OK']:
+        result['Value'].pop( 'Continuation', None )
+        result = S_OK( self.__pageToLFNs( path, result['Value'], entryTypes, replicas ) )
+      callback( result )
+
+    transferClient = TransferClient( url or self.serverURL )
+    return transferClient.receiveFile( DirectoryPageSink( pageCallback ), fileId )
+
   def listDirectory(self, lfn, verbose=False, rpc='', url='', timeout=120):
     """ List the given directory's contents
     """
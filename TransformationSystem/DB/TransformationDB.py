@@ -724,28 +724,16 @@ class TransformationDB( DB ):
 
       req = "%s %s" % ( req, self.buildCondition( condDict, older, newer, timeStamp, orderAttribute, limit,
                                                   offset = offset ) )
-    res = self._query( req, connection )
-    if not res['OK']:
-      return res
-
-    transFiles = res['Value']
-    fileIDs = [int( row[1] ) for row in transFiles]
+    # Stream the rows and build the result structures as they come, the LFNs are filled afterwards
     webList = []
     resultList = []
-    if not fileIDs:
-      originalFileIDs = {}
-    else:
-      if not originalFileIDs:
-        res = self.__getLfnsForFileIDs( fileIDs, connection = connection )
-        if not res['OK']:
-          return res
-        originalFileIDs = res['Value'][1]
-      for row in transFiles:
-        lfn = originalFileIDs[row[1]]
+    for res in self._queryIter( req ):
+      if not res['OK']:
+        return res
+      for row in res['Value']:
         # Prepare the structure for the web
-        rList = [lfn]
+        rList = [None]
         fDict = {}
-        fDict['LFN'] = lfn
         count = 0
         for item in row:
           fDict[self.TRANSFILEPARAMS[count]] = item
@@ -756,6 +744,16 @@ class TransformationDB( DB ):
             rList.append( item )
         webList.append( rList )
         resultList.append( fDict )
+    if resultList:
+      if not originalFileIDs:
+        res = self.__getLfnsForFileIDs( [ int( fDict['FileID'] ) for fDict in resultList ], connection = connection )
+        if not res['OK']:
+          return res
+        originalFileIDs = res['Value'][1]
+      for fDict, rList in zip( resultList, webList ):
+        lfn = originalFileIDs[fDict['FileID']]
+        fDict['LFN'] = lfn
+        rList[0] = lfn
     result = S_OK( resultList )
     # result['LFNs'] = originalFileIDs.values()
     result['Records'] = webList
@@ -853,15 +851,13 @@ class TransformationDB( DB ):
     res = self._query( req, connection )
     if not res['OK']:
       return res
-    for tupleIn in res['Value']:
-      fileIDs.remove( tupleIn[0] )
+    existingIDs = set( [tupleIn[0] for tupleIn in res['Value']] )
+    fileIDs[:] = [fileID for fileID in fileIDs if fileID not in existingIDs]
     if not fileIDs:
       return S_OK( [] )
-    req = "INSERT INTO TransformationFiles (TransformationID,FileID,LastUpdate,InsertedTime) VALUES"
-    for fileID in fileIDs:
-      req = "%s (%d,%d,UTC_TIMESTAMP(),UTC_TIMESTAMP())," % ( req, transID, fileID )
-    req = req.rstrip( ',' )
-    res = self._update( req, connection )
+    rows = [( transID, fileID, 'UTC_TIMESTAMP()', 'UTC_TIMESTAMP()' ) for fileID in fileIDs]
+    res = self.insertMany( 'TransformationFiles', ['TransformationID', 'FileID', 'LastUpdate', 'InsertedTime'], rows,
+                           conn = connection )
     if not res['OK']:
       return res
     return S_OK( fileIDs )
@@ -1293,8 +1289,7 @@ class TransformationDB( DB ):
   def __insertTaskInputs( self, transID, taskID, lfns, connection = False ):
     vector = str.join( ';', lfns )
     fields = ['TransformationID', 'TaskID', 'InputVector']
-    values = [transID, taskID, vector]
-    res = self.insertFields( 'TaskInputs', fields, values, connection )
+    res = self.insertMany( 'TaskInputs', fields, [( transID, taskID, vector )], conn = connection )
     if not res['OK']:
       gLogger.error( "Failed to add input vector to task %d" % taskID )
     return res
@@ -1411,13 +1406,16 @@ class TransformationDB( DB ):
     if not res['OK']:
       return res
     _fileIDs, lfnFileIDs = res['Value']
-    for lfn in lfns:
-      if not lfn in lfnFileIDs.keys():
-        req = "INSERT INTO DataFiles (LFN,Status) VALUES ('%s','New');" % lfn
-        res = self._update( req, connection )
-        if not res['OK']:
-          return res
-        lfnFileIDs[lfn] = res['lastRowId']
+    missing = [lfn for lfn in lfns if lfn not in lfnFileIDs]
+    if missing:
+      res = self.insertMany( 'DataFiles', ['LFN', 'Status'], [( lfn, 'New' ) for lfn in missing], conn = connection )
+      if not res['OK']:
+        return res
+      # Get the new FileIDs by LFN, auto increment ids of bulk inserts are not guaranteed to be consecutive
+      res = self.__getFileIDsForLfns( missing, connection = connection )
+      if not res['OK']:
+        return res
+      lfnFileIDs.update( res['Value'][1] )
     return S_OK( lfnFileIDs )
 
   def __setDataFileStatus( self, fileIDs, status, connection = False ):
@@ -1505,28 +1503,14 @@ class TransformationDB( DB ):
         return S_ERROR( "Not all supplied files available in the transformation database" )
 
     # Insert the task into the jobs table and retrieve the taskID
-    self.lock.acquire()
     req = "INSERT INTO TransformationTasks(TransformationID, ExternalStatus, ExternalID, TargetSE,"
     req = req + " CreationTime, LastUpdateTime)"
     req = req + " VALUES (%s,'%s','%d','%s', UTC_TIMESTAMP(), UTC_TIMESTAMP());" % ( transID, 'Created', 0, se )
-    res = self._update( req, connection )
+    res = self.__insertTask( req )
     if not res['OK']:
-      self.lock.release()
       gLogger.error( "Failed to publish task for transformation", res['Message'] )
       return res
-
-    # With InnoDB, TaskID is computed by a trigger, which sets the local variable @last (per connection)
-    # @last is the last insert TaskID. With multi-row inserts, will be the first new TaskID inserted.
-    # The trigger TaskID_Generator must be present with the InnoDB schema (defined in TransformationDB.sql)
-    if self.isTransformationTasksInnoDB:
-      res = self._query( "SELECT @last;", connection )
-    else:
-      res = self._query( "SELECT LAST_INSERT_ID();", connection )
-
-    self.lock.release()
-    if not res['OK']:
-      return res
-    taskID = int( res['Value'][0][0] )
+    taskID = int( res['Value'] )
     gLogger.verbose( "Published task %d for transformation %d." % ( taskID, transID ) )
     # If we have input data then update their status, and taskID in the transformation table
     if lfns:
@@ -1612,6 +1596,35 @@ class TransformationDB( DB ):
       return res
     return S_OK()
 
+  def __insertTask( self, req ):
+    ''' Insert a task and return its TaskID
+    '''
+    # With InnoDB, TaskID is computed by a trigger, which sets the local variable @last (per connection)
+    # @last is the last insert TaskID. With multi-row inserts, will be the first new TaskID inserted.
+    # The trigger TaskID_Generator must be present with the InnoDB schema (defined in TransformationDB.sql)
+    if not self.isTransformationTasksInnoDB:
+      res = self._update( req )
+      if not res['OK']:
+        return res
+      if 'lastRowId' not in res:
+        return S_ERROR( "Can't determine the TaskID after insertion" )
+      return S_OK( res['lastRowId'] )
+    # The transaction keeps the INSERT and the SELECT on the same connection
+    res = self.transactionStart()
+    if not res['OK']:
+      return res
+    res = self._update( req )
+    if res['OK']:
+      res = self._query( "SELECT @last;" )
+    if not res['OK']:
+      self.transactionRollback()
+      return res
+    taskID = res['Value'][0][0]
+    res = self.transactionCommit()
+    if not res['OK']:
+      return res
+    return S_OK( taskID )
+
   def __removeTransformationTask( self, transID, taskID, connection = False ):
     res = self.__deleteTransformationTaskInputs( transID, taskID, connection = connection )
     if not res['OK']:
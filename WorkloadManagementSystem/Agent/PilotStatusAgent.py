@@ -169,8 +169,6 @@ class PilotStatusAgent( AgentModule ):
     # longer available) and declare them Deleted.
     result = self.handleOldPilots( connection )
 
-    connection.close()
-
     return S_OK()
 
   def clearWaitingPilots( self, condDict ):
@@ -105,17 +105,20 @@ for the agent restart
 """
     stalledCounter = 0
     runningCounter = 0
-    result = self.jobDB.selectJobs( {'Status':'Running'} )
-    if not result['OK']:
-      return result
-    if not result['Value']:
+    # The update times of all the running jobs are read in bulk
+    jobs = []
+    for result in self.jobDB.iterJobAttributes( condDict = {'Status':'Running'},
+                                                attrList = ['HeartBeatTime', 'LastUpdateTime'] ):
+      if not result['OK']:
+        return result
+      jobs.extend( result['Value'][1] )
+    if not jobs:
       return S_OK()
-    jobs = result['Value']
     self.log.info( '%s Running jobs will be checked for being stalled' % ( len( jobs ) ) )
     jobs.sort()
 # jobs = jobs[:10] #for debugging
-    for job in jobs:
-      result = self.__getStalledJob( job, stalledTime )
+    for job, heartBeatTime, lastUpdateTime in jobs:
+      result = self.__getStalledJob( job, stalledTime, heartBeatTime, lastUpdateTime )
       if result['OK']:
         self.log.verbose( 'Updating status to Stalled for job %s' % ( job ) )
         self.__updateJobStatus( job, 'Stalled' )
@@ -223,11 +226,11 @@ for the agent restart
 
 
   #############################################################################
-  def __getStalledJob( self, job, stalledTime ):
+  def __getStalledJob( self, job, stalledTime, heartBeatTime, lastUpdateTime ):
     """ Compares the most recent of LastUpdateTime and HeartBeatTime against
 the stalledTime limit.
 """
-    result = self.__getLatestUpdateTime( job )
+    result = self.__getLatestTime( job, heartBeatTime, lastUpdateTime )
     if not result['OK']:
       return result
 
@@ -253,16 +256,26 @@ the stalledTime limit.
       return S_ERROR( 'Could not get attributes for job', '%s' % job )
 
     self.log.verbose( result )
+    return self.__getLatestTime( job, result['Value']['HeartBeatTime'], result['Value']['LastUpdateTime'] )
+
+  def __getLatestTime( self, job, heartBeatTime, lastUpdateTime ):
+    """ Returns the most recent of the given HeartBeatTime and LastUpdateTime, either
+strings or datetimes
+"""
     latestUpdate = 0
-    if not result['Value']['HeartBeatTime'] or result['Value']['HeartBeatTime'] == 'None':
+    if not heartBeatTime or heartBeatTime == 'None':
       self.log.verbose( 'HeartBeatTime is null for job %s' % job )
     else:
-      latestUpdate = toEpoch( fromString( result['Value']['HeartBeatTime'] ) )
+      if type( heartBeatTime ) in types.StringTypes:
+        heartBeatTime = fromString( heartBeatTime )
+      latestUpdate = toEpoch( heartBeatTime )
 
-    if not result['Value']['LastUpdateTime'] or result['Value']['LastUpdateTime'] == 'None':
+    if not lastUpdateTime or lastUpdateTime == 'None':
       self.log.verbose( 'LastUpdateTime is null for job %s' % job )
     else:
-      lastUpdate = toEpoch( fromString( result['Value']['LastUpdateTime'] ) )
+      if type( lastUpdateTime ) in types.StringTypes:
+        lastUpdateTime = fromString( lastUpdateTime )
+      lastUpdate = toEpoch( lastUpdateTime )
       if latestUpdate < lastUpdate:
         latestUpdate = lastUpdate
 
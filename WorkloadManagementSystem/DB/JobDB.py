@@ -9,6 +9,7 @@
     getAllJobAttributes()
     getDistinctJobAttributes()
     getAttributesForJobList()
+    iterJobAttributes()
     getJobParameter()
     getJobParameters()
     getAllJobParameters()
@@ -476,36 +477,115 @@ class JobDB( DB ):
     """
     if not jobIDList:
       return S_OK( {} )
-    if attrList:
-      attrNames = ','.join( [ str( x ) for x in attrList ] )
-      attr_tmp_list = attrList
-    else:
-      attrNames = ','.join( [ str( x ) for x in self.jobAttributeNames ] )
-      attr_tmp_list = self.jobAttributeNames
-    jobList = ','.join( [str( x ) for x in jobIDList] )
-
-    # FIXME: need to check if the attributes are in the list of job Attributes
+    if not attrList:
+      attrList = self.jobAttributeNames
+    retDict = {}
+    for result in self.iterJobAttributes( jobIDs = jobIDList, attrList = attrList ):
+      if not result['OK']:
+        return result
+      columns, rows = result['Value']
+      try:
+        for row in rows:
+          jobDict = { 'JobID' : row[0] }
+          for i in range( 1, len( columns ) ):
+            try:
+              jobDict[columns[i]] = row[i].tostring()
+            except Exception:
+              jobDict[columns[i]] = str( row[i] )
+          if 'JobID' in attrList:
+            jobDict['JobID'] = str( row[0] )
+          retDict[int( row[0] )] = jobDict
+      except Exception, x:
+        return S_ERROR( 'JobDB.getAttributesForJobList: Failed\n%s' % str( x ) )
+    return S_OK( retDict )
 
-    cmd = 'SELECT JobID,%s FROM Jobs WHERE JobID in ( %s )' % ( attrNames, jobList )
-    res = self._query( cmd )
-    if not res['OK']:
-      return res
+#############################################################################
+  def iterJobAttributes( self, jobIDs = None, condDict = None, attrList = None, paramList = None,
+                         older = None, newer = None, timeStamp = 'LastUpdateTime', batchSize = 1000 ):
+    """ Bulk read of the attributes and parameters of many jobs, selected by a list of
+        jobIDs and/or the condDict, older, newer conditions on the Jobs table.
+        Only the requested attributes (all of them if attrList is empty) and parameters
+        are read, the parameters being pivoted into columns by the query itself.
+        This is a generator yielding S_OK( ( columnNames, rows ) ) for each batch of
+        at most batchSize jobs, or a S_ERROR upon error. columnNames is JobID followed
+        by the attributes and then the parameters, and rows is a tuple of tuples with
+        the values in that order. Parameters not defined for a job are None.
+    """
+    if not attrList:
+      attrList = self.jobAttributeNames
+    attrList = [ attr for attr in attrList if attr != 'JobID' ]
+    for attr in attrList:
+      if attr not in self.jobAttributeNames:
+        yield S_ERROR( 'JobDB.iterJobAttributes: unknown job attribute %s' % attr )
+        return
+    if not paramList:
+      paramList = []
+    columnNames = tuple( [ 'JobID' ] + attrList + list( paramList ) )
+
+    condDict = dict( condDict or {} )
+    if 'JobID' in condDict:
+      # JobID is in both tables, it's moved to the job list
+      condJobIDs = condDict.pop( 'JobID' )
+      if type( condJobIDs ) not in ( types.ListType, types.TupleType ):
+        condJobIDs = [ condJobIDs ]
+      if jobIDs is None:
+        jobIDs = condJobIDs
+      else:
+        condJobIDs = set( [ str( jobID ) for jobID in condJobIDs ] )
+        jobIDs = [ jobID for jobID in jobIDs if str( jobID ) in condJobIDs ]
     try:
-      retDict = {}
-      for retValues in res['Value']:
-        jobID = retValues[0]
-        jobDict = {}
-        jobDict[ 'JobID' ] = jobID
-        attrValues = retValues[1:]
-        for i in range( len( attr_tmp_list ) ):
-          try:
-            jobDict[attr_tmp_list[i]] = attrValues[i].tostring()
-          except Exception:
-            jobDict[attr_tmp_list[i]] = str( attrValues[i] )
-        retDict[int( jobID )] = jobDict
-      return S_OK( retDict )
+      condition = self.buildCondition( condDict = condDict, older = older, newer = newer, timeStamp = timeStamp )
     except Exception, x:
-      return S_ERROR( 'JobDB.getAttributesForJobList: Failed\n%s' % str( x ) )
+      yield S_ERROR( x )
+      return
+
+    result = self._escapeValues( paramList )
+    if not result['OK']:
+      yield result
+      return
+    selectList = [ 'J.`JobID`' ] + [ 'J.`%s`' % attr for attr in attrList ]
+    joinList = []
+    for iP, paramName in enumerate( result['Value'] ):
+      selectList.append( 'P%d.`Value`' % iP )
+      joinList.append( 'LEFT JOIN `JobParameters` P%d ON P%d.`JobID` = J.`JobID` AND P%d.`Name` = %s' % ( iP, iP, iP,
+                                                                                                         paramName ) )
+    cmd = 'SELECT %s FROM `Jobs` J %s' % ( ', '.join( selectList ), ' '.join( joinList ) )
+
+    if jobIDs is None:
+      # One streamed query for all the jobs matching the conditions
+      queries = [ '%s %s' % ( cmd, condition ) ]
+    else:
+      try:
+        jobIDs = [ int( jobID ) for jobID in jobIDs ]
+      except ( TypeError, ValueError ):
+        yield S_ERROR( 'JobDB.iterJobAttributes: job IDs have to be integers' )
+        return
+      if condition:
+        condition = 'AND %s' % condition[ len( 'WHERE' ): ]
+      queries = []
+      for i in xrange( 0, len( jobIDs ), batchSize ):
+        jobList = ','.join( [ str( jobID ) for jobID in jobIDs[ i : i + batchSize ] ] )
+        queries.append( '%s WHERE J.`JobID` IN ( %s ) %s' % ( cmd, jobList, condition ) )
+
+    nAttrs = len( attrList ) + 1
+    for query in queries:
+      for result in self._queryIter( query, batchSize = batchSize ):
+        if not result['OK']:
+          yield result
+          return
+        rows = result['Value']
+        if paramList:
+          rows = tuple( [ row[ :nAttrs ] + tuple( [ self.__blobToString( value ) for value in row[ nAttrs: ] ] )
+                          for row in rows ] )
+        yield S_OK( ( columnNames, rows ) )
+
+  def __blobToString( self, value ):
+    """ BLOB values can come as arrays
+    """
+    try:
+      return value.tostring()
+    except AttributeError:
+      return value
 
 
 #############################################################################
@@ -961,15 +1041,23 @@ class JobDB( DB ):
 
     self.log.debug( 'JobDB.selectJobs: retrieving jobs.' )
 
-    res = self.getFields( 'Jobs', ['JobID'], condDict = condDict, limit = limit,
-                            older = older, newer = newer, timeStamp = timeStamp, orderAttribute = orderAttribute )
-
-    if not res['OK']:
-      return res
+    try:
+      try:
+        myLimit, myOffset = limit
+      except Exception:
+        myLimit, myOffset = limit, None
+      condition = self.buildCondition( condDict = condDict, older = older, newer = newer, timeStamp = timeStamp,
+                                       orderAttribute = orderAttribute, limit = myLimit, offset = myOffset )
+    except Exception, x:
+      return S_ERROR( x )
 
-    if not len( res['Value'] ):
-      return S_OK( [] )
-    return S_OK( [ self._to_value( i ) for i in  res['Value'] ] )
+    # Stream the rows, there can be millions of them
+    jobIDs = []
+    for res in self._queryIter( 'SELECT `JobID` FROM `Jobs` %s' % condition ):
+      if not res['OK']:
+        return res
+      jobIDs.extend( [ self._to_value( row ) for row in res['Value'] ] )
+    return S_OK( jobIDs )
 
 #############################################################################
   def setJobAttribute( self, jobID, attrName, attrValue, update = False, myDate = None ):
@@ -1041,6 +1129,67 @@ class JobDB( DB ):
     else:
       return S_ERROR( 'JobDB.setAttributes: failed to set attribute' )
 
+#############################################################################
+  def setAttributesForJobList( self, jobIDList, attrNames, attrValues, update = False, jobDates = None ):
+    """ Set the same attribute values for all the jobs in jobIDList with a single statement.
+        The LastUpdate time stamp is refreshed if explicitely requested.
+        If jobDates ( jobID -> date ) is given, the jobs updated since their date are left
+        untouched. The dates have to come from a server clock, not from the clients
+    """
+    if not jobIDList:
+      return S_OK( 0 )
+    if len( attrNames ) != len( attrValues ):
+      return S_ERROR( 'JobDB.setAttributesForJobList: incompatible Argument length' )
+    for attrName in attrNames:
+      if attrName not in self.jobAttributeNames:
+        return S_ERROR( 'JobDB.setAttributesForJobList: unknown job attribute %s' % attrName )
+    try:
+      jobList = ','.join( [ str( int( jobID ) ) for jobID in jobIDList ] )
+    except ( TypeError, ValueError ):
+      return S_ERROR( 'JobDB.setAttributesForJobList: job IDs have to be integers' )
+
+    ret = self._escapeValues( attrValues )
+    if not ret['OK']:
+      return ret
+    attr = [ "`%s`=%s" % ( attrNames[i], ret['Value'][i] ) for i in range( len( attrNames ) ) ]
+    condition = ''
+    if jobDates:
+      jobIDs = [ int( jobID ) for jobID in jobIDList ]
+      ret = self._escapeValues( [ str( jobDates[ jobID ] ) for jobID in jobIDs ] )
+      if not ret['OK']:
+        return ret
+      dateCase = "CASE JobID %s END" % ' '.join( [ "WHEN %d THEN %s" % ( jobID, date )
+                                                   for jobID, date in zip( jobIDs, ret['Value'] ) ] )
+      condition = ' AND ( LastUpdateTime IS NULL OR LastUpdateTime <= %s )' % dateCase
+    if update:
+      attr.append( "LastUpdateTime=UTC_TIMESTAMP()" )
+    if not attr:
+      return S_ERROR( 'JobDB.setAttributesForJobList: Nothing to do' )
+
+    return self._update( 'UPDATE Jobs SET %s WHERE JobID IN ( %s )%s' % ( ', '.join( attr ), jobList, condition ) )
+
+#############################################################################
+  def setExecTimesForJobList( self, timeAttribute, jobDates ):
+    """ Set the StartExecTime or EndExecTime of several jobs with a single statement.
+        jobDates is a dictionary jobID -> date. As for setStartExecTime and setEndExecTime,
+        only the jobs that don't have the time stamp yet are updated
+    """
+    if timeAttribute not in ( 'StartExecTime', 'EndExecTime' ):
+      return S_ERROR( 'JobDB.setExecTimesForJobList: invalid time attribute %s' % timeAttribute )
+    if not jobDates:
+      return S_OK( 0 )
+    try:
+      jobIDs = [ int( jobID ) for jobID in jobDates ]
+    except ( TypeError, ValueError ):
+      return S_ERROR( 'JobDB.setExecTimesForJobList: job IDs have to be integers' )
+    ret = self._escapeValues( [ str( jobDates[ jobID ] ) for jobID in jobDates ] )
+    if not ret['OK']:
+      return ret
+    cases = [ "WHEN %d THEN %s" % ( jobID, date ) for jobID, date in zip( jobIDs, ret['Value'] ) ]
+    cmd = "UPDATE Jobs SET `%s` = CASE JobID %s END WHERE JobID IN ( %s ) AND `%s` IS NULL" % \
+          ( timeAttribute, ' '.join( cases ), ','.join( [ str( jobID ) for jobID in jobIDs ] ), timeAttribute )
+    return self._update( cmd )
+
 #############################################################################
   def setJobStatus( self, jobID, status = '', minor = '', application = '', appCounter = None ):
     """ Set status of the job specified by its jobID
@@ -1143,20 +1292,8 @@ class JobDB( DB ):
     if not parameters:
       return S_OK()
 
-    insertValueList = []
-    for name, value in parameters:
-      ret = self._escapeString( name )
-      if not ret['OK']:
-        return ret
-      e_name = ret['Value']
-      ret = self._escapeString( value )
-      if not ret['OK']:
-        return ret
-      e_value = ret['Value']
-      insertValueList.append( '(%s,%s,%s)' % ( jobID, e_name, e_value ) )
-
-    cmd = 'REPLACE JobParameters (JobID,Name,Value) VALUES %s' % ', '.join( insertValueList )
-    result = self._update( cmd )
+    rows = [ ( jobID, str( name ), str( value ) ) for name, value in parameters ]
+    result = self.insertMany( 'JobParameters', ['JobID', 'Name', 'Value'], rows, onDuplicate = ['Value'] )
     if not result['OK']:
       return S_ERROR( 'JobDB.setJobParameters: operation failed.' )
 
@@ -2,6 +2,7 @@
     The following methods are provided
 
     addLoggingRecord()
+    addLoggingRecords()
     getJobLoggingInfo()
     getWMSTimeStamps()
 """
@@ -78,6 +79,25 @@ class JobLoggingDB( DB ):
     event = 'status/minor/app=%s/%s/%s' % ( status, minor, application )
     self.gLogger.info( "Adding record for job " + str( jobID ) + ": '" + event + "' from " + source )
 
+    return self.addLoggingRecords( [ ( jobID, status, minor, application, date, source ) ] )
+
+#############################################################################
+  def addLoggingRecords( self, records ):
+    """ Add several entries to the JobLoggingDB table with a single bulk insert.
+        records is a list of ( jobID, status, minor, application, date, source )
+        tuples, each one with the same meaning as the addLoggingRecord arguments
+    """
+    rows = []
+    for jobID, status, minor, application, date, source in records:
+      _date, time_order = self.__getStatusTime( date )
+      rows.append( ( int( jobID ), status, minor, application, str( _date ), time_order, source ) )
+
+    return self.insertMany( 'LoggingInfo', [ 'JobID', 'Status', 'MinorStatus', 'ApplicationStatus',
+                                             'StatusTime', 'StatusTimeOrder', 'StatusSource' ], rows )
+
+  def __getStatusTime( self, date ):
+    """ Get the UTC datetime of a logging record and its ordering number
+    """
     if not date:
       # Make the UTC datetime string and float
       _date = Time.dateTime()
@@ -105,11 +125,7 @@ class JobLoggingDB( DB ):
         epoc = time.mktime( _date.timetuple() ) - MAGIC_EPOC_NUMBER
         time_order = round( epoc, 3 )
 
-    cmd = "INSERT INTO LoggingInfo (JobId, Status, MinorStatus, ApplicationStatus, " + \
-          "StatusTime, StatusTimeOrder, StatusSource) VALUES (%d,'%s','%s','%s','%s',%f,'%s')" % \
-           ( int( jobID ), status, minor, application, str( _date ), time_order, source )
-
-    return self._update( cmd )
+    return _date, time_order
 
 #############################################################################
   def getJobLoggingInfo( self, jobID ):
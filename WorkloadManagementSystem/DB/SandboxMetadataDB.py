@@ -85,12 +85,9 @@ class SandboxMetadataDB( DB ):
     result = self._update( sqlCmd )
     if not result[ 'OK' ]:
       return result
-    if 'lastRowId' in result:
-      return S_OK( result[ 'lastRowId' ] )
-    result = self._query( "SELECT LAST_INSERT_ID()" )
-    if not result[ 'OK' ]:
+    if 'lastRowId' not in result:
       return S_ERROR( "Can't determine owner id after insertion" )
-    return S_OK( result[ 'Value' ][0][0] )
+    return S_OK( result[ 'lastRowId' ] )
 
   def registerAndGetSandbox( self, owner, ownerDN, ownerGroup, sbSE, sbPFN, size = 0 ):
     """
@@ -120,12 +117,9 @@ class SandboxMetadataDB( DB ):
       self.accessedSandboxById( sbId )
       return S_OK( ( sbId, False ) )
     #Inserted, time to get the id
-    if 'lastRowId' in result:
-      return S_OK( ( result['lastRowId'], True ) )
-    result = self._query( "SELECT LAST_INSERT_ID()" )
-    if not result[ 'OK' ]:
+    if 'lastRowId' not in result:
       return S_ERROR( "Can't determine sand box id after insertion" )
-    return S_OK( ( result[ 'Value' ][0][0], True ) )
+    return S_OK( ( result['lastRowId'], True ) )
 
 
   def accessedSandboxById( self, sbId ):
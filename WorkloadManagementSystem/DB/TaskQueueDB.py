@@ -4,10 +4,13 @@
 __RCSID__ = "ebed3a8 (2012-07-06 20:33:11 +0200) Adri Casajs <adria@ecm.ub.es>"
 
 import types
+import time
 import random
+import threading
 from DIRAC  import gConfig, gLogger, S_OK, S_ERROR
 from DIRAC.WorkloadManagementSystem.private.SharesCorrector import SharesCorrector
 from DIRAC.WorkloadManagementSystem.private.Queues import maxCPUSegments
+from DIRAC.WorkloadManagementSystem.private.TaskQueueIndex import TaskQueueIndex
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations import Operations
 from DIRAC.Core.Utilities import List
 from DIRAC.Core.Utilities.DictCache import DictCache
@@ -41,6 +44,11 @@ class TaskQueueDB( DB ):
     self.__opsHelper = Operations()
     self.__ensureInsertionIsSingle = False
     self.__sharesCorrector = SharesCorrector( self.__opsHelper )
+    #In memory index of the TQ definitions to match without building SQL, loaded when first needed
+    self.__tqIndex = TaskQueueIndex( self.__multiValueMatchFields, self.__tagMatchFields,
+                                     self.__bannedJobMatchFields, self.__strictRequireMatchFields )
+    self.__tqIndexLastRefresh = 0
+    self.__tqIndexLock = threading.Lock()
     result = self.__initializeDB()
     if not result[ 'OK' ]:
       raise Exception( "Can't create tables: %s" % result[ 'Message' ] )
@@ -48,6 +56,7 @@ class TaskQueueDB( DB ):
   def enableAllTaskQueues( self ):
     """ Enable all Task queues
     """
+    self.__tqIndexLastRefresh = 0
     return self.updateFields( "tq_TaskQueues", updateDict = { "Enabled" :"1" } )
 
   def findOrphanJobs( self ):
@@ -218,7 +227,7 @@ class TaskQueueDB( DB ):
           return S_ERROR( "PilotType %s is invalid" % pilotType )
     return S_OK( tqDefDict )
 
-  def _checkMatchDefinition( self, tqMatchDict ):
+  def _checkMatchDefinition( self, tqMatchDict, escapeValues = True ):
     """
     Check a task queue match dict is valid
     """
@@ -255,7 +264,8 @@ class TaskQueueDB( DB ):
       if field in [ "CPUTime" ]:
         result = travelAndCheckType( fieldValue, ( types.IntType, types.LongType ), escapeValues = False )
       else:
-        result = travelAndCheckType( fieldValue, ( types.StringType, types.UnicodeType ) )
+        result = travelAndCheckType( fieldValue, ( types.StringType, types.UnicodeType ),
+                                     escapeValues = escapeValues )
       if not result[ 'OK' ]:
         return S_ERROR( "Match definition field %s failed : %s" % ( field, result[ 'Message' ] ) )
       tqMatchDict[ field ] = result[ 'Value' ]
@@ -264,7 +274,8 @@ class TaskQueueDB( DB ):
       for field in ( multiField, "Banned%s" % multiField ):
         if field in tqMatchDict:
           fieldValue = tqMatchDict[ field ]
-          result = travelAndCheckType( fieldValue, ( types.StringType, types.UnicodeType ) )
+          result = travelAndCheckType( fieldValue, ( types.StringType, types.UnicodeType ),
+                                       escapeValues = escapeValues )
           if not result[ 'OK' ]:
             return S_ERROR( "Match definition field %s failed : %s" % ( field, result[ 'Message' ] ) )
           tqMatchDict[ field ] = result[ 'Value' ]
@@ -295,14 +306,11 @@ class TaskQueueDB( DB ):
     if not result[ 'OK' ]:
       self.log.error( "Can't insert TQ in DB", result[ 'Value' ] )
       return result
-    if 'lastRowId' in result:
-      tqId = result['lastRowId']
-    else:
-      result = self._query( "SELECT LAST_INSERT_ID()", conn = connObj )
-      if not result[ 'OK' ]:
-        self.cleanOrphanedTaskQueues( connObj = connObj )
-        return S_ERROR( "Can't determine task queue id after insertion" )
-      tqId = result[ 'Value' ][0][0]
+    #LAST_INSERT_ID() is per connection and the next query may not run on the same one
+    if 'lastRowId' not in result:
+      self.cleanOrphanedTaskQueues( connObj = connObj )
+      return S_ERROR( "Can't determine task queue id after insertion" )
+    tqId = result['lastRowId']
     for field in self.__multiValueDefFields:
       if field not in tqDefDict:
         continue
@@ -317,6 +325,15 @@ class TaskQueueDB( DB ):
         self.cleanOrphanedTaskQueues( connObj = connObj )
         return S_ERROR( "Can't insert values %s for field %s: %s" % ( str( values ), field, result[ 'Message' ] ) )
     self.log.info( "Created TQ %s" % tqId )
+    #Known by the index of this process without waiting for the next refresh, still disabled.
+    #Not while refreshing, the refresh could drop it as missing from its view of the DB
+    self.__tqIndexLock.acquire()
+    try:
+      result = self.__addTQsToIndex( [ tqId ], connObj = connObj )
+    finally:
+      self.__tqIndexLock.release()
+    if not result[ 'OK' ]:
+      self.log.warn( "Could not add TQ %s to the TQ index" % tqId, result[ 'Message' ] )
     return S_OK( tqId )
 
   def cleanOrphanedTaskQueues( self, connObj = False ):
@@ -324,6 +341,7 @@ class TaskQueueDB( DB ):
     Delete all empty task queues
     """
     self.log.info( "Cleaning orphaned TQs" )
+    self.__tqIndexLastRefresh = 0
     result = self._update( "DELETE FROM `tq_TaskQueues` WHERE Enabled >= 1 AND TQId not in ( SELECT DISTINCT TQId from `tq_Jobs` )", conn = connObj )
     if not result[ 'OK' ]:
       return result
@@ -337,8 +355,10 @@ class TaskQueueDB( DB ):
   def __setTaskQueueEnabled( self, tqId, enabled = True, connObj = False ):
     if enabled:
       enabled = "+ 1"
+      increment = 1
     else:
       enabled = "- 1"
+      increment = -1
     upSQL = "UPDATE `tq_TaskQueues` SET Enabled = Enabled %s WHERE TQId=%d" % ( enabled, tqId )
     result = self._update( upSQL, conn = connObj )
     if not result[ 'OK' ]:
@@ -347,6 +367,7 @@ class TaskQueueDB( DB ):
     updated = result['Value'] > 0
     if updated:
       self.log.info( "Set enabled = %s for TQ %s" % ( enabled, tqId ) )
+      self.__tqIndex.updateEnabled( tqId, increment )
     return S_OK( updated )
 
   def __hackJobPriority( self, jobPriority ):
@@ -498,10 +519,29 @@ class TaskQueueDB( DB ):
     """
     Match a job
     """
+    retVal = self.matchAndGetJobs( tqMatchDict, 1, numJobsPerTry = numJobsPerTry,
+                                   numQueuesPerTry = numQueuesPerTry, negativeCond = negativeCond )
+    if not retVal[ 'OK' ]:
+      return retVal
+    matchData = retVal[ 'Value' ]
+    if not matchData[ 'matchFound' ]:
+      return S_OK( { 'matchFound' : False, 'tqMatch' : matchData[ 'tqMatch' ] } )
+    jobId, tqId = matchData[ 'jobs' ][0]
+    return S_OK( { 'matchFound' : True, 'jobId' : jobId, 'taskQueueId' : tqId, 'tqMatch' : matchData[ 'tqMatch' ] } )
+
+  def matchAndGetJobs( self, tqMatchDict, numJobs, numJobsPerTry = 50, numQueuesPerTry = 10, negativeCond = {} ):
+    """
+    Match up to numJobs jobs for the same resource description. The TQs are matched
+    once and the jobs are taken out from them in bulk
+      Returns S_OK( { 'matchFound' : True/False, 'jobs' : [ ( jobId, tqId ), ... ], 'tqMatch' : dict,
+                      'jobPriorities' : { jobId : priority } } )
+      Jobs that can't be served after all can be put back with returnJobs
+    """
     #Make a copy to avoid modification of original if escaping needs to be done
     tqMatchDict = dict( tqMatchDict )
-    self.log.info( "Starting match for requirements", self.__strDict( tqMatchDict ) )
-    retVal = self._checkMatchDefinition( tqMatchDict )
+    self.log.info( "Starting match of %s jobs for requirements" % numJobs, self.__strDict( tqMatchDict ) )
+    #Values are escaped only if the match has to be done in SQL
+    retVal = self._checkMatchDefinition( tqMatchDict, escapeValues = False )
     if not retVal[ 'OK' ]:
       self.log.error( "TQ match request check failed", retVal[ 'Message' ] )
       return retVal
@@ -509,14 +549,17 @@ class TaskQueueDB( DB ):
     if not retVal[ 'OK' ]:
       return S_ERROR( "Can't connect to DB: %s" % retVal[ 'Message' ] )
     connObj = retVal[ 'Value' ]
-    preJobSQL = "SELECT `tq_Jobs`.JobId, `tq_Jobs`.TQId FROM `tq_Jobs` WHERE `tq_Jobs`.TQId = %s AND `tq_Jobs`.Priority = %s"
+    preJobSQL = "SELECT `tq_Jobs`.JobId FROM `tq_Jobs` WHERE `tq_Jobs`.TQId = %s AND `tq_Jobs`.Priority = %s"
     prioSQL = "SELECT `tq_Jobs`.Priority FROM `tq_Jobs` WHERE `tq_Jobs`.TQId = %s ORDER BY RAND() / `tq_Jobs`.RealPriority ASC LIMIT 1"
-    postJobSQL = " ORDER BY `tq_Jobs`.JobId ASC LIMIT %s" % numJobsPerTry
+    postJobSQL = " ORDER BY `tq_Jobs`.JobId ASC LIMIT %s" % max( numJobsPerTry, numJobs )
+    if 'JobID' in tqMatchDict:
+      # A certain JobID is required by the resource, so all TQ are to be considered
+      preJobSQL = "%s AND `tq_Jobs`.JobId = %s " % ( preJobSQL, tqMatchDict['JobID'] )
+    jobs = []
+    jobPriorities = {}
     for _ in range( self.__maxMatchRetry ):
       if 'JobID' in tqMatchDict:
-        # A certain JobID is required by the resource, so all TQ are to be considered
         retVal = self.matchAndGetTaskQueue( tqMatchDict, numQueuesToGet = 0, skipMatchDictDef = True, connObj = connObj )
-        preJobSQL = "%s AND `tq_Jobs`.JobId = %s " % ( preJobSQL, tqMatchDict['JobID'] )
       else:
         retVal = self.matchAndGetTaskQueue( tqMatchDict,
                                             numQueuesToGet = numQueuesPerTry,
@@ -528,37 +571,94 @@ class TaskQueueDB( DB ):
       tqList = retVal[ 'Value' ]
       if len( tqList ) == 0:
         self.log.info( "No TQ matches requirements" )
-        return S_OK( { 'matchFound' : False, 'tqMatch' : tqMatchDict } )
+        break
       for tqId, tqOwnerDN, tqOwnerGroup in tqList:
         self.log.info( "Trying to extract jobs from TQ %s" % tqId )
-        retVal = self._query( prioSQL % tqId, conn = connObj )
-        if not retVal[ 'OK' ]:
-          return S_ERROR( "Can't retrieve winning priority for matching job: %s" % retVal[ 'Message' ] )
-        if len( retVal[ 'Value' ] ) == 0:
-          continue
-        prio = retVal[ 'Value' ][0][0]
-        retVal = self._query( "%s %s" % ( preJobSQL % ( tqId, prio ), postJobSQL ), conn = connObj )
-        if not retVal[ 'OK' ]:
-          return S_ERROR( "Can't begin transaction for matching job: %s" % retVal[ 'Message' ] )
-        jobTQList = [ ( row[0], row[1] ) for row in retVal[ 'Value' ] ]
-        if len( jobTQList ) == 0:
-          gLogger.info( "Task queue %s seems to be empty, triggering a cleaning" % tqId )
-          self.__deleteTQWithDelay.add( tqId, 300, ( tqId, tqOwnerDN, tqOwnerGroup ) )
-        while len( jobTQList ) > 0:
-          jobId, tqId = jobTQList.pop( random.randint( 0, len( jobTQList ) - 1 ) )
-          self.log.info( "Trying to extract job %s from TQ %s" % ( jobId, tqId ) )
-          retVal = self.deleteJob( jobId, connObj = connObj )
+        while len( jobs ) < numJobs:
+          retVal = self._query( prioSQL % tqId, conn = connObj )
+          if not retVal[ 'OK' ]:
+            return S_ERROR( "Can't retrieve winning priority for matching job: %s" % retVal[ 'Message' ] )
+          if len( retVal[ 'Value' ] ) == 0:
+            break
+          prio = retVal[ 'Value' ][0][0]
+          retVal = self._query( "%s %s" % ( preJobSQL % ( tqId, prio ), postJobSQL ), conn = connObj )
           if not retVal[ 'OK' ]:
-            msgFix = "Could not take job"
-            msgVar = " %s out from the TQ %s: %s" % ( jobId, tqId, retVal[ 'Message' ] )
+            return S_ERROR( "Can't begin transaction for matching job: %s" % retVal[ 'Message' ] )
+          jobList = [ row[0] for row in retVal[ 'Value' ] ]
+          if len( jobList ) == 0:
+            gLogger.info( "Task queue %s seems to be empty, triggering a cleaning" % tqId )
+            self.__deleteTQWithDelay.add( tqId, 300, ( tqId, tqOwnerDN, tqOwnerGroup ) )
+            break
+          random.shuffle( jobList )
+          retVal = self.__extractJobs( tqId, jobList[ :numJobs - len( jobs ) ] )
+          if not retVal[ 'OK' ]:
+            msgFix = "Could not take jobs"
+            msgVar = " out from the TQ %s: %s" % ( tqId, retVal[ 'Message' ] )
             self.log.error( msgFix, msgVar )
             return S_ERROR( msgFix + msgVar )
-          if retVal[ 'Value' ] == True :
-            self.log.info( "Extracted job %s with prio %s from TQ %s" % ( jobId, prio, tqId ) )
-            return S_OK( { 'matchFound' : True, 'jobId' : jobId, 'taskQueueId' : tqId, 'tqMatch' : tqMatchDict } )
-        self.log.info( "No jobs could be extracted from TQ %s" % tqId )
-    self.log.info( "Could not find a match after %s match retries" % self.__maxMatchRetry )
-    return S_ERROR( "Could not find a match after %s match retries" % self.__maxMatchRetry )
+          if not retVal[ 'Value' ]:
+            #Somebody else took them
+            break
+          self.log.info( "Extracted jobs %s with prio %s from TQ %s" % ( retVal[ 'Value' ], prio, tqId ) )
+          jobs.extend( [ ( jobId, tqId ) for jobId in retVal[ 'Value' ] ] )
+          jobPriorities.update( dict.fromkeys( retVal[ 'Value' ], prio ) )
+          self.__deleteTQWithDelay.add( tqId, 300, ( tqId, tqOwnerDN, tqOwnerGroup ) )
+        if len( jobs ) >= numJobs:
+          break
+        self.log.info( "No more jobs could be extracted from TQ %s" % tqId )
+      if jobs:
+        break
+    else:
+      self.log.info( "Could not find a match after %s match retries" % self.__maxMatchRetry )
+      return S_ERROR( "Could not find a match after %s match retries" % self.__maxMatchRetry )
+    return S_OK( { 'matchFound' : len( jobs ) > 0, 'jobs' : jobs, 'tqMatch' : tqMatchDict,
+                   'jobPriorities' : jobPriorities } )
+
+  def returnJobs( self, jobList ):
+    """
+    Put back in their TQs jobs taken out by matchAndGetJobs that could not be served.
+    If the TQ has been deleted meanwhile the job is left as an orphan (see findOrphanJobs)
+      jobList is a list of ( jobId, tqId, priority )
+    """
+    failed = []
+    for jobId, tqId, jobPriority in jobList:
+      retVal = self.__insertJobInTaskQueue( jobId, tqId, jobPriority, checkTQExists = False )
+      if not retVal[ 'OK' ]:
+        self.log.error( "Could not return job to its TQ", "Job %s TQ %s: %s" % ( jobId, tqId, retVal[ 'Message' ] ) )
+        failed.append( jobId )
+    if failed:
+      return S_ERROR( "Could not return jobs %s to their task queues" % ", ".join( [ str( j ) for j in failed ] ) )
+    return S_OK()
+
+  def __extractJobs( self, tqId, jobIds ):
+    """
+    Take the jobs out from a TQ in a single transaction, concurrent matches
+    can't take the same job
+      Returns S_OK( list of jobs taken ) / S_ERROR
+    """
+    jobsStr = ", ".join( [ str( int( jobId ) ) for jobId in jobIds ] )
+    retVal = self.transactionStart()
+    if not retVal[ 'OK' ]:
+      return retVal
+    try:
+      retVal = self._query( "SELECT JobId FROM `tq_Jobs` WHERE TQId = %s AND JobId in ( %s ) FOR UPDATE" % ( tqId,
+                                                                                                       jobsStr ) )
+      if not retVal[ 'OK' ]:
+        self.transactionRollback()
+        return retVal
+      taken = [ row[0] for row in retVal[ 'Value' ] ]
+      if taken:
+        retVal = self._update( "DELETE FROM `tq_Jobs` WHERE JobId in ( %s )" % ", ".join( [ str( jobId ) for jobId in taken ] ) )
+        if not retVal[ 'OK' ]:
+          self.transactionRollback()
+          return retVal
+      retVal = self.transactionCommit()
+      if not retVal[ 'OK' ]:
+        return retVal
+    except Exception, excp:
+      self.transactionRollback()
+      return S_ERROR( "Exception while extracting jobs: %s" % excp )
+    return S_OK( taken )
 
   def matchAndGetTaskQueue( self, tqMatchDict, numQueuesToGet = 1, skipMatchDictDef = False,
                                   negativeCond = {}, connObj = False ):
@@ -568,9 +668,17 @@ class TaskQueueDB( DB ):
     #Make a copy to avoid modification of original if escaping needs to be done
     tqMatchDict = dict( tqMatchDict )
     if not skipMatchDictDef:
-      retVal = self._checkMatchDefinition( tqMatchDict )
+      retVal = self._checkMatchDefinition( tqMatchDict, escapeValues = False )
       if not retVal[ 'OK' ]:
         return retVal
+    if self.__getCSOption( "UseTaskQueueIndex", True ):
+      retVal = self.__matchInTQIndex( tqMatchDict, numQueuesToGet = numQueuesToGet, negativeCond = negativeCond )
+      if retVal[ 'OK' ]:
+        return retVal
+      self.log.warn( "Could not match using the TQ index, falling back to SQL", retVal[ 'Message' ] )
+    retVal = self._checkMatchDefinition( tqMatchDict )
+    if not retVal[ 'OK' ]:
+      return retVal
     retVal = self.__generateTQMatchSQL( tqMatchDict, numQueuesToGet = numQueuesToGet, negativeCond = negativeCond )
     if not retVal[ 'OK' ]:
       return retVal
@@ -580,6 +688,124 @@ class TaskQueueDB( DB ):
       return retVal
     return S_OK( [ ( row[0], row[1], row[2] ) for row in retVal[ 'Value' ] ] )
 
+  def __matchInTQIndex( self, tqMatchDict, numQueuesToGet = 1, negativeCond = {} ):
+    """
+    Match the TQs using the in memory index. tqMatchDict values must not be escaped
+    """
+    result = self.__refreshTQIndex()
+    if not result[ 'OK' ]:
+      return result
+    groups = tqMatchDict.get( 'OwnerGroup', [] )
+    if type( groups ) not in ( types.ListType, types.TupleType ):
+      groups = [ groups ]
+    sharingGroups = [ group for group in groups if Properties.JOB_SHARING in CS.getPropertiesForGroup( group ) ]
+    try:
+      tqList = self.__tqIndex.match( tqMatchDict, numQueuesToGet = numQueuesToGet,
+                                     negativeCond = negativeCond, sharingGroups = sharingGroups )
+      if not tqList:
+        #The matching TQs may have been created by another process since the last refresh
+        result = self.__refreshTQIndex( force = True )
+        if not result[ 'OK' ]:
+          return result
+        if result[ 'Value' ]:
+          tqList = self.__tqIndex.match( tqMatchDict, numQueuesToGet = numQueuesToGet,
+                                         negativeCond = negativeCond, sharingGroups = sharingGroups )
+      return S_OK( tqList )
+    except Exception, excp:
+      return S_ERROR( "Error while matching in the TQ index: %s" % excp )
+
+  def __refreshTQIndex( self, force = False ):
+    """
+    Bring the in memory TQ index in sync with the DB. TQ definitions never change, so
+    only the ones of new TQs are loaded once they get enabled ( they are created
+    disabled until fully inserted ). Priorities and enabled flags are updated for all.
+    The refresh is done every TaskQueueIndexRefreshTime seconds, or every
+    TaskQueueIndexMinRefreshTime seconds if forced
+      Returns S_OK( True if refreshed )
+    """
+    refreshTime = self.__getCSOption( "TaskQueueIndexRefreshTime", 10 )
+    if force:
+      refreshTime = min( refreshTime, self.__getCSOption( "TaskQueueIndexMinRefreshTime", 2 ) )
+    if time.time() - self.__tqIndexLastRefresh < refreshTime:
+      return S_OK( False )
+    #If another thread is refreshing, use the current data unless it was never loaded
+    if not self.__tqIndexLock.acquire( not self.__tqIndexLastRefresh ):
+      return S_OK( False )
+    try:
+      if time.time() - self.__tqIndexLastRefresh < refreshTime:
+        return S_OK( False )
+      startTime = time.time()
+      singleFields = list( self.__singleValueDefFields )
+      result = self._query( "SELECT TQId, Priority, Enabled, %s FROM `tq_TaskQueues`" % ", ".join( singleFields ) )
+      if not result[ 'OK' ]:
+        return result
+      tqData = {}
+      for row in result[ 'Value' ]:
+        tqData[ row[0] ] = ( row[1], row[2], dict( zip( singleFields, row[3:] ) ) )
+      knownTQs = self.__tqIndex.getTaskQueueIds()
+      for tqId in knownTQs.difference( tqData ):
+        self.__tqIndex.removeTaskQueue( tqId )
+      newTQs = {}
+      for tqId in tqData:
+        priority, enabled, tqDef = tqData[ tqId ]
+        if tqId in knownTQs:
+          indexDef = self.__tqIndex.getDefinition( tqId )
+          #TQIds can be reused by the DB after a restart
+          if [ field for field in singleFields if indexDef[ field ] != tqDef[ field ] ]:
+            self.__tqIndex.removeTaskQueue( tqId )
+          else:
+            self.__tqIndex.setPriority( [ tqId ], priority )
+            self.__tqIndex.setEnabled( tqId, enabled )
+            continue
+        if enabled >= 1:
+          newTQs[ tqId ] = tqData[ tqId ]
+      result = self.__loadTQsInIndex( newTQs )
+      if not result[ 'OK' ]:
+        return result
+      self.__tqIndexLastRefresh = startTime
+      self.log.verbose( "TQ index refreshed: %s TQs, %s loaded in %.3f secs" % ( len( self.__tqIndex ),
+                                                                              len( newTQs ),
+                                                                              time.time() - startTime ) )
+      return S_OK( True )
+    finally:
+      self.__tqIndexLock.release()
+
+  def __addTQsToIndex( self, tqIdList, connObj = False ):
+    """
+    Load the given TQs from the DB into the index
+    """
+    singleFields = list( self.__singleValueDefFields )
+    result = self._query( "SELECT TQId, Priority, Enabled, %s FROM `tq_TaskQueues` WHERE TQId in ( %s )" %
+                          ( ", ".join( singleFields ), ", ".join( [ str( int( tqId ) ) for tqId in tqIdList ] ) ),
+                          conn = connObj )
+    if not result[ 'OK' ]:
+      return result
+    tqData = {}
+    for row in result[ 'Value' ]:
+      tqData[ row[0] ] = ( row[1], row[2], dict( zip( singleFields, row[3:] ) ) )
+    return self.__loadTQsInIndex( tqData, connObj = connObj )
+
+  def __loadTQsInIndex( self, tqData, connObj = False ):
+    """
+    Add TQs to the index with their multi value fields
+      tqData is a dict tqId -> ( priority, enabled, dict with the single value fields )
+    """
+    tqIdList = sorted( tqData )
+    for iP in range( 0, len( tqIdList ), 1000 ):
+      tqIdChunk = tqIdList[ iP : iP + 1000 ]
+      tqIdStr = ", ".join( [ str( tqId ) for tqId in tqIdChunk ] )
+      for field in self.__multiValueDefFields:
+        result = self._query( "SELECT TQId, Value FROM `tq_TQTo%s` WHERE TQId in ( %s )" % ( field, tqIdStr ),
+                              conn = connObj )
+        if not result[ 'OK' ]:
+          return result
+        for tqId, value in result[ 'Value' ]:
+          tqData[ tqId ][2].setdefault( field, [] ).append( value )
+      for tqId in tqIdChunk:
+        priority, enabled, tqDef = tqData[ tqId ]
+        self.__tqIndex.addTaskQueue( tqId, tqDef, priority, enabled )
+    return S_OK()
+
   def __generateSQLSubCond( self, sqlString, value, boolOp = 'OR' ):
     if type( value ) not in ( types.ListType, types.TupleType ):
       return sqlString % str( value ).strip()
@@ -862,6 +1088,7 @@ class TaskQueueDB( DB ):
       return S_ERROR( "Could not delete task queue %s: %s" % ( tqId, retVal[ 'Message' ] ) )
     delTQ = retVal[ 'Value' ]
     if delTQ > 0:
+      self.__tqIndex.removeTaskQueue( tqId )
       for mvField in self.__multiValueDefFields:
         retVal = self._update( "DELETE FROM `tq_TQTo%s` WHERE TQId = %s" % ( mvField, tqId ), conn = connObj )
         if not retVal[ 'OK' ]:
@@ -894,6 +1121,7 @@ class TaskQueueDB( DB ):
     if not retVal[ 'OK' ]:
       return S_ERROR( "Could not delete task queue %s: %s" % ( tqId, retVal[ 'Message' ] ) )
     delTQ = retVal[ 'Value' ]
+    self.__tqIndex.removeTaskQueue( tqId )
     sqlCmd = "DELETE FROM `tq_Jobs` WHERE `tq_Jobs`.TQId = %s" % tqId
     retVal = self._update( sqlCmd, conn = connObj )
     if not retVal[ 'OK' ]:
@@ -1145,7 +1373,9 @@ class TaskQueueDB( DB ):
     for prio in prioDict:
       tqList = ", ".join( [ str( tqId ) for tqId in prioDict[ prio ] ] )
       updateSQL = "UPDATE `tq_TaskQueues` SET Priority=%.4f WHERE TQId in ( %s )" % ( prio, tqList )
-      self._update( updateSQL, conn = connObj )
+      result = self._update( updateSQL, conn = connObj )
+      if result[ 'OK' ]:
+        self.__tqIndex.setPriority( prioDict[ prio ], prio )
     return S_OK()
 
   def getGroupShares( self ):
@@ -359,46 +359,38 @@ class JobMonitoringHandler( RequestHandler ):
                                                                                             RIGHT_GET_INFO )
         summaryJobList = validJobs
 
-      result = gJobDB.getAttributesForJobList( summaryJobList, SUMMARY )
-      if not result['OK']:
-        return S_ERROR( 'Failed to get job summary: ' + result['Message'] )
-
-      summaryDict = result['Value']
-
-      # Evaluate last sign of life time
-      for jobID, jobDict in summaryDict.items():
-        if jobDict['HeartBeatTime'] == 'None':
-          jobDict['LastSignOfLife'] = jobDict['LastUpdateTime']
-        else:
-          lastTime = Time.fromString( jobDict['LastUpdateTime'] )
-          hbTime = Time.fromString( jobDict['HeartBeatTime'] )
-          if ( hbTime - lastTime ) > ( lastTime - lastTime ) or jobDict['Status'] == "Stalled":
-            jobDict['LastSignOfLife'] = jobDict['HeartBeatTime']
-          else:
-            jobDict['LastSignOfLife'] = jobDict['LastUpdateTime']
+      # If no jobs can be selected after the properties check
+      if not summaryJobList:
+        return S_OK( resultDict )
 
       tqDict = {}
       result = gTaskQueueDB.getTaskQueueForJobs( summaryJobList )
       if result['OK']:
         tqDict = result['Value']
 
-      # If no jobs can be selected after the properties check
-      if not summaryDict.keys():
-        return S_OK( resultDict )
-
-      # prepare the standard structure now
-      key = summaryDict.keys()[0]
-      paramNames = summaryDict[key].keys()
-
+      # Records are built directly from the rows, in the selection order
+      jobOrder = dict( [ ( int( jobID ), iJob ) for iJob, jobID in enumerate( summaryJobList ) ] )
       records = []
-      for jobID, jobDict in summaryDict.items():
-        jParList = []
-        for pname in paramNames:
-          jParList.append( jobDict[pname] )
-        jParList.append( tqDict.get( jobID, 0 ) )
-        records.append( jParList )
-
-      resultDict['ParameterNames'] = paramNames + ['TaskQueueID']
+      paramNames = []
+      for result in gJobDB.iterJobAttributes( jobIDs = summaryJobList, attrList = SUMMARY ):
+        if not result['OK']:
+          return S_ERROR( 'Failed to get job summary: ' + result['Message'] )
+        paramNames, rows = result['Value']
+        iStatus = paramNames.index( 'Status' )
+        iLastUpdate = paramNames.index( 'LastUpdateTime' )
+        iHeartBeat = paramNames.index( 'HeartBeatTime' )
+        for row in rows:
+          jParList = [ str( value ) for value in row ]
+          # Evaluate last sign of life time
+          lastSignOfLife = jParList[iLastUpdate]
+          if row[iHeartBeat] is not None and ( row[iHeartBeat] > row[iLastUpdate] or row[iStatus] == "Stalled" ):
+            lastSignOfLife = jParList[iHeartBeat]
+          jParList.append( lastSignOfLife )
+          jParList.append( tqDict.get( row[0], 0 ) )
+          records.append( jParList )
+      records.sort( key = lambda jParList: jobOrder.get( int( jParList[0] ), 0 ) )
+
+      resultDict['ParameterNames'] = list( paramNames ) + ['LastSignOfLife', 'TaskQueueID']
       resultDict['Records'] = records
 
     return S_OK( resultDict )
@@ -15,15 +15,20 @@ __RCSID__ = "$Id$"
 
 from types import StringType, IntType, LongType, ListType, DictType
 # from types import *
+import os
 import time
-from DIRAC.Core.DISET.RequestHandler import RequestHandler
+import DIRAC
+from DIRAC.Core.DISET.RequestHandler import RequestHandler, getServiceOption
 from DIRAC import gLogger, S_OK, S_ERROR
 from DIRAC.WorkloadManagementSystem.DB.JobDB import JobDB
 from DIRAC.WorkloadManagementSystem.DB.JobLoggingDB import JobLoggingDB
+from DIRAC.WorkloadManagementSystem.private.JobStatusUpdateBuffer import JobStatusUpdateBuffer
 
 # This is a global instance of the JobDB class
 jobDB = False
 logDB = False
+# Write behind buffer of the status updates, if enabled
+statusBuffer = False
 
 JOB_FINAL_STATES = ['Done', 'Completed', 'Failed']
 
@@ -31,10 +36,29 @@ def initializeJobStateUpdateHandler( serviceInfo ):
 
   global jobDB
   global logDB
+  global statusBuffer
   jobDB = JobDB()
   logDB = JobLoggingDB()
+  flushTime = getServiceOption( serviceInfo, 'StatusBufferFlushTime', 0 )
+  if flushTime > 0:
+    journalPath = getServiceOption( serviceInfo, 'StatusBufferJournal',
+                                    os.path.join( DIRAC.rootPath, 'work', 'WorkloadManagement',
+                                                  'JobStateUpdate', 'StatusJournal' ) )
+    try:
+      os.makedirs( os.path.dirname( journalPath ) )
+    except OSError:
+      pass
+    statusBuffer = JobStatusUpdateBuffer( jobDB, logDB, journalPath, flushTime = flushTime,
+                                          maxRecords = getServiceOption( serviceInfo, 'StatusBufferMaxRecords', 1000 ) )
   return S_OK()
 
+def flushBufferedStatus( jobID ):
+  """ Write the buffered status updates of a job before updating it synchronously
+  """
+  if not statusBuffer:
+    return S_OK()
+  return statusBuffer.flushJobs( [ jobID ] )
+
 class JobStateUpdateHandler( RequestHandler ):
 
   ###########################################################################
@@ -50,6 +74,9 @@ class JobStateUpdateHandler( RequestHandler ):
     else:
       return S_ERROR( "updateJobFromStager: %s status not known." % status )
 
+    result = flushBufferedStatus( jobID )
+    if not result['OK']:
+      return result
     infoStr = None
     trials = 10
     for i in range( trials ):
@@ -98,6 +125,10 @@ class JobStateUpdateHandler( RequestHandler ):
 
   def __setJobStatus( self, jobID, status, minorStatus, source, datetime ):
     """ update the job status. """
+    if statusBuffer:
+      # Written to the DBs later together with other updates
+      return statusBuffer.addStatus( jobID, status, minorStatus, date = datetime, source = source )
+
     result = jobDB.setJobStatus( jobID, status, minorStatus )
     if not result['OK']:
       return result
@@ -140,6 +171,11 @@ class JobStateUpdateHandler( RequestHandler ):
     startFlag = ''
     jobID = int( jobID )
 
+    # Buffered updates must not land after this one, and their time stamps are needed below
+    result = flushBufferedStatus( jobID )
+    if not result['OK']:
+      return result
+
     result = jobDB.getJobAttributes( jobID, ['Status'] )
     if not result['OK']:
       return result
@@ -204,6 +240,7 @@ class JobStateUpdateHandler( RequestHandler ):
       result = jobDB.setStartExecTime( jobID, startDate )
 
     # Update the JobLoggingDB records
+    records = []
     for date in dates:
       sDict = statusDict[date]
       status = sDict['Status']
@@ -219,9 +256,10 @@ class JobStateUpdateHandler( RequestHandler ):
         status = "Running"
         minor = "Application"
       source = sDict['Source']
-      result = logDB.addLoggingRecord( jobID, status, minor, application, date, source )
-      if not result['OK']:
-        return result
+      records.append( ( jobID, status, minor, application, date, source ) )
+    result = logDB.addLoggingRecords( records )
+    if not result['OK']:
+      return result
 
     return S_OK()
 
@@ -255,6 +293,10 @@ class JobStateUpdateHandler( RequestHandler ):
     """ Set the application status for job specified by its JobId.
     """
 
+    result = flushBufferedStatus( jobID )
+    if not result['OK']:
+      return result
+
     result = jobDB.getJobAttributes( int( jobID ), ['Status', 'MinorStatus'] )
     if not result['OK']:
       return result
@@ -10,7 +10,7 @@ It also provides an XMLRPC interface to the Matcher
 __RCSID__ = "$Id$"
 
 import time
-from   types import StringType, DictType, StringTypes
+from   types import StringType, DictType, StringTypes, IntType, LongType
 import threading
 
 from DIRAC.ConfigurationSystem.Client.Helpers          import Registry, Operations
@@ -26,6 +26,7 @@ from DIRAC.Core.Utilities.ThreadScheduler              import gThreadScheduler
 from DIRAC.Core.Security                               import Properties
 from DIRAC.Core.Utilities.DictCache                    import DictCache
 from DIRAC.ResourceStatusSystem.Client.SiteStatus      import SiteStatus
+from DIRAC.ConfigurationSystem.Client.ConfigurationData import gConfigurationData
 
 DEBUG = 0
 
@@ -86,6 +87,12 @@ class Limiter:
   __csDictCache = DictCache()
   __condCache = DictCache()
   __delayMem = {}
+  __csVersion = None
+  #Site -> attribute -> value -> number of jobs Running, Matched or Stalled
+  __runningCounters = {}
+  __runningCountersTime = 0
+  __countersLock = threading.Lock()
+  __runningStatus = [ 'Running', 'Matched', 'Stalled' ]
 
   def __init__( self, opsHelper ):
     """ Constructor
@@ -100,9 +107,21 @@ class Limiter:
   def checkMatchingDelay( self ):
     return self.__opsHelper.getValue( "JobScheduling/CheckMatchingDelay", True )
 
+  def __checkCSVersion( self ):
+    """ Forget the cached limits and conditions if the CS has changed
+    """
+    csVersion = gConfigurationData.getVersion()
+    if csVersion == Limiter.__csVersion:
+      return
+    Limiter.__csVersion = csVersion
+    Limiter.__csDictCache.purgeAll()
+    Limiter.__condCache.purgeAll()
+    Limiter.__runningCountersTime = 0
+
   def getNegativeCond( self ):
     """ Get negative condition for ALL sites
     """
+    self.__checkCSVersion()
     orCond = Limiter.__condCache.get( "GLOBAL" )
     if orCond:
       return orCond
@@ -145,6 +164,7 @@ class Limiter:
   def getNegativeCondForSite( self, siteName ):
     """ Generate a negative query based on the limits set on the site
     """
+    self.__checkCSVersion()
     # Check if Limits are imposed onto the site
     negativeCond = {}
     if self.checkJobLimit():
@@ -206,6 +226,52 @@ class Limiter:
     Limiter.__csDictCache.add( section, 300, stuffDict )
     return S_OK( stuffDict )
 
+  def __loadRunningCounters( self ):
+    """ Count the running jobs of all the sites with limits, one query per limited attribute
+    """
+    result = self.__opsHelper.getSections( self.__runningLimitSection )
+    sites = []
+    if result[ 'OK' ]:
+      sites = result[ 'Value' ]
+    attSites = {}
+    for siteName in sites:
+      result = self.__extractCSData( "%s/%s" % ( self.__runningLimitSection, siteName ) )
+      if not result[ 'OK' ]:
+        continue
+      for attName in result[ 'Value' ]:
+        if attName in gJobDB.jobAttributeNames:
+          attSites.setdefault( attName, [] ).append( siteName )
+    startTime = time.time()
+    counters = {}
+    for attName in attSites:
+      result = gJobDB.getCounters( 'Jobs', [ 'Site', attName ], { 'Site' : attSites[ attName ],
+                                                                  'Status' : Limiter.__runningStatus } )
+      if not result[ 'OK' ]:
+        return result
+      for attDict, count in result[ 'Value' ]:
+        counters.setdefault( attDict[ 'Site' ], {} ).setdefault( attName, {} )[ attDict[ attName ] ] = count
+    Limiter.__runningCounters = counters
+    Limiter.__runningCountersTime = startTime
+    return S_OK()
+
+  def __getRunningCounters( self, siteName ):
+    """ Get the number of running jobs at the site for each limited attribute value.
+        The counters of all sites are reloaded every RunningLimitRefreshTime seconds,
+        in between they are increased for every job matched by this service
+    """
+    refreshTime = self.__opsHelper.getValue( "JobScheduling/RunningLimitRefreshTime", 30 )
+    if time.time() - Limiter.__runningCountersTime > refreshTime:
+      #Don't wait for another thread reloading them unless there's nothing loaded
+      if Limiter.__countersLock.acquire( not Limiter.__runningCountersTime ):
+        try:
+          if time.time() - Limiter.__runningCountersTime > refreshTime:
+            result = self.__loadRunningCounters()
+            if not result[ 'OK' ]:
+              return result
+        finally:
+          Limiter.__countersLock.release()
+    return S_OK( Limiter.__runningCounters.get( siteName, {} ) )
+
   def __getRunningCondition( self, siteName ):
     """ Get extra conditions allowing site throttling
     """
@@ -217,21 +283,17 @@ class Limiter:
     #limitsDict is something like { 'JobType' : { 'Merge' : 20, 'MCGen' : 1000 } }
     if not limitsDict:
       return S_OK( {} )
+    result = self.__getRunningCounters( siteName )
+    if not result[ 'OK' ]:
+      return result
+    siteCounters = result[ 'Value' ]
     # Check if the site exceeding the given limits
     negCond = {}
     for attName in limitsDict:
       if attName not in gJobDB.jobAttributeNames:
         gLogger.error( "Attribute %s does not exist. Check the job limits" % attName )
         continue
-      cK = "Running:%s:%s" % ( siteName, attName )
-      data = self.__condCache.get( cK )
-      if not data:
-        result = gJobDB.getCounters( 'Jobs', [ attName ], { 'Site' : siteName, 'Status' : [ 'Running', 'Matched', 'Stalled' ] } )
-        if not result[ 'OK' ]:
-          return result
-        data = result[ 'Value' ]
-        data = dict( [ ( k[0][ attName ], k[1] )  for k in data ] )
-        self.__condCache.add( cK, 10, data )
+      data = siteCounters.get( attName, {} )
       for attValue in limitsDict[ attName ]:
         limit = limitsDict[ attName ][ attValue ]
         running = data.get( attValue, 0 )
@@ -244,33 +306,58 @@ class Limiter:
     #negCond is something like : {'JobType': ['Merge']}
     return S_OK( negCond )
 
-  def updateDelayCounters( self, siteName, jid ):
-    #Get the info from the CS
-    siteSection = "%s/%s" % ( self.__matchingDelaySection, siteName )
-    result = self.__extractCSData( siteSection )
-    if not result['OK']:
-      return result
-    delayDict = result[ 'Value' ]
-    #limitsDict is something like { 'JobType' : { 'Merge' : 20, 'MCGen' : 1000 } }
-    if not delayDict:
+  def jobMatched( self, siteName, jid ):
+    """ Account for a job matched to the site: increase its running counters
+        and start the matching delays that apply to it
+    """
+    self.__checkCSVersion()
+    limitsDict = {}
+    if self.checkJobLimit():
+      result = self.__extractCSData( "%s/%s" % ( self.__runningLimitSection, siteName ) )
+      if result[ 'OK' ]:
+        limitsDict = result[ 'Value' ]
+    delayDict = {}
+    if self.checkMatchingDelay():
+      result = self.__extractCSData( "%s/%s" % ( self.__matchingDelaySection, siteName ) )
+      if not result['OK']:
+        return result
+      delayDict = result[ 'Value' ]
+    #Both are something like { 'JobType' : { 'Merge' : 20, 'MCGen' : 1000 } }
+    if not limitsDict and not delayDict:
       return S_OK()
     attNames = []
-    for attName in delayDict:
+    for attName in set( limitsDict ).union( delayDict ):
       if attName not in gJobDB.jobAttributeNames:
         gLogger.error( "Attribute %s does not exist in the JobDB. Please fix it!" % attName )
       else:
         attNames.append( attName )
+    if not attNames:
+      return S_OK()
     result = gJobDB.getJobAttributes( jid, attNames )
     if not result[ 'OK' ]:
-      gLogger.error( "While retrieving attributes coming from %s: %s" % ( siteSection, result[ 'Message' ] ) )
+      gLogger.error( "While retrieving attributes of matched job %s: %s" % ( jid, result[ 'Message' ] ) )
       return result
     atts = result[ 'Value' ]
+    #Update the running counters
+    Limiter.__countersLock.acquire()
+    try:
+      siteCounters = Limiter.__runningCounters.setdefault( siteName, {} )
+      for attName in limitsDict:
+        if attName in atts:
+          attCounters = siteCounters.setdefault( attName, {} )
+          attCounters[ atts[ attName ] ] = attCounters.get( atts[ attName ], 0 ) + 1
+    finally:
+      Limiter.__countersLock.release()
+    if not delayDict:
+      return S_OK()
     #Create the DictCache if not there
     if siteName not in Limiter.__delayMem:
       Limiter.__delayMem[ siteName ] = DictCache()
     #Update the counters
     delayCounter = Limiter.__delayMem[ siteName ]
-    for attName in atts:
+    for attName in delayDict:
+      if attName not in atts:
+        continue
       attValue = atts[ attName ]
       if attValue in delayDict[ attName ]:
         delayTime = delayDict[ attName ][ attValue ]
@@ -372,6 +459,15 @@ class MatcherHandler( RequestHandler ):
     """ Main job selection function to find the highest priority job
         matching the resource capacity
     """
+    result = self.selectJobs( resourceDescription, 1 )
+    if not result[ 'OK' ]:
+      return result
+    return S_OK( result[ 'Value' ][0] )
+
+  def selectJobs( self, resourceDescription, nSlots ):
+    """ Find up to nSlots of the highest priority jobs matching the resource capacity.
+        The resource description is processed and matched only once for all of them
+    """
 
     startTime = time.time()
     resourceDict = self.__processResourceDescription( resourceDescription )
@@ -455,7 +551,7 @@ class MatcherHandler( RequestHandler ):
     usableSites = result['Value']
 
     siteName = resourceDict['Site']
-    if siteName not in maskList:
+    if siteName not in usableSites:
       
       # if 'GridCE' not in resourceDict:
       #  return S_ERROR( 'Site not in mask and GridCE not specified' )
@@ -472,7 +568,7 @@ class MatcherHandler( RequestHandler ):
       gLogger.verbose( "%s : %s" % ( key.rjust( 20 ), resourceDict[ key ] ) )
 
     negativeCond = self.__limiter.getNegativeCondForSite( siteName )
-    result = gTaskQueueDB.matchAndGetJob( resourceDict, negativeCond = negativeCond )
+    result = gTaskQueueDB.matchAndGetJobs( resourceDict, nSlots, negativeCond = negativeCond )
 
     if DEBUG:
       print result
@@ -483,10 +579,52 @@ class MatcherHandler( RequestHandler ):
     if not result['matchFound']:
       return S_ERROR( 'No match found' )
 
-    jobID = result['jobId']
-    resAtt = gJobDB.getJobAttributes( jobID, ['OwnerDN', 'OwnerGroup', 'Status'] )
+    jobs = []
+    lastError = False
+    toReturn = []
+    jobPriorities = result.get( 'jobPriorities', {} )
+    for iJob, ( jobID, tqId ) in enumerate( result['jobs'] ):
+      # Every assignment moves the site running counters and matching delays,
+      # so the limits are checked again for all but the first job
+      if iJob:
+        negativeCond = self.__limiter.getNegativeCondForSite( siteName )
+      else:
+        negativeCond = {}
+      result = self.__assignJob( jobID, siteName, pilotReference, negativeCond )
+      if not result[ 'OK' ]:
+        lastError = result
+        if result.get( 'ReturnToTQ' ) and jobID in jobPriorities:
+          toReturn.append( ( jobID, tqId, jobPriorities[ jobID ] ) )
+        continue
+      resultDict = result[ 'Value' ]
+      resultDict['PilotInfoReportedFlag'] = pilotInfoReported
+      jobs.append( resultDict )
+    if toReturn:
+      gLogger.info( "Returning %s unassigned jobs to their task queues" % len( toReturn ) )
+      result = gTaskQueueDB.returnJobs( toReturn )
+      if not result[ 'OK' ]:
+        gLogger.error( result[ 'Message' ] )
+    if not jobs:
+      return lastError
+
+    matchTime = time.time() - startTime
+    gLogger.info( "Match time for %s jobs: [%s]" % ( len( jobs ), str( matchTime ) ) )
+    gMonitor.addMark( "matchTime", matchTime )
+
+    return S_OK( jobs )
+
+  def __assignJob( self, jobID, siteName, pilotReference, negativeCond = None ):
+    """ Mark a matched job as assigned to the resource and get what the pilot needs to run it.
+        A job matching the negativeCond is not assigned. When the job is still Waiting
+        after a failure, result['ReturnToTQ'] is set so it can be put back in its TQ
+    """
+    if not negativeCond:
+      negativeCond = {}
+    attNames = [ 'OwnerDN', 'OwnerGroup', 'Status' ]
+    attNames.extend( [ attName for attName in negativeCond if attName not in attNames ] )
+    resAtt = gJobDB.getJobAttributes( jobID, attNames )
     if not resAtt['OK']:
-      return S_ERROR( 'Could not retrieve job attributes' )
+      return self.__returnToTQ( S_ERROR( 'Could not retrieve job attributes' ) )
     if not resAtt['Value']:
       return S_ERROR( 'No attributes returned for job' )
     if not resAtt['Value']['Status'] == 'Waiting':
@@ -495,41 +633,41 @@ class MatcherHandler( RequestHandler ):
       if not result[ 'OK' ]:
         return result
       return S_ERROR( "Job %s is not in Waiting state" % str( jobID ) )
+    for attName in negativeCond:
+      if resAtt['Value'].get( attName ) in negativeCond[ attName ]:
+        gLogger.verbose( "Job %s can't run at %s: %s=%s is over the limits" % ( jobID, siteName, attName,
+                                                                               resAtt['Value'][ attName ] ) )
+        return self.__returnToTQ( S_ERROR( "Job %s is over the limits of %s" % ( jobID, siteName ) ) )
+
+    # Everything the pilot needs is retrieved before changing the job status
+    result = gJobDB.getJobJDL( jobID )
+    if not result['OK']:
+      return self.__returnToTQ( S_ERROR( 'Failed to get the job JDL' ) )
+    jobJDL = result['Value']
 
     attNames = ['Status','MinorStatus','ApplicationStatus','Site']
     attValues = ['Matched','Assigned','Unknown',siteName]
-    result = gJobDB.setJobAttributes( jobID, attNames, attValues )
+    # LastUpdateTime is refreshed so older status updates buffered elsewhere don't overwrite it
+    result = gJobDB.setJobAttributes( jobID, attNames, attValues, update = True )
+    if not result['OK']:
+      return self.__returnToTQ( S_ERROR( 'Failed to set the job as Matched: %s' % result['Message'] ) )
     # result = gJobDB.setJobStatus( jobID, status = 'Matched', minor = 'Assigned' )
     result = gJobLoggingDB.addLoggingRecord( jobID,
                                              status = 'Matched',
                                              minor = 'Assigned',
                                              source = 'Matcher' )
 
-    result = gJobDB.getJobJDL( jobID )
-    if not result['OK']:
-      return S_ERROR( 'Failed to get the job JDL' )
-
     resultDict = {}
-    resultDict['JDL'] = result['Value']
+    resultDict['JDL'] = jobJDL
     resultDict['JobID'] = jobID
 
-    matchTime = time.time() - startTime
-    gLogger.info( "Match time: [%s]" % str( matchTime ) )
-    gMonitor.addMark( "matchTime", matchTime )
-
     # Get some extra stuff into the response returned
     resOpt = gJobDB.getJobOptParameters( jobID )
     if resOpt['OK']:
       for key, value in resOpt['Value'].items():
         resultDict[key] = value
-    resAtt = gJobDB.getJobAttributes( jobID, ['OwnerDN', 'OwnerGroup'] )
-    if not resAtt['OK']:
-      return S_ERROR( 'Could not retrieve job attributes' )
-    if not resAtt['Value']:
-      return S_ERROR( 'No attributes returned for job' )
 
-    if self.__opsHelper.getValue( "JobScheduling/CheckMatchingDelay", True ):
-      self.__limiter.updateDelayCounters( siteName, jobID )
+    self.__limiter.jobMatched( siteName, jobID )
 
     # Report pilot-job association
     if pilotReference:
@@ -538,9 +676,14 @@ class MatcherHandler( RequestHandler ):
 
     resultDict['DN'] = resAtt['Value']['OwnerDN']
     resultDict['Group'] = resAtt['Value']['OwnerGroup']
-    resultDict['PilotInfoReportedFlag'] = pilotInfoReported
     return S_OK( resultDict )
 
+  def __returnToTQ( self, result ):
+    """ Flag a failed assignment of a job that is still Waiting
+    """
+    result['ReturnToTQ'] = True
+    return result
+
 ##############################################################################
   types_requestJob = [ [StringType, DictType] ]
   def export_requestJob( self, resourceDescription ):
@@ -554,6 +697,20 @@ class MatcherHandler( RequestHandler ):
       gMonitor.addMark( "matchesOK" )
     return result
 
+##############################################################################
+  types_requestJobs = [ [StringType, DictType], [IntType, LongType] ]
+  def export_requestJobs( self, resourceDescription, nSlots ):
+    """ Serve up to nSlots jobs to a resource with several free slots in one call.
+        Returns the list of the job dicts returned by requestJob
+    """
+    maxSlots = self.__opsHelper.getValue( "JobScheduling/MaxJobsPerMatch", 64 )
+    nSlots = max( 1, min( nSlots, maxSlots ) )
+    result = self.selectJobs( resourceDescription, nSlots )
+    gMonitor.addMark( "matchesDone" )
+    if result[ 'OK' ]:
+      gMonitor.addMark( "matchesOK", len( result[ 'Value' ] ) )
+    return result
+
 ##############################################################################
   types_getActiveTaskQueues = []
   def export_getActiveTaskQueues( self ):
@@ -0,0 +1,265 @@
+########################################################################
+# $HeadURL$
+########################################################################
+""" Write behind buffer for the job status updates received by the
+    JobStateUpdate service.
+
+    Status updates are journaled to a local file and kept in memory. Every
+    flushTime seconds, or as soon as maxRecords updates are pending, they are
+    written to the DBs in bulk: all the logging records in one multi row
+    insert, and only the latest status of each job, with one UPDATE for all
+    the jobs going to the same status. The journal is replayed at startup so
+    no update is lost if the service dies before a flush.
+
+    Each update is stamped with the time it reached the service: a buffered
+    status is not set if the job has been updated after that, so the clock of
+    the client is never compared with the one of the DB. The pending updates
+    of a job have to be flushed with flushJobs before updating it synchronously.
+"""
+
+__RCSID__ = "$Id$"
+
+import os
+import datetime
+import threading
+from DIRAC import gLogger, S_OK, S_ERROR
+from DIRAC.Core.Utilities import DEncode, Time
+
+JOB_FINAL_STATES = ['Done', 'Completed', 'Failed']
+
+def coalesceStatusRecords( records ):
+  """
+  Reduce a list of ( jobID, status, minor, application, date, source[, arrival] )
+  logging records to what has to be set in the Jobs table. Returns a tuple with
+    - dict ( status, minor, update ) -> list of jobIDs, with the latest status and
+      minor status of each job ( '' if not set ) and whether LastUpdateTime has to
+      be refreshed ( not for jobs only set to Stalled )
+    - dict jobID -> StartExecTime
+    - dict jobID -> EndExecTime
+  """
+  jobsStatus = {}
+  startTimes = {}
+  endTimes = {}
+  #Records of each job are applied in time order
+  for record in sorted( records, key = lambda record: record[4] ):
+    jobID, status, minor, _application, date, _source = record[:6]
+    jobStatus = jobsStatus.setdefault( jobID, [ '', '', False ] )
+    if status and status != 'idem':
+      jobStatus[0] = status
+      if status in JOB_FINAL_STATES and jobID not in endTimes:
+        endTimes[ jobID ] = date
+    if minor and minor != 'idem':
+      jobStatus[1] = minor
+    if status != 'Stalled':
+      jobStatus[2] = True
+    if status == 'Running' and minor == 'Application' and jobID not in startTimes:
+      startTimes[ jobID ] = date
+
+  updates = {}
+  for jobID, jobStatus in jobsStatus.items():
+    if jobStatus[0] or jobStatus[1]:
+      updates.setdefault( tuple( jobStatus ), [] ).append( jobID )
+  return updates, startTimes, endTimes
+
+
+class JobStatusUpdateBuffer:
+
+  def __init__( self, jobDB, logDB, journalPath, flushTime = 5, maxRecords = 1000, clockMargin = 2 ):
+    self.__jobDB = jobDB
+    self.__logDB = logDB
+    self.__journalPath = journalPath
+    self.__flushTime = flushTime
+    self.__maxRecords = maxRecords
+    #Tolerated offset in seconds between the clocks of the service and of the DB
+    self.__clockMargin = datetime.timedelta( seconds = clockMargin )
+    self.__records = []
+    self.__lock = threading.Lock()
+    #Only one flush at a time
+    self.__flushLock = threading.Lock()
+    self.__flushEvent = threading.Event()
+    self.__stopped = False
+    self.__replayJournal()
+    self.__journal = open( self.__journalPath, "ab" )
+    self.__flushThread = threading.Thread( target = self.__flushLoop )
+    self.__flushThread.setDaemon( 1 )
+    self.__flushThread.start()
+
+  def __replayJournal( self ):
+    """
+    Load the records that were not flushed before the last shutdown
+    """
+    if not os.path.isfile( self.__journalPath ):
+      return
+    fd = open( self.__journalPath, "rb" )
+    try:
+      data = fd.read()
+    finally:
+      fd.close()
+    pos = 0
+    while pos < len( data ):
+      try:
+        record, pos = DEncode.g_dDecodeFunctions[ data[ pos ] ]( data, pos )
+      except Exception:
+        #The service died while writing the last record
+        gLogger.warn( "Ignoring truncated record in the status journal", self.__journalPath )
+        break
+      record = tuple( record )
+      if len( record ) == 6:
+        #Journaled before the arrival time was recorded, it is at least as old as now
+        record = record + ( Time.toString( Time.dateTime() ), )
+      self.__records.append( record )
+    if self.__records:
+      gLogger.info( "Recovered %s job status updates from the journal" % len( self.__records ) )
+    #Rewrite the journal without the truncated data
+    self.__rewriteJournal( self.__records )
+
+  def __rewriteJournal( self, records ):
+    fd = open( self.__journalPath, "wb" )
+    try:
+      fd.write( "".join( [ DEncode.encode( record ) for record in records ] ) )
+      fd.flush()
+      os.fsync( fd.fileno() )
+    finally:
+      fd.close()
+
+  def getNumPendingRecords( self ):
+    return len( self.__records )
+
+  def addStatus( self, jobID, status = 'idem', minor = 'idem', application = 'idem', date = '', source = 'Unknown' ):
+    """
+    Queue a status update. The date is taken now if not given, the DBs are updated later
+    """
+    arrival = Time.toString( Time.dateTime() )
+    if not date:
+      date = arrival
+    record = ( int( jobID ), status or 'idem', minor or 'idem', application or 'idem', str( date ), source, arrival )
+    self.__lock.acquire()
+    try:
+      if self.__stopped:
+        return S_ERROR( "The status buffer is stopped" )
+      try:
+        self.__journal.write( DEncode.encode( record ) )
+        self.__journal.flush()
+      except IOError, excp:
+        return S_ERROR( "Could not journal the status update: %s" % str( excp ) )
+      self.__records.append( record )
+      numRecords = len( self.__records )
+    finally:
+      self.__lock.release()
+    if numRecords >= self.__maxRecords:
+      self.__flushEvent.set()
+    return S_OK()
+
+  def stop( self ):
+    """
+    Stop the flush thread. The pending updates stay in the journal
+    """
+    self.__lock.acquire()
+    try:
+      self.__stopped = True
+    finally:
+      self.__lock.release()
+    self.__flushEvent.set()
+    self.__flushThread.join()
+    self.__lock.acquire()
+    try:
+      self.__journal.close()
+    finally:
+      self.__lock.release()
+
+  def __flushLoop( self ):
+    while True:
+      self.__flushEvent.wait( self.__flushTime )
+      if self.__stopped:
+        return
+      self.__flushEvent.clear()
+      try:
+        result = self.flush()
+        if not result[ 'OK' ]:
+          gLogger.error( "Could not flush the job status updates", result[ 'Message' ] )
+      except Exception:
+        gLogger.exception( "Exception while flushing the job status updates" )
+
+  def flushJobs( self, jobIDs ):
+    """
+    Write the pending updates of the given jobs to the DBs, waiting for any flush
+    in progress. To be called before updating these jobs synchronously
+    """
+    return self.flush( jobIDs )
+
+  def flush( self, jobIDs = None ):
+    """
+    Write all the pending updates to the DBs, or only the ones of jobIDs if given
+    """
+    self.__flushLock.acquire()
+    try:
+      self.__lock.acquire()
+      try:
+        if jobIDs is None:
+          records = self.__records
+          self.__records = []
+        else:
+          jobIDs = set( [ int( jobID ) for jobID in jobIDs ] )
+          records = [ record for record in self.__records if record[0] in jobIDs ]
+          if records:
+            self.__records = [ record for record in self.__records if record[0] not in jobIDs ]
+      finally:
+        self.__lock.release()
+      if not records:
+        return S_OK( 0 )
+      result = self.__writeRecords( records )
+      self.__lock.acquire()
+      try:
+        if not result[ 'OK' ]:
+          #Keep them for the next flush, they are still in the journal
+          self.__records = records + self.__records
+          return result
+        #Only the records received while flushing stay in the journal
+        self.__journal.close()
+        self.__rewriteJournal( self.__records )
+        self.__journal = open( self.__journalPath, "ab" )
+      finally:
+        self.__lock.release()
+      return S_OK( len( records ) )
+    finally:
+      self.__flushLock.release()
+
+  def __writeRecords( self, records ):
+    #Drop the updates for jobs that don't exist
+    result = self.__jobDB.selectJobs( { 'JobID' : list( set( [ record[0] for record in records ] ) ) } )
+    if not result[ 'OK' ]:
+      return result
+    existingJobs = set( [ int( jobID ) for jobID in result[ 'Value' ] ] )
+    validRecords = [ record for record in records if record[0] in existingJobs ]
+    if len( validRecords ) < len( records ):
+      gLogger.warn( "Dropping status updates for unknown jobs",
+                    ", ".join( sorted( set( [ str( record[0] ) for record in records if record[0] not in existingJobs ] ) ) ) )
+    if not validRecords:
+      return S_OK()
+
+    updates, startTimes, endTimes = coalesceStatusRecords( validRecords )
+    #Jobs updated after the arrival of their latest buffered record are not modified
+    lastDates = {}
+    for record in validRecords:
+      lastDates[ record[0] ] = max( lastDates.get( record[0], '' ), record[6] )
+    for jobID in lastDates:
+      lastDates[ jobID ] = Time.toString( Time.fromString( lastDates[ jobID ] ) + self.__clockMargin )
+    for ( status, minor, update ), jobIDs in updates.items():
+      attrNames = []
+      attrValues = []
+      if status:
+        attrNames.append( 'Status' )
+        attrValues.append( status )
+      if minor:
+        attrNames.append( 'MinorStatus' )
+        attrValues.append( minor )
+      result = self.__jobDB.setAttributesForJobList( jobIDs, attrNames, attrValues, update = update,
+                                                     jobDates = lastDates )
+      if not result[ 'OK' ]:
+        return result
+    for timeAttribute, jobDates in ( ( 'StartExecTime', startTimes ), ( 'EndExecTime', endTimes ) ):
+      result = self.__jobDB.setExecTimesForJobList( timeAttribute, jobDates )
+      if not result[ 'OK' ]:
+        return result
+    gLogger.verbose( "Flushed %s status updates of %s jobs" % ( len( validRecords ), len( existingJobs ) ) )
+    return self.__logDB.addLoggingRecords( [ record[:6] for record in validRecords ] )
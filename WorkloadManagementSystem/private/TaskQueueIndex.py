@@ -0,0 +1,316 @@
+########################################################################
+# $HeadURL$
+########################################################################
+""" In memory index of the task queue definitions used to match resources
+    without querying the TaskQueueDB.
+
+    Task queue definitions don't change once created, so every multi value
+    field is kept as an inverted index value -> set of TQIds, and a match
+    is resolved with set operations. Only priorities and the enabled flag
+    are updated afterwards.
+"""
+
+__RCSID__ = "$Id$"
+
+import random
+import threading
+from types import ListType, TupleType, DictType
+
+class TaskQueueIndex:
+  """
+  Inverted index of task queues. The match semantics are the same as the
+  ones of the SQL generated by TaskQueueDB.__generateTQMatchSQL
+  """
+
+  def __init__( self, multiValueMatchFields, tagMatchFields = ( 'Tag', ),
+                bannedJobMatchFields = ( 'Site', ), strictRequireMatchFields = () ):
+    self.__matchFields = tuple( multiValueMatchFields )
+    self.__tagMatchFields = tuple( tagMatchFields )
+    self.__bannedJobMatchFields = tuple( bannedJobMatchFields )
+    self.__strictRequireMatchFields = tuple( strictRequireMatchFields )
+    #Definition fields are plural, match fields are singular
+    self.__defFields = [ "%ss" % field for field in self.__matchFields ]
+    self.__defFields.extend( [ "Banned%ss" % field for field in self.__bannedJobMatchFields ] )
+    self.__singleValueFields = ( 'OwnerDN', 'OwnerGroup', 'Setup', 'CPUTime' )
+    self.__lock = threading.RLock()
+    self.clear()
+
+  def clear( self ):
+    self.__lock.acquire()
+    try:
+      #TQId -> definition dict with the multi value fields as frozensets
+      self.__tqs = {}
+      self.__priorities = {}
+      self.__enabled = {}
+      self.__bySetup = {}
+      self.__byGroup = {}
+      self.__byOwner = {}
+      self.__byCPUTime = {}
+      #Field -> Value -> set of TQIds
+      self.__byValue = dict( [ ( field, {} ) for field in self.__defFields ] )
+      #Field -> set of TQIds that have any value for the field
+      self.__withField = dict( [ ( field, set() ) for field in self.__defFields ] )
+    finally:
+      self.__lock.release()
+
+  def __len__( self ):
+    return len( self.__tqs )
+
+  def __contains__( self, tqId ):
+    return tqId in self.__tqs
+
+  def getTaskQueueIds( self ):
+    self.__lock.acquire()
+    try:
+      return set( self.__tqs )
+    finally:
+      self.__lock.release()
+
+  def getDefinition( self, tqId ):
+    self.__lock.acquire()
+    try:
+      return self.__tqs.get( tqId )
+    finally:
+      self.__lock.release()
+
+  def addTaskQueue( self, tqId, tqDefDict, priority = 1, enabled = 1 ):
+    """
+    Add ( or replace ) a task queue. tqDefDict has the OwnerDN, OwnerGroup, Setup
+    and CPUTime of the TQ plus the multi value definition fields that have values
+    """
+    tqDef = { 'OwnerDN' : tqDefDict[ 'OwnerDN' ],
+              'OwnerGroup' : tqDefDict[ 'OwnerGroup' ],
+              'Setup' : tqDefDict[ 'Setup' ],
+              'CPUTime' : tqDefDict[ 'CPUTime' ] }
+    for field in self.__defFields:
+      values = frozenset( [ value for value in tqDefDict.get( field, () ) if value ] )
+      if values:
+        tqDef[ field ] = values
+    self.__lock.acquire()
+    try:
+      if tqId in self.__tqs:
+        self.removeTaskQueue( tqId )
+      self.__tqs[ tqId ] = tqDef
+      self.__priorities[ tqId ] = priority
+      self.__enabled[ tqId ] = enabled
+      self.__bySetup.setdefault( tqDef[ 'Setup' ], set() ).add( tqId )
+      self.__byGroup.setdefault( tqDef[ 'OwnerGroup' ], set() ).add( tqId )
+      self.__byOwner.setdefault( ( tqDef[ 'OwnerDN' ], tqDef[ 'OwnerGroup' ] ), set() ).add( tqId )
+      self.__byCPUTime.setdefault( tqDef[ 'CPUTime' ], set() ).add( tqId )
+      for field in self.__defFields:
+        if field not in tqDef:
+          continue
+        self.__withField[ field ].add( tqId )
+        fieldIndex = self.__byValue[ field ]
+        for value in tqDef[ field ]:
+          fieldIndex.setdefault( value, set() ).add( tqId )
+    finally:
+      self.__lock.release()
+
+  def __discard( self, index, key, tqId ):
+    tqIds = index.get( key )
+    if tqIds is None:
+      return
+    tqIds.discard( tqId )
+    if not tqIds:
+      del index[ key ]
+
+  def removeTaskQueue( self, tqId ):
+    self.__lock.acquire()
+    try:
+      tqDef = self.__tqs.pop( tqId, None )
+      if not tqDef:
+        return False
+      self.__priorities.pop( tqId, None )
+      self.__enabled.pop( tqId, None )
+      self.__discard( self.__bySetup, tqDef[ 'Setup' ], tqId )
+      self.__discard( self.__byGroup, tqDef[ 'OwnerGroup' ], tqId )
+      self.__discard( self.__byOwner, ( tqDef[ 'OwnerDN' ], tqDef[ 'OwnerGroup' ] ), tqId )
+      self.__discard( self.__byCPUTime, tqDef[ 'CPUTime' ], tqId )
+      for field in self.__defFields:
+        if field not in tqDef:
+          continue
+        self.__withField[ field ].discard( tqId )
+        for value in tqDef[ field ]:
+          self.__discard( self.__byValue[ field ], value, tqId )
+      return True
+    finally:
+      self.__lock.release()
+
+  def setPriority( self, tqIds, priority ):
+    self.__lock.acquire()
+    try:
+      for tqId in tqIds:
+        if tqId in self.__tqs:
+          self.__priorities[ tqId ] = priority
+    finally:
+      self.__lock.release()
+
+  def setEnabled( self, tqId, enabled ):
+    self.__lock.acquire()
+    try:
+      if tqId in self.__tqs:
+        self.__enabled[ tqId ] = enabled
+    finally:
+      self.__lock.release()
+
+  def updateEnabled( self, tqId, increment ):
+    """
+    The Enabled column is a counter, apply the same increment as the DB
+    """
+    self.__lock.acquire()
+    try:
+      if tqId in self.__tqs:
+        self.__enabled[ tqId ] += increment
+    finally:
+      self.__lock.release()
+
+  def __toList( self, value ):
+    if type( value ) in ( ListType, TupleType ):
+      return list( value )
+    return [ value ]
+
+  def __unionOf( self, index, keys ):
+    result = set()
+    for key in keys:
+      result.update( index.get( key, () ) )
+    return result
+
+  def __ownerCandidates( self, tqMatchDict, sharingGroups ):
+    """
+    TQs allowed by the OwnerDN and OwnerGroup conditions. None means no restriction
+    """
+    candidates = None
+    if 'OwnerDN' in tqMatchDict and 'OwnerGroup' in tqMatchDict:
+      dns = self.__toList( tqMatchDict[ 'OwnerDN' ] )
+      candidates = set()
+      for group in self.__toList( tqMatchDict[ 'OwnerGroup' ] ):
+        if group in sharingGroups:
+          candidates.update( self.__byGroup.get( group, () ) )
+        else:
+          candidates.update( self.__unionOf( self.__byOwner, [ ( dn, group ) for dn in dns ] ) )
+      return candidates
+    if 'OwnerGroup' in tqMatchDict:
+      candidates = self.__unionOf( self.__byGroup, self.__toList( tqMatchDict[ 'OwnerGroup' ] ) )
+    if 'OwnerDN' in tqMatchDict:
+      dns = set( self.__toList( tqMatchDict[ 'OwnerDN' ] ) )
+      dnCandidates = set()
+      for owner, tqIds in self.__byOwner.items():
+        if owner[0] in dns:
+          dnCandidates.update( tqIds )
+      if candidates is None:
+        candidates = dnCandidates
+      else:
+        candidates &= dnCandidates
+    return candidates
+
+  def __checkMultiValue( self, tqIds, field, values ):
+    """
+    Keep the TQs that don't define the field or that have any of the values
+    """
+    defField = "%ss" % field
+    allowed = self.__unionOf( self.__byValue[ defField ], values )
+    return set( [ tqId for tqId in tqIds if tqId in allowed or tqId not in self.__withField[ defField ] ] )
+
+  def __checkTags( self, tqIds, field, values ):
+    """
+    Keep the TQs whose values for the field are all in the values
+    """
+    defField = "%ss" % field
+    values = set( values )
+    return set( [ tqId for tqId in tqIds
+                  if tqId not in self.__withField[ defField ] or self.__tqs[ tqId ][ defField ] <= values ] )
+
+  def __checkNotAll( self, tqIds, defField, values ):
+    """
+    Keep the TQs where at least one of the values is not in the field
+    """
+    values = set( values )
+    return set( [ tqId for tqId in tqIds
+                  if not values <= self.__tqs[ tqId ].get( defField, frozenset() ) ] )
+
+  def __matchesNegativeDict( self, tqId, negativeCond ):
+    """
+    Not ( cond1 and cond2 ): the TQ is eligible if any of the conditions is not fulfilled
+    """
+    tqDef = self.__tqs[ tqId ]
+    hasConds = False
+    for field in negativeCond:
+      if field in self.__matchFields:
+        hasConds = True
+        if not set( self.__toList( negativeCond[ field ] ) ) & tqDef.get( "%ss" % field, frozenset() ):
+          return True
+      elif field in self.__singleValueFields:
+        for value in negativeCond[ field ]:
+          hasConds = True
+          if str( value ) != str( tqDef[ field ] ):
+            return True
+    return not hasConds
+
+  def __checkNegativeCond( self, tqIds, negativeCond ):
+    if type( negativeCond ) == DictType:
+      negativeCond = [ negativeCond ]
+    elif type( negativeCond ) not in ( ListType, TupleType ):
+      raise RuntimeError( "negativeCond has to be either a list or a dict and it's %s" % type( negativeCond ) )
+    return set( [ tqId for tqId in tqIds
+                  if [ True for condDict in negativeCond if self.__matchesNegativeDict( tqId, condDict ) ] ] )
+
+  def match( self, tqMatchDict, numQueuesToGet = 1, negativeCond = None, sharingGroups = () ):
+    """
+    Get the enabled TQs that match the resource description tqMatchDict as a list of
+    ( TQId, OwnerDN, OwnerGroup ) in random order weighted by priority.
+    Values in tqMatchDict must not be escaped. sharingGroups are the groups with the
+    JobSharing property
+    """
+    self.__lock.acquire()
+    try:
+      candidates = self.__ownerCandidates( tqMatchDict, sharingGroups )
+      if 'Setup' in tqMatchDict:
+        setupCandidates = self.__unionOf( self.__bySetup, self.__toList( tqMatchDict[ 'Setup' ] ) )
+        if candidates is None:
+          candidates = setupCandidates
+        else:
+          candidates &= setupCandidates
+      if candidates is None:
+        candidates = set( self.__tqs )
+      if 'CPUTime' in tqMatchDict:
+        maxCPUTime = max( self.__toList( tqMatchDict[ 'CPUTime' ] ) )
+        candidates &= self.__unionOf( self.__byCPUTime,
+                                      [ cpuTime for cpuTime in self.__byCPUTime if cpuTime <= maxCPUTime ] )
+      candidates = set( [ tqId for tqId in candidates if self.__enabled[ tqId ] >= 1 ] )
+
+      for field in self.__matchFields:
+        if not candidates:
+          break
+        if field in tqMatchDict and tqMatchDict[ field ]:
+          values = self.__toList( tqMatchDict[ field ] )
+          if field in self.__tagMatchFields:
+            if values != [ 'Any' ]:
+              candidates = self.__checkTags( candidates, field, values )
+          else:
+            candidates = self.__checkMultiValue( candidates, field, values )
+          #The site can't be one of the ones banned by the job
+          if field in self.__bannedJobMatchFields:
+            candidates = self.__checkNotAll( candidates, "Banned%ss" % field, values )
+        #Resource banning
+        bannedField = "Banned%s" % field
+        if bannedField in tqMatchDict and tqMatchDict[ bannedField ]:
+          candidates = self.__checkNotAll( candidates, "%ss" % field, self.__toList( tqMatchDict[ bannedField ] ) )
+
+      #If the resource doesn't define a strict field, the TQ can't require it
+      for field in self.__strictRequireMatchFields:
+        if field not in tqMatchDict:
+          candidates -= self.__withField[ "%ss" % field ]
+
+      if negativeCond and candidates:
+        candidates = self.__checkNegativeCond( candidates, negativeCond )
+
+      #Same ordering as "ORDER BY RAND() / Priority"
+      weighted = [ ( random.random() / max( self.__priorities[ tqId ], 10 ** -6 ), tqId ) for tqId in candidates ]
+      weighted.sort()
+      if numQueuesToGet:
+        weighted = weighted[ :numQueuesToGet ]
+      return [ ( tqId, self.__tqs[ tqId ][ 'OwnerDN' ], self.__tqs[ tqId ][ 'OwnerGroup' ] )
+               for _w, tqId in weighted ]
+    finally:
+      self.__lock.release()
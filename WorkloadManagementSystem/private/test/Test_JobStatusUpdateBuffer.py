@@ -0,0 +1,161 @@
+""" Test cases for the JobStatusUpdateBuffer
+"""
+
+import os
+import shutil
+import tempfile
+import sys
+if sys.version_info < ( 2, 7 ):
+  import unittest2 as unittest
+else:
+  import unittest
+
+from DIRAC import S_OK
+from DIRAC.Core.Utilities import Time
+from DIRAC.WorkloadManagementSystem.private.JobStatusUpdateBuffer import JobStatusUpdateBuffer, coalesceStatusRecords
+
+class FakeJobDB:
+
+  def __init__( self, jobIDs ):
+    self.jobIDs = jobIDs
+    self.updates = []
+    self.execTimes = {}
+    self.lastUpdate = {}
+
+  def selectJobs( self, condDict ):
+    return S_OK( [ jobID for jobID in condDict[ 'JobID' ] if jobID in self.jobIDs ] )
+
+  def setAttributesForJobList( self, jobIDList, attrNames, attrValues, update = False, jobDates = None ):
+    if jobDates:
+      jobIDList = [ jobID for jobID in jobIDList if self.lastUpdate.get( jobID, '' ) <= jobDates[ jobID ] ]
+    if update:
+      for jobID in jobIDList:
+        self.lastUpdate[ jobID ] = Time.toString( Time.dateTime() )
+    self.updates.append( ( sorted( jobIDList ), attrNames, attrValues, update ) )
+    return S_OK()
+
+  def setExecTimesForJobList( self, timeAttribute, jobDates ):
+    self.execTimes[ timeAttribute ] = dict( jobDates )
+    return S_OK()
+
+class FakeLoggingDB:
+
+  def __init__( self ):
+    self.records = []
+
+  def addLoggingRecords( self, records ):
+    self.records.extend( records )
+    return S_OK()
+
+class JobStatusUpdateBufferTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.tmpDir = tempfile.mkdtemp()
+    self.journal = os.path.join( self.tmpDir, "journal" )
+    self.jobDB = FakeJobDB( [ 1, 2, 3 ] )
+    self.logDB = FakeLoggingDB()
+    self.buffers = []
+
+  def tearDown( self ):
+    for statusBuffer in self.buffers:
+      statusBuffer.stop()
+    shutil.rmtree( self.tmpDir )
+
+  def newBuffer( self ):
+    statusBuffer = JobStatusUpdateBuffer( self.jobDB, self.logDB, self.journal, flushTime = 3600 )
+    self.buffers.append( statusBuffer )
+    return statusBuffer
+
+  def test_coalesce( self ):
+    records = [ ( 1, 'Running', 'Application', 'idem', '2013-01-01 10:00:01', 'JobWrapper' ),
+                ( 1, 'idem', 'Uploading', 'idem', '2013-01-01 10:00:03', 'JobWrapper' ),
+                ( 1, 'Done', 'idem', 'idem', '2013-01-01 10:00:04', 'JobWrapper' ),
+                ( 1, 'Running', 'Input', 'idem', '2013-01-01 10:00:00', 'JobWrapper' ),
+                ( 2, 'Done', 'Execution Complete', 'idem', '2013-01-01 10:00:00', 'JobWrapper' ),
+                ( 3, 'Stalled', 'idem', 'idem', '2013-01-01 10:00:00', 'StalledJobAgent' ) ]
+    updates, startTimes, endTimes = coalesceStatusRecords( records )
+    self.assertEqual( updates, { ( 'Done', 'Uploading', True ) : [ 1 ],
+                                 ( 'Done', 'Execution Complete', True ) : [ 2 ],
+                                 ( 'Stalled', '', False ) : [ 3 ] } )
+    self.assertEqual( startTimes, { 1 : '2013-01-01 10:00:01' } )
+    self.assertEqual( endTimes, { 1 : '2013-01-01 10:00:04', 2 : '2013-01-01 10:00:00' } )
+
+  def test_flush( self ):
+    statusBuffer = self.newBuffer()
+    for jobID in ( 1, 2, 4 ):
+      statusBuffer.addStatus( jobID, 'Done', 'Execution Complete', source = 'JobWrapper' )
+    self.assertEqual( statusBuffer.getNumPendingRecords(), 3 )
+    result = statusBuffer.flush()
+    self.assertTrue( result[ 'OK' ] )
+    self.assertEqual( statusBuffer.getNumPendingRecords(), 0 )
+    #Same status for both existing jobs is set at once, job 4 is unknown
+    self.assertEqual( self.jobDB.updates, [ ( [ 1, 2 ], [ 'Status', 'MinorStatus' ],
+                                              [ 'Done', 'Execution Complete' ], True ) ] )
+    self.assertEqual( sorted( self.jobDB.execTimes[ 'EndExecTime' ] ), [ 1, 2 ] )
+    self.assertEqual( sorted( [ record[0] for record in self.logDB.records ] ), [ 1, 2 ] )
+    self.assertEqual( os.path.getsize( self.journal ), 0 )
+
+  def test_journalReplay( self ):
+    statusBuffer = self.newBuffer()
+    statusBuffer.addStatus( 1, 'Running', 'Application', date = '2013-01-01 10:00:00' )
+    statusBuffer.addStatus( 1, '', 'Uploading', date = '2013-01-01 10:00:01' )
+    #Half written record
+    fd = open( self.journal, "ab" )
+    fd.write( "t" )
+    fd.close()
+    recoveredBuffer = self.newBuffer()
+    self.assertEqual( recoveredBuffer.getNumPendingRecords(), 2 )
+    self.assertTrue( recoveredBuffer.flush()[ 'OK' ] )
+    self.assertEqual( self.logDB.records[1], ( 1, 'idem', 'Uploading', 'idem', '2013-01-01 10:00:01', 'Unknown' ) )
+    self.assertEqual( self.jobDB.execTimes[ 'StartExecTime' ], { 1 : '2013-01-01 10:00:00' } )
+
+  def test_flushJobs( self ):
+    statusBuffer = self.newBuffer()
+    statusBuffer.addStatus( 1, 'Running', 'Application', date = '2013-01-01 10:00:00' )
+    statusBuffer.addStatus( 2, 'Running', 'Application', date = '2013-01-01 10:00:00' )
+    result = statusBuffer.flushJobs( [ 2 ] )
+    self.assertTrue( result[ 'OK' ] )
+    self.assertEqual( result[ 'Value' ], 1 )
+    self.assertEqual( [ record[0] for record in self.logDB.records ], [ 2 ] )
+    #Job 1 is still pending, also in the journal
+    self.assertEqual( statusBuffer.getNumPendingRecords(), 1 )
+    self.assertEqual( self.newBuffer().getNumPendingRecords(), 1 )
+    self.assertEqual( statusBuffer.flushJobs( [ 3 ] )[ 'Value' ], 0 )
+
+  def test_staleStatus( self ):
+    statusBuffer = self.newBuffer()
+    statusBuffer.addStatus( 1, 'Running', 'Application', date = '2013-01-01 10:00:00' )
+    statusBuffer.addStatus( 2, 'Running', 'Application', date = '2013-01-01 10:00:00' )
+    #Job 1 updated synchronously after the buffered status arrived
+    later = Time.toString( Time.dateTime() + 60 * Time.second )
+    self.jobDB.lastUpdate[ 1 ] = later
+    self.assertTrue( statusBuffer.flush()[ 'OK' ] )
+    self.assertEqual( self.jobDB.updates[0][0], [ 2 ] )
+    self.assertEqual( self.jobDB.lastUpdate[ 1 ], later )
+    #The history is still complete
+    self.assertEqual( sorted( [ record[0] for record in self.logDB.records ] ), [ 1, 2 ] )
+
+  def test_skewedDate( self ):
+    statusBuffer = self.newBuffer()
+    #Job matched just before its worker node, whose clock is hours late, sends a status
+    matched = Time.toString( Time.dateTime() - Time.second )
+    self.jobDB.lastUpdate[ 1 ] = matched
+    skewed = Time.toString( Time.dateTime() - 3 * Time.hour )
+    statusBuffer.addStatus( 1, 'Running', 'Application', date = skewed )
+    self.assertTrue( statusBuffer.flush()[ 'OK' ] )
+    self.assertEqual( self.jobDB.updates[0][0], [ 1 ] )
+    self.assertTrue( self.jobDB.lastUpdate[ 1 ] >= matched )
+    #The logging record keeps the date of the client
+    self.assertEqual( self.logDB.records[0][4], skewed )
+    self.assertEqual( self.jobDB.execTimes[ 'StartExecTime' ], { 1 : skewed } )
+
+  def test_stopped( self ):
+    statusBuffer = self.newBuffer()
+    statusBuffer.stop()
+    result = statusBuffer.addStatus( 1, 'Running', 'Application' )
+    self.assertFalse( result[ 'OK' ] )
+    self.assertEqual( statusBuffer.getNumPendingRecords(), 0 )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( JobStatusUpdateBufferTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
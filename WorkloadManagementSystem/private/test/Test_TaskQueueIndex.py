@@ -0,0 +1,80 @@
+""" Test cases for the in memory TaskQueueIndex
+"""
+
+import sys
+if sys.version_info < ( 2, 7 ):
+  import unittest2 as unittest
+else:
+  import unittest
+
+from DIRAC.WorkloadManagementSystem.private.TaskQueueIndex import TaskQueueIndex
+
+MATCH_FIELDS = ( 'GridCE', 'Site', 'GridMiddleware', 'Platform',
+                 'PilotType', 'SubmitPool', 'JobType', 'Tag' )
+STRICT_FIELDS = ( 'SubmitPool', 'Platform', 'PilotType', 'Tag' )
+
+def tqDef( ownerDN = 'dn1', ownerGroup = 'g1', cpuTime = 1000, **multiValues ):
+  tqDefDict = { 'OwnerDN' : ownerDN, 'OwnerGroup' : ownerGroup, 'Setup' : 'Test', 'CPUTime' : cpuTime }
+  tqDefDict.update( multiValues )
+  return tqDefDict
+
+class TaskQueueIndexTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.index = TaskQueueIndex( MATCH_FIELDS, strictRequireMatchFields = STRICT_FIELDS )
+    self.index.addTaskQueue( 1, tqDef() )
+    self.index.addTaskQueue( 2, tqDef( Sites = [ 'LCG.CERN.ch' ], cpuTime = 5000 ) )
+    self.index.addTaskQueue( 3, tqDef( ownerDN = 'dn2', BannedSites = [ 'LCG.CERN.ch' ] ) )
+    self.index.addTaskQueue( 4, tqDef( Platforms = [ 'x86_64-slc6' ], JobTypes = [ 'User' ] ) )
+    self.index.addTaskQueue( 5, tqDef( ownerGroup = 'g2', Tags = [ 'MultiProcessor', 'GPU' ] ) )
+
+  def __match( self, **matchDict ):
+    matchDict.setdefault( 'Setup', 'Test' )
+    matchDict.setdefault( 'CPUTime', 10000 )
+    negativeCond = matchDict.pop( 'negativeCond', None )
+    result = self.index.match( matchDict, numQueuesToGet = 0, negativeCond = negativeCond,
+                               sharingGroups = ( 'g2', ) )
+    return sorted( [ tqTuple[0] for tqTuple in result ] )
+
+  def test_site( self ):
+    self.assertEqual( self.__match( Site = 'LCG.CERN.ch' ), [ 1, 2 ] )
+    self.assertEqual( self.__match( Site = 'LCG.PIC.es' ), [ 1, 3 ] )
+    self.assertEqual( self.__match( Site = 'LCG.PIC.es', BannedSite = [ 'LCG.CERN.ch' ] ), [ 1, 3 ] )
+
+  def test_cpuAndOwner( self ):
+    self.assertEqual( self.__match( Site = 'LCG.CERN.ch', CPUTime = 2000 ), [ 1 ] )
+    self.assertEqual( self.__match( OwnerDN = 'dn2', OwnerGroup = 'g1', Site = 'LCG.PIC.es' ), [ 3 ] )
+    #g2 is a job sharing group, the DN does not matter
+    self.assertEqual( self.__match( OwnerDN = 'dn9', OwnerGroup = [ 'g1', 'g2' ], Site = 'X',
+                                    Tag = [ 'GPU', 'MultiProcessor', 'BigMem' ] ), [ 5 ] )
+
+  def test_strictFields( self ):
+    self.assertEqual( self.__match( Site = 'X', Platform = 'x86_64-slc6' ), [ 1, 3, 4 ] )
+    self.assertEqual( self.__match( Site = 'X', Platform = 'x86_64-slc5' ), [ 1, 3 ] )
+    self.assertEqual( self.__match( Site = 'X', Tag = 'GPU' ), [ 1, 3 ] )
+    self.assertEqual( self.__match( Site = 'X', Tag = 'Any' ), [ 1, 3, 5 ] )
+
+  def test_negativeCond( self ):
+    self.assertEqual( self.__match( Site = 'X', Platform = 'x86_64-slc6', JobType = 'User' ), [ 1, 3, 4 ] )
+    self.assertEqual( self.__match( Site = 'X', Platform = 'x86_64-slc6', JobType = 'User',
+                                    negativeCond = { 'JobType' : 'User' } ), [ 1, 3 ] )
+    result = self.index.match( { 'Setup' : 'Test', 'Site' : 'X' }, numQueuesToGet = 0,
+                               negativeCond = [ { 'OwnerDN' : [ 'dn1' ] }, { 'OwnerGroup' : [ 'g1' ] } ] )
+    self.assertEqual( sorted( [ tqTuple[0] for tqTuple in result ] ), [ 3 ] )
+
+  def test_updates( self ):
+    self.index.updateEnabled( 1, -1 )
+    self.assertEqual( self.__match( Site = 'LCG.CERN.ch' ), [ 2 ] )
+    self.index.updateEnabled( 1, 1 )
+    self.assertTrue( self.index.removeTaskQueue( 2 ) )
+    self.assertFalse( self.index.removeTaskQueue( 2 ) )
+    self.assertEqual( self.__match( Site = 'LCG.CERN.ch' ), [ 1 ] )
+    self.assertEqual( len( self.index ), 4 )
+    #Higher priority comes first most of the times
+    self.index.setPriority( [ 3 ], 10 ** 6 )
+    result = self.index.match( { 'Setup' : 'Test', 'Site' : 'LCG.PIC.es' }, numQueuesToGet = 1 )
+    self.assertEqual( result, [ ( 3, 'dn2', 'g1' ) ] )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( TaskQueueIndexTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )